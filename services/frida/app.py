@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from sentence_transformers import SentenceTransformer
 import torch
 import time
@@ -8,6 +8,19 @@ import requests
 from requests.adapters import HTTPAdapter, Retry
 from huggingface_hub import snapshot_download, HfApi
 import threading
+import json
+import fcntl
+import functools
+from concurrent.futures.process import BrokenProcessPool
+
+from batching import encode_texts
+from onnx_backend import FRIDA_BACKEND, FRIDA_NUM_THREADS, FRIDA_QUANTIZE, SUPPORTED_BACKENDS, configure_torch_threads, load_cpu_encoder
+from encode_pool import FRIDA_POOL_WORKERS, EncodePool
+from jobs import FRIDA_JOBS_DB, STATUS_FAILED, JobRunner, JobStore
+from shared_weights import freeze_for_fork, share_module_weights
+from semantic_cache import CACHE_INVALIDATION_DIR, SemanticCache
+from vector_store import VECTOR_STORE_DIR, VectorStore, start_import
+from chunking import CHUNK_OVERLAP_TOKENS, batched, default_target_tokens, iter_chunks, iter_text_blocks
 
 # Настраиваем логирование
 logging.basicConfig(level=logging.INFO, 
@@ -19,6 +32,10 @@ logger = logging.getLogger(__name__)
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 logger.info(f"Using device: {device}")
 
+if FRIDA_BACKEND not in SUPPORTED_BACKENDS:
+    raise ValueError(f"FRIDA_BACKEND должен быть одним из {SUPPORTED_BACKENDS}, получено: {FRIDA_BACKEND}")
+configure_torch_threads()
+
 # Увеличиваем таймауты для загрузки моделей
 os.environ["HF_HUB_DOWNLOAD_TIMEOUT"] = "600"  # 10 минут для загрузки файлов
 os.environ["TRANSFORMERS_HTTP_TIMEOUT"] = "600"  # 10 минут для HTTP запросов
@@ -38,46 +55,149 @@ app = Flask(__name__)
 model = None
 model_loading = False
 model_error = None
+# Пул процессов для больших запросов на CPU (FRIDA_POOL_WORKERS > 0)
+encode_pool = None
+# Хранилище и обработчик асинхронных заданий (/jobs)
+job_store = None
+job_runner = None
+_jobs_lock_file = None
+# Семантический кеш запросов и результатов поиска (/cache/*)
+semantic_cache = SemanticCache(invalidation_dir=CACHE_INVALIDATION_DIR)
+# Точный поиск по шардам проектов на диске (/vectors/*)
+vector_store = VectorStore(VECTOR_STORE_DIR)
+
+MODEL_ID = "ai-forever/FRIDA"
+CACHE_DIR = os.environ.get("TRANSFORMERS_CACHE", "/app/models")
+LOCAL_MODEL_DIR = os.path.join(CACHE_DIR, MODEL_ID)
+SNAPSHOT_REQUIRED_FILES = ("modules.json", "config.json")
+PRELOAD_MODEL_ON_STARTUP = os.environ.get("FRIDA_PRELOAD_ON_STARTUP", "1").strip() != "0"
+# Загрузка весов один раз в мастере gunicorn (--preload) с общими для воркеров страницами
+FRIDA_SHARED_WEIGHTS = os.environ.get("FRIDA_SHARED_WEIGHTS", "0").strip() == "1"
+shared_weights_info = None
+
+# Загрузка модели выполняется не более чем в одном потоке одновременно
+_load_lock = threading.Lock()
+# Длительности фаз запуска (мс) и источник весов: local / network / hub / export_cache
+load_timings = {}
+load_source = None
+
+PROMPT_PREFIXES = ["search_query:", "search_document:", "paraphrase:", "categorize:", "categorize_sentiment:", "categorize_topic:", "categorize_entailment:"]
+
+def _record_phase(name, started):
+    """Сохраняет длительность фазы запуска (мс) для /health"""
+    load_timings[name] = int((time.time() - started) * 1000)
+
+def local_snapshot_ready(path=None):
+    """Снэпшот считается готовым, если на месте конфиги и веса модели"""
+    path = path or LOCAL_MODEL_DIR
+    if not all(os.path.isfile(os.path.join(path, name)) for name in SNAPSHOT_REQUIRED_FILES):
+        return False
+    return any(name.endswith(".safetensors") or name == "pytorch_model.bin" for name in os.listdir(path))
 
-def load_model_thread():
-    """Загрузка модели в отдельном потоке"""
-    global model, model_loading, model_error
+def resolve_model_path():
+    """Возвращает путь к модели: локальный снэпшот без обращения к сети, иначе скачивает его"""
+    global load_source
+    started = time.time()
+    ready = local_snapshot_ready()
+    _record_phase("snapshot_check_ms", started)
+    if ready:
+        logger.info(f"Найден локальный снэпшот {LOCAL_MODEL_DIR}, сеть не используется")
+        load_source = "local"
+        return LOCAL_MODEL_DIR, True
+
+    started = time.time()
+    try:
+        snapshot_download(MODEL_ID, local_dir=LOCAL_MODEL_DIR, cache_dir=CACHE_DIR)
+        logger.info("Модель успешно загружена через snapshot_download")
+        load_source = "network"
+        return LOCAL_MODEL_DIR, True
+    except Exception as e:
+        logger.warning(f"Ошибка при загрузке через snapshot: {str(e)}, продолжаем через SentenceTransformer")
+        load_source = "hub"
+        return MODEL_ID, False
+    finally:
+        _record_phase("download_ms", started)
+
+def build_sentence_transformer(target_device):
+    """Создает SentenceTransformer из локального снэпшота (веса safetensors через mmap)"""
+    model_path, is_local = resolve_model_path()
+    kwargs = {}
+    if is_local:
+        kwargs["local_files_only"] = True
+        if any(name.endswith(".safetensors") for name in os.listdir(model_path)):
+            # safetensors отображаются в память, без pickle-десериализации и лишней копии весов
+            kwargs["model_kwargs"] = {"use_safetensors": True}
+    started = time.time()
+    sentence_model = SentenceTransformer(model_path, cache_folder=CACHE_DIR, device=target_device, **kwargs)
+    _record_phase("model_init_ms", started)
+    return sentence_model
+
+def load_model_thread(start_pool=True):
+    """Загрузка модели в отдельном потоке (запускается только через ensure_model_loading)"""
+    global model, model_loading, model_error, encode_pool, load_source
+    error = None
     try:
         logger.info("Начинаю загрузку модели FRIDA...")
         start_time = time.time()
-        
-        # Скачиваем модель с проверкой локального кеша
-        cache_dir = os.environ.get("TRANSFORMERS_CACHE", "/app/models")
-        logger.info(f"Используем кеш-директорию: {cache_dir}")
-        
-        # Предварительно скачиваем модель снэпшотом для надежности
-        try:
-            snapshot_download(
-                "ai-forever/FRIDA",
-                local_dir=f"{cache_dir}/ai-forever/FRIDA",
-                cache_dir=cache_dir,
-                local_dir_use_symlinks=False,
-                resume_download=True
-            )
-            logger.info("Модель успешно загружена через snapshot_download")
-        except Exception as e:
-            logger.warning(f"Ошибка при загрузке через snapshot: {str(e)}, продолжаем через SentenceTransformer")
-        
-        # Загружаем через SentenceTransformer, используя правильное устройство
-        model = SentenceTransformer("ai-forever/FRIDA", cache_folder=cache_dir, device=device)
-        
-        logger.info(f"Модель FRIDA загружена за {time.time() - start_time:.2f} сек на устройстве {device}")
-        model_loading = False
-        model_error = None
+        load_timings.clear()
+        load_source = None
+        logger.info(f"Используем кеш-директорию: {CACHE_DIR}")
+
+        if FRIDA_BACKEND == "torch":
+            # Загружаем через SentenceTransformer, используя правильное устройство
+            loaded_model = build_sentence_transformer(device)
+        else:
+            # CPU-бэкенд: PyTorch-модель нужна только для однократного экспорта графа
+            backend_started = time.time()
+            loaded_model = load_cpu_encoder(lambda: build_sentence_transformer("cpu"), CACHE_DIR, MODEL_ID)
+            load_source = load_source or "export_cache"
+            _record_phase("backend_load_ms", backend_started)
+
+        logger.info(f"Модель FRIDA загружена за {time.time() - start_time:.2f} сек (бэкенд {FRIDA_BACKEND}, устройство {device})")
+
+        # С одним воркером шардировать нечего: пул только занял бы память еще одной копией модели
+        if start_pool and FRIDA_POOL_WORKERS > 1 and device.type == 'cpu' and encode_pool is None:
+            pool_started = time.time()
+            pool = EncodePool({
+                "backend": FRIDA_BACKEND,
+                "model_path": LOCAL_MODEL_DIR if local_snapshot_ready() else MODEL_ID,
+                "model_id": MODEL_ID,
+                "cache_dir": CACHE_DIR,
+                "quantize": FRIDA_QUANTIZE,
+            })
+            try:
+                encode_pool = pool.start()
+            except Exception as e:
+                logger.warning(f"Не удалось запустить пул процессов, кодируем в текущем процессе: {str(e)}")
+                pool.shutdown()
+            _record_phase("pool_start_ms", pool_started)
+
+        model = loaded_model
+        _record_phase("total_ms", start_time)
     except Exception as e:
         logger.error(f"Ошибка при загрузке модели FRIDA: {str(e)}")
-        model_loading = False
-        model_error = str(e)
+        error = str(e)
+    finally:
+        with _load_lock:
+            model_loading = False
+            model_error = error
+
+def ensure_model_loading():
+    """Запускает загрузку модели, если она не загружена и не загружается (single-flight).
+
+    Возвращает True, если этим вызовом была запущена новая загрузка.
+    """
+    global model_loading, model_error
+    with _load_lock:
+        if model is not None or model_loading:
+            return False
+        model_loading = True
+        model_error = None
+    threading.Thread(target=load_model_thread, name="frida-load", daemon=True).start()
+    return True
 
 def get_model():
     """Ленивая инициализация модели с обработкой ошибок"""
-    global model, model_loading, model_error
-    
     # Если модель уже загружена, возвращаем её
     if model is not None:
         return model
@@ -91,12 +211,32 @@ def get_model():
         raise Exception(f"Ошибка при загрузке модели: {model_error}")
     
     # Запускаем загрузку в отдельном потоке
-    model_loading = True
-    threading.Thread(target=load_model_thread).start()
+    ensure_model_loading()
     
     # Возвращаем ошибку о том, что загрузка началась
     raise Exception("Первая загрузка модели началась, попробуйте запрос через несколько минут")
 
+def apply_prompt(text, prompt_name):
+    """Добавляет префикс prompt_name, если текст еще не содержит известный префикс"""
+    if not any(text.startswith(prefix) for prefix in PROMPT_PREFIXES):
+        text = f"{prompt_name}: {text}"
+    return text
+
+def encode_processed_texts(processed_texts, return_sparse=False):
+    """Создает эмбеддинги для подготовленных текстов: в пуле процессов или в текущем процессе.
+
+    С return_sparse=True дополнительно возвращает разреженные лексические векторы
+    в формате Qdrant, посчитанные по той же токенизации.
+    """
+    current_model = get_model()
+    if encode_pool is not None and encode_pool.should_shard(len(processed_texts)):
+        try:
+            return encode_pool.encode(processed_texts, return_sparse=return_sparse, prompt_prefixes=PROMPT_PREFIXES)
+        except BrokenProcessPool:
+            # Пул уже остановлен; этот и следующие запросы кодирует текущий процесс
+            pass
+    return encode_texts(current_model, processed_texts, return_sparse=return_sparse, prompt_prefixes=PROMPT_PREFIXES)
+
 @app.route('/health', methods=['GET'])
 def health():
     """Эндпоинт для проверки работоспособности сервиса"""
@@ -104,7 +244,16 @@ def health():
         "status": "ok",
         "model_loaded": model is not None,
         "model_loading": model_loading,
-        "model_error": model_error
+        "model_error": model_error,
+        "backend": FRIDA_BACKEND,
+        "quantized": FRIDA_QUANTIZE and FRIDA_BACKEND != "torch",
+        "pool": encode_pool.status() if encode_pool is not None else None,
+        "startup": {
+            "source": load_source,
+            "timings_ms": dict(load_timings)
+        },
+        "worker_pid": os.getpid(),
+        "shared_weights": shared_weights_info
     }
     return jsonify(status)
 
@@ -121,20 +270,16 @@ def embed():
             texts = [texts]
         
         prompt_name = data.get('prompt_name', 'search_document')
+        return_sparse = bool(data.get('return_sparse', False))
         
         # Добавляем префикс, если не указан
-        processed_texts = []
-        for text in texts:
-            if not any(text.startswith(prefix) for prefix in ["search_query:", "search_document:", "paraphrase:", "categorize:", "categorize_sentiment:", "categorize_topic:", "categorize_entailment:"]):
-                text = f"{prompt_name}: {text}"
-            processed_texts.append(text)
+        processed_texts = [apply_prompt(text, prompt_name) for text in texts]
         
         logger.info(f"Создание эмбеддингов для {len(processed_texts)} текстов с prompt_name={prompt_name}")
         
         # Получаем модель и создаем эмбеддинги
         try:
-            current_model = get_model()
-            embeddings = current_model.encode(processed_texts)
+            result = encode_processed_texts(processed_texts, return_sparse=return_sparse)
         except Exception as e:
             # Если модель загружается первый раз, возвращаем заглушку
             if model_loading:
@@ -145,24 +290,419 @@ def embed():
             else:
                 raise e
         
-        # Преобразуем в список, если это один элемент
-        if len(processed_texts) == 1:
-            embeddings = embeddings.reshape(1, -1)
-        
+        embeddings, batching_stats = result[:2]
         logger.info(f"Созданы эмбеддинги размерности {embeddings.shape}")
         
         # Преобразуем тензоры PyTorch в списки Python
         embeddings_list = embeddings.tolist()
         
-        return jsonify({
+        response = {
             "embeddings": embeddings_list,
-            "dimension": embeddings.shape[1]
-        })
+            "dimension": embeddings.shape[1],
+            "batching": batching_stats
+        }
+        if return_sparse:
+            # Формат разреженного вектора Qdrant: {"indices": [...], "values": [...]}
+            response["sparse_embeddings"] = result[2]
+        return jsonify(response)
     
     except Exception as e:
         logger.error(f"Ошибка при создании эмбеддингов: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def iter_job_texts(prompt_name):
+    """Читает тексты задания из запроса: JSON {"texts": [...]} или NDJSON построчно.
+
+    Каждый текст должен быть непустой строкой; иначе ValueError, и create_job
+    откатывает транзакцию, так что задание с битыми текстами не создается.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        for line_number, line in enumerate(request.stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            text = item.get("text") if isinstance(item, dict) else item
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError(f"Строка NDJSON {line_number} должна быть непустой строкой или объектом с полем text")
+            yield apply_prompt(text, prompt_name)
+    else:
+        data = request.get_json(silent=True) or {}
+        texts = data.get("texts", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        if not isinstance(texts, list):
+            raise ValueError("texts должен быть строкой или списком строк")
+        for index, text in enumerate(texts):
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError(f"texts[{index}] должен быть непустой строкой")
+            yield apply_prompt(text, prompt_name)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Создает асинхронное задание на эмбеддинги большого корпуса"""
+    if job_store is None:
+        return jsonify({"error": "Хранилище заданий недоступно"}), 503
+    try:
+        prompt_name = request.args.get('prompt_name')
+        if prompt_name is None and request.is_json:
+            prompt_name = (request.get_json(silent=True) or {}).get('prompt_name')
+        prompt_name = prompt_name or 'search_document'
+
+        job = job_store.create_job(iter_job_texts(prompt_name), prompt_name=prompt_name)
+        if job_runner is not None:
+            job_runner.notify()
+        logger.info(f"Создано задание {job['id']} на {job['total']} текстов с prompt_name={prompt_name}")
+        return jsonify({"job_id": job["id"], "status": job["status"], "total": job["total"]}), 202
+    except (ValueError, json.JSONDecodeError) as e:
+        return jsonify({"error": f"Некорректные входные данные: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при создании задания: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Состояние и прогресс задания"""
+    job = job_store.get_job(job_id) if job_store is not None else None
+    if job is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "progress": job["progress"],
+        "dimension": job["dimension"],
+        "prompt_name": job["prompt_name"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    })
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Удаляет задание вместе с результатами"""
+    if job_store is None or not job_store.delete_job(job_id):
+        return jsonify({"error": "Задание не найдено"}), 404
+    return jsonify({"status": "deleted", "job_id": job_id})
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """Потоковая выдача результатов по мере готовности батчей.
+
+    format=ndjson (по умолчанию): строка {"index": i, "embedding": [...]} на текст;
+    если задание упало, поток завершается строкой {"status": "failed", "error": ...}.
+    format=binary: подряд идущие float32 (little-endian) векторы в порядке текстов;
+    у упавшего задания передача обрывается, а X-Job-Status показывает статус на момент запроса.
+    """
+    job = job_store.get_job(job_id) if job_store is not None else None
+    if job is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'binary'):
+        return jsonify({"error": "format должен быть ndjson или binary"}), 400
+
+    def generate():
+        for start_idx, vectors in job_store.iter_batches(job_id):
+            if output_format == 'binary':
+                yield vectors.astype('<f4', copy=False).tobytes()
+            else:
+                yield "".join(
+                    json.dumps({"index": start_idx + offset, "embedding": vector.tolist()}) + "\n"
+                    for offset, vector in enumerate(vectors)
+                )
+        final = job_store.get_job(job_id)
+        if final is None or final["status"] == STATUS_FAILED:
+            error = final["error"] if final is not None else "Задание удалено"
+            logger.warning(f"Выдача результатов задания {job_id} прервана: {error}")
+            if output_format == 'binary':
+                # В бинарном потоке нет места для записи об ошибке: обрываем передачу,
+                # чтобы клиент не принял неполный результат за готовый
+                raise RuntimeError(f"Задание {job_id} завершилось с ошибкой: {error}")
+            yield json.dumps({"status": STATUS_FAILED, "error": error}) + "\n"
+
+    headers = {"X-Job-Total": str(job["total"]), "X-Job-Status": job["status"]}
+    if output_format == 'binary':
+        mimetype = "application/octet-stream"
+        headers["X-Embedding-Dtype"] = "float32"
+        if job["dimension"]:
+            headers["X-Embedding-Dimension"] = str(job["dimension"])
+    else:
+        mimetype = "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+def embed_query_cached(query):
+    """Эмбеддинг search_query с кешем по точному тексту запроса"""
+    processed = apply_prompt(query, 'search_query')
+    embedding = semantic_cache.get_embedding(processed)
+    if embedding is None:
+        embeddings, _ = encode_processed_texts([processed])
+        embedding = embeddings[0]
+        semantic_cache.put_embedding(processed, embedding)
+    return embedding
+
+def parse_cache_request(require_payload=False):
+    data = request.get_json(silent=True) or {}
+    project = data.get('project')
+    query = data.get('query')
+    if not isinstance(project, str) or not project:
+        raise ValueError("Не указан project")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("Не указан query")
+    if require_payload and 'payload' not in data:
+        raise ValueError("Не указан payload")
+    return data, project, query
+
+@app.route('/cache/lookup', methods=['POST'])
+def cache_lookup():
+    """Ищет сохраненный результат для близкого запроса проекта.
+
+    Тело: {"project", "query", "context"?, "return_embedding"?}. context — параметры
+    поиска (limit, фильтры): результаты с разным context не смешиваются.
+    При промахе с return_embedding=true возвращается эмбеддинг запроса для поиска в Qdrant.
+    При промахе возвращается generation: его нужно передать в /cache/store, чтобы
+    результат, посчитанный до сброса проекта, не попал в кеш после него.
+    """
+    try:
+        data, project, query = parse_cache_request()
+        embedding = embed_query_cached(query)
+        # Поколение берется до поиска: сброс после этой точки отклонит запись результата
+        generation = semantic_cache.generation(project)
+        cached = semantic_cache.lookup(project, embedding, data.get('context'))
+        response = {"hit": cached is not None}
+        if cached is not None:
+            response.update(cached)
+        else:
+            response["generation"] = generation
+            if data.get('return_embedding'):
+                response["embedding"] = embedding.tolist()
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        if model_loading:
+            return jsonify({"error": "Модель загружается, попробуйте позже", "loading": True}), 503
+        logger.error(f"Ошибка поиска в семантическом кеше: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache/store', methods=['POST'])
+def cache_store():
+    """Сохраняет результат поиска: {"project", "query", "payload", "context"?, "generation"?}.
+
+    generation из ответа /cache/lookup; если проект с тех пор сбросили — 409 и запись не сохраняется.
+    """
+    try:
+        data, project, query = parse_cache_request(require_payload=True)
+        generation = data.get('generation')
+        if generation is not None and not isinstance(generation, str):
+            raise ValueError("generation должен быть строкой")
+        embedding = embed_query_cached(query)
+        if not semantic_cache.store(project, embedding, query, data['payload'], data.get('context'), generation):
+            return jsonify({"status": "stale", "error": "Кеш проекта сброшен после поиска, результат не сохранен"}), 409
+        return jsonify({"status": "stored"})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        if model_loading:
+            return jsonify({"error": "Модель загружается, попробуйте позже", "loading": True}), 503
+        logger.error(f"Ошибка записи в семантический кеш: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    """Сбрасывает кеш проекта при изменении его документов: {"project"}; без project — весь кеш"""
+    data = request.get_json(silent=True) or {}
+    project = data.get('project')
+    if project is not None and not isinstance(project, str):
+        return jsonify({"error": "project должен быть строкой"}), 400
+    removed = semantic_cache.invalidate(project)
+    return jsonify({"status": "invalidated", "project": project, "removed": removed})
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Метрики кеша: доля попаданий, размер, вытеснения по проектам"""
+    return jsonify(semantic_cache.stats())
+
+@app.route('/chunk', methods=['POST'])
+def chunk_document():
+    """Разбивает документ на чанки по токенам FRIDA и при необходимости сразу создает эмбеддинги.
+
+    Вход: text/plain (читается потоком; параметры в query string) или JSON
+    {"text", "target_tokens"?, "overlap_tokens"?, "embed"?, "prompt_name"?}.
+    target_tokens не больше размера по умолчанию (вместимость модели за вычетом
+    префикса); итоговый размер — в заголовке X-Chunk-Target-Tokens.
+    Выход: NDJSON, строка {"index", "text", "tokens", "embedding"?} на чанк,
+    выдается по мере готовности.
+    """
+    data = {} if request.mimetype == 'text/plain' else (request.get_json(silent=True) or {})
+
+    def option(name, default=None):
+        value = request.args.get(name)
+        return data.get(name, default) if value is None else value
+
+    try:
+        current_model = get_model()
+    except Exception as e:
+        if model_loading:
+            return jsonify({"error": "Модель загружается, попробуйте позже", "loading": True}), 503
+        return jsonify({"error": str(e)}), 500
+
+    prompt_name = option('prompt_name', 'search_document')
+    embed_chunks = str(option('embed', False)).lower() in ('1', 'true', 'yes')
+    try:
+        max_tokens = default_target_tokens(current_model, f"{prompt_name}: ")
+        # Чанк длиннее вместимости модели embed=true молча обрезал бы
+        target_tokens = min(int(option('target_tokens', 0)) or max_tokens, max_tokens)
+        overlap_tokens = int(option('overlap_tokens', CHUNK_OVERLAP_TOKENS))
+        if not 0 <= overlap_tokens < target_tokens:
+            raise ValueError(f"Перекрытие должно быть меньше размера чанка ({target_tokens} токенов)")
+        if request.mimetype == 'text/plain':
+            blocks = iter_text_blocks(request.stream)
+        else:
+            text = data.get('text')
+            if not isinstance(text, str):
+                raise ValueError("Не указан text")
+            blocks = [text]
+        chunks = iter_chunks(blocks, current_model.tokenizer, target_tokens, overlap_tokens)
+        # Ошибки параметров проявляются на первом чанке, до начала ответа
+        first = next(chunks, None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def all_chunks():
+        if first is not None:
+            yield first
+            yield from chunks
+
+    def generate():
+        try:
+            for group in batched(all_chunks(), 32):
+                if embed_chunks:
+                    embeddings, _ = encode_processed_texts([apply_prompt(chunk["text"], prompt_name) for chunk in group])
+                    for chunk, embedding in zip(group, embeddings):
+                        chunk["embedding"] = embedding.tolist()
+                yield "".join(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in group)
+        except Exception as e:
+            logger.error(f"Ошибка при разбиении документа: {str(e)}")
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+    headers = {"X-Chunk-Target-Tokens": str(target_tokens), "X-Chunk-Overlap-Tokens": str(overlap_tokens)}
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers=headers)
+
+def vector_store_errors(handler):
+    """Единая обработка ошибок /vectors: 400 для входных данных, 404 для неизвестного проекта"""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except KeyError:
+            return jsonify({"error": "Проект не найден"}), 404
+        except Exception as e:
+            if model_loading:
+                return jsonify({"error": "Модель загружается, попробуйте позже", "loading": True}), 503
+            logger.error(f"Ошибка векторного хранилища: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+    return wrapper
+
+@app.route('/vectors/<project>', methods=['GET'])
+@vector_store_errors
+def vectors_info(project):
+    """Размер шарда проекта и состояние импорта из Qdrant"""
+    import_status = vector_store.imports.get(project)
+    if not vector_store.exists(project):
+        if import_status is None:
+            raise KeyError(project)
+        return jsonify({"project": project, "points": 0, "import": import_status})
+    info = vector_store.shard(project).stats()
+    info.update({"project": project, "import": import_status})
+    return jsonify(info)
+
+@app.route('/vectors/<project>', methods=['DELETE'])
+@vector_store_errors
+def vectors_drop(project):
+    """Удаляет шард проекта целиком"""
+    if not vector_store.drop(project):
+        raise KeyError(project)
+    return jsonify({"status": "deleted", "project": project})
+
+@app.route('/vectors/<project>/points', methods=['POST'])
+@vector_store_errors
+def vectors_upsert(project):
+    """Добавляет или заменяет точки: {"points": [{"id", "vector" | "text", "payload"?}]}.
+
+    Точки с text вместо vector кодируются FRIDA с prompt_name (по умолчанию search_document).
+    """
+    data = request.get_json(silent=True) or {}
+    points = data.get('points')
+    if not isinstance(points, list) or not points:
+        raise ValueError("Не указаны points")
+    for point in points:
+        if not isinstance(point, dict) or isinstance(point.get('id'), bool) or not isinstance(point.get('id'), (int, str)):
+            raise ValueError("Каждая точка должна быть объектом с id (число или строка)")
+        if point.get('vector') is not None and (not isinstance(point['vector'], list) or not point['vector']):
+            raise ValueError("vector точки должен быть непустым списком чисел")
+    prompt_name = data.get('prompt_name', 'search_document')
+    to_embed = [idx for idx, point in enumerate(points) if point.get('vector') is None]
+    vectors = [point.get('vector') for point in points]
+    if to_embed:
+        if any(not isinstance(points[idx].get('text'), str) for idx in to_embed):
+            raise ValueError("У точки должен быть vector или text")
+        embeddings, _ = encode_processed_texts([apply_prompt(points[idx]['text'], prompt_name) for idx in to_embed])
+        for idx, embedding in zip(to_embed, embeddings):
+            vectors[idx] = embedding
+    if len({len(vector) for vector in vectors}) != 1:
+        raise ValueError("У всех точек должна быть одна размерность vector")
+    shard = vector_store.shard(project, dimension=len(vectors[0]))
+    count = shard.upsert([point['id'] for point in points], vectors, [point.get('payload') for point in points])
+    return jsonify({"status": "ok", "upserted": count})
+
+@app.route('/vectors/<project>/points/delete', methods=['POST'])
+@vector_store_errors
+def vectors_delete(project):
+    """Удаляет точки по id: {"ids": [...]}"""
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if not isinstance(ids, list):
+        raise ValueError("Не указаны ids")
+    return jsonify({"status": "ok", "deleted": vector_store.shard(project).delete(ids)})
+
+@app.route('/vectors/<project>/search', methods=['POST'])
+@vector_store_errors
+def vectors_search(project):
+    """Top-k по косинусной близости.
+
+    Тело: {"vector": [...]} или {"query": "текст"} → {"results": [{"id", "score", "payload"}]};
+    {"vectors": [[...], ...]} → {"results": [[...], ...]} (пачка запросов одним произведением).
+    """
+    data = request.get_json(silent=True) or {}
+    limit = int(data.get('limit', 10))
+    shard = vector_store.shard(project)
+    if data.get('vectors') is not None:
+        return jsonify({"results": shard.search(data['vectors'], limit)})
+    if data.get('vector') is not None:
+        vector = data['vector']
+    elif isinstance(data.get('query'), str):
+        vector = embed_query_cached(data['query'])
+    else:
+        raise ValueError("Укажите vector, vectors или query")
+    return jsonify({"results": shard.search(vector, limit)[0]})
+
+@app.route('/vectors/<project>/import', methods=['POST'])
+@vector_store_errors
+def vectors_import(project):
+    """Импортирует коллекцию Qdrant в шард проекта в фоне: {"collection"?, "url"?, "vector_name"?}"""
+    data = request.get_json(silent=True) or {}
+    options = {key: data[key] for key in ('collection', 'url', 'vector_name') if data.get(key)}
+    return jsonify(start_import(vector_store, project, **options)), 202
+
+@app.route('/vectors/<project>/compact', methods=['POST'])
+@vector_store_errors
+def vectors_compact(project):
+    """Переписывает шард без удаленных и замененных точек"""
+    return jsonify({"status": "ok", "dropped": vector_store.shard(project).compact()})
+
 @app.route('/info', methods=['GET'])
 def model_info():
     """Получение информации о модели"""
@@ -182,25 +722,76 @@ def model_info():
 @app.route('/load', methods=['GET'])
 def start_load_model():
     """Запускает загрузку модели в фоне"""
-    global model, model_loading, model_error
-    
     if model is not None:
         return jsonify({"status": "Model already loaded"})
     
-    if model_loading:
+    # Сбрасывает прошлую ошибку; повторный вызов во время загрузки ничего не запускает
+    if not ensure_model_loading():
         return jsonify({"status": "Model loading already in progress"})
     
-    # Сбрасываем ошибку и запускаем загрузку
-    model_error = None
-    model_loading = True
-    threading.Thread(target=load_model_thread).start()
-    
     return jsonify({"status": "Model loading started"})
 
-# Запускаем загрузку модели сразу при запуске сервиса
-if __name__ != '__main__':
-    # Запускаем предзагрузку только при запуске через gunicorn
-    threading.Thread(target=load_model_thread).start()
+def start_job_runner():
+    """Открывает хранилище заданий и запускает фоновый обработчик (продолжает прерванные задания).
+
+    Обработчик работает только в одном процессе: том, что захватил файловую блокировку
+    рядом с базой. Остальные воркеры gunicorn принимают задания и отдают результаты.
+    """
+    global job_store
+    try:
+        job_store = JobStore(FRIDA_JOBS_DB)
+    except Exception as e:
+        logger.error(f"Не удалось открыть хранилище заданий: {str(e)}")
+        return
+    threading.Thread(target=_run_jobs_when_lock_acquired, name="frida-jobs-lock", daemon=True).start()
+
+def _run_jobs_when_lock_acquired():
+    global job_runner, _jobs_lock_file
+    try:
+        _jobs_lock_file = open(f"{FRIDA_JOBS_DB}.lock", "w")
+        # Блокирующее ожидание: если процесс-владелец завершится, блокировку получит другой воркер
+        fcntl.flock(_jobs_lock_file, fcntl.LOCK_EX)
+        job_runner = JobRunner(job_store, encode_processed_texts, is_ready=lambda: model is not None).start()
+        logger.info(f"Обработчик заданий запущен в процессе {os.getpid()}, база: {FRIDA_JOBS_DB}")
+    except Exception as e:
+        logger.error(f"Не удалось запустить обработчик заданий: {str(e)}")
+
+def load_shared_model():
+    """Загружает веса в мастере gunicorn до fork и переносит их в разделяемую память.
+
+    Поддерживается только torch-бэкенд на CPU: CUDA-контекст и потоки ONNX Runtime
+    не переживают fork, в этих случаях модель загружается в каждом воркере.
+    """
+    global model_loading, shared_weights_info
+    if device.type != 'cpu' or FRIDA_BACKEND != 'torch':
+        logger.warning("FRIDA_SHARED_WEIGHTS поддерживается только для torch на CPU, модель загрузится в каждом воркере")
+        return
+    with _load_lock:
+        model_loading = True
+    # Синхронно и без пула процессов: потоки и дочерние процессы мастера не переживают fork
+    load_model_thread(start_pool=False)
+    if model is not None:
+        shared_weights_info = share_module_weights(model)
+        freeze_for_fork()
+
+def init_worker_process(worker_count=1):
+    """Инициализация воркера gunicorn после fork (хук post_fork в режиме --preload)"""
+    # Без явного FRIDA_NUM_THREADS ядра делятся поровну между воркерами
+    configure_torch_threads(FRIDA_NUM_THREADS or max(1, (os.cpu_count() or 1) // max(1, worker_count)))
+    if model is None and PRELOAD_MODEL_ON_STARTUP:
+        ensure_model_loading()
+    start_job_runner()
+
+if __name__ != '__main__' and FRIDA_SHARED_WEIGHTS:
+    # Режим --preload: модуль импортируется в мастере gunicorn, потоки запускаются в воркерах
+    load_shared_model()
+else:
+    start_job_runner()
+
+    # Запускаем загрузку модели сразу при запуске сервиса
+    if __name__ != '__main__' and PRELOAD_MODEL_ON_STARTUP:
+        # Запускаем предзагрузку только при запуске через gunicorn
+        ensure_model_loading()
 
 if __name__ == '__main__':
     # Для локальной разработки
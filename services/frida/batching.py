@@ -0,0 +1,187 @@
+"""
+Пакетирование текстов для FRIDA.
+
+Тексты токенизируются один раз, дубликаты внутри запроса схлопываются,
+после чего уникальные тексты сортируются по длине и собираются в батчи
+под бюджет токенов (длина самого длинного текста × размер батча), а не
+под фиксированное количество. Результат возвращается в исходном порядке.
+
+По тем же input_ids можно получить разреженный лексический вектор
+(id токена → log(1 + tf)) в формате разреженных векторов Qdrant
+{"indices": [...], "values": [...]} без повторной токенизации.
+"""
+
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Бюджет "паддированных" токенов на один forward: max_len * batch_size
+MAX_BATCH_TOKENS = int(os.environ.get("FRIDA_MAX_BATCH_TOKENS", "16384"))
+# Верхняя граница количества текстов в батче (для очень коротких запросов)
+MAX_BATCH_SIZE = int(os.environ.get("FRIDA_MAX_BATCH_SIZE", "128"))
+
+
+def plan_batches(lengths: Sequence[int], max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_batch_size: int = MAX_BATCH_SIZE) -> List[List[int]]:
+    """Разбивает индексы текстов на батчи, отсортированные по убыванию длины.
+
+    Стоимость батча считается как длина первого (самого длинного) текста,
+    умноженная на количество текстов. Текст длиннее бюджета попадает в
+    отдельный батч.
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx], reverse=True)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_max = 0
+    for idx in order:
+        length = max(1, int(lengths[idx]))
+        if current and (
+            len(current) >= max_batch_size
+            or max(current_max, length) * (len(current) + 1) > max_batch_tokens
+        ):
+            batches.append(current)
+            current = []
+            current_max = 0
+        current.append(idx)
+        current_max = max(current_max, length)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def deduplicate(texts: Sequence[str]) -> Tuple[List[str], List[int]]:
+    """Возвращает уникальные тексты и индексы для восстановления исходного порядка."""
+    unique_texts: List[str] = []
+    positions: Dict[str, int] = {}
+    inverse: List[int] = []
+    for text in texts:
+        # SentenceTransformer сам обрезает пробелы перед токенизацией, повторяем это
+        key = str(text).strip()
+        position = positions.get(key)
+        if position is None:
+            position = len(unique_texts)
+            positions[key] = position
+            unique_texts.append(key)
+        inverse.append(position)
+    return unique_texts, inverse
+
+
+def tokenize_once(model: Any, texts: Sequence[str]) -> Dict[str, List[List[int]]]:
+    """Токенизирует тексты без паддинга, с обрезкой по max_seq_length модели."""
+    encoded = model.tokenizer(
+        list(texts),
+        padding=False,
+        truncation=True,
+        max_length=model.max_seq_length,
+    )
+    return {key: list(value) for key, value in encoded.items()}
+
+
+def prefix_token_ids(tokenizer: Any, prefixes: Iterable[str]) -> List[List[int]]:
+    """Токенизирует префиксы промптов без служебных токенов (длинные первыми)."""
+    prefixes = list(prefixes)
+    if not prefixes:
+        return []
+    encoded = tokenizer(prefixes, add_special_tokens=False)["input_ids"]
+    return sorted((list(ids) for ids in encoded if ids), key=len, reverse=True)
+
+
+def sparse_vector(input_ids: Sequence[int], special_ids: Iterable[int] = (),
+                  prefixes: Sequence[Sequence[int]] = ()) -> Dict[str, List]:
+    """Строит разреженный вектор Qdrant из input_ids одного текста.
+
+    Вес токена — log(1 + tf): повторы учитываются с насыщением, IDF можно
+    включить на стороне Qdrant (modifier "idf" у разреженного вектора).
+    Служебные токены и ведущий префикс промпта ("search_document:" и т.п.)
+    отбрасываются, иначе они совпадали бы у всех документов.
+    """
+    special_ids = set(special_ids)
+    ids = list(input_ids)
+    start = 0
+    while start < len(ids) and ids[start] in special_ids:
+        start += 1
+    for prefix in prefixes:
+        if ids[start:start + len(prefix)] == list(prefix):
+            start += len(prefix)
+            break
+    counts = Counter(token for token in ids[start:] if token not in special_ids)
+    indices = sorted(counts)
+    return {
+        "indices": [int(token) for token in indices],
+        "values": [float(np.log1p(counts[token])) for token in indices],
+    }
+
+
+def encode_texts(model: Any, texts: Sequence[str], max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_batch_size: int = MAX_BATCH_SIZE, return_sparse: bool = False,
+                 prompt_prefixes: Sequence[str] = ()):
+    """Создает эмбеддинги с сортировкой по длине и батчами под бюджет токенов.
+
+    Возвращает матрицу эмбеддингов (float32) в порядке входных текстов и
+    статистику вызова, включая долю паддинга. С return_sparse=True третьим
+    элементом возвращается список разреженных векторов (см. sparse_vector),
+    посчитанных по той же токенизации; prompt_prefixes исключаются из них.
+    """
+    started = time.time()
+    unique_texts, inverse = deduplicate(texts)
+    if not unique_texts:
+        empty = np.zeros((0, 0), dtype=np.float32), {"texts": 0, "unique_texts": 0, "batches": 0,
+                                                     "real_tokens": 0, "padded_tokens": 0,
+                                                     "padding_ratio": 0.0, "duration_ms": 0}
+        return empty + ([],) if return_sparse else empty
+
+    features = tokenize_once(model, unique_texts)
+    lengths = [len(ids) for ids in features["input_ids"]]
+    batches = plan_batches(lengths, max_batch_tokens, max_batch_size)
+
+    unique_embeddings: List[np.ndarray] = [None] * len(unique_texts)
+    real_tokens = 0
+    padded_tokens = 0
+    with torch.inference_mode():
+        for batch in batches:
+            batch_features = model.tokenizer.pad(
+                {key: [values[idx] for idx in batch] for key, values in features.items()},
+                padding=True,
+                return_tensors="pt",
+            )
+            batch_features = {key: value.to(model.device) for key, value in batch_features.items()}
+            output = model(batch_features)["sentence_embedding"]
+            output = output.float().cpu().numpy()
+            for row, idx in enumerate(batch):
+                unique_embeddings[idx] = output[row]
+
+            real_tokens += sum(lengths[idx] for idx in batch)
+            padded_tokens += lengths[batch[0]] * len(batch)
+
+    embeddings = np.stack(unique_embeddings)[inverse]
+    padding_ratio = 1.0 - (real_tokens / padded_tokens) if padded_tokens else 0.0
+    stats = {
+        "texts": len(texts),
+        "unique_texts": len(unique_texts),
+        "batches": len(batches),
+        "real_tokens": real_tokens,
+        "padded_tokens": padded_tokens,
+        "padding_ratio": round(padding_ratio, 4),
+        "duration_ms": int((time.time() - started) * 1000),
+    }
+    logger.info(
+        "Эмбеддинги: %s текстов (%s уникальных), %s батчей, токенов %s/%s, доля паддинга %.3f",
+        stats["texts"], stats["unique_texts"], stats["batches"],
+        real_tokens, padded_tokens, padding_ratio,
+    )
+    if not return_sparse:
+        return embeddings, stats
+
+    sparse_started = time.time()
+    special_ids = getattr(model.tokenizer, "all_special_ids", [])
+    prefixes = prefix_token_ids(model.tokenizer, prompt_prefixes)
+    unique_sparse = [sparse_vector(ids, special_ids, prefixes) for ids in features["input_ids"]]
+    stats["sparse_ms"] = int((time.time() - sparse_started) * 1000)
+    return embeddings, stats, [unique_sparse[idx] for idx in inverse]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности бэкендов FRIDA (texts/sec при разной длине текстов).
+
+Использование:
+    python bench_backends.py --model ai-forever/FRIDA --lengths 16 128 512 --texts 256
+    python bench_backends.py --backends torch onnx onnx-int8 openvino --threads 8
+
+Результат печатается построчно в JSON (по строке на пару бэкенд/длина).
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import batching
+import onnx_backend
+
+WORDS = "векторный поиск документ эмбеддинг модель текст запрос ответ данные система".split()
+
+
+def make_texts(count, words_per_text):
+    texts = []
+    for idx in range(count):
+        words = [WORDS[(idx + offset) % len(WORDS)] for offset in range(words_per_text)]
+        # Номер текста делает тексты уникальными, иначе их схлопнет дедупликация
+        texts.append(f"search_document: {idx} " + " ".join(words))
+    return texts
+
+
+def load_backend(name, args, cache_dir):
+    from sentence_transformers import SentenceTransformer
+
+    def factory():
+        return SentenceTransformer(args.model, device="cpu")
+
+    if name == "torch":
+        onnx_backend.configure_torch_threads(args.threads)
+        return factory()
+    runtime, _, precision = name.partition("-")
+    return onnx_backend.load_cpu_encoder(
+        factory, cache_dir, args.model, runtime=runtime, quantize=precision == "int8", num_threads=args.threads,
+    )
+
+
+def run(args):
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="frida-bench-")
+    for backend in args.backends:
+        model = load_backend(backend, args, cache_dir)
+        for length in args.lengths:
+            texts = make_texts(args.texts, length)
+            batching.encode_texts(model, texts[: min(8, len(texts))])  # прогрев
+            started = time.perf_counter()
+            _, stats = batching.encode_texts(model, texts)
+            elapsed = time.perf_counter() - started
+            print(json.dumps({
+                "backend": backend,
+                "words_per_text": length,
+                "texts": len(texts),
+                "tokens_per_text": round(stats["real_tokens"] / max(1, stats["unique_texts"]), 1),
+                "seconds": round(elapsed, 3),
+                "texts_per_sec": round(len(texts) / elapsed, 1),
+                "threads": args.threads or "auto",
+            }), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.environ.get("FRIDA_PARITY_MODEL", "ai-forever/FRIDA"))
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"],
+                        help="torch, onnx, onnx-int8, openvino, openvino-int8")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[16, 128, 512], help="слов на текст")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=onnx_backend.FRIDA_NUM_THREADS)
+    parser.add_argument("--cache-dir", default=None, help="каталог для кеша ONNX-экспорта")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
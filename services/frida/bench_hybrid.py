@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Сравнение пропускной способности FRIDA: только плотные эмбеддинги против
+плотных + разреженных (return_sparse=True) за один проход токенизации.
+
+Использование:
+    python bench_hybrid.py --model ai-forever/FRIDA --lengths 16 128 512 --texts 256
+    python bench_hybrid.py --backend onnx-int8 --threads 8
+
+Результат печатается построчно в JSON (по строке на длину текста).
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import batching
+import onnx_backend
+from bench_backends import load_backend, make_texts
+
+PROMPT_PREFIXES = ["search_query:", "search_document:"]
+
+
+def measure(model, texts, return_sparse, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        batching.encode_texts(model, texts, return_sparse=return_sparse, prompt_prefixes=PROMPT_PREFIXES)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.environ.get("FRIDA_PARITY_MODEL", "ai-forever/FRIDA"))
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8", "openvino"])
+    parser.add_argument("--lengths", nargs="+", type=int, default=[16, 128, 512], help="слов на текст")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=onnx_backend.FRIDA_NUM_THREADS)
+    parser.add_argument("--cache-dir", default=None, help="каталог для кеша ONNX-экспорта")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="frida-bench-")
+    model = load_backend(args.backend, args, cache_dir)
+    for length in args.lengths:
+        texts = make_texts(args.texts, length)
+        batching.encode_texts(model, texts[: min(8, len(texts))])  # прогрев
+        dense = measure(model, texts, False, args.repeats)
+        hybrid = measure(model, texts, True, args.repeats)
+        print(json.dumps({
+            "backend": args.backend,
+            "words_per_text": length,
+            "texts": len(texts),
+            "dense_texts_per_sec": round(len(texts) / dense, 1),
+            "hybrid_texts_per_sec": round(len(texts) / hybrid, 1),
+            "sparse_overhead_pct": round((hybrid / dense - 1) * 100, 2),
+        }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
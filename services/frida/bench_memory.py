@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти FRIDA под gunicorn: RSS/PSS мастера и воркеров для 1, 2 и 4
+воркеров с общими весами (FRIDA_SHARED_WEIGHTS=1, --preload) и без них.
+
+Использование (Linux, из каталога services/frida):
+    python bench_memory.py --workers 1 2 4
+    TRANSFORMERS_CACHE=/app/models python bench_memory.py --modes shared per-worker
+
+Для каждого запуска печатается строка JSON с суммарными RSS и PSS в МБ.
+PSS делит общие страницы между процессами, поэтому показывает реальный
+расход памяти; RSS считает общие страницы в каждом процессе.
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def read_memory_kb(pid):
+    """Возвращает (rss_kb, pss_kb) процесса из /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0] in ("Rss:", "Pss:"):
+                values[parts[0][:-1]] = int(parts[1])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def child_pids(parent_pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                # Поле 4 (ppid) идет после имени процесса в скобках
+                ppid = int(stat_file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent_pid:
+            children.append(int(entry))
+    return children
+
+
+def wait_until_ready(port, workers, timeout):
+    """Опрашивает /health, пока модель не будет загружена во всех воркерах."""
+    ready_pids = set()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5) as response:
+                health = json.load(response)
+            if health.get("model_loaded"):
+                ready_pids.add(health["worker_pid"])
+            if len(ready_pids) >= workers:
+                return True
+            if health.get("model_error"):
+                raise RuntimeError(health["model_error"])
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def warm_up(port, requests_count=8):
+    body = json.dumps({"texts": ["search_query: прогрев модели"] * 4}).encode()
+    for _ in range(requests_count):
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/embed", data=body,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+
+
+def measure(mode, workers, port, timeout):
+    env = dict(os.environ, FRIDA_WORKERS=str(workers), FRIDA_SHARED_WEIGHTS="1" if mode == "shared" else "0")
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "app:app"]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_until_ready(port, workers, timeout):
+            raise RuntimeError(f"Сервис не загрузил модель за {timeout} сек ({mode}, workers={workers})")
+        warm_up(port, requests_count=workers * 4)
+        time.sleep(1)
+        pids = [server.pid] + child_pids(server.pid)
+        memory = [read_memory_kb(pid) for pid in pids]
+        return {
+            "mode": mode,
+            "workers": workers,
+            "processes": len(pids),
+            "rss_mb": round(sum(rss for rss, _ in memory) / 1024, 1),
+            "pss_mb": round(sum(pss for _, pss in memory) / 1024, 1),
+            "worker_pss_mb": [round(pss / 1024, 1) for _, pss in memory[1:]],
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", default=["per-worker", "shared"], choices=["per-worker", "shared"])
+    parser.add_argument("--port", type=int, default=18002)
+    parser.add_argument("--timeout", type=int, default=900, help="ожидание загрузки модели, сек")
+    args = parser.parse_args()
+    for mode in args.modes:
+        for workers in args.workers:
+            print(json.dumps(measure(mode, workers, args.port, args.timeout)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк масштабирования пула процессов FRIDA от 1 до N воркеров.
+
+Использование:
+    python bench_pool.py --model ai-forever/FRIDA --max-workers 8 --texts 2048
+    python bench_pool.py --backend onnx --max-workers 16 --words 64
+
+Для каждого числа воркеров печатается строка JSON с texts/sec и ускорением
+относительно одного воркера. Число ядер делится поровну между воркерами.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import encode_pool
+from bench_backends import make_texts
+
+
+def run(args):
+    texts = make_texts(args.texts, args.words)
+    cores = encode_pool.available_cores()
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        pool = encode_pool.EncodePool({
+            "backend": args.backend,
+            "model_path": args.model,
+            "model_id": args.model,
+            "cache_dir": args.cache_dir,
+            "quantize": args.quantize,
+        }, workers=workers, threads_per_worker=args.threads, min_texts=1, cores=cores).start()
+        try:
+            pool.encode(texts[: workers * 4])  # прогрев всех воркеров
+            started = time.perf_counter()
+            _, stats = pool.encode(texts)
+            elapsed = time.perf_counter() - started
+        finally:
+            pool.shutdown()
+
+        texts_per_sec = len(texts) / elapsed
+        baseline = baseline or texts_per_sec
+        print(json.dumps({
+            "backend": args.backend,
+            "workers": workers,
+            "cores_per_worker": len(pool.core_sets[0]),
+            "threads_per_worker": pool.worker_info[0]["threads"],
+            "texts": len(texts),
+            "padding_ratio": stats["padding_ratio"],
+            "seconds": round(elapsed, 3),
+            "texts_per_sec": round(texts_per_sec, 1),
+            "speedup": round(texts_per_sec / baseline, 2),
+        }), flush=True)
+        workers *= 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.environ.get("FRIDA_PARITY_MODEL", "ai-forever/FRIDA"))
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "openvino"])
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--max-workers", type=int, default=len(encode_pool.available_cores()))
+    parser.add_argument("--threads", type=int, default=0, help="потоков на воркер (0 — по ядрам)")
+    parser.add_argument("--texts", type=int, default=1024)
+    parser.add_argument("--words", type=int, default=32, help="слов на текст")
+    parser.add_argument("--cache-dir", default=os.environ.get("TRANSFORMERS_CACHE", "/app/models"))
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк точного поиска vector_store против Qdrant на 10k–1M векторов.
+
+Использование (из каталога services/frida):
+    python bench_vector_store.py --sizes 10000 100000 1000000 --dimension 1536
+    python bench_vector_store.py --sizes 10000 100000 --qdrant-url http://localhost:6333
+
+Векторы генерируются блоками с фиксированным seed, так что точный ответ
+(float32) пересчитывается без хранения всей матрицы в памяти. Для каждого
+размера печатается строка JSON: p50/p95 задержки одиночного запроса,
+запросов в секунду при пачке, recall@k относительно точного float32 и
+размер шарда. С --qdrant-url те же запросы выполняются в Qdrant
+(коллекция создается и удаляется бенчмарком) через REST, как это делает Zeus.
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import requests
+
+import vector_store
+
+GENERATION_BLOCK = 10000
+
+
+def iter_blocks(size, dimension, seed):
+    for block_number, start in enumerate(range(0, size, GENERATION_BLOCK)):
+        rng = np.random.default_rng((seed, block_number))
+        yield start, rng.standard_normal((min(GENERATION_BLOCK, size - start), dimension), dtype=np.float32)
+
+
+def exact_top_k(queries, size, dimension, seed, k):
+    normalized = vector_store.normalize_rows(queries)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    for start, block in iter_blocks(size, dimension, seed):
+        scores = normalized @ vector_store.normalize_rows(block).T
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(block)), scores.shape)], axis=1)
+        keep = np.argsort(-best_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        best_ids = np.take_along_axis(best_ids, keep, axis=1)
+    return [set(row.tolist()) for row in best_ids]
+
+
+def recall(found, expected):
+    return float(np.mean([len(set(ids) & truth) / len(truth) for ids, truth in zip(found, expected)]))
+
+
+def latencies(search, queries):
+    timings = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        timings.append((time.perf_counter() - started) * 1000)
+    return results, round(float(np.percentile(timings, 50)), 2), round(float(np.percentile(timings, 95)), 2)
+
+
+def bench_store(root, size, dimension, seed, queries, k, expected):
+    store = vector_store.VectorStore(root)
+    shard = store.shard(f"bench{size}", dimension=dimension)
+    started = time.perf_counter()
+    for start, block in iter_blocks(size, dimension, seed):
+        shard.upsert(list(range(start, start + len(block))), block)
+    load_sec = time.perf_counter() - started
+
+    shard.search(queries[:1], k)  # прогрев page cache
+    results, p50, p95 = latencies(lambda query: shard.search(query, k)[0], queries)
+    started = time.perf_counter()
+    shard.search(queries, k)
+    batch_sec = time.perf_counter() - started
+    return {
+        "load_sec": round(load_sec, 2),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "batch_qps": round(len(queries) / batch_sec, 1),
+        "recall_at_k": round(recall([[hit["id"] for hit in found] for found in results], expected), 4),
+        "shard_mb": round(shard.stats()["bytes"] / 1024 ** 2, 1),
+    }
+
+
+def bench_qdrant(url, size, dimension, seed, queries, k, expected):
+    session = requests.Session()
+    collection = f"frida_bench_{size}"
+    session.delete(f"{url}/collections/{collection}")
+    session.put(f"{url}/collections/{collection}",
+                json={"vectors": {"size": dimension, "distance": "Cosine"}}).raise_for_status()
+    try:
+        started = time.perf_counter()
+        for start, block in iter_blocks(size, dimension, seed):
+            for offset in range(0, len(block), 1000):
+                part = block[offset:offset + 1000]
+                points = [{"id": start + offset + idx, "vector": vector.tolist(), "payload": {}}
+                          for idx, vector in enumerate(part)]
+                session.put(f"{url}/collections/{collection}/points?wait=true",
+                            json={"points": points}).raise_for_status()
+        load_sec = time.perf_counter() - started
+
+        def search(query):
+            response = session.post(f"{url}/collections/{collection}/points/search",
+                                    json={"vector": query.tolist(), "limit": k, "with_payload": True})
+            response.raise_for_status()
+            return [point["id"] for point in response.json()["result"]]
+
+        search(queries[0])
+        results, p50, p95 = latencies(search, queries)
+        started = time.perf_counter()
+        session.post(f"{url}/collections/{collection}/points/search/batch", json={"searches": [
+            {"vector": query.tolist(), "limit": k, "with_payload": True} for query in queries
+        ]}).raise_for_status()
+        batch_sec = time.perf_counter() - started
+        return {
+            "load_sec": round(load_sec, 2),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "batch_qps": round(len(queries) / batch_sec, 1),
+            "recall_at_k": round(recall(results, expected), 4),
+        }
+    finally:
+        session.delete(f"{url}/collections/{collection}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000, 100000, 1000000])
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--qdrant-url", default=None, help="сравнить с Qdrant по этому адресу")
+    parser.add_argument("--dir", default=None, help="каталог для шардов (по умолчанию временный)")
+    args = parser.parse_args()
+
+    root = args.dir or tempfile.mkdtemp(prefix="frida-vectors-")
+    try:
+        for size in args.sizes:
+            # Запросы — зашумленные векторы из коллекции, как перефразированные вопросы
+            rng = np.random.default_rng((args.seed, 1 << 30))
+            _, first_block = next(iter_blocks(size, args.dimension, args.seed))
+            picked = first_block[rng.integers(0, len(first_block), args.queries)]
+            queries = picked + 0.8 * rng.standard_normal(picked.shape, dtype=np.float32)
+            expected = exact_top_k(queries, size, args.dimension, args.seed, args.k)
+            row = {"vectors": size, "dimension": args.dimension, "k": args.k,
+                   "store": bench_store(root, size, args.dimension, args.seed, queries, args.k, expected)}
+            if args.qdrant_url:
+                row["qdrant"] = bench_qdrant(args.qdrant_url, size, args.dimension, args.seed, queries, args.k, expected)
+            print(json.dumps(row), flush=True)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Разбиение документов на чанки по токенам FRIDA.
+
+Конвейер целиком потоковый: текст читается блоками, делится на
+предложения (те же эвристики, что и в splitIntoChunks Zeus: абзацы по
+пустой строке, предложения по .!?… перед заглавной буквой), предложения
+токенизируются небольшими группами, а чанки собираются жадно до целевого
+числа токенов. Границы чанков проходят по предложениям; предложение
+длиннее цели режется по токенам. Перекрытие — хвостовые предложения
+предыдущего чанка в пределах overlap токенов, а если последнее
+предложение больше перекрытия — его последние overlap токенов.
+
+В памяти одновременно находятся только текущий чанк и недочитанный хвост
+текста, поэтому размер документа не ограничен.
+"""
+
+import codecs
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Целевой размер чанка в токенах; 0 — max_seq_length модели за вычетом префикса и служебных токенов
+CHUNK_TOKENS = int(os.environ.get("FRIDA_CHUNK_TOKENS", "0"))
+# Перекрытие соседних чанков в токенах
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("FRIDA_CHUNK_OVERLAP_TOKENS", "64"))
+# Предложение без границ длиннее этого (в символах) принудительно режется по пробелу
+MAX_SENTENCE_CHARS = 20000
+# Сколько предложений токенизировать за один вызов токенизатора
+TOKENIZE_GROUP = 64
+READ_BLOCK_BYTES = 64 * 1024
+
+# Пустая строка — конец абзаца; .!?… + пробел + заглавная/кавычка/скобка — конец предложения
+BOUNDARY_RE = re.compile(r"(?P<paragraph>[ \t]*\n[ \t\r]*\n\s*)|(?<=[.!?…])\s+(?=[A-ZА-ЯЁ\"'«(\[—–])")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def iter_text_blocks(stream: Any, block_size: int = READ_BLOCK_BYTES) -> Iterator[str]:
+    """Читает байтовый поток блоками и декодирует UTF-8 без разрыва многобайтовых символов."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _clean(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def iter_sentences(blocks: Iterable[str], max_chars: int = MAX_SENTENCE_CHARS) -> Iterator[Tuple[str, bool]]:
+    """Выдает (предложение, конец_абзаца) по мере поступления текста."""
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        start = 0
+        for match in BOUNDARY_RE.finditer(buffer):
+            sentence = _clean(buffer[start:match.start()])
+            if sentence:
+                yield sentence, match.group("paragraph") is not None
+            start = match.end()
+        buffer = buffer[start:]
+        # Текст без границ (таблицы, логи) не должен копиться бесконечно
+        while len(buffer) > max_chars:
+            cut = buffer.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            sentence = _clean(buffer[:cut])
+            if sentence:
+                yield sentence, False
+            buffer = buffer[cut:]
+    sentence = _clean(buffer)
+    if sentence:
+        yield sentence, True
+
+
+def iter_tokenized(sentences: Iterable[Tuple[str, bool]], tokenizer: Any,
+                   group: int = TOKENIZE_GROUP) -> Iterator[Tuple[str, bool, List[Tuple[int, int]]]]:
+    """Добавляет к предложениям символьные границы их токенов (без служебных токенов)."""
+    pending: List[Tuple[str, bool]] = []
+
+    def flush():
+        encoded = tokenizer([text for text, _ in pending], add_special_tokens=False,
+                            return_offsets_mapping=True)
+        for (text, paragraph_end), offsets in zip(pending, encoded["offset_mapping"]):
+            yield text, paragraph_end, [tuple(span) for span in offsets]
+        pending.clear()
+
+    for sentence in sentences:
+        pending.append(sentence)
+        if len(pending) >= group:
+            yield from flush()
+    if pending:
+        yield from flush()
+
+
+def _split_long(text: str, spans: List[Tuple[int, int]], size: int) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+    """Режет предложение длиннее чанка на окна по size токенов."""
+    for first in range(0, len(spans), size):
+        window = spans[first:first + size]
+        start = window[0][0]
+        yield text[start:window[-1][1]], [(a - start, b - start) for a, b in window]
+
+
+def reserved_tokens(tokenizer: Any, prefix: str = "") -> int:
+    """Сколько токенов занимают служебные токены и префикс промпта в каждом тексте."""
+    return len(tokenizer([prefix], add_special_tokens=True)["input_ids"][0])
+
+
+def iter_chunks(blocks: Iterable[str], tokenizer: Any, target_tokens: int,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict[str, Any]]:
+    """Собирает чанки не длиннее target_tokens токенов с перекрытием overlap_tokens.
+
+    Каждый чанк — {"index", "text", "tokens"}; tokens — сумма токенов частей,
+    токенизированных по отдельности (для SentencePiece и WordPiece совпадает
+    с токенизацией склеенного текста с точностью до пробелов на стыках).
+    """
+    if target_tokens < 1:
+        raise ValueError("Размер чанка должен быть положительным")
+    if not 0 <= overlap_tokens < target_tokens:
+        raise ValueError("Перекрытие должно быть меньше размера чанка")
+
+    # Части текущего чанка: (текст, токенов, границы токенов, конец абзаца)
+    pieces: List[Tuple[str, int, List[Tuple[int, int]], bool]] = []
+    total = 0
+    index = 0
+    fresh = False  # есть ли в текущем чанке что-то кроме перекрытия
+
+    def build():
+        parts = []
+        for position, (text, _, _, paragraph_end) in enumerate(pieces):
+            parts.append(text)
+            if position < len(pieces) - 1:
+                parts.append("\n\n" if paragraph_end else " ")
+        return {"index": index, "text": "".join(parts), "tokens": total}
+
+    def overlap():
+        kept, kept_tokens = [], 0
+        for piece in reversed(pieces):
+            if kept_tokens + piece[1] > overlap_tokens:
+                break
+            kept.insert(0, piece)
+            kept_tokens += piece[1]
+        if not kept and overlap_tokens > 0:
+            text, _, spans, paragraph_end = pieces[-1]
+            tail = spans[-overlap_tokens:]
+            start = tail[0][0]
+            kept = [(text[start:], len(tail), [(a - start, b - start) for a, b in tail], paragraph_end)]
+            kept_tokens = len(tail)
+        return kept, kept_tokens
+
+    for sentence, paragraph_end, spans in iter_tokenized(iter_sentences(blocks), tokenizer):
+        if not spans:
+            continue
+        if len(spans) > target_tokens:
+            # Окна оставляют место под перекрытие с предыдущим окном
+            parts = list(_split_long(sentence, spans, target_tokens - overlap_tokens))
+        else:
+            parts = [(sentence, spans)]
+        for part_number, (text, part_spans) in enumerate(parts):
+            count = len(part_spans)
+            if pieces and total + count > target_tokens:
+                if fresh:
+                    yield build()
+                    index += 1
+                pieces, total = overlap()
+                fresh = False
+                while pieces and total + count > target_tokens:
+                    total -= pieces.pop(0)[1]
+            pieces.append((text, count, part_spans, paragraph_end and part_number == len(parts) - 1))
+            total += count
+            fresh = True
+    if fresh:
+        yield build()
+
+
+def default_target_tokens(model: Any, prefix: str = "") -> int:
+    """Целевой размер чанка: FRIDA_CHUNK_TOKENS или вместимость модели за вычетом префикса."""
+    capacity = int(model.max_seq_length) - reserved_tokens(model.tokenizer, prefix)
+    if CHUNK_TOKENS > 0:
+        return min(CHUNK_TOKENS, capacity)
+    return capacity
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,262 @@
+"""
+Пул процессов для CPU-инференса FRIDA.
+
+Каждый воркер закрепляется за своим подмножеством ядер (sched_setaffinity),
+получает собственное число потоков и загружает свою копию модели. Большие
+запросы делятся на шарды (тексты предварительно сортируются по длине, чтобы
+внутри шарда было меньше паддинга), шарды кодируются параллельно и
+собираются обратно в исходном порядке. Маленькие запросы выполняются
+в текущем процессе, чтобы не платить за IPC. Если воркер погибнет (OOM,
+падение torch), пул останавливается, и дальше кодирует текущий процесс.
+"""
+
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+import batching
+import onnx_backend
+
+logger = logging.getLogger(__name__)
+
+# Количество процессов-воркеров (0 или 1 — пул выключен: один воркер не дает параллелизма)
+FRIDA_POOL_WORKERS = int(os.environ.get("FRIDA_POOL_WORKERS", "0"))
+# Потоков на воркер (0 — по количеству закрепленных ядер)
+FRIDA_POOL_THREADS = int(os.environ.get("FRIDA_POOL_THREADS", "0"))
+# Запросы с меньшим числом текстов обрабатываются в текущем процессе
+FRIDA_POOL_MIN_TEXTS = int(os.environ.get("FRIDA_POOL_MIN_TEXTS", "64"))
+WORKER_START_TIMEOUT = 600
+
+_worker_model = None
+_worker_cores: List[int] = []
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_core_sets(cores: Sequence[int], workers: int) -> List[List[int]]:
+    """Делит ядра на непересекающиеся непрерывные группы по числу воркеров.
+
+    Если воркеров больше, чем ядер, группы переиспользуются по кругу.
+    """
+    cores = list(cores)
+    if workers <= 0 or not cores:
+        return []
+    if workers >= len(cores):
+        return [[cores[idx % len(cores)]] for idx in range(workers)]
+    base, extra = divmod(len(cores), workers)
+    core_sets = []
+    start = 0
+    for idx in range(workers):
+        size = base + (1 if idx < extra else 0)
+        core_sets.append(cores[start:start + size])
+        start += size
+    return core_sets
+
+
+def load_model_from_spec(spec: Dict[str, Any]) -> Any:
+    """Загружает модель в воркере согласно спецификации бэкенда."""
+    from sentence_transformers import SentenceTransformer
+
+    backend = spec.get("backend", "torch")
+    model_path = spec["model_path"]
+    if backend == "torch":
+        return SentenceTransformer(model_path, cache_folder=spec.get("cache_dir"), device="cpu")
+    return onnx_backend.load_cpu_encoder(
+        lambda: SentenceTransformer(model_path, cache_folder=spec.get("cache_dir"), device="cpu"),
+        spec["cache_dir"],
+        spec.get("model_id", model_path),
+        runtime=backend,
+        quantize=spec.get("quantize", False),
+        num_threads=spec.get("threads", 0),
+    )
+
+
+def _resolve_loader(spec: Dict[str, Any]):
+    module_name, _, func_name = spec.get("loader", "encode_pool:load_model_from_spec").partition(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def _init_worker(spec: Dict[str, Any], core_queue, info_queue, threads_per_worker: int, ready_barrier):
+    global _worker_model, _worker_cores
+
+    _worker_cores = core_queue.get()
+    if _worker_cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, _worker_cores)
+    threads = threads_per_worker or max(1, len(_worker_cores))
+    torch.set_num_threads(threads)
+    spec = dict(spec, threads=threads)
+    _worker_model = _resolve_loader(spec)(spec)
+    info_queue.put({"pid": os.getpid(), "cores": _worker_cores, "threads": threads})
+    ready_barrier.wait(WORKER_START_TIMEOUT)
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def _encode_shard(texts: List[str], return_sparse: bool = False, prompt_prefixes: Sequence[str] = ()):
+    return batching.encode_texts(_worker_model, texts, return_sparse=return_sparse, prompt_prefixes=prompt_prefixes)
+
+
+def plan_shards(texts: Sequence[str], shards: int) -> List[List[int]]:
+    """Делит индексы на шарды близкого суммарного размера.
+
+    Тексты упорядочиваются по длине (в символах) и раздаются "змейкой",
+    так что каждый шард получает тексты схожих длин и сопоставимый объем работы.
+    """
+    order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]), reverse=True)
+    shards = max(1, min(shards, len(order)))
+    planned: List[List[int]] = [[] for _ in range(shards)]
+    for position, idx in enumerate(order):
+        lap, offset = divmod(position, shards)
+        planned[offset if lap % 2 == 0 else shards - 1 - offset].append(idx)
+    return [shard for shard in planned if shard]
+
+
+def merge_stats(stats_list: Sequence[Dict[str, Any]], texts: int, unique_texts: int, started: float) -> Dict[str, Any]:
+    real_tokens = sum(stats["real_tokens"] for stats in stats_list)
+    padded_tokens = sum(stats["padded_tokens"] for stats in stats_list)
+    return {
+        "texts": texts,
+        "unique_texts": unique_texts,
+        "batches": sum(stats["batches"] for stats in stats_list),
+        "real_tokens": real_tokens,
+        "padded_tokens": padded_tokens,
+        "padding_ratio": round(1.0 - real_tokens / padded_tokens, 4) if padded_tokens else 0.0,
+        "duration_ms": int((time.time() - started) * 1000),
+        "shards": len(stats_list),
+    }
+
+
+class EncodePool:
+    """Пул процессов с закреплением по ядрам и шардированием больших запросов."""
+
+    def __init__(self, spec: Dict[str, Any], workers: int = FRIDA_POOL_WORKERS,
+                 threads_per_worker: int = FRIDA_POOL_THREADS, min_texts: int = FRIDA_POOL_MIN_TEXTS,
+                 cores: Optional[Sequence[int]] = None):
+        self.spec = spec
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.min_texts = min_texts
+        self.core_sets = plan_core_sets(cores if cores is not None else available_cores(), workers)
+        self.worker_info: List[Dict[str, Any]] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.failure: Optional[str] = None
+
+    def start(self):
+        """Запускает все воркеры и ждет, пока каждый загрузит модель."""
+        started = time.time()
+        context = multiprocessing.get_context("spawn")
+        core_queue = context.Queue()
+        info_queue = context.Queue()
+        for core_set in self.core_sets:
+            core_queue.put(core_set)
+        ready_barrier = context.Barrier(self.workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.spec, core_queue, info_queue, self.threads_per_worker, ready_barrier),
+        )
+        # Барьер в инициализаторе держит воркеры занятыми, поэтому пул поднимает их все
+        ready = [self._executor.submit(_worker_ready) for _ in range(self.workers)]
+        for future in ready:
+            future.result(WORKER_START_TIMEOUT)
+        self.worker_info = sorted(
+            (info_queue.get(timeout=WORKER_START_TIMEOUT) for _ in range(self.workers)),
+            key=lambda info: info["pid"],
+        )
+        logger.info(f"Пул FRIDA запущен за {time.time() - started:.2f} сек: {self.worker_info}")
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def _discard(self, executor: ProcessPoolExecutor, error: BaseException):
+        """Останавливает сломанный пул: should_shard вернет False, запросы пойдут в текущий процесс."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.failure = f"{type(error).__name__}: {error}"
+                logger.error(f"Воркер пула FRIDA завершился аварийно, пул остановлен: {self.failure}")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def should_shard(self, count: int) -> bool:
+        return self.running and self.workers > 1 and count >= self.min_texts
+
+    def encode(self, texts: Sequence[str], return_sparse: bool = False, prompt_prefixes: Sequence[str] = ()):
+        """Кодирует тексты в пуле и возвращает эмбеддинги в исходном порядке.
+
+        С return_sparse=True третьим элементом возвращаются разреженные векторы,
+        как в batching.encode_texts. BrokenProcessPool, если воркер погиб:
+        пул при этом останавливается, повторять запрос нужно без него.
+        """
+        started = time.time()
+        executor = self._executor
+        if executor is None:
+            raise BrokenProcessPool(self.failure or "Пул процессов не запущен")
+        unique_texts, inverse = batching.deduplicate(texts)
+        shards = plan_shards(unique_texts, self.workers)
+        try:
+            return self._encode_shards(executor, texts, unique_texts, inverse, shards, return_sparse, prompt_prefixes,
+                                       started)
+        except BrokenProcessPool as e:
+            self._discard(executor, e)
+            raise
+
+    def _encode_shards(self, executor, texts, unique_texts, inverse, shards, return_sparse, prompt_prefixes, started):
+        futures = [
+            executor.submit(_encode_shard, [unique_texts[idx] for idx in shard], return_sparse, list(prompt_prefixes))
+            for shard in shards
+        ]
+
+        unique_embeddings: Optional[np.ndarray] = None
+        unique_sparse: List[Dict[str, List]] = [None] * len(unique_texts)
+        stats_list = []
+        for shard, future in zip(shards, futures):
+            shard_result = future.result()
+            shard_embeddings, shard_stats = shard_result[:2]
+            if unique_embeddings is None:
+                unique_embeddings = np.empty((len(unique_texts), shard_embeddings.shape[1]), dtype=np.float32)
+            unique_embeddings[shard] = shard_embeddings
+            stats_list.append(shard_stats)
+            if return_sparse:
+                for idx, vector in zip(shard, shard_result[2]):
+                    unique_sparse[idx] = vector
+
+        if unique_embeddings is None:
+            result = np.zeros((0, 0), dtype=np.float32), merge_stats([], len(texts), 0, started)
+        else:
+            result = unique_embeddings[inverse], merge_stats(stats_list, len(texts), len(unique_texts), started)
+        return result + ([unique_sparse[idx] for idx in inverse],) if return_sparse else result
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "failure": self.failure,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker or "auto",
+            "min_texts": self.min_texts,
+            "worker_info": self.worker_info,
+        }
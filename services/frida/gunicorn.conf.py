@@ -0,0 +1,27 @@
+"""
+Конфигурация gunicorn для FRIDA.
+
+FRIDA_WORKERS        — количество процессов-воркеров (по умолчанию 1)
+FRIDA_WORKER_THREADS — потоков gthread на воркер (по умолчанию 8)
+FRIDA_SHARED_WEIGHTS — 1: модель загружается один раз в мастере до fork (preload_app),
+                       воркеры обслуживают запросы на общих страницах весов
+"""
+
+import os
+
+bind = "0.0.0.0:8002"
+workers = int(os.environ.get("FRIDA_WORKERS", "1"))
+# gthread-воркер не убивается по таймауту во время долгой потоковой выдачи
+# результатов заданий (/jobs/<id>/results)
+worker_class = "gthread"
+threads = int(os.environ.get("FRIDA_WORKER_THREADS", "8"))
+timeout = 120
+preload_app = os.environ.get("FRIDA_SHARED_WEIGHTS", "0").strip() == "1"
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Модуль app уже импортирован в мастере: запускаем потоки и потоки torch в воркере
+        from app import init_worker_process
+
+        init_worker_process(server.cfg.workers)
@@ -0,0 +1,275 @@
+"""
+Асинхронные задания на массовое создание эмбеддингов.
+
+Состояние заданий (тексты, прогресс и готовые батчи векторов) хранится в
+локальном sqlite-файле. Фоновый поток обрабатывает задания батч за батчем и
+фиксирует каждый батч отдельной транзакцией, поэтому после перезапуска
+сервиса обработка продолжается с последнего завершенного батча.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FRIDA_JOBS_DB = os.environ.get("FRIDA_JOBS_DB", "/app/models/frida_jobs.sqlite3")
+# Количество текстов в одном фиксируемом батче задания
+FRIDA_JOB_BATCH_TEXTS = int(os.environ.get("FRIDA_JOB_BATCH_TEXTS", "256"))
+POLL_INTERVAL_SEC = 0.5
+INSERT_CHUNK = 1000
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+FINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    prompt_name TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    batch_size INTEGER NOT NULL,
+    dimension INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_texts (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_batches (
+    job_id TEXT NOT NULL,
+    batch_idx INTEGER NOT NULL,
+    start_idx INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    vectors BLOB NOT NULL,
+    PRIMARY KEY (job_id, batch_idx)
+);
+"""
+
+
+class JobStore:
+    """Хранилище заданий в sqlite. Каждая операция открывает свое соединение."""
+
+    def __init__(self, path: str = FRIDA_JOBS_DB, batch_size: int = FRIDA_JOB_BATCH_TEXTS):
+        self.path = path
+        self.batch_size = batch_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение на одну транзакцию: commit/rollback и закрытие по выходу."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create_job(self, texts: Iterable[str], prompt_name: Optional[str] = None) -> Dict[str, Any]:
+        """Создает задание; тексты пишутся порциями, без удержания всего списка в памяти."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        total = 0
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, prompt_name, batch_size, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, prompt_name, self.batch_size, now, now),
+            )
+            chunk: List[Tuple[str, int, str]] = []
+            for text in texts:
+                chunk.append((job_id, total, text))
+                total += 1
+                if len(chunk) >= INSERT_CHUNK:
+                    conn.executemany("INSERT INTO job_texts (job_id, idx, text) VALUES (?, ?, ?)", chunk)
+                    chunk = []
+            if chunk:
+                conn.executemany("INSERT INTO job_texts (job_id, idx, text) VALUES (?, ?, ?)", chunk)
+            status = STATUS_QUEUED if total else STATUS_COMPLETED
+            conn.execute("UPDATE jobs SET total = ?, status = ? WHERE id = ?", (total, status, job_id))
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = round(job["completed"] / job["total"], 4) if job["total"] else 1.0
+        return job
+
+    def delete_job(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+            conn.execute("DELETE FROM job_texts WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM job_batches WHERE job_id = ?", (job_id,))
+        return deleted > 0
+
+    def next_pending_job(self) -> Optional[Dict[str, Any]]:
+        """Возвращает незавершенное задание: сначала прерванные (running), затем по очереди."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY status = ? DESC, created_at LIMIT 1",
+                (STATUS_QUEUED, STATUS_RUNNING, STATUS_RUNNING),
+            ).fetchone()
+        return self.get_job(row["id"]) if row else None
+
+    def next_batch(self, job: Dict[str, Any]) -> Tuple[int, int, List[str]]:
+        """Определяет следующий незавершенный батч задания по уже сохраненным батчам."""
+        with self._connect() as conn:
+            done = conn.execute("SELECT COUNT(*) FROM job_batches WHERE job_id = ?", (job["id"],)).fetchone()[0]
+            start_idx = done * job["batch_size"]
+            rows = conn.execute(
+                "SELECT text FROM job_texts WHERE job_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                (job["id"], start_idx, start_idx + job["batch_size"]),
+            ).fetchall()
+        return done, start_idx, [row["text"] for row in rows]
+
+    def mark_running(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                         (STATUS_RUNNING, time.time(), job_id, STATUS_QUEUED))
+
+    def save_batch(self, job: Dict[str, Any], batch_idx: int, start_idx: int, embeddings: np.ndarray) -> bool:
+        """Атомарно сохраняет батч векторов и продвигает прогресс задания.
+
+        Возвращает False и ничего не пишет, если задание удалили (или оно
+        перестало выполняться), пока батч кодировался.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        completed = start_idx + len(embeddings)
+        status = STATUS_COMPLETED if completed >= job["total"] else STATUS_RUNNING
+        with self._connect() as conn:
+            # Прогресс продвигается первым: UPDATE берет блокировку записи, и удаление
+            # задания не вклинится между проверкой и вставкой батча
+            updated = conn.execute(
+                "UPDATE jobs SET completed = ?, dimension = ?, status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (completed, int(embeddings.shape[1]), status, time.time(), job["id"], STATUS_RUNNING),
+            ).rowcount
+            if not updated:
+                return False
+            conn.execute(
+                "INSERT INTO job_batches (job_id, batch_idx, start_idx, count, vectors) VALUES (?, ?, ?, ?, ?)",
+                (job["id"], batch_idx, start_idx, len(embeddings), embeddings.tobytes()),
+            )
+            if status == STATUS_COMPLETED:
+                # Тексты больше не нужны: результаты лежат в job_batches
+                conn.execute("DELETE FROM job_texts WHERE job_id = ?", (job["id"],))
+        return True
+
+    def mark_failed(self, job_id: str, error: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                         (STATUS_FAILED, error, time.time(), job_id))
+
+    def get_batch(self, job_id: str, batch_idx: int) -> Optional[Tuple[int, np.ndarray]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT j.dimension, b.start_idx, b.count, b.vectors FROM job_batches b "
+                "JOIN jobs j ON j.id = b.job_id WHERE b.job_id = ? AND b.batch_idx = ?",
+                (job_id, batch_idx),
+            ).fetchone()
+        if row is None:
+            return None
+        vectors = np.frombuffer(row["vectors"], dtype=np.float32).reshape(row["count"], row["dimension"])
+        return row["start_idx"], vectors
+
+    def iter_batches(self, job_id: str, poll_interval: float = POLL_INTERVAL_SEC) -> Iterator[Tuple[int, np.ndarray]]:
+        """Отдает готовые батчи по порядку, дожидаясь следующих, пока задание не завершится."""
+        batch_idx = 0
+        while True:
+            batch = self.get_batch(job_id, batch_idx)
+            if batch is not None:
+                yield batch
+                batch_idx += 1
+                continue
+            job = self.get_job(job_id)
+            if job is None or job["status"] in FINAL_STATUSES:
+                # Последняя проверка: батч мог записаться между двумя запросами
+                batch = self.get_batch(job_id, batch_idx)
+                if batch is None:
+                    return
+                continue
+            time.sleep(poll_interval)
+
+
+class JobRunner:
+    """Фоновый поток, последовательно обрабатывающий задания из JobStore."""
+
+    def __init__(self, store: JobStore, encode_fn: Callable[[List[str]], Tuple[np.ndarray, Dict[str, Any]]],
+                 is_ready: Callable[[], bool] = lambda: True, poll_interval: float = POLL_INTERVAL_SEC):
+        self.store = store
+        self.encode_fn = encode_fn
+        self.is_ready = is_ready
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="frida-jobs", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        """Будит поток сразу после создания нового задания."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.is_ready() and self.process_next_batch()
+            except Exception as e:
+                logger.error(f"Ошибка обработчика заданий: {str(e)}")
+                processed = False
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def process_next_batch(self) -> bool:
+        """Обрабатывает один батч ближайшего задания. Возвращает False, если работы нет."""
+        job = self.store.next_pending_job()
+        if job is None:
+            return False
+        self.store.mark_running(job["id"])
+        batch_idx, start_idx, texts = self.store.next_batch(job)
+        if not texts:
+            self.store.mark_failed(job["id"], "Тексты задания не найдены")
+            return True
+        try:
+            embeddings, _ = self.encode_fn(texts)
+        except Exception as e:
+            logger.error(f"Задание {job['id']} завершилось ошибкой на батче {batch_idx}: {str(e)}")
+            self.store.mark_failed(job["id"], str(e))
+            return True
+        if not self.store.save_batch(job, batch_idx, start_idx, embeddings):
+            logger.info(f"Задание {job['id']} удалено во время батча {batch_idx}: батч отброшен")
+            return True
+        logger.info(f"Задание {job['id']}: батч {batch_idx} готов ({start_idx + len(texts)}/{job['total']})")
+        return True
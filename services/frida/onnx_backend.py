@@ -0,0 +1,224 @@
+"""
+CPU-бэкенды инференса FRIDA: экспортированный ONNX-граф (encoder + pooling)
+через onnxruntime или OpenVINO, с опциональной int8 динамической квантизацией.
+
+Экспорт выполняется один раз и кешируется на диске рядом с моделями. Вместе
+с графом сохраняются токенизатор и метаданные, поэтому при повторных запусках
+PyTorch-модель для CPU-бэкенда вообще не загружается. Каталог экспорта
+появляется целиком (запись во временный каталог и переименование), а
+экспортирует его один воркер под файловой блокировкой: остальные ждут и
+загружают готовый.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# torch | onnx | openvino
+FRIDA_BACKEND = os.environ.get("FRIDA_BACKEND", "torch").strip().lower()
+# int8 динамическая квантизация весов линейных слоев
+FRIDA_QUANTIZE = os.environ.get("FRIDA_QUANTIZE", "0").strip().lower() in ("1", "true", "yes", "int8")
+# Количество потоков инференса (0 — значение рантайма по умолчанию)
+FRIDA_NUM_THREADS = int(os.environ.get("FRIDA_NUM_THREADS", "0"))
+ONNX_OPSET = 17
+
+SUPPORTED_BACKENDS = ("torch", "onnx", "openvino")
+META_FILE = "frida_onnx.json"
+
+
+class PooledEncoder(torch.nn.Module):
+    """Обертка SentenceTransformer для экспорта: тензоры на входе, sentence_embedding на выходе."""
+
+    def __init__(self, model: Any, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.model(dict(zip(self.input_names, inputs)))["sentence_embedding"]
+
+
+def export_dir_for(cache_dir: str, model_id: str, quantize: bool) -> str:
+    suffix = "int8" if quantize else "fp32"
+    return os.path.join(cache_dir, "onnx", model_id.replace("/", "__"), suffix)
+
+
+def export_onnx(model: Any, target_dir: str, quantize: bool = False) -> str:
+    """Экспортирует SentenceTransformer (вместе с pooling/normalize) в ONNX.
+
+    Файлы пишутся во временный каталог рядом с target_dir, который затем
+    переименовывается в target_dir: читатель не увидит частично записанный экспорт.
+    """
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=os.path.basename(target_dir) + ".tmp-", dir=parent)
+    try:
+        _export_into(model, work_dir, quantize)
+        if os.path.isdir(target_dir):
+            # Остаток прерванного экспорта прежних версий (без метаданных)
+            shutil.rmtree(target_dir)
+        os.replace(work_dir, target_dir)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    return os.path.join(target_dir, "model.onnx")
+
+
+def _export_into(model: Any, target_dir: str, quantize: bool):
+    fp32_path = os.path.join(target_dir, "model_fp32.onnx")
+    model_path = os.path.join(target_dir, "model.onnx")
+    started = time.time()
+
+    model.eval()
+    # Экспортируем на батче с паддингом, чтобы в граф попала ветка attention_mask
+    sample = model.tokenizer(
+        ["search_document: пример текста для экспорта графа", "paraphrase: ok"],
+        padding=True,
+        truncation=True,
+        max_length=model.max_seq_length,
+        return_tensors="pt",
+    )
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["sentence_embedding"] = {0: "batch"}
+
+    wrapper = PooledEncoder(model.cpu(), input_names).eval()
+    with torch.inference_mode():
+        dimension = int(wrapper(*(sample[name] for name in input_names)).shape[-1])
+        torch.onnx.export(
+            wrapper,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["sentence_embedding"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+
+    model.tokenizer.save_pretrained(target_dir)
+    with open(os.path.join(target_dir, META_FILE), "w", encoding="utf-8") as meta_file:
+        json.dump({
+            "input_names": input_names,
+            "max_seq_length": model.max_seq_length,
+            "dimension": dimension,
+            "quantized": quantize,
+            "opset": ONNX_OPSET,
+        }, meta_file)
+
+    logger.info(f"ONNX-граф FRIDA экспортирован за {time.time() - started:.2f} сек (int8={quantize})")
+
+
+class OnnxEncoder:
+    """Замена SentenceTransformer для encode_texts на ONNX-графе.
+
+    Предоставляет те же атрибуты, что использует пакетирование: tokenizer,
+    max_seq_length, device и вызов model(features) -> {"sentence_embedding": ...}.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self, model_dir: str, runtime: str = "onnx", num_threads: int = 0):
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, META_FILE), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        self.model_dir = model_dir
+        self.runtime = runtime
+        self.input_names: List[str] = meta["input_names"]
+        self.max_seq_length: int = meta["max_seq_length"]
+        self.dimension: int = meta["dimension"]
+        self.quantized: bool = meta.get("quantized", False)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        model_path = os.path.join(model_dir, "model.onnx")
+        if runtime == "openvino":
+            self._run = self._build_openvino(model_path, num_threads)
+        else:
+            self._run = self._build_onnxruntime(model_path, num_threads)
+
+    def _build_onnxruntime(self, model_path: str, num_threads: int) -> Callable[[Dict[str, np.ndarray]], np.ndarray]:
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        def run(inputs: Dict[str, np.ndarray]) -> np.ndarray:
+            return session.run(["sentence_embedding"], inputs)[0]
+
+        return run
+
+    def _build_openvino(self, model_path: str, num_threads: int) -> Callable[[Dict[str, np.ndarray]], np.ndarray]:
+        import openvino as ov
+
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if num_threads > 0:
+            config["INFERENCE_NUM_THREADS"] = num_threads
+        compiled = ov.Core().compile_model(model_path, "CPU", config)
+        output = compiled.output(0)
+
+        def run(inputs: Dict[str, np.ndarray]) -> np.ndarray:
+            return compiled(inputs)[output]
+
+        return run
+
+    def __call__(self, features: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        inputs = {name: features[name].cpu().numpy().astype(np.int64) for name in self.input_names}
+        return {"sentence_embedding": torch.from_numpy(np.asarray(self._run(inputs)))}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+
+def configure_torch_threads(num_threads: int = FRIDA_NUM_THREADS):
+    """Ограничивает intra-op потоки PyTorch, если задан FRIDA_NUM_THREADS."""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+
+def load_cpu_encoder(model_factory: Callable[[], Any], cache_dir: str, model_id: str,
+                     runtime: str = FRIDA_BACKEND, quantize: bool = FRIDA_QUANTIZE,
+                     num_threads: int = FRIDA_NUM_THREADS) -> OnnxEncoder:
+    """Загружает ONNX/OpenVINO-энкодер, экспортируя граф при первом запуске.
+
+    model_factory вызывается только если экспорт еще не закеширован.
+    """
+    if runtime not in ("onnx", "openvino"):
+        raise ValueError(f"Неизвестный CPU-бэкенд: {runtime}")
+    target_dir = export_dir_for(cache_dir, model_id, quantize)
+    if not os.path.exists(os.path.join(target_dir, META_FILE)):
+        os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+        # Воркеры gunicorn стартуют одновременно: экспортирует первый, остальные ждут его
+        with open(target_dir + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(os.path.join(target_dir, META_FILE)):
+                    logger.info(f"Экспорт FRIDA в ONNX ({target_dir}), это выполняется один раз")
+                    export_onnx(model_factory(), target_dir, quantize=quantize)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    encoder = OnnxEncoder(target_dir, runtime=runtime, num_threads=num_threads)
+    logger.info(f"Используется бэкенд {runtime} (int8={encoder.quantized}, threads={num_threads or 'auto'})")
+    return encoder
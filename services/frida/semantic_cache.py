@@ -0,0 +1,335 @@
+"""
+Семантический кеш запросов FRIDA.
+
+Два уровня:
+  * эмбеддинги запросов: точный текст search_query → вектор (LRU), чтобы
+    повторный вопрос не проходил через модель;
+  * результаты поиска: по проекту хранится матрица нормированных
+    эмбеддингов недавних запросов и их payload (например, найденные
+    документы). Новый запрос с косинусной близостью не ниже порога получает
+    сохраненный payload без обращения к Qdrant.
+
+Записи живут не дольше TTL; при переполнении проекта вытесняется давно не
+использованная запись. Проект целиком сбрасывается при изменении его
+документов; под gunicorn с несколькими воркерами сброс доходит до всех
+через файл-метку проекта в общем каталоге (время изменения метки — граница,
+раньше которой записи считаются устаревшими).
+
+Результат, посчитанный до сброса, но сохраненный после него, меткой времени
+не отличить от свежего. Поэтому у проекта есть поколение (generation): при
+каждом сбросе в метку пишется новый токен. /cache/lookup возвращает
+поколение при промахе, клиент передает его в /cache/store, и запись
+отклоняется, если поколение с тех пор сменилось.
+
+Индекс — плоская матрица NumPy: при тысячах записей на проект одно
+матричное умножение дешевле построения HNSW.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Минимальная косинусная близость запросов для попадания в кеш
+CACHE_THRESHOLD = float(os.environ.get("FRIDA_CACHE_THRESHOLD", "0.95"))
+# Время жизни записи, сек
+CACHE_TTL = float(os.environ.get("FRIDA_CACHE_TTL", "600"))
+# Максимум записей с результатами на проект
+CACHE_MAX_ENTRIES = int(os.environ.get("FRIDA_CACHE_MAX_ENTRIES", "2048"))
+# Максимум эмбеддингов запросов в точном кеше
+CACHE_MAX_EMBEDDINGS = int(os.environ.get("FRIDA_CACHE_MAX_EMBEDDINGS", "10000"))
+# Максимум проектов со счетчиками в stats (имена приходят из запросов)
+CACHE_MAX_PROJECTS = int(os.environ.get("FRIDA_CACHE_MAX_PROJECTS", "1024"))
+# Каталог меток сброса, общий для воркеров gunicorn
+CACHE_INVALIDATION_DIR = os.environ.get("FRIDA_CACHE_INVALIDATION_DIR", "/app/models/frida_cache")
+
+ALL_PROJECTS_MARKER = "_all"
+
+
+def context_key(context: Any) -> str:
+    """Ключ параметров поиска: результаты с разными limit/фильтрами не смешиваются."""
+    if not context:
+        return ""
+    encoded = json.dumps(context, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(embedding: Any) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+
+class _ProjectIndex:
+    """Матрица эмбеддингов одного проекта и метаданные ее строк."""
+
+    def __init__(self, dimension: int, capacity: int):
+        self.vectors = np.zeros((min(capacity, 64), dimension), dtype=np.float32)
+        self.capacity = capacity
+        self.size = 0
+        self.queries = []
+        self.payloads = []
+        self.created = np.zeros(self.vectors.shape[0], dtype=np.float64)
+        self.last_used = np.zeros(self.vectors.shape[0], dtype=np.float64)
+
+    def _grow(self):
+        rows = min(self.capacity, self.vectors.shape[0] * 2)
+        self.vectors = np.resize(self.vectors, (rows, self.vectors.shape[1]))
+        self.created = np.resize(self.created, rows)
+        self.last_used = np.resize(self.last_used, rows)
+
+    def remove(self, row: int):
+        """Удаляет строку, перенося на ее место последнюю (порядок не важен)."""
+        last = self.size - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.created[row] = self.created[last]
+            self.last_used[row] = self.last_used[last]
+            self.queries[row] = self.queries[last]
+            self.payloads[row] = self.payloads[last]
+        self.queries.pop()
+        self.payloads.pop()
+        self.size = last
+
+    def expire(self, deadline: float) -> int:
+        expired = np.nonzero(self.created[:self.size] < deadline)[0]
+        for row in sorted(expired.tolist(), reverse=True):
+            self.remove(row)
+        return len(expired)
+
+    def add(self, vector: np.ndarray, query: str, payload: Any, now: float) -> int:
+        """Добавляет запись, при переполнении вытесняя давно не использованную. Возвращает число вытеснений."""
+        evicted = 0
+        if self.size >= self.capacity:
+            self.remove(int(np.argmin(self.last_used[:self.size])))
+            evicted = 1
+        if self.size >= self.vectors.shape[0]:
+            self._grow()
+        row = self.size
+        self.vectors[row] = vector
+        self.created[row] = now
+        self.last_used[row] = now
+        self.queries.append(query)
+        self.payloads.append(payload)
+        self.size += 1
+        return evicted
+
+    def nearest(self, vector: np.ndarray):
+        if self.size == 0:
+            return None, 0.0
+        similarities = self.vectors[:self.size] @ vector
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+
+class SemanticCache:
+    """Кеш эмбеддингов запросов и результатов поиска по проектам. Потокобезопасен."""
+
+    def __init__(self, threshold: float = CACHE_THRESHOLD, ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_embeddings: int = CACHE_MAX_EMBEDDINGS,
+                 invalidation_dir: Optional[str] = None, clock: Callable[[], float] = time.time,
+                 max_projects: int = CACHE_MAX_PROJECTS):
+        self.threshold = threshold
+        self.invalidation_dir = invalidation_dir
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_embeddings = max(0, max_embeddings)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._indexes: Dict[str, Dict[str, _ProjectIndex]] = {}
+        self._stats: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self.max_projects = max(1, max_projects)
+        # Токены поколений без общего каталога (один процесс); None — весь кеш
+        self._tokens: Dict[Optional[str], str] = {}
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+
+    # Уровень 1: эмбеддинги запросов по точному тексту
+
+    def get_embedding(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._embeddings.get(text)
+            if vector is None:
+                self.embedding_misses += 1
+                return None
+            self._embeddings.move_to_end(text)
+            self.embedding_hits += 1
+            return vector
+
+    def put_embedding(self, text: str, embedding: Any):
+        if self.max_embeddings == 0:
+            return
+        with self._lock:
+            self._embeddings[text] = np.asarray(embedding, dtype=np.float32)
+            self._embeddings.move_to_end(text)
+            while len(self._embeddings) > self.max_embeddings:
+                self._embeddings.popitem(last=False)
+
+    # Уровень 2: результаты поиска по близости запросов
+
+    def _marker_path(self, project: Optional[str]) -> str:
+        name = hashlib.sha1(project.encode("utf-8")).hexdigest() if project is not None else ALL_PROJECTS_MARKER
+        return os.path.join(self.invalidation_dir, name)
+
+    def _invalidated_at(self, project: str) -> float:
+        """Время последнего сброса проекта другим процессом (0, если меток нет)."""
+        if not self.invalidation_dir:
+            return 0.0
+        latest = 0.0
+        for path in (self._marker_path(project), self._marker_path(None)):
+            try:
+                latest = max(latest, os.stat(path).st_mtime)
+            except OSError:
+                pass
+        return latest
+
+    def _touch_marker(self, project: Optional[str], token: str):
+        """Записывает в метку новый токен поколения (файл заменяется целиком, mtime — время сброса)."""
+        if not self.invalidation_dir:
+            return
+        try:
+            os.makedirs(self.invalidation_dir, exist_ok=True)
+            path = self._marker_path(project)
+            tmp_path = f"{path}.{token}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as marker_file:
+                marker_file.write(token)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать метку сброса кеша: {e}")
+
+    def _token(self, project: Optional[str]) -> str:
+        if not self.invalidation_dir:
+            return self._tokens.get(project, "")
+        try:
+            with open(self._marker_path(project), encoding="utf-8") as marker_file:
+                return marker_file.read().strip()
+        except OSError:
+            return ""
+
+    def generation(self, project: str) -> str:
+        """Поколение кеша проекта: меняется при каждом сбросе проекта или всего кеша, в любом воркере."""
+        tokens = f"{self._token(project)}/{self._token(None)}"
+        return hashlib.sha1(tokens.encode("utf-8")).hexdigest()[:16]
+
+    def _project_stats(self, project: str) -> Dict[str, int]:
+        stats = self._stats.get(project)
+        if stats is None:
+            stats = self._stats[project] = {"hits": 0, "misses": 0, "stores": 0, "stale_stores": 0,
+                                            "evictions": 0, "expired": 0, "invalidations": 0}
+            while len(self._stats) > self.max_projects:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(project)
+        return stats
+
+    def lookup(self, project: str, embedding: Any, context: Any = None) -> Optional[Dict[str, Any]]:
+        """Ищет ближайший сохраненный запрос проекта; возвращает payload при близости не ниже порога."""
+        vector = _normalize(embedding)
+        now = self._clock()
+        invalidated_at = self._invalidated_at(project)
+        with self._lock:
+            stats = self._project_stats(project)
+            index = self._indexes.get(project, {}).get(context_key(context))
+            if index is not None and index.vectors.shape[1] == vector.shape[0]:
+                stats["expired"] += index.expire(max(now - self.ttl, invalidated_at))
+                row, similarity = index.nearest(vector)
+                if row is not None and similarity >= self.threshold:
+                    index.last_used[row] = now
+                    stats["hits"] += 1
+                    return {
+                        "payload": index.payloads[row],
+                        "similarity": similarity,
+                        "cached_query": index.queries[row],
+                        "age_sec": round(now - index.created[row], 3),
+                    }
+            stats["misses"] += 1
+            return None
+
+    def store(self, project: str, embedding: Any, query: str, payload: Any, context: Any = None,
+              generation: Optional[str] = None) -> bool:
+        """Сохраняет результат поиска для запроса проекта.
+
+        generation — поколение, полученное при промахе lookup; если проект с тех пор
+        сбрасывали, результат посчитан по старым данным и не сохраняется (False).
+        """
+        vector = _normalize(embedding)
+        now = self._clock()
+        invalidated_at = self._invalidated_at(project)
+        with self._lock:
+            stats = self._project_stats(project)
+            # Под блокировкой: локальный сброс не вклинится между проверкой и записью
+            if generation is not None and generation != self.generation(project):
+                stats["stale_stores"] += 1
+                return False
+            indexes = self._indexes.setdefault(project, {})
+            key = context_key(context)
+            index = indexes.get(key)
+            if index is None or index.vectors.shape[1] != vector.shape[0]:
+                index = indexes[key] = _ProjectIndex(vector.shape[0], self.max_entries)
+            stats["expired"] += index.expire(max(now - self.ttl, invalidated_at))
+            row, similarity = index.nearest(vector)
+            if row is not None and similarity >= 1.0 - 1e-6:
+                # Тот же запрос: обновляем результат вместо дубликата
+                index.payloads[row] = payload
+                index.created[row] = now
+                index.last_used[row] = now
+            else:
+                stats["evictions"] += index.add(vector, query, payload, now)
+            stats["stores"] += 1
+            return True
+
+    def invalidate(self, project: Optional[str] = None) -> int:
+        """Сбрасывает результаты проекта (или всех проектов). Возвращает число удаленных записей.
+
+        Остальные воркеры узнают о сбросе по метке в invalidation_dir.
+        """
+        token = uuid.uuid4().hex
+        self._touch_marker(project, token)
+        with self._lock:
+            self._tokens[project] = token
+            projects = [project] if project is not None else list(self._indexes)
+            removed = 0
+            for name in projects:
+                removed += sum(index.size for index in self._indexes.pop(name, {}).values())
+                self._project_stats(name)["invalidations"] += 1
+        logger.info(f"Семантический кеш сброшен: проект={project or '*'}, удалено записей {removed}")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            projects = {}
+            for name, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                projects[name] = dict(
+                    stats,
+                    entries=sum(index.size for index in self._indexes.get(name, {}).values()),
+                    hit_ratio=round(stats["hits"] / lookups, 4) if lookups else 0.0,
+                )
+            hits = sum(stats["hits"] for stats in self._stats.values())
+            lookups = hits + sum(stats["misses"] for stats in self._stats.values())
+            embedding_lookups = self.embedding_hits + self.embedding_misses
+            return {
+                "threshold": self.threshold,
+                "ttl_sec": self.ttl,
+                "max_entries_per_project": self.max_entries,
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "embeddings": {
+                    "entries": len(self._embeddings),
+                    "hits": self.embedding_hits,
+                    "misses": self.embedding_misses,
+                    "hit_ratio": round(self.embedding_hits / embedding_lookups, 4) if embedding_lookups else 0.0,
+                },
+                "projects": projects,
+            }
@@ -0,0 +1,64 @@
+"""
+Подготовка весов FRIDA к fork в мастере gunicorn (--preload).
+
+Все параметры и буферы модели переносятся в один непрерывный буфер в
+разделяемой памяти (один файловый дескриптор вместо дескриптора на тензор),
+а тензоры модели становятся представлениями этого буфера. После fork
+воркеры читают одни и те же физические страницы; запись в параметры
+исключается (eval, requires_grad=False, inference_mode при кодировании),
+а gc.freeze() не дает сборщику мусора трогать заголовки объектов мастера.
+"""
+
+import gc
+import logging
+from typing import Any, Dict
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT_BYTES = 64
+
+
+def _aligned(size: int) -> int:
+    return (size + ALIGNMENT_BYTES - 1) // ALIGNMENT_BYTES * ALIGNMENT_BYTES
+
+
+def share_module_weights(module: torch.nn.Module) -> Dict[str, Any]:
+    """Переносит параметры и буферы модуля в общий буфер разделяемой памяти.
+
+    Возвращает статистику: количество тензоров и размер буфера в байтах.
+    """
+    module.eval()
+    tensors = []
+    seen = set()
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        # Связанные веса (например, общие эмбеддинги T5) переносим один раз
+        if id(tensor) in seen or tensor.device.type != "cpu":
+            continue
+        seen.add(id(tensor))
+        tensors.append(tensor)
+
+    total_bytes = sum(_aligned(tensor.numel() * tensor.element_size()) for tensor in tensors)
+    storage = torch.empty(total_bytes, dtype=torch.uint8).share_memory_()
+
+    offset = 0
+    with torch.no_grad():
+        for tensor in tensors:
+            nbytes = tensor.numel() * tensor.element_size()
+            view = storage[offset:offset + nbytes].view(tensor.dtype).view(tensor.shape)
+            view.copy_(tensor)
+            tensor.data = view
+            offset += _aligned(nbytes)
+
+    for parameter in module.parameters():
+        parameter.requires_grad_(False)
+
+    logger.info(f"Веса перенесены в разделяемую память: {len(tensors)} тензоров, {total_bytes / 1024**2:.1f} МБ")
+    return {"tensors": len(tensors), "bytes": total_bytes}
+
+
+def freeze_for_fork():
+    """Собирает мусор и замораживает объекты мастера, чтобы GC воркеров не копировал их страницы."""
+    gc.collect()
+    gc.freeze()
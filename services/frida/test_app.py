@@ -0,0 +1,332 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+# Окружение задается до импорта app: без предзагрузки и с временными путями
+_TMP = tempfile.TemporaryDirectory()
+os.environ["FRIDA_PRELOAD_ON_STARTUP"] = "0"
+os.environ["FRIDA_JOBS_DB"] = os.path.join(_TMP.name, "jobs.sqlite3")
+os.environ["TRANSFORMERS_CACHE"] = os.path.join(_TMP.name, "models")
+os.environ["FRIDA_CACHE_INVALIDATION_DIR"] = os.path.join(_TMP.name, "cache")
+os.environ["FRIDA_VECTOR_STORE_DIR"] = os.path.join(_TMP.name, "vectors")
+
+import app  # noqa: E402
+
+
+class FakeSentenceTransformer:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class ModelLoadingTests(unittest.TestCase):
+    def setUp(self):
+        app.model = None
+        app.model_loading = False
+        app.model_error = None
+        app.load_timings.clear()
+        self.snapshot_dir = tempfile.mkdtemp(dir=_TMP.name)
+        patcher = patch.object(app, "LOCAL_MODEL_DIR", self.snapshot_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for_load(self, timeout=5):
+        deadline = time.time() + timeout
+        while app.model_loading and time.time() < deadline:
+            time.sleep(0.01)
+
+    def write_snapshot(self):
+        for name in ("modules.json", "config.json", "model.safetensors"):
+            with open(os.path.join(self.snapshot_dir, name), "w") as snapshot_file:
+                snapshot_file.write("{}")
+
+    def test_concurrent_load_requests_start_a_single_load(self):
+        calls = []
+
+        def slow_build(target_device):
+            calls.append(target_device)
+            time.sleep(0.2)
+            return FakeSentenceTransformer()
+
+        with patch.object(app, "build_sentence_transformer", side_effect=slow_build):
+            threads = [threading.Thread(target=app.ensure_model_loading) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            with self.assertRaises(Exception):
+                app.get_model()
+            response = app.app.test_client().get("/load")
+            for thread in threads:
+                thread.join()
+            self.wait_for_load()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(response.json["status"], "Model loading already in progress")
+        self.assertIsInstance(app.get_model(), FakeSentenceTransformer)
+
+    def test_local_snapshot_is_loaded_without_network(self):
+        self.write_snapshot()
+
+        with patch.object(app, "snapshot_download", side_effect=AssertionError("network must not be used")), \
+                patch.object(app, "SentenceTransformer", FakeSentenceTransformer):
+            loaded = app.build_sentence_transformer("cpu")
+
+        self.assertEqual(loaded.args, (self.snapshot_dir,))
+        self.assertTrue(loaded.kwargs["local_files_only"])
+        self.assertEqual(loaded.kwargs["model_kwargs"], {"use_safetensors": True})
+        self.assertEqual(app.load_source, "local")
+
+    def test_missing_snapshot_is_downloaded_before_loading(self):
+        def download(*args, **kwargs):
+            self.write_snapshot()
+
+        with patch.object(app, "snapshot_download", side_effect=download) as snapshot, \
+                patch.object(app, "SentenceTransformer", FakeSentenceTransformer):
+            loaded = app.build_sentence_transformer("cpu")
+
+        snapshot.assert_called_once()
+        self.assertEqual(loaded.args, (self.snapshot_dir,))
+        self.assertEqual(app.load_source, "network")
+
+    def test_health_reports_startup_phase_timings(self):
+        self.write_snapshot()
+
+        with patch.object(app, "SentenceTransformer", FakeSentenceTransformer):
+            app.ensure_model_loading()
+            self.wait_for_load()
+        health = app.app.test_client().get("/health").json
+
+        self.assertTrue(health["model_loaded"])
+        self.assertEqual(health["startup"]["source"], "local")
+        for phase in ("snapshot_check_ms", "model_init_ms", "total_ms"):
+            self.assertIn(phase, health["startup"]["timings_ms"])
+
+    def test_load_error_is_reported_and_can_be_retried(self):
+        with patch.object(app, "build_sentence_transformer", side_effect=RuntimeError("offline")):
+            app.ensure_model_loading()
+            self.wait_for_load()
+
+        self.assertEqual(app.model_error, "offline")
+        with patch.object(app, "build_sentence_transformer", return_value=FakeSentenceTransformer()):
+            response = app.app.test_client().get("/load")
+            self.wait_for_load()
+
+        self.assertEqual(response.json["status"], "Model loading started")
+        self.assertIsNone(app.model_error)
+        self.assertIsNotNone(app.model)
+
+
+class EncodeFallbackTests(unittest.TestCase):
+    def test_broken_pool_falls_back_to_in_process_encoding(self):
+        from concurrent.futures.process import BrokenProcessPool
+        from unittest.mock import MagicMock
+
+        pool = MagicMock()
+        pool.should_shard.return_value = True
+        pool.encode.side_effect = BrokenProcessPool("воркер убит")
+        in_process = (np.ones((2, 2), dtype=np.float32), {})
+        with patch.object(app, "model", object()), patch.object(app, "encode_pool", pool), \
+                patch.object(app, "encode_texts", return_value=in_process) as encode_texts:
+            self.assertIs(app.encode_processed_texts(["a", "b"]), in_process)
+        encode_texts.assert_called_once()
+
+
+class JobEndpointTests(unittest.TestCase):
+    def setUp(self):
+        from jobs import JobStore
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.tmp.name, "jobs.sqlite3"), batch_size=2)
+        patcher = patch.multiple(app, job_store=self.store, job_runner=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+        self.client = app.app.test_client()
+
+    def job_count(self):
+        with self.store._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def test_bad_texts_are_rejected_at_submit_time(self):
+        for payload in ({"texts": ["ok", 5]}, {"texts": ["ok", "  "]}, {"texts": {"a": "b"}}):
+            with self.subTest(payload=payload):
+                response = self.client.post("/jobs", json=payload)
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.post("/jobs", data='"ok"\n{"text": ""}\n', content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("2", response.get_json()["error"])
+        self.assertEqual(self.job_count(), 0)
+
+    def test_failed_job_stream_ends_with_error_record(self):
+        job = self.client.post("/jobs", json={"texts": ["a", "b", "c"]}).get_json()
+        self.store.mark_running(job["job_id"])
+        self.store.save_batch(self.store.get_job(job["job_id"]), 0, 0, np.ones((2, 4), dtype=np.float32))
+        self.store.mark_failed(job["job_id"], "CUDA out of memory")
+
+        response = self.client.get(f"/jobs/{job['job_id']}/results")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([line.get("index") for line in lines[:2]], [0, 1])
+        self.assertEqual(lines[-1], {"status": "failed", "error": "CUDA out of memory"})
+        self.assertEqual(response.headers["X-Job-Status"], "failed")
+
+        response = self.client.get(f"/jobs/{job['job_id']}/results?format=binary")
+        self.assertEqual(response.headers["X-Job-Status"], "failed")
+        with self.assertRaises(RuntimeError):
+            response.get_data()
+
+    def test_completed_job_stream_has_no_error_record(self):
+        job = self.client.post("/jobs", json={"texts": ["a", "b"]}).get_json()
+        self.store.mark_running(job["job_id"])
+        self.store.save_batch(self.store.get_job(job["job_id"]), 0, 0, np.ones((2, 4), dtype=np.float32))
+
+        response = self.client.get(f"/jobs/{job['job_id']}/results")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([line["index"] for line in lines], [0, 1])
+
+
+class SemanticCacheEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.encoded = []
+
+        def fake_encode(texts):
+            self.encoded.extend(texts)
+            return np.array([[1.0, float(len(text))] for text in texts], dtype=np.float32), {}
+
+        patcher = patch.object(app, "encode_processed_texts", side_effect=fake_encode)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache_patcher = patch.object(app, "semantic_cache", app.SemanticCache(threshold=0.99))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        self.client = app.app.test_client()
+
+    def test_lookup_store_and_invalidate_round_trip(self):
+        request = {"project": "docs", "query": "пароль", "context": {"limit": 5}}
+
+        miss = self.client.post("/cache/lookup", json=dict(request, return_embedding=True)).json
+        self.client.post("/cache/store", json=dict(request, payload={"documents": [7]}))
+        hit = self.client.post("/cache/lookup", json=request).json
+        self.client.post("/cache/invalidate", json={"project": "docs"})
+        after = self.client.post("/cache/lookup", json=request).json
+        stats = self.client.get("/cache/stats").json
+
+        self.assertFalse(miss["hit"])
+        self.assertEqual(len(miss["embedding"]), 2)
+        self.assertTrue(hit["hit"])
+        self.assertEqual(hit["payload"], {"documents": [7]})
+        self.assertFalse(after["hit"])
+        self.assertEqual(self.encoded, ["search_query: пароль"])
+        self.assertEqual(stats["projects"]["docs"]["hits"], 1)
+        self.assertEqual(stats["embeddings"]["hits"], 3)
+
+    def test_store_after_invalidation_is_rejected_with_generation(self):
+        request = {"project": "docs", "query": "пароль"}
+
+        miss = self.client.post("/cache/lookup", json=request).json
+        self.client.post("/cache/invalidate", json={"project": "docs"})
+        stale = self.client.post("/cache/store", json=dict(request, payload=[1], generation=miss["generation"]))
+
+        self.assertEqual(stale.status_code, 409)
+        self.assertFalse(self.client.post("/cache/lookup", json=request).json["hit"])
+
+    def test_missing_fields_are_rejected(self):
+        self.assertEqual(self.client.post("/cache/lookup", json={"query": "q"}).status_code, 400)
+        self.assertEqual(self.client.post("/cache/store", json={"project": "p", "query": "q"}).status_code, 400)
+
+
+class ChunkEndpointTests(unittest.TestCase):
+    def setUp(self):
+        from test_chunking import WordTokenizer
+
+        class ChunkModel:
+            max_seq_length = 8
+            tokenizer = WordTokenizer()
+
+        for name, value in (("model", ChunkModel()),
+                            ("encode_processed_texts", lambda texts: (np.ones((len(texts), 2), dtype=np.float32), {}))):
+            patcher = patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app.app.test_client()
+
+    def read_chunks(self, response):
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_plain_text_body_is_chunked_with_embeddings(self):
+        text = "Один два три. Четыре пять шесть. Семь восемь."
+
+        response = self.client.post("/chunk?embed=true&overlap_tokens=0", data=text.encode("utf-8"),
+                                    content_type="text/plain")
+        chunks = self.read_chunks(response)
+
+        # max_seq_length 8 минус "search_document:" и два служебных токена
+        self.assertEqual(response.headers["X-Chunk-Target-Tokens"], "5")
+        self.assertEqual([chunk["text"] for chunk in chunks],
+                         ["Один два три.", "Четыре пять шесть. Семь восемь."])
+        self.assertEqual(chunks[0]["embedding"], [1.0, 1.0])
+
+    def test_json_body_and_invalid_overlap(self):
+        ok = self.client.post("/chunk", json={"text": "А б. В г.", "target_tokens": 4, "overlap_tokens": 0})
+        bad = self.client.post("/chunk", json={"text": "А б.", "target_tokens": 4, "overlap_tokens": 4})
+
+        self.assertEqual([chunk["text"] for chunk in self.read_chunks(ok)], ["А б. В г."])
+        self.assertNotIn("embedding", self.read_chunks(ok)[0])
+        self.assertEqual(bad.status_code, 400)
+
+    def test_target_tokens_are_clamped_to_model_capacity(self):
+        text = "Один два три. Четыре пять шесть. Семь восемь."
+
+        clamped = self.client.post("/chunk", json={"text": text, "target_tokens": 100, "overlap_tokens": 0})
+        # Перекрытие проверяется по урезанному размеру
+        bad = self.client.post("/chunk", json={"text": text, "target_tokens": 100, "overlap_tokens": 5})
+
+        self.assertEqual(clamped.headers["X-Chunk-Target-Tokens"], "5")
+        self.assertTrue(all(chunk["tokens"] <= 5 for chunk in self.read_chunks(clamped)))
+        self.assertEqual(bad.status_code, 400)
+
+
+class VectorEndpointTests(unittest.TestCase):
+    def setUp(self):
+        def fake_encode(texts):
+            return np.array([[1.0, float(len(text))] for text in texts], dtype=np.float32), {}
+
+        patcher = patch.object(app, "encode_processed_texts", side_effect=fake_encode)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.app.test_client()
+        self.addCleanup(app.vector_store.drop, "docs")
+
+    def test_points_are_searchable_by_vector_and_query(self):
+        upsert = self.client.post("/vectors/docs/points", json={"points": [
+            {"id": 1, "vector": [1.0, 0.0], "payload": {"content": "x"}},
+            {"id": 2, "vector": [0.0, 1.0], "payload": {"content": "y"}},
+            {"id": 3, "text": "abc"},
+        ]})
+        by_vector = self.client.post("/vectors/docs/search", json={"vector": [1.0, 0.1], "limit": 1}).json
+        batch = self.client.post("/vectors/docs/search", json={"vectors": [[1.0, 0.0], [0.0, 1.0]], "limit": 1}).json
+        self.client.post("/vectors/docs/points/delete", json={"ids": [2]})
+        info = self.client.get("/vectors/docs").json
+
+        self.assertEqual(upsert.json["upserted"], 3)
+        self.assertEqual(by_vector["results"][0]["payload"], {"content": "x"})
+        self.assertEqual([found[0]["id"] for found in batch["results"]], [1, 2])
+        self.assertEqual(info["points"], 2)
+
+    def test_unknown_project_and_bad_input(self):
+        self.assertEqual(self.client.post("/vectors/nope/search", json={"vector": [1.0]}).status_code, 404)
+        self.assertEqual(self.client.post("/vectors/docs/points", json={"points": [{"id": 1}]}).status_code, 400)
+        for points in (["x"], [{"vector": [1.0]}], [{"id": {"a": 1}, "vector": [1.0]}], [{"id": 1, "vector": "1"}],
+                       [{"id": 1, "vector": [1.0, 0.0]}, {"id": 2, "vector": [1.0]}]):
+            with self.subTest(points=points):
+                self.assertEqual(self.client.post("/vectors/docs/points", json={"points": points}).status_code, 400)
+        self.assertFalse(app.vector_store.exists("docs"))
+
+
+if __name__ == "__main__":
+    unittest.main()
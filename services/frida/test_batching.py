@@ -0,0 +1,151 @@
+import unittest
+
+import numpy as np
+import torch
+
+import batching
+
+
+class FakeTokenizer:
+    """Токенизатор "один символ = один токен" со счетчиком вызовов."""
+
+    all_special_ids = [0]
+
+    def __init__(self):
+        self.tokenized = []
+
+    def __call__(self, texts, padding=False, truncation=True, max_length=None, add_special_tokens=True):
+        if add_special_tokens:
+            self.tokenized.extend(texts)
+        input_ids = [[ord(ch) for ch in text][:max_length] for text in texts]
+        return {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids]}
+
+    def pad(self, features, padding=True, return_tensors="pt"):
+        width = max(len(ids) for ids in features["input_ids"])
+        return {
+            key: torch.tensor([row + [0] * (width - len(row)) for row in rows])
+            for key, rows in features.items()
+        }
+
+
+class FakeModel:
+    max_seq_length = 8
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.tokenizer = FakeTokenizer()
+        self.batch_shapes = []
+
+    def __call__(self, features):
+        input_ids = features["input_ids"]
+        mask = features["attention_mask"]
+        self.batch_shapes.append(tuple(input_ids.shape))
+        # Эмбеддинг = [длина, сумма кодов], не зависит от паддинга
+        lengths = mask.sum(dim=1).float()
+        sums = (input_ids * mask).sum(dim=1).float()
+        return {"sentence_embedding": torch.stack([lengths, sums], dim=1)}
+
+
+class PlanBatchesTests(unittest.TestCase):
+    def test_batches_are_sorted_by_length_and_respect_token_budget(self):
+        lengths = [2, 10, 3, 10, 1]
+        batches = batching.plan_batches(lengths, max_batch_tokens=20, max_batch_size=8)
+
+        self.assertEqual(batches, [[1, 3], [2, 0, 4]])
+        for batch in batches:
+            self.assertLessEqual(lengths[batch[0]] * len(batch), 20)
+
+    def test_text_longer_than_budget_gets_own_batch(self):
+        batches = batching.plan_batches([50, 2, 2], max_batch_tokens=16, max_batch_size=8)
+
+        self.assertEqual(batches, [[0], [1, 2]])
+
+    def test_max_batch_size_caps_short_texts(self):
+        batches = batching.plan_batches([1] * 5, max_batch_tokens=1000, max_batch_size=2)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+
+class EncodeTextsTests(unittest.TestCase):
+    def test_results_are_returned_in_input_order(self):
+        model = FakeModel()
+        texts = ["bbbb", "a", "ccccccc", "dd"]
+
+        embeddings, _ = batching.encode_texts(model, texts, max_batch_tokens=8, max_batch_size=4)
+
+        self.assertEqual(embeddings[:, 0].tolist(), [4.0, 1.0, 7.0, 2.0])
+        self.assertEqual(embeddings[2, 1], float(sum(ord(ch) for ch in "ccccccc")))
+
+    def test_duplicates_are_tokenized_and_encoded_once(self):
+        model = FakeModel()
+        texts = ["chunk", "other", "chunk", " chunk "]
+
+        embeddings, stats = batching.encode_texts(model, texts)
+
+        self.assertEqual(model.tokenizer.tokenized, ["chunk", "other"])
+        self.assertEqual(stats["unique_texts"], 2)
+        np.testing.assert_array_equal(embeddings[0], embeddings[2])
+        np.testing.assert_array_equal(embeddings[0], embeddings[3])
+
+    def test_padding_ratio_is_reported(self):
+        model = FakeModel()
+
+        _, stats = batching.encode_texts(model, ["aaaa", "b"], max_batch_tokens=100)
+
+        self.assertEqual(stats["real_tokens"], 5)
+        self.assertEqual(stats["padded_tokens"], 8)
+        self.assertAlmostEqual(stats["padding_ratio"], 0.375)
+
+    def test_length_sorting_reduces_padding(self):
+        model = FakeModel()
+        texts = ["aaaaaaaa", "b", "cccccccc", "d"]
+
+        _, stats = batching.encode_texts(model, texts, max_batch_tokens=16, max_batch_size=2)
+
+        self.assertEqual(stats["padding_ratio"], 0.0)
+        self.assertEqual(model.batch_shapes, [(2, 8), (2, 1)])
+
+    def test_texts_are_truncated_to_max_seq_length(self):
+        model = FakeModel()
+
+        embeddings, _ = batching.encode_texts(model, ["x" * 20])
+
+        self.assertEqual(embeddings[0, 0], float(model.max_seq_length))
+
+
+class SparseVectorTests(unittest.TestCase):
+    def test_weights_are_log_saturated_term_frequencies(self):
+        vector = batching.sparse_vector([7, 3, 7, 7, 5])
+
+        self.assertEqual(vector["indices"], [3, 5, 7])
+        np.testing.assert_allclose(vector["values"], np.log1p([1, 1, 3]))
+
+    def test_special_tokens_and_prompt_prefix_are_skipped(self):
+        vector = batching.sparse_vector([101, 9, 9, 4, 9, 102], special_ids=[101, 102], prefixes=[[9, 9]])
+
+        self.assertEqual(vector["indices"], [4, 9])
+        np.testing.assert_allclose(vector["values"], np.log1p([1, 1]))
+
+    def test_hybrid_encoding_reuses_tokenization_and_keeps_input_order(self):
+        model = FakeModel()
+        texts = ["q: ab", "q: bb", "q: ab"]
+
+        embeddings, stats, sparse = batching.encode_texts(model, texts, return_sparse=True, prompt_prefixes=["q: "])
+        dense, _ = batching.encode_texts(FakeModel(), texts)
+
+        self.assertEqual(model.tokenizer.tokenized, ["q: ab", "q: bb"])
+        np.testing.assert_array_equal(embeddings, dense)
+        self.assertEqual(sparse[0], sparse[2])
+        self.assertEqual(sparse[0]["indices"], [ord("a"), ord("b")])
+        self.assertEqual(sparse[1], {"indices": [ord("b")], "values": [float(np.log1p(2))]})
+        self.assertIn("sparse_ms", stats)
+
+    def test_empty_input_returns_empty_sparse_list(self):
+        embeddings, _, sparse = batching.encode_texts(FakeModel(), [], return_sparse=True)
+
+        self.assertEqual(embeddings.shape, (0, 0))
+        self.assertEqual(sparse, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import re
+import unittest
+
+import chunking
+
+
+class WordTokenizer:
+    """Токенизатор "слово = токен" с символьными границами, как у fast-токенизаторов HF."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, add_special_tokens=True, return_offsets_mapping=False):
+        self.calls.append(len(texts))
+        offsets = [[match.span() for match in re.finditer(r"\S+", text)] for text in texts]
+        input_ids = [[1] * len(spans) for spans in offsets]
+        if add_special_tokens:
+            input_ids = [[0] + ids + [2] for ids in input_ids]
+        encoded = {"input_ids": input_ids}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = offsets
+        return encoded
+
+
+def sentence(number, words):
+    return f"Предложение{number} " + " ".join(f"w{number}" for _ in range(words - 1)) + "."
+
+
+class SentenceSplittingTests(unittest.TestCase):
+    def test_boundaries_survive_arbitrary_block_splits(self):
+        text = "Первое предложение. Второе, т.е. то же самое!\n\n«Новый» абзац с числом 3.14 внутри"
+        expected = list(chunking.iter_sentences([text]))
+
+        for size in (1, 2, 5, 7):
+            blocks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual(list(chunking.iter_sentences(blocks)), expected)
+
+        self.assertEqual(expected, [
+            ("Первое предложение.", False),
+            ("Второе, т.е. то же самое!", True),
+            ("«Новый» абзац с числом 3.14 внутри", True),
+        ])
+
+    def test_text_without_boundaries_is_cut_at_whitespace(self):
+        sentences = list(chunking.iter_sentences(["слово " * 100], max_chars=50))
+
+        self.assertTrue(all(len(text) <= 50 for text, _ in sentences))
+        self.assertEqual(" ".join(text for text, _ in sentences), ("слово " * 100).strip())
+
+    def test_utf8_stream_is_decoded_across_block_borders(self):
+        data = "Привет, мир. Ещё текст.".encode("utf-8")
+
+        blocks = list(chunking.iter_text_blocks(io.BytesIO(data), block_size=3))
+
+        self.assertEqual("".join(blocks), "Привет, мир. Ещё текст.")
+
+
+class ChunkingTests(unittest.TestCase):
+    def chunk(self, text, target, overlap, tokenizer=None):
+        return list(chunking.iter_chunks([text], tokenizer or WordTokenizer(), target, overlap))
+
+    def test_chunks_fill_target_at_sentence_boundaries(self):
+        text = " ".join(sentence(number, 4) for number in range(6))
+
+        chunks = self.chunk(text, target=10, overlap=0)
+
+        self.assertEqual([chunk["tokens"] for chunk in chunks], [8, 8, 8])
+        self.assertTrue(all(chunk["text"].endswith(".") for chunk in chunks))
+        self.assertEqual(" ".join(chunk["text"] for chunk in chunks), text)
+
+    def test_overlap_repeats_trailing_sentences(self):
+        text = " ".join(sentence(number, 3) for number in range(5))
+
+        chunks = self.chunk(text, target=9, overlap=3)
+
+        self.assertEqual(chunks[0]["text"], " ".join(sentence(number, 3) for number in range(3)))
+        self.assertTrue(chunks[1]["text"].startswith(sentence(2, 3)))
+        self.assertTrue(all(chunk["tokens"] <= 9 for chunk in chunks))
+        self.assertEqual([chunk["index"] for chunk in chunks], list(range(len(chunks))))
+
+    def test_long_sentence_is_split_by_tokens_with_token_overlap(self):
+        words = [f"t{idx}" for idx in range(25)]
+
+        chunks = self.chunk(" ".join(words) + ".", target=10, overlap=2)
+
+        self.assertEqual(chunks[0]["text"].split(), words[:8])
+        self.assertEqual(chunks[1]["text"].split(), words[6:16])
+        self.assertTrue(all(chunk["tokens"] <= 10 for chunk in chunks))
+        self.assertTrue(chunks[-1]["text"].endswith("t24."))
+
+    def test_paragraph_breaks_are_kept_inside_chunks(self):
+        chunks = self.chunk("Первый абзац.\n\nВторой абзац.", target=10, overlap=0)
+
+        self.assertEqual(chunks, [{"index": 0, "text": "Первый абзац.\n\nВторой абзац.", "tokens": 4}])
+
+    def test_sentences_are_tokenized_in_groups(self):
+        tokenizer = WordTokenizer()
+        text = " ".join(sentence(number, 2) for number in range(150))
+
+        self.chunk(text, target=50, overlap=0, tokenizer=tokenizer)
+
+        self.assertEqual(tokenizer.calls, [64, 64, 22])
+
+    def test_invalid_sizes_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.chunk("Текст.", target=4, overlap=4)
+
+    def test_default_target_reserves_prefix_and_special_tokens(self):
+        class Model:
+            max_seq_length = 512
+            tokenizer = WordTokenizer()
+
+        self.assertEqual(chunking.default_target_tokens(Model(), "search_document: "), 509)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import signal
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import torch
+
+import encode_pool
+
+
+class FakeTokenizer:
+    def __call__(self, texts, padding=False, truncation=True, max_length=None):
+        input_ids = [[ord(ch) for ch in text][:max_length] for text in texts]
+        return {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids]}
+
+    def pad(self, features, padding=True, return_tensors="pt"):
+        width = max(len(ids) for ids in features["input_ids"])
+        return {
+            key: torch.tensor([row + [0] * (width - len(row)) for row in rows])
+            for key, rows in features.items()
+        }
+
+
+class FakeModel:
+    """Эмбеддинг = [длина текста, pid процесса-воркера]."""
+
+    max_seq_length = 64
+    device = torch.device("cpu")
+    tokenizer = FakeTokenizer()
+
+    def __call__(self, features):
+        lengths = features["attention_mask"].sum(dim=1).double()
+        pids = torch.full_like(lengths, float(os.getpid()))
+        return {"sentence_embedding": torch.stack([lengths, pids], dim=1)}
+
+
+def fake_loader(spec):
+    return FakeModel()
+
+
+class PlanningTests(unittest.TestCase):
+    def test_core_sets_are_disjoint_and_cover_all_cores(self):
+        core_sets = encode_pool.plan_core_sets(range(10), 4)
+
+        self.assertEqual(core_sets, [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]])
+
+    def test_core_sets_wrap_when_workers_exceed_cores(self):
+        self.assertEqual(encode_pool.plan_core_sets([0, 1], 3), [[0], [1], [0]])
+
+    def test_shards_are_balanced_by_length(self):
+        texts = ["x" * length for length in (10, 9, 8, 7, 6, 5)]
+
+        shards = encode_pool.plan_shards(texts, 2)
+
+        self.assertEqual(sorted(idx for shard in shards for idx in shard), list(range(6)))
+        totals = [sum(len(texts[idx]) for idx in shard) for shard in shards]
+        self.assertLessEqual(abs(totals[0] - totals[1]), 1)
+
+
+class EncodePoolTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = encode_pool.EncodePool(
+            {"loader": "test_encode_pool:fake_loader"}, workers=2, threads_per_worker=1, min_texts=4,
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def test_workers_are_started_and_pinned(self):
+        self.assertEqual(len(self.pool.worker_info), 2)
+        self.assertEqual(len({info["pid"] for info in self.pool.worker_info}), 2)
+        for info in self.pool.worker_info:
+            self.assertEqual(info["threads"], 1)
+            self.assertTrue(info["cores"])
+
+    def test_results_are_merged_in_input_order(self):
+        texts = ["a" * (idx % 7 + 1) + str(idx) for idx in range(40)] + ["dup", "dup"]
+
+        embeddings, stats = self.pool.encode(texts)
+
+        self.assertEqual(embeddings[:, 0].tolist(), [float(len(text)) for text in texts])
+        self.assertEqual(stats["shards"], 2)
+        self.assertEqual(stats["unique_texts"], 41)
+        # Какой воркер возьмет шард, решает исполнитель; важно, что кодировали воркеры пула
+        worker_pids = {info["pid"] for info in self.pool.worker_info}
+        self.assertTrue(set(np.unique(embeddings[:, 1]).astype(int)) <= worker_pids)
+
+    def test_sparse_vectors_are_merged_in_input_order(self):
+        texts = ["ab" * (idx % 3 + 1) + str(idx % 5) for idx in range(20)]
+
+        _, _, sparse = self.pool.encode(texts, return_sparse=True)
+
+        self.assertEqual(len(sparse), len(texts))
+        for text, vector in zip(texts, sparse):
+            self.assertEqual(vector["indices"], sorted({ord(ch) for ch in text}))
+
+    def test_small_requests_stay_in_process(self):
+        self.assertFalse(self.pool.should_shard(3))
+        self.assertTrue(self.pool.should_shard(4))
+
+
+
+class BrokenPoolTests(unittest.TestCase):
+    def test_killed_worker_stops_pool_and_requests_fall_back(self):
+        pool = encode_pool.EncodePool(
+            {"loader": "test_encode_pool:fake_loader"}, workers=2, threads_per_worker=1, min_texts=4,
+        ).start()
+        self.addCleanup(pool.shutdown)
+        os.kill(pool.worker_info[0]["pid"], signal.SIGKILL)
+        # Иначе живой воркер может успеть посчитать оба шарда раньше, чем пул заметит гибель
+        deadline = time.time() + 10
+        while not pool._executor._broken and time.time() < deadline:
+            time.sleep(0.05)
+
+        with self.assertRaises(BrokenProcessPool):
+            pool.encode(["a", "b", "c", "d"])
+
+        self.assertFalse(pool.running)
+        self.assertFalse(pool.should_shard(100))
+        self.assertIn("BrokenProcessPool", pool.status()["failure"])
+        with self.assertRaises(BrokenProcessPool):
+            pool.encode(["a", "b", "c", "d"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+import jobs
+
+
+def fake_encode(texts):
+    return np.array([[len(text), idx] for idx, text in enumerate(texts)], dtype=np.float32), {}
+
+
+class JobStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "jobs.sqlite3")
+        self.store = jobs.JobStore(self.path, batch_size=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_batches(self, store, count):
+        runner = jobs.JobRunner(store, fake_encode)
+        for _ in range(count):
+            self.assertTrue(runner.process_next_batch())
+
+    def test_job_is_processed_batch_by_batch(self):
+        texts = ["t" * length for length in range(1, 8)]
+        job = self.store.create_job(iter(texts))
+
+        self.run_batches(self.store, 3)
+
+        job = self.store.get_job(job["id"])
+        self.assertEqual(job["status"], jobs.STATUS_COMPLETED)
+        self.assertEqual(job["completed"], 7)
+        self.assertEqual(job["dimension"], 2)
+        lengths = [row[0] for _, vectors in self.store.iter_batches(job["id"]) for row in vectors]
+        self.assertEqual(lengths, [float(len(text)) for text in texts])
+
+    def test_restart_resumes_from_last_completed_batch(self):
+        job = self.store.create_job(["a", "bb", "ccc", "dddd", "eeeee"])
+        self.run_batches(self.store, 1)
+
+        encoded = []
+
+        def tracking_encode(texts):
+            encoded.append(list(texts))
+            return fake_encode(texts)
+
+        # Новое хранилище поверх того же файла имитирует перезапуск сервиса
+        restarted = jobs.JobStore(self.path, batch_size=3)
+        runner = jobs.JobRunner(restarted, tracking_encode)
+        self.assertTrue(runner.process_next_batch())
+        self.assertFalse(runner.process_next_batch())
+
+        self.assertEqual(encoded, [["dddd", "eeeee"]])
+        self.assertEqual(restarted.get_job(job["id"])["status"], jobs.STATUS_COMPLETED)
+
+    def test_encode_error_marks_job_failed(self):
+        job = self.store.create_job(["a"])
+
+        def broken_encode(texts):
+            raise RuntimeError("boom")
+
+        jobs.JobRunner(self.store, broken_encode).process_next_batch()
+
+        job = self.store.get_job(job["id"])
+        self.assertEqual(job["status"], jobs.STATUS_FAILED)
+        self.assertEqual(job["error"], "boom")
+
+    def test_empty_job_is_completed_immediately(self):
+        job = self.store.create_job([])
+
+        self.assertEqual(job["status"], jobs.STATUS_COMPLETED)
+        self.assertEqual(list(self.store.iter_batches(job["id"])), [])
+
+    def test_results_stream_while_job_is_running(self):
+        job = self.store.create_job(["a", "bb", "ccc", "dddd"])
+        runner = jobs.JobRunner(self.store, fake_encode, poll_interval=0.01).start()
+        try:
+            starts = [start for start, _ in self.store.iter_batches(job["id"], poll_interval=0.01)]
+        finally:
+            runner.stop()
+
+        self.assertEqual(starts, [0, 3])
+
+    def test_runner_waits_until_model_is_ready(self):
+        job = self.store.create_job(["a"])
+        ready = threading.Event()
+        runner = jobs.JobRunner(self.store, fake_encode, is_ready=ready.is_set, poll_interval=0.01).start()
+        try:
+            threading.Event().wait(0.1)
+            self.assertEqual(self.store.next_pending_job()["status"], jobs.STATUS_QUEUED)
+
+            ready.set()
+            for _ in self.store.iter_batches(job["id"], poll_interval=0.01):
+                pass
+        finally:
+            runner.stop()
+
+        self.assertIsNone(self.store.next_pending_job())
+
+    def test_delete_removes_job(self):
+        job = self.store.create_job(["a"])
+
+        self.assertTrue(self.store.delete_job(job["id"]))
+        self.assertIsNone(self.store.get_job(job["id"]))
+        self.assertFalse(self.store.delete_job(job["id"]))
+
+
+    def test_job_deleted_while_batch_encodes_leaves_no_batch(self):
+        job = self.store.create_job(["a", "b", "c", "d"])
+
+        def deleting_encode(texts):
+            self.store.delete_job(job["id"])
+            return fake_encode(texts)
+
+        self.assertTrue(jobs.JobRunner(self.store, deleting_encode).process_next_batch())
+
+        with self.store._connect() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM job_batches WHERE job_id = ?", (job["id"],)).fetchone()[0]
+        self.assertEqual(rows, 0)
+        self.assertIsNone(self.store.get_job(job["id"]))
+        self.assertIsNone(self.store.next_pending_job())
+
+if __name__ == "__main__":
+    unittest.main()
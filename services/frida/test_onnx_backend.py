@@ -0,0 +1,140 @@
+import importlib.util
+import os
+import string
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import batching
+import onnx_backend
+
+HAS_ONNXRUNTIME = importlib.util.find_spec("onnxruntime") is not None
+HAS_OPENVINO = importlib.util.find_spec("openvino") is not None
+
+# Для проверки на настоящей модели: FRIDA_PARITY_MODEL=ai-forever/FRIDA (или локальный путь)
+PARITY_MODEL = os.environ.get("FRIDA_PARITY_MODEL")
+
+PARITY_TEXTS = [
+    "search_query: как настроить синхронизацию документов",
+    "search_document: " + "абзац о векторном поиске и эмбеддингах " * 12,
+    "paraphrase: привет мир",
+    "categorize_topic: мир",
+    "search_document: a",
+]
+
+
+def build_tiny_model(root):
+    """Собирает маленькую случайную BERT-модель без обращения к сети."""
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    letters = list(string.ascii_lowercase) + list("абвгдеёжзийклмнопрстуфхцчшщъыьэюя")
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", ":", "_"] + letters + ["##" + ch for ch in letters]
+    vocab_path = os.path.join(root, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as vocab_file:
+        vocab_file.write("\n".join(vocab))
+
+    hf_dir = os.path.join(root, "hf")
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=64)
+    BertModel(config).save_pretrained(hf_dir)
+    BertTokenizerFast(vocab_file=vocab_path, do_lower_case=True).save_pretrained(hf_dir)
+
+    transformer = models.Transformer(hf_dir, max_seq_length=128)
+    pooling = models.Pooling(32, pooling_mode="cls")
+    return SentenceTransformer(modules=[transformer, pooling, models.Normalize()], device="cpu")
+
+
+def cosine_rows(left, right):
+    left = left / np.linalg.norm(left, axis=1, keepdims=True)
+    right = right / np.linalg.norm(right, axis=1, keepdims=True)
+    return np.sum(left * right, axis=1)
+
+
+@unittest.skipUnless(HAS_ONNXRUNTIME, "onnxruntime is not installed")
+class OnnxParityTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from sentence_transformers import SentenceTransformer
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        if PARITY_MODEL:
+            cls.model = SentenceTransformer(PARITY_MODEL, device="cpu")
+        else:
+            cls.model = build_tiny_model(cls.tmp.name)
+        cls.reference = cls.model.encode(PARITY_TEXTS)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def load(self, runtime, quantize):
+        return onnx_backend.load_cpu_encoder(
+            lambda: self.model, self.tmp.name, "parity/model", runtime=runtime, quantize=quantize, num_threads=2,
+        )
+
+    def test_fp32_onnx_matches_pytorch(self):
+        encoder = self.load("onnx", quantize=False)
+
+        embeddings, _ = batching.encode_texts(encoder, PARITY_TEXTS, max_batch_tokens=256, max_batch_size=2)
+
+        self.assertGreater(cosine_rows(embeddings, self.reference).min(), 0.9999)
+
+    def test_int8_onnx_stays_close_to_pytorch(self):
+        encoder = self.load("onnx", quantize=True)
+
+        embeddings, _ = batching.encode_texts(encoder, PARITY_TEXTS)
+
+        self.assertTrue(encoder.quantized)
+        self.assertGreater(cosine_rows(embeddings, self.reference).min(), 0.98)
+
+    @unittest.skipUnless(HAS_OPENVINO, "openvino is not installed")
+    def test_openvino_runs_the_exported_graph(self):
+        encoder = self.load("openvino", quantize=False)
+
+        embeddings, _ = batching.encode_texts(encoder, PARITY_TEXTS)
+
+        self.assertGreater(cosine_rows(embeddings, self.reference).min(), 0.9999)
+
+    def test_export_is_cached_between_loads(self):
+        self.load("onnx", quantize=False)
+
+        def fail():
+            raise AssertionError("model factory must not be called when export is cached")
+
+        encoder = onnx_backend.load_cpu_encoder(fail, self.tmp.name, "parity/model", runtime="onnx", quantize=False)
+
+        self.assertEqual(encoder.get_sentence_embedding_dimension(), self.reference.shape[1])
+
+
+    def test_concurrent_loads_export_once_into_complete_directory(self):
+        cache_dir = tempfile.mkdtemp(dir=self.tmp.name)
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return self.model
+
+        def load():
+            return onnx_backend.load_cpu_encoder(factory, cache_dir, "race/model", runtime="onnx", quantize=False)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            encoders = list(executor.map(lambda _: load(), range(3)))
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(encoder.get_sentence_embedding_dimension() == self.reference.shape[1]
+                            for encoder in encoders))
+        export_parent = os.path.dirname(onnx_backend.export_dir_for(cache_dir, "race/model", False))
+        self.assertEqual(sorted(os.listdir(export_parent)), ["fp32", "fp32.lock"])
+
+
+class LoadCpuEncoderTests(unittest.TestCase):
+    def test_unknown_runtime_is_rejected(self):
+        with self.assertRaises(ValueError):
+            onnx_backend.load_cpu_encoder(lambda: None, "/tmp", "x", runtime="tensorrt")
+
+
+if __name__ == "__main__":
+    unittest.main()
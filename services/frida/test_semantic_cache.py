@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import semantic_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class SemanticCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = semantic_cache.SemanticCache(threshold=0.9, ttl=60, max_entries=2, clock=self.clock)
+
+    def test_similar_query_returns_cached_payload(self):
+        self.cache.store("docs", [1.0, 0.0], "как сбросить пароль", {"documents": [1, 2]})
+
+        hit = self.cache.lookup("docs", [0.98, 0.05])
+        miss = self.cache.lookup("docs", [0.0, 1.0])
+
+        self.assertEqual(hit["payload"], {"documents": [1, 2]})
+        self.assertEqual(hit["cached_query"], "как сбросить пароль")
+        self.assertGreaterEqual(hit["similarity"], 0.9)
+        self.assertIsNone(miss)
+        self.assertEqual(self.cache.stats()["projects"]["docs"]["hit_ratio"], 0.5)
+
+    def test_projects_and_contexts_are_isolated(self):
+        self.cache.store("docs", [1.0, 0.0], "q", "docs-result", context={"limit": 5})
+
+        self.assertIsNone(self.cache.lookup("other", [1.0, 0.0], context={"limit": 5}))
+        self.assertIsNone(self.cache.lookup("docs", [1.0, 0.0], context={"limit": 10}))
+        self.assertEqual(self.cache.lookup("docs", [1.0, 0.0], context={"limit": 5})["payload"], "docs-result")
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.store("docs", [1.0, 0.0], "q", "result")
+        self.clock.now += 61
+
+        self.assertIsNone(self.cache.lookup("docs", [1.0, 0.0]))
+        self.assertEqual(self.cache.stats()["projects"]["docs"]["expired"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.store("docs", unit(1, 0, 0), "a", "A")
+        self.clock.now += 1
+        self.cache.store("docs", unit(0, 1, 0), "b", "B")
+        self.clock.now += 1
+        self.cache.lookup("docs", unit(1, 0, 0))
+        self.clock.now += 1
+        self.cache.store("docs", unit(0, 0, 1), "c", "C")
+
+        self.assertIsNone(self.cache.lookup("docs", unit(0, 1, 0)))
+        self.assertEqual(self.cache.lookup("docs", unit(1, 0, 0))["payload"], "A")
+        self.assertEqual(self.cache.stats()["projects"]["docs"]["evictions"], 1)
+
+    def test_invalidate_drops_only_the_project(self):
+        self.cache.store("docs", [1.0, 0.0], "q", "docs-result")
+        self.cache.store("other", [1.0, 0.0], "q", "other-result")
+
+        self.assertEqual(self.cache.invalidate("docs"), 1)
+
+        self.assertIsNone(self.cache.lookup("docs", [1.0, 0.0]))
+        self.assertEqual(self.cache.lookup("other", [1.0, 0.0])["payload"], "other-result")
+
+    def test_invalidation_reaches_other_processes_through_marker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker_a = semantic_cache.SemanticCache(threshold=0.9, invalidation_dir=directory)
+            worker_b = semantic_cache.SemanticCache(threshold=0.9, invalidation_dir=directory)
+            worker_b.store("docs", [1.0, 0.0], "q", "stale")
+            # Метка должна быть строго новее записи даже на ФС с грубым mtime
+            worker_a.invalidate("docs")
+            marker = worker_a._marker_path("docs")
+            os.utime(marker, (os.stat(marker).st_atime, os.stat(marker).st_mtime + 1))
+
+            self.assertIsNone(worker_b.lookup("docs", [1.0, 0.0]))
+
+    def test_result_computed_before_invalidation_is_not_stored(self):
+        generation = self.cache.generation("docs")
+        self.cache.invalidate("docs")
+
+        self.assertFalse(self.cache.store("docs", [1.0, 0.0], "q", "stale", generation=generation))
+        self.assertIsNone(self.cache.lookup("docs", [1.0, 0.0]))
+        self.assertTrue(self.cache.store("docs", [1.0, 0.0], "q", "fresh", generation=self.cache.generation("docs")))
+        self.assertEqual(self.cache.stats()["projects"]["docs"]["stale_stores"], 1)
+
+    def test_generation_is_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker_a = semantic_cache.SemanticCache(invalidation_dir=directory)
+            worker_b = semantic_cache.SemanticCache(invalidation_dir=directory)
+            generation = worker_b.generation("docs")
+            self.assertEqual(worker_a.generation("docs"), generation)
+
+            worker_a.invalidate(None)
+
+            self.assertNotEqual(worker_b.generation("docs"), generation)
+            self.assertFalse(worker_b.store("docs", [1.0, 0.0], "q", "stale", generation=generation))
+
+    def test_per_project_stats_are_bounded(self):
+        cache = semantic_cache.SemanticCache(max_projects=3)
+        for idx in range(10):
+            cache.lookup(f"project-{idx}", [1.0, 0.0])
+
+        self.assertEqual(sorted(cache.stats()["projects"]), ["project-7", "project-8", "project-9"])
+
+    def test_query_embeddings_are_cached_by_exact_text(self):
+        cache = semantic_cache.SemanticCache(max_embeddings=1)
+        cache.put_embedding("search_query: a", [1.0])
+        cache.put_embedding("search_query: b", [2.0])
+
+        self.assertIsNone(cache.get_embedding("search_query: a"))
+        self.assertEqual(cache.get_embedding("search_query: b").tolist(), [2.0])
+        self.assertEqual(cache.stats()["embeddings"]["hit_ratio"], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import torch
+
+import shared_weights
+
+
+class TiedModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = torch.nn.Embedding(10, 4)
+        self.proj = torch.nn.Linear(4, 10, bias=False)
+        self.proj.weight = self.embed.weight
+        self.norm = torch.nn.BatchNorm1d(4)
+
+    def forward(self, ids):
+        return self.proj(self.norm(self.embed(ids)))
+
+
+class ShareModuleWeightsTests(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = TiedModel().eval()
+        self.ids = torch.tensor([1, 2, 3])
+        with torch.inference_mode():
+            self.reference = self.model(self.ids)
+
+    def test_outputs_are_unchanged(self):
+        shared_weights.share_module_weights(self.model)
+
+        with torch.inference_mode():
+            torch.testing.assert_close(self.model(self.ids), self.reference)
+
+    def test_all_tensors_live_in_one_shared_storage(self):
+        info = shared_weights.share_module_weights(self.model)
+
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        self.assertTrue(all(tensor.is_shared() for tensor in tensors))
+        storages = {tensor.untyped_storage().data_ptr() for tensor in tensors}
+        self.assertEqual(len(storages), 1)
+        self.assertEqual(info["tensors"], 6)
+
+    def test_tied_weights_stay_tied_and_frozen(self):
+        shared_weights.share_module_weights(self.model)
+
+        self.assertIs(self.model.proj.weight, self.model.embed.weight)
+        self.assertFalse(any(parameter.requires_grad for parameter in self.model.parameters()))
+        self.assertFalse(self.model.training)
+
+    def test_tensors_are_aligned(self):
+        shared_weights.share_module_weights(self.model)
+
+        base = self.model.embed.weight.untyped_storage().data_ptr()
+        for tensor in list(self.model.parameters()) + list(self.model.buffers()):
+            self.assertEqual((tensor.data_ptr() - base) % shared_weights.ALIGNMENT_BYTES, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
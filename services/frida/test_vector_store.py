@@ -0,0 +1,168 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+
+import vector_store
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeQdrantSession:
+    """Отдает точки коллекции страницами, как POST /collections/{name}/points/scroll."""
+
+    def __init__(self, points, page_size):
+        self.points = points
+        self.page_size = page_size
+        self.requests = []
+
+    def post(self, url, json=None, timeout=None):
+        self.requests.append((url, dict(json)))
+        start = json.get("offset", 0)
+        end = start + self.page_size
+        next_offset = end if end < len(self.points) else None
+        return FakeResponse({"result": {"points": self.points[start:end], "next_page_offset": next_offset}})
+
+
+class ProjectShardTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = vector_store.VectorStore(self.tmp.name)
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(500, 16)).astype(np.float32)
+        self.shard = self.store.shard("docs", dimension=16)
+        self.shard.upsert(list(range(500)), self.vectors, [{"n": idx} for idx in range(500)])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def exact_top(self, query, k):
+        normalized = vector_store.normalize_rows(self.vectors)
+        scores = normalized @ vector_store.normalize_rows(query)[0]
+        return list(np.argsort(-scores)[:k])
+
+    def test_search_matches_exact_top_k_across_blocks(self):
+        queries = self.vectors[:3] + 0.1
+
+        results = self.shard.search(queries, limit=5, block_rows=64)
+
+        for query, found in zip(queries, results):
+            self.assertEqual([hit["id"] for hit in found], self.exact_top(query, 5))
+            self.assertEqual(found[0]["payload"], {"n": found[0]["id"]})
+            scores = [hit["score"] for hit in found]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_upsert_replaces_and_delete_hides_points(self):
+        self.shard.upsert([7], -self.vectors[7:8], [{"n": "new"}])
+        self.shard.delete([8])
+
+        self.assertEqual(self.shard.search(-self.vectors[7], limit=1)[0][0]["payload"], {"n": "new"})
+        self.assertNotIn(8, [hit["id"] for hit in self.shard.search(self.vectors[8], limit=3)[0]])
+        self.assertEqual(self.shard.stats()["points"], 499)
+        self.assertEqual(self.shard.stats()["rows"], 501)
+
+    def test_compact_drops_hidden_rows_and_keeps_results(self):
+        self.shard.delete(list(range(100)))
+        before = self.shard.search(self.vectors[200], limit=3)
+
+        self.assertEqual(self.shard.compact(), 100)
+
+        self.assertEqual(self.shard.stats()["rows"], 400)
+        self.assertEqual(self.shard.search(self.vectors[200], limit=3), before)
+
+    def test_other_process_sees_writes_and_compaction(self):
+        # Второе хранилище над тем же каталогом — как другой воркер gunicorn
+        other = vector_store.VectorStore(self.tmp.name).shard("docs")
+        self.shard.upsert(["new"], self.vectors[:1] * -1)
+        self.assertEqual(other.search(-self.vectors[0], limit=1)[0][0]["id"], "new")
+
+        self.shard.delete(list(range(10)))
+        self.shard.compact()
+        self.assertEqual(other.stats()["rows"], 491)
+
+    def test_replacing_a_point_during_search_keeps_it_in_results(self):
+        from_numpy = torch.from_numpy
+        replaced = []
+
+        def upsert_after_snapshot(array):
+            # Первый вызов — уже после снимка под блокировкой: замена id идет параллельно поиску
+            if not replaced:
+                replaced.append(self.shard.upsert([7], self.vectors[7:8], [{"n": "new"}]))
+            return from_numpy(array)
+
+        with patch.object(vector_store.torch, "from_numpy", side_effect=upsert_after_snapshot):
+            found = self.shard.search(self.vectors[7], limit=1)[0]
+
+        self.assertEqual(replaced, [1])
+        self.assertEqual(found[0]["id"], 7)
+
+    def test_shard_dropped_by_other_process_is_not_served_from_cache(self):
+        other_store = vector_store.VectorStore(self.tmp.name)
+        other = other_store.shard("docs")
+        self.store.drop("docs")
+
+        with self.assertRaises(KeyError):
+            other.search(self.vectors[0])
+        with self.assertRaises(KeyError):
+            other.stats()
+        with self.assertRaises(KeyError):
+            other_store.shard("docs")
+        # Пересозданный проект с другой размерностью открывается заново, а не старым шардом
+        self.store.shard("docs", dimension=4).upsert(["a"], np.ones((1, 4)))
+        self.assertEqual(other_store.shard("docs").search(np.ones(4), limit=1)[0][0]["id"], "a")
+        with self.assertRaises(KeyError):
+            other.upsert(["b"], np.ones((1, 16)))
+
+    def test_torn_write_is_repaired_on_open(self):
+        path = os.path.join(self.tmp.name, "docs")
+        with open(os.path.join(path, vector_store.VECTORS_FILE), "ab") as vectors_file:
+            vectors_file.write(b"\x00" * 10)
+        with open(os.path.join(path, vector_store.INDEX_FILE), "a") as index_file:
+            index_file.write('{"id": 999, "payl')
+
+        reopened = vector_store.ProjectShard(path)
+
+        self.assertEqual(reopened.stats()["rows"], 500)
+        self.assertEqual(os.path.getsize(os.path.join(path, vector_store.VECTORS_FILE)), 500 * 16 * 2)
+
+    def test_dimension_mismatch_and_bad_names_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.shard.upsert([1], np.ones((1, 8)))
+        with self.assertRaises(ValueError):
+            self.store.shard("../etc", dimension=16)
+        with self.assertRaises(KeyError):
+            self.store.shard("missing")
+
+
+class QdrantImportTests(unittest.TestCase):
+    def test_collection_is_imported_page_by_page(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = vector_store.VectorStore(root)
+            points = [{"id": idx, "vector": np.eye(25)[idx].tolist(), "payload": {"content": str(idx)}}
+                      for idx in range(25)]
+            session = FakeQdrantSession(points, page_size=10)
+
+            imported = vector_store.import_from_qdrant(store, "docs", url="http://qdrant", session=session,
+                                                       batch_size=10)
+
+            self.assertEqual(imported, 25)
+            self.assertEqual(len(session.requests), 3)
+            self.assertEqual(session.requests[0][0], "http://qdrant/collections/docs/points/scroll")
+            hit = store.shard("docs").search(np.eye(25)[24], limit=1)[0][0]
+            self.assertEqual(hit["payload"], {"content": "24"})
+
+
+if __name__ == "__main__":
+    unittest.main()
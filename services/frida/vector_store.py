@@ -0,0 +1,423 @@
+"""
+Точный векторный поиск в процессе FRIDA по шардам проектов на диске.
+
+Каталог проекта:
+  meta.json     — размерность векторов;
+  vectors.f16   — нормированные векторы float16 подряд, только дозапись;
+  index.ndjson  — по строке на каждую строку vectors.f16 ({"id", "payload"})
+                  и строки-надгробия {"deleted": id} для удаленных точек.
+
+Поиск — косинусная близость через матричное произведение по блокам
+memmap-файла прямо в float16 (torch: в NumPy нет быстрого умножения
+float16, а приведение к float32 дороже самого поиска) и argpartition;
+отобранные с запасом кандидаты пересчитываются в float32, так что порядок
+top-k точный. Несколько запросов обрабатываются одним произведением. Повторная запись id добавляет новую строку и
+скрывает старую; compact() переписывает шард без скрытых строк.
+Воркеры gunicorn видят записи друг друга: индекс дочитывается с последней
+позиции перед каждым запросом. Шард, удаленный другим воркером, в кеше
+не остается: операции над ним дают KeyError, следующее открытие — новый шард.
+
+Для небольших и средних проектов это дешевле сетевого запроса в Qdrant;
+import_from_qdrant переносит существующую коллекцию через scroll API.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import requests
+import torch
+
+logger = logging.getLogger(__name__)
+
+VECTOR_STORE_DIR = os.environ.get("FRIDA_VECTOR_STORE_DIR", "/app/models/vectors")
+QDRANT_URL = os.environ.get("QDRANT_URL", "http://vector-db:6333")
+# Строк матрицы на один блок произведения (матрица оценок блока: queries * rows * 4 байт)
+SEARCH_BLOCK_ROWS = int(os.environ.get("FRIDA_VECTOR_BLOCK_ROWS", "16384"))
+# Во сколько раз больше кандидатов, чем limit, отбирается в float16 для точного пересчета
+RESCORE_FACTOR = 4
+IMPORT_BATCH = 1000
+
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.f16"
+INDEX_FILE = "index.ndjson"
+
+# Те же правила, что у имен проектов в Zeus: буквы, цифры, "_" и "-", не с "_"/"-"
+PROJECT_NAME_RE = re.compile(r"^[^\W_][\w-]*$")
+PROJECT_NAME_MAX_BYTES = 63
+
+
+def validate_project_name(name: str) -> str:
+    if not isinstance(name, str) or not PROJECT_NAME_RE.match(name) or len(name.encode("utf-8")) > PROJECT_NAME_MAX_BYTES:
+        raise ValueError(f"Некорректное имя проекта: {name!r}")
+    return name
+
+
+def normalize_rows(vectors: Any) -> np.ndarray:
+    matrix = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class ProjectShard:
+    """Векторы одного проекта.
+
+    Состояние в памяти строится чтением index.ndjson с последней прочитанной
+    позиции, поэтому записи других воркеров видны при следующем запросе.
+    Запись и сжатие выполняются под файловой блокировкой шарда.
+    """
+
+    def __init__(self, path: str, dimension: Optional[int] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            if not dimension:
+                raise KeyError(f"Шард {path} не найден")
+            os.makedirs(path, exist_ok=True)
+            tmp_path = meta_path + ".tmp"
+            with open(tmp_path, "w") as meta_file:
+                json.dump({"dimension": int(dimension)}, meta_file)
+            for name in (VECTORS_FILE, INDEX_FILE):
+                open(os.path.join(path, name), "ab").close()
+            os.replace(tmp_path, meta_path)
+        with open(meta_path) as meta_file:
+            self.dimension = int(json.load(meta_file)["dimension"])
+            self._identity = self._meta_identity(os.fstat(meta_file.fileno()))
+        self._reset()
+        with self._file_lock():
+            self._repair()
+            self._refresh()
+
+    def _reset(self):
+        self.ids: List[Any] = []
+        self.payloads: List[Any] = []
+        self._alive = np.zeros(1024, dtype=bool)
+        self.rows = 0
+        self.row_of: Dict[str, int] = {}
+        self._offset = 0
+        self._inode = None
+        self._mmap: Optional[np.memmap] = None
+
+    @staticmethod
+    def _meta_identity(stat: os.stat_result) -> tuple:
+        return stat.st_ino, stat.st_mtime_ns
+
+    def is_current(self) -> bool:
+        """Каталог шарда на месте и не пересоздан после открытия (drop в другом воркере)."""
+        try:
+            return self._meta_identity(os.stat(os.path.join(self.path, META_FILE))) == self._identity
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False):
+        """Межпроцессная блокировка шарда: общая для чтения, исключительная для записи и сжатия.
+
+        KeyError, если шард удален: его файлы трогать уже нельзя.
+        """
+        try:
+            lock_file = open(os.path.join(self.path, ".lock"), "a")
+        except FileNotFoundError:
+            raise KeyError(f"Шард {self.path} удален") from None
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                if not self.is_current():
+                    raise KeyError(f"Шард {self.path} удален")
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(point_id: Any) -> str:
+        return json.dumps(point_id)
+
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[:self.rows]
+
+    def _repair(self):
+        """Обрезает хвост после оборванной записи: строки индекса без вектора и векторы без строки."""
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        vector_rows = os.path.getsize(vectors_path) // (self.dimension * 2)
+        rows = 0
+        valid_bytes = 0
+        with open(os.path.join(self.path, INDEX_FILE), "rb") as index_file:
+            for raw in index_file:
+                if not raw.endswith(b"\n"):
+                    break
+                if "deleted" not in json.loads(raw):
+                    if rows >= vector_rows:
+                        break
+                    rows += 1
+                valid_bytes += len(raw)
+        with open(os.path.join(self.path, INDEX_FILE), "r+b") as index_file:
+            index_file.truncate(valid_bytes)
+        with open(vectors_path, "r+b") as vectors_file:
+            vectors_file.truncate(rows * self.dimension * 2)
+
+    def _apply(self, entry: Dict[str, Any]):
+        if "deleted" in entry:
+            row = self.row_of.pop(self._key(entry["deleted"]), None)
+            if row is not None:
+                self._alive[row] = False
+            return
+        if self.rows >= len(self._alive):
+            self._alive = np.concatenate([self._alive, np.zeros(len(self._alive), dtype=bool)])
+        key = self._key(entry["id"])
+        previous = self.row_of.get(key)
+        if previous is not None:
+            self._alive[previous] = False
+        self.row_of[key] = self.rows
+        self._alive[self.rows] = True
+        self.ids.append(entry["id"])
+        self.payloads.append(entry.get("payload"))
+        self.rows += 1
+
+    def _refresh(self):
+        """Дочитывает новые строки индекса; после сжатия (новый файл) перечитывает его целиком."""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        stat = os.stat(index_path)
+        if stat.st_ino != self._inode:
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size <= self._offset:
+            return
+        with open(index_path, "rb") as index_file:
+            index_file.seek(self._offset)
+            for raw in index_file:
+                if not raw.endswith(b"\n"):
+                    break
+                self._apply(json.loads(raw))
+                self._offset += len(raw)
+
+    def _matrix(self, rows: int) -> np.ndarray:
+        if rows == 0:
+            return np.zeros((0, self.dimension), dtype=np.float16)
+        if self._mmap is None or self._mmap.shape[0] < rows:
+            # copy-on-write: torch.from_numpy требует записываемый массив, файл при этом не меняется
+            self._mmap = np.memmap(os.path.join(self.path, VECTORS_FILE), dtype=np.float16,
+                                   mode="c", shape=(rows, self.dimension))
+        return self._mmap[:rows]
+
+    def upsert(self, ids: Sequence[Any], vectors: Any, payloads: Optional[Sequence[Any]] = None) -> int:
+        matrix = normalize_rows(vectors)
+        if matrix.shape[1] != self.dimension:
+            raise ValueError(f"Размерность {matrix.shape[1]} не совпадает с размерностью проекта {self.dimension}")
+        if len(ids) != matrix.shape[0]:
+            raise ValueError("Количество id и векторов не совпадает")
+        payloads = list(payloads) if payloads is not None else [None] * len(ids)
+        with self._lock, self._file_lock():
+            # Векторы пишутся раньше индекса: строка индекса без вектора не появится
+            with open(os.path.join(self.path, VECTORS_FILE), "ab") as vectors_file:
+                vectors_file.write(matrix.astype("<f2").tobytes())
+            with open(os.path.join(self.path, INDEX_FILE), "a", encoding="utf-8") as index_file:
+                index_file.write("".join(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n"
+                                         for point_id, payload in zip(ids, payloads)))
+            self._refresh()
+        return len(ids)
+
+    def delete(self, ids: Iterable[Any]) -> int:
+        with self._lock, self._file_lock():
+            self._refresh()
+            ids = [point_id for point_id in ids if self._key(point_id) in self.row_of]
+            if ids:
+                with open(os.path.join(self.path, INDEX_FILE), "a", encoding="utf-8") as index_file:
+                    index_file.write("".join(json.dumps({"deleted": point_id}, ensure_ascii=False) + "\n"
+                                             for point_id in ids))
+                self._refresh()
+        return len(ids)
+
+    def search(self, queries: Any, limit: int = 10, block_rows: int = SEARCH_BLOCK_ROWS) -> List[List[Dict[str, Any]]]:
+        """Top-k по косинусной близости для пачки запросов (по списку результатов на запрос)."""
+        query_matrix = normalize_rows(queries)
+        if query_matrix.shape[1] != self.dimension:
+            raise ValueError(f"Размерность запроса {query_matrix.shape[1]} не совпадает с размерностью проекта {self.dimension}")
+        with self._lock, self._file_lock(shared=True):
+            self._refresh()
+            # Снимок: дозапись и сжатие не меняют уже взятые списки и отображение файла
+            # alive — копия: _refresh снимает флаги на месте, и замена id в другом потоке
+            # скрыла бы старую строку снимка, не добавив в него новую
+            rows, alive, ids, payloads = self.rows, self.alive.copy(), self.ids, self.payloads
+            matrix = self._matrix(rows)
+        limit = max(1, int(limit))
+        # Грубый отбор в float16 берет кандидатов с запасом, точный порядок дает пересчет в float32
+        candidates = limit * RESCORE_FACTOR
+        query_half = torch.from_numpy(query_matrix).half()
+
+        best_scores = np.full((query_matrix.shape[0], 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((query_matrix.shape[0], 0), dtype=np.int64)
+        with torch.inference_mode():
+            for start in range(0, rows, block_rows):
+                block = torch.from_numpy(matrix[start:start + block_rows])
+                scores = (query_half @ block.T).float().numpy()
+                scores[:, ~alive[start:start + block.shape[0]]] = -np.inf
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+                if scores.shape[1] > candidates:
+                    top = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+                    scores = np.take_along_axis(scores, top, axis=1)
+                best_scores = np.concatenate([best_scores, scores], axis=1)
+                best_rows = np.concatenate([best_rows, top + start], axis=1)
+                if best_scores.shape[1] > candidates:
+                    keep = np.argpartition(-best_scores, candidates - 1, axis=1)[:, :candidates]
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                    best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        results = []
+        for query, coarse, found in zip(query_matrix, best_scores, best_rows):
+            found = np.sort(found[np.isfinite(coarse)])
+            scores = np.asarray(matrix[found], dtype=np.float32) @ query
+            order = np.argsort(-scores, kind="stable")[:limit]
+            results.append([
+                {"id": ids[found[idx]], "score": float(scores[idx]), "payload": payloads[found[idx]]}
+                for idx in order
+            ])
+        return results
+
+    def compact(self) -> int:
+        """Переписывает шард без удаленных и замененных строк. Возвращает число освобожденных строк."""
+        with self._lock, self._file_lock():
+            self._refresh()
+            keep = np.nonzero(self.alive)[0]
+            dropped = self.rows - len(keep)
+            if dropped == 0:
+                return 0
+            matrix = self._matrix(self.rows)
+            tmp_vectors = os.path.join(self.path, VECTORS_FILE + ".tmp")
+            tmp_index = os.path.join(self.path, INDEX_FILE + ".tmp")
+            with open(tmp_vectors, "wb") as vectors_file:
+                for start in range(0, len(keep), SEARCH_BLOCK_ROWS):
+                    vectors_file.write(np.asarray(matrix[keep[start:start + SEARCH_BLOCK_ROWS]], dtype="<f2").tobytes())
+            with open(tmp_index, "w", encoding="utf-8") as index_file:
+                for row in keep:
+                    index_file.write(json.dumps({"id": self.ids[row], "payload": self.payloads[row]}, ensure_ascii=False) + "\n")
+            os.replace(tmp_vectors, os.path.join(self.path, VECTORS_FILE))
+            os.replace(tmp_index, os.path.join(self.path, INDEX_FILE))
+            self._refresh()
+        logger.info(f"Шард {self.path} сжат: удалено строк {dropped}")
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock, self._file_lock(shared=True):
+            self._refresh()
+            return {
+                "dimension": self.dimension,
+                "points": int(self.alive.sum()),
+                "rows": self.rows,
+                "bytes": self.rows * self.dimension * 2,
+            }
+
+
+class VectorStore:
+    """Набор шардов проектов в общем каталоге."""
+
+    def __init__(self, root: str = VECTOR_STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._shards: Dict[str, ProjectShard] = {}
+        self.imports: Dict[str, Dict[str, Any]] = {}
+
+    def shard(self, project: str, dimension: Optional[int] = None) -> ProjectShard:
+        """Открывает шард проекта; с dimension создает его при отсутствии, иначе KeyError."""
+        validate_project_name(project)
+        with self._lock:
+            shard = self._shards.get(project)
+            if shard is not None and not shard.is_current():
+                # Удален или пересоздан другим воркером
+                shard = None
+            if shard is None:
+                shard = self._shards[project] = ProjectShard(os.path.join(self.root, project), dimension)
+            return shard
+
+    def exists(self, project: str) -> bool:
+        validate_project_name(project)
+        return os.path.exists(os.path.join(self.root, project, META_FILE))
+
+    def drop(self, project: str) -> bool:
+        validate_project_name(project)
+        with self._lock:
+            self._shards.pop(project, None)
+            path = os.path.join(self.root, project)
+            if not os.path.isdir(path):
+                return False
+            # Под исключительной блокировкой: запись или сжатие в другом воркере успеют закончиться
+            with open(os.path.join(path, ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                shutil.rmtree(path)
+            return True
+
+
+def _point_vector(point: Dict[str, Any], vector_name: Optional[str]) -> List[float]:
+    vector = point.get("vector")
+    if isinstance(vector, dict):
+        if vector_name is None:
+            if len(vector) != 1:
+                raise ValueError("В коллекции несколько именованных векторов, укажите vector_name")
+            return next(iter(vector.values()))
+        return vector[vector_name]
+    return vector
+
+
+def import_from_qdrant(store: VectorStore, project: str, collection: Optional[str] = None,
+                       url: str = QDRANT_URL, vector_name: Optional[str] = None,
+                       batch_size: int = IMPORT_BATCH, session: Optional[Any] = None,
+                       progress: Optional[Dict[str, Any]] = None) -> int:
+    """Переносит коллекцию Qdrant в шард проекта через POST /collections/{name}/points/scroll."""
+    session = session or requests.Session()
+    collection = collection or project
+    offset = None
+    imported = 0
+    while True:
+        body = {"limit": batch_size, "with_payload": True, "with_vector": True}
+        if offset is not None:
+            body["offset"] = offset
+        response = session.post(f"{url}/collections/{collection}/points/scroll", json=body, timeout=60)
+        response.raise_for_status()
+        result = response.json()["result"]
+        points = [point for point in result.get("points", []) if point.get("vector")]
+        if points:
+            vectors = [_point_vector(point, vector_name) for point in points]
+            shard = store.shard(project, dimension=len(vectors[0]))
+            imported += shard.upsert([point["id"] for point in points], vectors,
+                                     [point.get("payload") for point in points])
+            if progress is not None:
+                progress["imported"] = imported
+        offset = result.get("next_page_offset")
+        if offset is None:
+            break
+    logger.info(f"Импортировано {imported} точек из Qdrant {collection} в проект {project}")
+    return imported
+
+
+def start_import(store: VectorStore, project: str, **kwargs) -> Dict[str, Any]:
+    """Запускает импорт из Qdrant в фоне; состояние доступно в store.imports[project]."""
+    validate_project_name(project)
+    with store._lock:
+        current = store.imports.get(project)
+        if current is not None and current["status"] == "running":
+            return current
+        status = store.imports[project] = {"status": "running", "imported": 0, "error": None,
+                                           "started_at": time.time()}
+
+    def run():
+        try:
+            import_from_qdrant(store, project, progress=status, **kwargs)
+            status["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Ошибка импорта из Qdrant в проект {project}: {e}")
+            status["status"] = "failed"
+            status["error"] = str(e)
+        status["finished_at"] = time.time()
+
+    threading.Thread(target=run, daemon=True, name=f"vector-import-{project}").start()
+    return status
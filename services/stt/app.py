@@ -7,20 +7,40 @@ Speech-to-Text (STT) Service
 
 import os
 import io
+import queue
+import fcntl
+import shutil
 import tempfile
+import threading
 import logging
-import hashlib
+import time
 import torch
-from typing import Dict, List, Any, Optional
-from flask import Flask, request, jsonify, send_file
+from typing import Callable, Dict, List, Any, Optional
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
 from flasgger import Swagger
 import whisper
 import librosa
 import soundfile as sf
 import numpy as np
-from pydub import AudioSegment
+import json
 import traceback
+from contextlib import contextmanager
+
+from model_pool import ModelPool
+import streaming
+import vad
+import longform
+from clip_batcher import ClipBatcher
+import audio_input
+from result_cache import ResultCache, cache_key
+from inference_queue import PREEMPT_SEGMENTS, PRIORITIES, InferenceQueue, QueueFull, Ticket, classify
+import ct2_backend
+import jobs
+import subtitles
+import pipeline
+import speculative
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -39,9 +59,10 @@ app.config['SWAGGER'] = {
 swagger = Swagger(app)
 
 # Глобальные переменные
-whisper_model = None
-device = None
-model_name = "base"  # По умолчанию small модель
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+if ct2_backend.STT_BACKEND not in ct2_backend.SUPPORTED_BACKENDS:
+    raise ValueError(f"STT_BACKEND должен быть одним из {ct2_backend.SUPPORTED_BACKENDS}, получено: {ct2_backend.STT_BACKEND}")
 
 # Поддерживаемые языки (основные для Whisper)
 SUPPORTED_LANGUAGES = {
@@ -75,101 +96,79 @@ WHISPER_MODELS = {
     'turbo': {'size': '809 MB', 'speed': 'очень быстро', 'quality': 'очень хорошее'}
 }
 
+# Модель для запросов без параметра model. Задается только окружением: у каждого
+# воркера gunicorn свое состояние, и смена по запросу разошлась бы между ними
+DEFAULT_MODEL = os.environ.get('STT_DEFAULT_MODEL', 'base').strip().lower()
+if DEFAULT_MODEL not in WHISPER_MODELS:
+    raise ValueError(f"STT_DEFAULT_MODEL должна быть одной из {list(WHISPER_MODELS)}, получено: {DEFAULT_MODEL}")
+
 def load_whisper_model(model_name: str = "base"):
-    """Загрузка модели Whisper"""
-    global whisper_model, device
+    """Загрузка модели Whisper (вызывается пулом моделей один раз на имя)"""
+    if device == "cuda":
+        logger.info("Используется GPU для Whisper")
+    else:
+        logger.info("Используется CPU для Whisper")
 
-    try:
-        # Определяем устройство
-        if torch.cuda.is_available():
-            device = "cuda"
-            logger.info("Используется GPU для Whisper")
-        else:
-            device = "cpu"
-            logger.info("Используется CPU для Whisper")
+    logger.info(f"Загружаем модель Whisper: {model_name}")
+    logger.info(f"Размер модели: {WHISPER_MODELS.get(model_name, {}).get('size', 'unknown')}")
 
-        logger.info(f"Загружаем модель Whisper: {model_name}")
-        logger.info(f"Размер модели: {WHISPER_MODELS.get(model_name, {}).get('size', 'unknown')}")
+    cache_dir = os.environ.get('WHISPER_CACHE', '/app/models')
+    if ct2_backend.STT_BACKEND == 'ctranslate2':
+        model = ct2_backend.load_model(model_name, device, cache_dir)
+    else:
+        model = whisper.load_model(model_name, device=device, download_root=cache_dir)
 
-        # Загружаем модель
-        whisper_model = whisper.load_model(model_name, device=device, download_root=os.environ.get('WHISPER_CACHE', '/app/models'))
+    logger.info(f"Модель Whisper {model_name} успешно загружена на {device} (бэкенд {ct2_backend.STT_BACKEND})")
+    return model
 
-        logger.info(f"Модель Whisper {model_name} успешно загружена на {device}")
 
-        # Очищаем кеш GPU если нужно
-        if device == "cuda":
-            torch.cuda.empty_cache()
+def release_gpu_memory(name: str):
+    """Освобождает кеш GPU после выгрузки модели из пула"""
+    if device == "cuda":
+        torch.cuda.empty_cache()
 
-        return True
 
-    except Exception as e:
-        logger.error(f"Ошибка загрузки модели Whisper: {e}")
-        return False
+# Резидентные модели: LRU в пределах бюджета памяти, одна загрузка на имя
+model_pool = ModelPool(load_whisper_model, on_evict=release_gpu_memory)
+# Ограниченная очередь распознавания и слоты обслуживания по моделям
+inference_queue = InferenceQueue()
+# Стадии конвейера до модели: декодирование загрузок (soundfile/ffmpeg, STT_DECODE_WORKERS потоков)
+# и log-mel спектрограммы пачками (STT_FEATURE_WORKERS потоков), обе с ограниченными очередями
+decode_stage = pipeline.Stage('decode', audio_input.DECODE_WORKERS)
+feature_stage = pipeline.FeatureStage(lambda n_mels, audios: longform.batch_mels(audios, n_mels))
+# Хранилище и обработчик асинхронных заданий (/jobs)
+job_store = None
+job_runner = None
+_jobs_lock_file = None
 
-def preprocess_audio(audio_file, target_sr: int = 16000) -> np.ndarray:
-    """Предобработка аудио файла"""
-    try:
-        # Загружаем аудио
-        if hasattr(audio_file, 'read'):
-            # Если это file-like объект
-            audio_data = audio_file.read()
-            audio_file.seek(0)  # Сброс позиции
-        else:
-            audio_data = audio_file
-
-        # Конвертируем через pydub для поддержки различных форматов
-        audio = AudioSegment.from_file(io.BytesIO(audio_data))
 
-        # Конвертируем в моно и нужную частоту
-        audio = audio.set_channels(1).set_frame_rate(target_sr)
+@contextmanager
+def serve_model(name: str, ticket=None):
+    """Слот очереди модели и сама модель из пула на время распознавания"""
+    with inference_queue.slot(name, ticket), model_pool.acquire(name) as whisper_model:
+        yield whisper_model
 
-        # Конвертируем в numpy array
-        audio_array = np.array(audio.get_array_of_samples(), dtype=np.float32)
+@contextmanager
+def serve_draft_pair(name: str, draft: str, ticket=None):
+    """Слот и модель name вместе с моделью-черновиком для спекулятивного декодирования.
 
-        # Нормализуем
-        if audio.sample_width == 2:  # 16-bit
-            audio_array = audio_array / 32768.0
-        elif audio.sample_width == 4:  # 32-bit
-            audio_array = audio_array / 2147483648.0
+    Черновик всегда берется вторым, а черновиками служат только малые модели,
+    поэтому встречных ожиданий между запросами нет.
+    """
+    with serve_model(name, ticket) as whisper_model, model_pool.acquire(draft) as draft_model:
+        yield whisper_model, draft_model
 
-        return audio_array
 
+def preprocess_audio(audio_file, target_sr: int = 16000) -> np.ndarray:
+    """Декодирование аудио (bytes или file-like) в моно float32 с частотой target_sr"""
+    try:
+        stream = audio_file if hasattr(audio_file, 'read') else io.BytesIO(audio_file)
+        return audio_input.decode_upload(stream, target_sr).audio
     except Exception as e:
         logger.error(f"Ошибка предобработки аудио: {e}")
         raise
 
 
-def analyze_audio_quality(audio_array: np.ndarray, sample_rate: int = 16000) -> Dict[str, float]:
-    """Базовая оценка качества входного аудио для защиты от галлюцинаций на тишине."""
-    if audio_array is None or len(audio_array) == 0:
-        return {"duration_sec": 0.0, "rms": 0.0}
-    duration_sec = float(len(audio_array)) / float(sample_rate)
-    rms = float(np.sqrt(np.mean(np.square(audio_array))))
-    return {"duration_sec": duration_sec, "rms": rms}
-
-
-def build_amplitude_envelope(audio_array: np.ndarray, points: int = 64) -> List[float]:
-    """Строит компактную амплитудную огибающую (0..1) для быстрой диагностики входа."""
-    if audio_array is None or len(audio_array) == 0 or points <= 0:
-        return []
-    abs_audio = np.abs(audio_array.astype(np.float32))
-    max_amp = float(np.max(abs_audio)) if len(abs_audio) > 0 else 0.0
-    if max_amp <= 1e-9:
-        return [0.0] * points
-    chunk = max(1, int(np.ceil(len(abs_audio) / points)))
-    envelope: List[float] = []
-    for idx in range(0, len(abs_audio), chunk):
-        segment = abs_audio[idx:idx + chunk]
-        if len(segment) == 0:
-            continue
-        envelope.append(float(np.mean(segment) / max_amp))
-    if len(envelope) > points:
-        envelope = envelope[:points]
-    elif len(envelope) < points:
-        envelope.extend([0.0] * (points - len(envelope)))
-    return [round(min(1.0, max(0.0, value)), 4) for value in envelope]
-
-
 def envelope_to_ascii(envelope: List[float]) -> str:
     """ASCII-визуализация огибающей для логов/UI без графики."""
     if not envelope:
@@ -182,6 +181,212 @@ def envelope_to_ascii(envelope: List[float]) -> str:
         chars.append(palette[level])
     return "".join(chars)
 
+def transcribe_options(task: str = 'transcribe', language: Optional[str] = None) -> Dict[str, Any]:
+    """Параметры декодирования Whisper, общие для всех режимов распознавания"""
+    options = {
+        'task': task,
+        'fp16': device == 'cuda',  # Используем fp16 только на GPU
+        # Стабилизация декодирования: меньше "зацикливаний" и автодописывания на тишине
+        'temperature': 0.0,
+        'condition_on_previous_text': False,
+        'no_speech_threshold': 0.6,
+        'compression_ratio_threshold': 2.4
+    }
+    if language and language in SUPPORTED_LANGUAGES:
+        options['language'] = language
+    return options
+
+
+def word_transcriber(name: str, options: Dict[str, Any]) -> streaming.TranscribeFn:
+    """Функция распознавания окна с пословными временами для потокового режима"""
+    def transcribe_window(audio: np.ndarray, prompt: str) -> List[streaming.Word]:
+        window_options = dict(options, word_timestamps=True, initial_prompt=prompt or None)
+        with serve_model(name) as whisper_model:
+            result = whisper_model.transcribe(audio, **window_options)
+        return [
+            (float(word['start']), float(word['end']), word['word'])
+            for segment in result.get('segments', [])
+            for word in segment.get('words', [])
+        ]
+    return transcribe_window
+
+
+# Короткие клипы одновременных запросов декодируются одной пачкой
+clip_batcher = ClipBatcher(lambda name: serve_model(name))
+
+# Режимы распознавания /transcribe
+DECODE_MODES = ('auto', 'longform', 'batched', 'sequential')
+# Потоковые ответы /transcribe по заголовку Accept
+STREAM_MIMETYPES = ('application/x-ndjson', 'text/event-stream')
+# Окон longform в пачке при потоковом ответе: сегменты уходят клиенту после каждой пачки
+STREAM_BATCH_SEGMENTS = int(os.environ.get('STT_STREAM_BATCH_SEGMENTS', '1'))
+# Пауза без событий, после которой в поток уходит keepalive, сек
+STREAM_KEEPALIVE_SEC = 15
+
+
+def run_whisper(audio_array: np.ndarray, name: str, options: Dict[str, Any],
+                vad_backend: str = vad.VAD_BACKEND, mode: str = 'auto', priority: str = 'auto',
+                on_segments: Optional[Callable[[List[Dict[str, Any]]], None]] = None, draft: Optional[str] = None):
+    """Распознавание с вырезанием участков без речи; времена сегментов — по исходной записи.
+
+    mode: sequential — whisper.transcribe окнами по очереди, longform — нарезка
+    по паузам и пакетное декодирование, batched — общая пачка с короткими
+    клипами других запросов, auto — batched для клипов до STT_CLIP_BATCH_MAX_SEC,
+    longform для записей длиннее STT_LONGFORM_MIN_SEC и пакетных, иначе sequential.
+    priority: interactive, batch или auto (по длительности после VAD); пакетные
+    записи в longform уступают модель интерактивным между пачками сегментов.
+    on_segments (потоковый ответ): вызывается с пустым списком, когда запрос
+    допущен в очередь, затем в longform — с сегментами каждой пачки по мере
+    распознавания (времена уже по исходной записи); auto при этом выбирает
+    longform для всего, что не ушло в общую пачку коротких клипов.
+    draft: малая модель для спекулятивного декодирования окон longform (вместо mode);
+    результат тот же, что у жадного декодирования модели name.
+    Возвращает (результат Whisper, отладочная информация VAD).
+    """
+    speech_map = vad.detect_speech(audio_array, 16000, vad_backend)
+    no_speech_debug = None
+    if speech_map is not None and not speech_map.regions:
+        # VAD речи не нашел: тихую запись он может не услышать, поэтому она
+        # распознается целиком (отсечь галлюцинации на тишине — дело порогов Whisper)
+        no_speech_debug = speech_map.debug()
+        speech_map = None
+
+    decode_audio = speech_map.compact(audio_array) if speech_map is not None else audio_array
+    if ct2_backend.STT_BACKEND != 'whisper':
+        # Пакетные пути работают с PyTorch-моделью Whisper напрямую
+        mode = 'sequential'
+    priority = classify(len(decode_audio) / 16000, priority)
+    if draft and ct2_backend.STT_BACKEND == 'whisper':
+        mode = 'speculative'
+    elif mode == 'auto':
+        if priority == 'interactive' and clip_batcher.accepts(decode_audio):
+            mode = 'batched'
+        elif priority == 'batch' or len(decode_audio) / 16000 >= longform.LONGFORM_MIN_SEC or on_segments:
+            # Сегментами, чтобы длинная запись не занимала модель целиком
+            mode = 'longform'
+    batch_size = longform.LONGFORM_BATCH_SIZE
+    emit = None
+    if on_segments is not None:
+        batch_size = min(batch_size, max(1, STREAM_BATCH_SEGMENTS))
+
+        def emit(segments: List[Dict[str, Any]]):
+            segments = [{'start': segment['start'], 'end': segment['end'], 'text': segment['text'],
+                         'avg_logprob': segment.get('avg_logprob')} for segment in segments]
+            if speech_map is not None:
+                speech_map.remap_result({'segments': segments})
+            on_segments(segments)
+    started = time.time()
+    # QueueFull, если очередь модели заполнена: вызывающий отвечает 503
+    with inference_queue.admit(name, priority) as ticket:
+        if on_segments is not None:
+            on_segments([])
+        cut_points = speech_map.cut_points() if speech_map is not None else None
+        if mode == 'batched' and len(decode_audio) / 16000 <= 30.0:
+            # Спектрограмма считается стадией признаков до очереди модели;
+            # модель и слот захватывает фоновый декодер пачки, а не поток запроса
+            timings = {}
+            mel = feature_stage.run(longform.model_n_mels(name), decode_audio, timings=timings)
+            result = clip_batcher.transcribe(name, decode_audio, options, mel=mel)
+            result['batch'].update(timings)
+            ticket.queue_wait_sec = result['batch']['queue_wait_ms'] / 1000
+            ticket.service_sec = result['batch']['decode_ms'] / 1000
+        elif mode == 'speculative':
+            # Обе модели берутся на каждое окно: между окнами модель может получить более срочный запрос
+            result = speculative.transcribe(None, None, decode_audio, options, cut_points=cut_points,
+                                            draft_name=draft, acquire=lambda: serve_draft_pair(name, draft, ticket),
+                                            on_segments=emit)
+        elif mode in ('longform', 'batched') and priority == 'batch':
+            # Слот и модель берутся на каждую пачку сегментов: ждущие голосовые команды
+            # получают модель на ближайшей границе, а не после всего файла
+            result = longform.transcribe_long(None, decode_audio, options, cut_points=cut_points,
+                                              batch_size=max(1, min(batch_size, PREEMPT_SEGMENTS)),
+                                              acquire=lambda: serve_model(name, ticket), on_segments=emit,
+                                              features=feature_stage, n_mels=longform.model_n_mels(name))
+        else:
+            with serve_model(name, ticket) as whisper_model:
+                if mode in ('longform', 'batched'):
+                    result = longform.transcribe_long(whisper_model, decode_audio, options, cut_points=cut_points,
+                                                      batch_size=batch_size, on_segments=emit,
+                                                      features=feature_stage)
+                else:
+                    result = whisper_model.transcribe(decode_audio, **options)
+    result['queue'] = ticket.debug()
+    decode_sec = time.time() - started
+    if no_speech_debug is not None:
+        no_speech_debug.update(no_speech=True, fallback='full_audio', saved_sec=0.0, decode_sec=round(decode_sec, 3))
+        return result, no_speech_debug
+    if speech_map is None:
+        return result, {'backend': 'off', 'decode_sec': round(decode_sec, 3)}
+
+    speech_map.remap_result(result)
+    vad_debug = speech_map.debug()
+    saved_sec = max(0.0, len(audio_array) / 16000 - vad_debug['decoded_sec'])
+    vad_debug.update(
+        saved_sec=round(saved_sec, 3),
+        decode_sec=round(decode_sec, 3),
+        # Оценка по скорости декодирования этого же запроса
+        saved_decode_sec_est=round(decode_sec * saved_sec / vad_debug['decoded_sec'], 3) if vad_debug['decoded_sec'] else 0.0,
+    )
+    return result, vad_debug
+
+
+def pipeline_stats() -> Dict[str, Any]:
+    """Стадии конвейера /transcribe (декодирование, признаки, модель) и стадия с наибольшим ожиданием"""
+    stages = {
+        'decode': decode_stage.stats(),
+        'features': feature_stage.stats(),
+        'model': pipeline.queue_stage_stats(inference_queue.stats()),
+    }
+    name, wait_ms = pipeline.bottleneck(stages)
+    return {'stages': stages, 'bottleneck': name, 'bottleneck_queue_wait_ms': wait_ms}
+
+
+# Повторные загрузки того же аудио с теми же параметрами не декодируются заново
+result_cache = ResultCache()
+
+
+def transcribe_cached(decoded: audio_input.DecodedAudio, name: str, options: Dict[str, Any],
+                      vad_backend: str, mode: str, priority: str = 'auto',
+                      on_segments: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                      draft: Optional[str] = None):
+    """run_whisper через кеш результатов; возвращает (результат, отладка VAD, источник кеша или None).
+
+    on_segments передается в run_whisper и вызывается, только если запись декодируется заново.
+    """
+    def compute():
+        result, vad_debug = run_whisper(decoded.audio, name, options, vad_backend, mode, priority, on_segments, draft)
+        # В кеш идет только то, что попадает в ответ (и в потоковые события): токены не нужны
+        return {
+            'result': {
+                'text': result['text'],
+                'language': result.get('language', 'unknown'),
+                'segments': [{'start': segment.get('start', 0), 'end': segment.get('end', 0),
+                              'text': segment.get('text', ''), 'avg_logprob': segment.get('avg_logprob')}
+                             for segment in result.get('segments', [])],
+                'longform': result.get('longform'),
+                'batch': result.get('batch'),
+                'speculative': result.get('speculative'),
+                'queue': result.get('queue'),
+            },
+            'vad': vad_debug,
+        }
+
+    # Потоковый ответ в auto выбирает longform, поэтому кешируется отдельно
+    extra = {'stream': True} if on_segments is not None else {}
+    if draft:
+        # Текст тот же, но в ответе статистика черновика
+        extra['draft'] = draft
+    key = cache_key(decoded.sha1, name, options, vad=vad_backend, mode=mode, priority=priority,
+                    backend=ct2_backend.STT_BACKEND, **extra)
+    value, source = result_cache.get_or_compute(key, compute)
+    if source is not None:
+        # Очередь и время обслуживания относятся к запросу, который декодировал запись
+        value['result']['queue'] = None
+    return value['result'], value['vad'], source
+
+
+stream_sessions = streaming.SessionRegistry()
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -191,8 +396,6 @@ def health_check():
       200:
         description: Сервис работает
     """
-    global whisper_model
-
     # Информация о памяти GPU
     gpu_info = {}
     if torch.cuda.is_available():
@@ -207,13 +410,20 @@ def health_check():
 
     return jsonify({
         'status': 'healthy',
-        'model_loaded': whisper_model is not None,
+        'model_loaded': model_pool.is_loaded(DEFAULT_MODEL),
         'device': device,
-        'model_name': model_name,
-        'model_info': WHISPER_MODELS.get(model_name, {}),
+        'model_name': DEFAULT_MODEL,
+        'model_info': WHISPER_MODELS.get(DEFAULT_MODEL, {}),
         'gpu_info': gpu_info,
         'supported_languages': len(SUPPORTED_LANGUAGES),
-        'available_models': list(WHISPER_MODELS.keys())
+        'available_models': list(WHISPER_MODELS.keys()),
+        'backend': ct2_backend.backend_info(device),
+        'model_pool': model_pool.status(),
+        'clip_batching': clip_batcher.stats(),
+        'result_cache': result_cache.stats(),
+        'inference_queue': inference_queue.stats(),
+        'pipeline': pipeline_stats(),
+        'jobs': {'store': job_store is not None, 'runner': job_runner is not None}
     })
 
 @app.route('/models', methods=['GET'])
@@ -227,14 +437,18 @@ def get_models():
     """
     return jsonify({
         'models': WHISPER_MODELS,
-        'current_model': model_name,
+        'current_model': DEFAULT_MODEL,
         'languages': SUPPORTED_LANGUAGES
     })
 
 @app.route('/model/load', methods=['POST'])
 def load_model():
     """
-    Загрузить указанную модель Whisper
+    Загрузить указанную модель Whisper в пул моделей
+    Модель по умолчанию не меняется (она задается STT_DEFAULT_MODEL и одинакова
+    во всех воркерах): загруженной моделью распознаются запросы с параметром
+    model. Прогревается пул воркера, принявшего запрос; остальные воркеры
+    загрузят модель при первом обращении.
     ---
     parameters:
       - in: body
@@ -253,28 +467,90 @@ def load_model():
     """
     try:
         data = request.get_json()
-        new_model_name = data.get('model_name', 'base')
+        new_model_name = data.get('model_name', DEFAULT_MODEL)
 
         if new_model_name not in WHISPER_MODELS:
             return jsonify({'error': f'Неизвестная модель: {new_model_name}'}), 400
 
-        global model_name
-        model_name = new_model_name
-
-        success = load_whisper_model(model_name)
-        if success:
-            return jsonify({
-                'status': 'success',
-                'model_name': model_name,
-                'device': device
-            })
-        else:
+        try:
+            model_pool.get(new_model_name)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки модели Whisper: {e}")
             return jsonify({'error': 'Не удалось загрузить модель'}), 500
 
+        return jsonify({
+            'status': 'success',
+            'model_name': new_model_name,
+            'default_model': DEFAULT_MODEL,
+            'device': device
+        })
+
     except Exception as e:
         logger.error(f"Ошибка при загрузке модели: {e}")
         return jsonify({'error': str(e)}), 500
 
+def transcription_events(compute: Callable) -> "queue.Queue":
+    """Запускает compute(on_segments) в отдельном потоке; события в очереди:
+    ('segments', [...]) по мере распознавания, затем ('done', результат) или ('error', исключение).
+
+    Если клиент отключится, распознавание доработает и результат попадет в кеш.
+    """
+    events = queue.Queue()
+
+    def worker():
+        try:
+            events.put(('done', compute(lambda segments: events.put(('segments', segments)))))
+        except Exception as e:
+            events.put(('error', e))
+
+    threading.Thread(target=worker, name='stt-transcribe-stream', daemon=True).start()
+    return events
+
+
+def stream_transcription(events: "queue.Queue", first_event, mimetype: str, finish: Callable):
+    """Тело потокового ответа /transcribe: segment на каждый сегмент, затем summary (ответ без сегментов).
+
+    application/x-ndjson — JSON-строки с полем type, text/event-stream — события SSE.
+    """
+    def line(event_type: str, payload: Dict[str, Any]) -> str:
+        if mimetype == 'text/event-stream':
+            return f"event: {event_type}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return json.dumps(dict(payload, type=event_type), ensure_ascii=False) + "\n"
+
+    def segment_line(segment: Dict[str, Any]) -> str:
+        avg_logprob = segment.get('avg_logprob')
+        return line('segment', {'start': segment.get('start', 0), 'end': segment.get('end', 0),
+                                'text': segment.get('text', '').strip(),
+                                'avg_logprob': round(avg_logprob, 4) if avg_logprob is not None else None})
+
+    streamed = 0
+    kind, payload = first_event
+    while True:
+        if kind == 'segments':
+            for segment in payload:
+                streamed += 1
+                yield segment_line(segment)
+        elif kind == 'error':
+            logger.error(f"Ошибка потоковой транскрибации: {payload}")
+            yield line('error', {'error': f'Ошибка обработки: {str(payload)}'})
+            return
+        elif kind == 'done':
+            result, vad_debug, cache_source = payload
+            if not streamed:
+                # Кеш, короткие клипы и sequential: сегменты известны только целиком
+                for segment in result.get('segments', []):
+                    yield segment_line(segment)
+            summary = finish(result, vad_debug, cache_source)
+            summary['segments_count'] = len(summary.pop('segments'))
+            yield line('summary', summary)
+            return
+        try:
+            kind, payload = events.get(timeout=STREAM_KEEPALIVE_SEC)
+        except queue.Empty:
+            kind = None
+            yield ": keepalive\n\n" if mimetype == 'text/event-stream' else json.dumps({'type': 'keepalive'}) + "\n"
+
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
     """
@@ -298,16 +574,36 @@ def transcribe_audio():
         name: model
         type: string
         description: Модель Whisper (tiny, base, small, medium, large)
+      - in: formData
+        name: vad
+        type: string
+        description: Вырезание участков без речи (energy, silero, off; по умолчанию STT_VAD)
+      - in: formData
+        name: mode
+        type: string
+        description: auto (по умолчанию), longform (пакетное декодирование сегментов), batched (общая пачка коротких клипов) или sequential
+      - in: formData
+        name: priority
+        type: string
+        description: interactive (голосовые команды, вне очереди длинных файлов), batch или auto (по длительности, STT_INTERACTIVE_MAX_SEC)
+      - in: formData
+        name: draft_model
+        type: string
+        description: Спекулятивное декодирование для medium/large/turbo — малая модель (tiny, base) предлагает токены, результат совпадает с жадным декодированием выбранной модели; off — выключить, по умолчанию STT_SPECULATIVE_DRAFT
+    produces:
+      - application/json
+      - application/x-ndjson
+      - text/event-stream
     responses:
       200:
-        description: Успешная транскрибация
+        description: 'Успешная транскрибация. При Accept: application/x-ndjson или text/event-stream — поток событий segment (start, end, text, avg_logprob) по мере распознавания окон, затем summary'
       400:
         description: Ошибка в параметрах
       500:
         description: Ошибка сервера
+      503:
+        description: Очередь модели заполнена (заголовок Retry-After)
     """
-    global whisper_model, model_name
-
     try:
         # Проверяем наличие аудио файла
         if 'audio' not in request.files:
@@ -324,32 +620,41 @@ def transcribe_audio():
         client_audio_mime = request.form.get('client_audio_mime', '')
         client_audio_size = request.form.get('client_audio_size', '')
 
-        # Диагностика входного файла: позволяет быстро понять, меняется ли аудио между запросами
-        raw_audio_bytes = audio_file.read()
-        audio_file.seek(0)
-        input_size_bytes = len(raw_audio_bytes)
-        input_audio_hash = hashlib.sha1(raw_audio_bytes).hexdigest()[:12] if input_size_bytes > 0 else "empty"
-
-        # Проверяем и загружаем нужную модель
-        if requested_model:
-            if requested_model not in WHISPER_MODELS:
-                return jsonify({'error': f'Неизвестная модель: {requested_model}. Доступные: {list(WHISPER_MODELS.keys())}'}), 400
-
-            # Если запрошенная модель отличается от загруженной, перегружаем
-            if requested_model != model_name or whisper_model is None:
-                logger.info(f"Переключение модели с {model_name} на {requested_model}")
-                model_name = requested_model
-                success = load_whisper_model(model_name)
-                if not success:
-                    return jsonify({'error': f'Не удалось загрузить модель {requested_model}'}), 500
-        else:
-            # Если модель не указана, используем текущую загруженную
-            if whisper_model is None:
-                return jsonify({'error': 'Модель не загружена. Укажите параметр model или загрузите модель через /model/load'}), 500
+        # Модель берется из пула: переключение между моделями не вызывает перезагрузку
+        if requested_model and requested_model not in WHISPER_MODELS:
+            return jsonify({'error': f'Неизвестная модель: {requested_model}. Доступные: {list(WHISPER_MODELS.keys())}'}), 400
+        request_model_name = requested_model or DEFAULT_MODEL
+        vad_backend = (request.form.get('vad') or vad.VAD_BACKEND).lower()
+        if vad_backend not in vad.BACKENDS:
+            return jsonify({'error': f'Неизвестный VAD: {vad_backend}. Доступные: {list(vad.BACKENDS)}'}), 400
+        decode_mode = (request.form.get('mode') or 'auto').lower()
+        if decode_mode not in DECODE_MODES:
+            return jsonify({'error': f'Неизвестный режим: {decode_mode}. Доступные: {list(DECODE_MODES)}'}), 400
+        priority = (request.form.get('priority') or 'auto').lower()
+        if priority != 'auto' and priority not in PRIORITIES:
+            return jsonify({'error': f'Неизвестный приоритет: {priority}. Доступные: {["auto"] + list(PRIORITIES)}'}), 400
+        draft_model = (request.form.get('draft_model') or '').lower()
+        if draft_model in ('', 'auto'):
+            draft_model = speculative.DEFAULT_DRAFT if request_model_name in speculative.TARGET_MODELS else ''
+        elif draft_model == 'off':
+            draft_model = ''
+        elif draft_model not in speculative.DRAFT_MODELS:
+            return jsonify({'error': f'Неизвестная модель-черновик: {draft_model}. Доступные: {list(speculative.DRAFT_MODELS)}'}), 400
+        elif request_model_name not in speculative.TARGET_MODELS:
+            return jsonify({'error': f'Спекулятивное декодирование доступно только для моделей {list(speculative.TARGET_MODELS)}'}), 400
+        elif ct2_backend.STT_BACKEND != 'whisper':
+            return jsonify({'error': 'Спекулятивное декодирование доступно только с бэкендом whisper'}), 400
+
+        # Декодируем загрузку потоком в один буфер; хеш и RMS считаются по пути.
+        # Хеш позволяет быстро понять, меняется ли аудио между запросами
+        stage_timings = {}
+        decoded = decode_stage.run(audio_input.decode_upload, audio_file.stream, timings=stage_timings)
+        input_size_bytes = decoded.size_bytes
+        input_audio_hash = decoded.short_hash
 
         logger.info(
             "Начинаем транскрибацию, модель: %s, язык: %s, задача: %s, файл: %s, mime: %s, size: %s, hash: %s, client_mime: %s, client_size: %s",
-            model_name,
+            request_model_name,
             language,
             task,
             audio_file.filename,
@@ -360,12 +665,9 @@ def transcribe_audio():
             client_audio_size,
         )
 
-        # Предобрабатываем аудио
-        audio_array = preprocess_audio(audio_file)
-
         # Базовые проверки качества входа (частая причина "галлюцинаций" на тишине)
-        audio_metrics = analyze_audio_quality(audio_array, sample_rate=16000)
-        envelope = build_amplitude_envelope(audio_array, points=64)
+        audio_metrics = {"duration_sec": decoded.duration_sec, "rms": decoded.rms}
+        envelope = decoded.envelope(points=64)
         envelope_ascii = envelope_to_ascii(envelope)
         if audio_metrics["duration_sec"] < 0.35:
             return jsonify({
@@ -388,80 +690,561 @@ def transcribe_audio():
             )
 
         # Запускаем Whisper
-        options = {
-            'task': task,
-            'fp16': device == 'cuda',  # Используем fp16 только на GPU
-            # Стабилизация декодирования: меньше "зацикливаний" и автодописывания на тишине
-            'temperature': 0.0,
-            'condition_on_previous_text': False,
-            'no_speech_threshold': 0.6,
-            'compression_ratio_threshold': 2.4
-        }
+        options = transcribe_options(task, language)
+        stream_mimetype = request.accept_mimetypes.best_match(('application/json',) + STREAM_MIMETYPES)
+
+        try:
+            if stream_mimetype in STREAM_MIMETYPES:
+                events = transcription_events(lambda on_segments: transcribe_cached(
+                    decoded, request_model_name, options, vad_backend, decode_mode, priority, on_segments,
+                    draft_model))
+                # Первое событие — допуск в очередь (или ошибка, пока ответ еще не начат)
+                first_event = events.get()
+                if first_event[0] == 'error':
+                    raise first_event[1]
+            else:
+                result, vad_debug, cache_source = transcribe_cached(decoded, request_model_name, options, vad_backend,
+                                                                    decode_mode, priority, draft=draft_model)
+        except QueueFull as e:
+            logger.warning(str(e))
+            response = jsonify({'error': str(e), 'retry_after_sec': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
 
-        if language and language in SUPPORTED_LANGUAGES:
-            options['language'] = language
-
-        result = whisper_model.transcribe(audio_array, **options)
-
-        # Формируем ответ
-        response_data = {
-            'text': result['text'].strip(),
-            'language': result.get('language', 'unknown'),
-            'task': task,
-            'model': model_name,
-            'segments': [],
-            'debug': {
-                'input_filename': audio_file.filename,
-                'input_mime': audio_file.mimetype,
-                'input_size_bytes': input_size_bytes,
-                'input_audio_hash': input_audio_hash,
-                'input_duration_sec': round(audio_metrics["duration_sec"], 3),
-                'input_rms': round(audio_metrics["rms"], 6),
-                'input_amplitude_envelope': envelope,
-                'input_amplitude_ascii': envelope_ascii,
-                'language_forced': bool(language and language in SUPPORTED_LANGUAGES),
-                'client_audio_mime': client_audio_mime,
-                'client_audio_size': client_audio_size
+        def finish(result, vad_debug, cache_source):
+            # Формируем ответ
+            response_data = {
+                'text': result['text'].strip(),
+                'language': result.get('language', 'unknown'),
+                'task': task,
+                'model': request_model_name,
+                'segments': [],
+                'debug': {
+                    'input_filename': audio_file.filename,
+                    'input_mime': audio_file.mimetype,
+                    'input_size_bytes': input_size_bytes,
+                    'input_audio_hash': input_audio_hash,
+                    'input_duration_sec': round(audio_metrics["duration_sec"], 3),
+                    'input_rms': round(audio_metrics["rms"], 6),
+                    'input_decode': dict(decoded.debug(), stage=stage_timings.get('decode')),
+                    'input_amplitude_envelope': envelope,
+                    'input_amplitude_ascii': envelope_ascii,
+                    'language_forced': bool(language and language in SUPPORTED_LANGUAGES),
+                    'client_audio_mime': client_audio_mime,
+                    'client_audio_size': client_audio_size,
+                    'backend': ct2_backend.STT_BACKEND,
+                    'cache_hit': cache_source is not None,
+                    'cache_source': cache_source,
+                    'vad': vad_debug,
+                    'queue': result.get('queue'),
+                    'longform': result.get('longform'),
+                    'batch': result.get('batch'),
+                    'speculative': result.get('speculative')
+                }
             }
-        }
 
-        # Добавляем сегменты если есть
-        if 'segments' in result:
-            for segment in result['segments']:
-                response_data['segments'].append({
-                    'start': segment.get('start', 0),
-                    'end': segment.get('end', 0),
-                    'text': segment.get('text', '').strip()
-                })
+            # Добавляем сегменты если есть
+            if 'segments' in result:
+                for segment in result['segments']:
+                    response_data['segments'].append({
+                        'start': segment.get('start', 0),
+                        'end': segment.get('end', 0),
+                        'text': segment.get('text', '').strip()
+                    })
 
-        logger.info(f"Транскрибация завершена: {len(response_data['text'])} символов, модель: {model_name}")
+            logger.info(
+                f"Транскрибация завершена: {len(response_data['text'])} символов, модель: {request_model_name}, "
+                f"речь {vad_debug.get('speech_ratio', 1.0):.0%}, пропущено {vad_debug.get('saved_sec', 0.0)} сек, "
+                f"кеш: {cache_source or 'промах'}"
+            )
+            return response_data
 
-        return jsonify(response_data)
+        if stream_mimetype in STREAM_MIMETYPES:
+            headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            return Response(stream_with_context(stream_transcription(events, first_event, stream_mimetype, finish)),
+                            mimetype=stream_mimetype, headers=headers)
+        return jsonify(finish(result, vad_debug, cache_source))
 
     except Exception as e:
         logger.error(f"Ошибка транскрибации: {e}")
         logger.error(traceback.format_exc())
         return jsonify({'error': f'Ошибка обработки: {str(e)}'}), 500
 
+def job_files_from_request(upload_dir_factory):
+    """Файлы задания: загрузки audio (сохраняются на диск) или каталог общего тома из JSON.
+
+    Возвращает (файлы [(имя, путь)], параметры, каталог загрузок или None).
+    """
+    if request.is_json:
+        params = request.get_json(silent=True) or {}
+        if not params.get('directory'):
+            raise ValueError('Укажите directory или загрузите файлы audio')
+        directory = jobs.resolve_directory(str(params['directory']))
+        files = jobs.list_directory(directory, params.get('pattern'), bool(params.get('recursive', False)))
+        return files, params, None
+
+    uploads = [upload for upload in request.files.getlist('audio') if upload.filename]
+    if not uploads:
+        raise ValueError('Аудио файлы не найдены')
+    upload_dir = upload_dir_factory()
+    files = []
+    for idx, upload in enumerate(uploads):
+        path = os.path.join(upload_dir, f"{idx:05d}_{secure_filename(upload.filename) or 'audio'}")
+        upload.save(path)
+        files.append((upload.filename, path))
+    return files, request.form, upload_dir
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Асинхронное задание на распознавание многих файлов
+    ---
+    consumes:
+      - multipart/form-data
+      - application/json
+    parameters:
+      - in: formData
+        name: audio
+        type: file
+        description: Аудио файлы (поле повторяется)
+      - in: body
+        name: body
+        description: 'Вместо загрузки: {"directory": путь внутри STT_JOBS_DIRS, "pattern": "*.wav", "recursive": false}'
+        schema:
+          type: object
+      - in: formData
+        name: language
+        type: string
+      - in: formData
+        name: task
+        type: string
+      - in: formData
+        name: model
+        type: string
+      - in: formData
+        name: vad
+        type: string
+    responses:
+      202:
+        description: Задание создано (job_id)
+      400:
+        description: Ошибка в параметрах
+      503:
+        description: Хранилище заданий недоступно
+    """
+    if job_store is None:
+        return jsonify({'error': 'Хранилище заданий недоступно'}), 503
+    upload_dir = None
+    try:
+        files, params, upload_dir = job_files_from_request(job_store.new_upload_dir)
+        requested_model = params.get('model') or DEFAULT_MODEL
+        if requested_model not in WHISPER_MODELS:
+            raise ValueError(f'Неизвестная модель: {requested_model}. Доступные: {list(WHISPER_MODELS.keys())}')
+        vad_backend = (params.get('vad') or vad.VAD_BACKEND).lower()
+        if vad_backend not in vad.BACKENDS:
+            raise ValueError(f'Неизвестный VAD: {vad_backend}. Доступные: {list(vad.BACKENDS)}')
+        options = transcribe_options(params.get('task') or 'transcribe', params.get('language'))
+
+        job = job_store.create_job(files, requested_model, options, vad_backend, upload_dir=upload_dir)
+        if job_runner is not None:
+            job_runner.notify()
+        logger.info(f"Создано задание {job['id']} на {job['total_files']} файлов, модель: {requested_model}")
+        return jsonify({'job_id': job['id'], 'status': job['status'], 'total_files': job['total_files']}), 202
+    except ValueError as e:
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({'error': f'Некорректные входные данные: {str(e)}'}), 400
+    except Exception as e:
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+        logger.error(f"Ошибка при создании задания: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Состояние и прогресс задания по файлам
+    ---
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: true
+    responses:
+      200:
+        description: Прогресс (доля сегментов) и состояние каждого файла
+      404:
+        description: Задание не найдено
+    """
+    job = job_store.get_job(job_id) if job_store is not None else None
+    if job is None:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'model': job['model'],
+        'vad': job['vad'],
+        'total_files': job['total_files'],
+        'completed_files': job['completed_files'],
+        'failed_files': job['failed_files'],
+        'progress': job['progress'],
+        'files': job_store.list_files(job_id),
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    })
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """
+    Удалить задание вместе с результатами и загруженными файлами
+    ---
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: true
+    responses:
+      200:
+        description: Задание удалено
+      404:
+        description: Задание не найдено
+    """
+    if job_store is None or not job_store.delete_job(job_id):
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify({'status': 'deleted', 'job_id': job_id})
+
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """
+    Потоковая выдача результатов по мере готовности файлов (NDJSON, строка на файл)
+    ---
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: true
+      - in: query
+        name: subtitles
+        type: string
+        description: srt или vtt — добавить в строку файла субтитры в этом формате
+    responses:
+      200:
+        description: 'application/x-ndjson: {"index", "file", "status", "text", "language", "segments", ...}'
+      404:
+        description: Задание не найдено
+    """
+    job = job_store.get_job(job_id) if job_store is not None else None
+    if job is None:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    subtitle_format = request.args.get('subtitles')
+    if subtitle_format and subtitle_format not in subtitles.FORMATS:
+        return jsonify({'error': f'subtitles должен быть одним из {list(subtitles.FORMATS)}'}), 400
+
+    def generate():
+        for result in job_store.iter_results(job_id):
+            if subtitle_format and 'segments' in result:
+                result[subtitle_format] = subtitles.render(result['segments'], subtitle_format)
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    headers = {'X-Job-Total-Files': str(job['total_files'])}
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
+
+@app.route('/jobs/<job_id>/files/<int:index>', methods=['GET'])
+def get_job_file(job_id, index):
+    """
+    Результат одного файла задания: JSON или субтитры
+    ---
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: true
+      - in: path
+        name: index
+        type: integer
+        required: true
+      - in: query
+        name: format
+        type: string
+        description: json (по умолчанию), srt или vtt
+    responses:
+      200:
+        description: Результат файла
+      404:
+        description: Задание или файл не найдены
+      409:
+        description: Файл еще не распознан или завершился ошибкой
+    """
+    output_format = request.args.get('format', 'json')
+    if output_format != 'json' and output_format not in subtitles.FORMATS:
+        return jsonify({'error': f'format должен быть json или одним из {list(subtitles.FORMATS)}'}), 400
+    result = job_store.get_file_result(job_id, index) if job_store is not None else None
+    if result is None:
+        return jsonify({'error': 'Файл задания не найден'}), 404
+    if output_format == 'json':
+        return jsonify(result)
+    if result['status'] != jobs.STATUS_COMPLETED:
+        return jsonify({'error': 'Файл еще не распознан', 'status': result['status'],
+                        'file_error': result.get('error')}), 409
+    name = os.path.splitext(os.path.basename(result['file']))[0] or f'file_{index}'
+    return Response(subtitles.render(result['segments'], output_format), mimetype=subtitles.MIMETYPES[output_format],
+                    headers={'Content-Disposition': f'attachment; filename="{secure_filename(name) or index}.{output_format}"'})
+
+def stream_params() -> Dict[str, Any]:
+    """Параметры потоковой сессии из JSON или query string"""
+    params = dict(request.args)
+    if request.is_json:
+        params.update(request.get_json(silent=True) or {})
+    return params
+
+
 @app.route('/transcribe/stream', methods=['POST'])
 def transcribe_stream():
     """
-    Потоковая транскрибация (пока не реализована)
+    Открыть сессию потокового распознавания
     ---
+    description: |
+      Аудио досылается кусками в POST /transcribe/stream/{session_id}/audio по мере записи,
+      результаты читаются как SSE из GET /transcribe/stream/{session_id}/events
+      (события partial, final, done), запись завершается POST /transcribe/stream/{session_id}/end.
+    parameters:
+      - in: body
+        name: body
+        schema:
+          type: object
+          properties:
+            format:
+              type: string
+              description: pcm_s16le (моно, по умолчанию) или контейнер, понятный ffmpeg (webm, ogg, ...)
+            sample_rate:
+              type: integer
+              description: Частота PCM (по умолчанию 16000)
+            language:
+              type: string
+            task:
+              type: string
+            model:
+              type: string
     responses:
-      501:
-        description: Не реализовано
+      201:
+        description: Сессия создана
+      400:
+        description: Ошибка в параметрах
+      503:
+        description: Слишком много сессий
     """
-    return jsonify({'error': 'Потоковая транскрибация будет добавлена в следующей версии'}), 501
+    params = stream_params()
+    requested_model = params.get('model') or DEFAULT_MODEL
+    if requested_model not in WHISPER_MODELS:
+        return jsonify({'error': f'Неизвестная модель: {requested_model}. Доступные: {list(WHISPER_MODELS.keys())}'}), 400
+    audio_format = params.get('format') or streaming.PCM_FORMAT
+    try:
+        sample_rate = int(params.get('sample_rate') or streaming.SAMPLE_RATE)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'sample_rate должен быть целым числом'}), 400
+    if sample_rate <= 0:
+        return jsonify({'error': 'sample_rate должен быть положительным'}), 400
+
+    options = transcribe_options(params.get('task') or 'transcribe', params.get('language'))
+    transcriber = streaming.OnlineTranscriber(word_transcriber(requested_model, options))
+    try:
+        session = stream_sessions.add(lambda: streaming.StreamSession(
+            transcriber,
+            audio_format=audio_format,
+            sample_rate=sample_rate,
+            decode_fn=preprocess_audio,
+            meta={'model': requested_model, 'language': options.get('language'), 'task': options['task']},
+        ))
+    except OverflowError as e:
+        return jsonify({'error': str(e)}), 503
+
+    logger.info(f"Открыта потоковая сессия {session.id}: модель {requested_model}, формат {audio_format}")
+    base = f"/transcribe/stream/{session.id}"
+    return jsonify({
+        'session_id': session.id,
+        'audio_url': f"{base}/audio",
+        'events_url': f"{base}/events",
+        'end_url': f"{base}/end",
+        'format': audio_format,
+        'sample_rate': sample_rate,
+        'min_chunk_sec': transcriber.min_chunk_sec,
+        **session.meta
+    }), 201
 
-if __name__ == '__main__':
-    # Загружаем модель при старте
-    logger.info("Запуск STT сервиса...")
 
-    if load_whisper_model(model_name):
+@app.route('/transcribe/stream/<session_id>/audio', methods=['POST'])
+def transcribe_stream_audio(session_id):
+    """
+    Дослать кусок аудио в потоковую сессию
+    ---
+    parameters:
+      - in: path
+        name: session_id
+        type: string
+        required: true
+    responses:
+      202:
+        description: Аудио принято
+      404:
+        description: Сессия не найдена
+      409:
+        description: Сессия уже завершена
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Сессия не найдена'}), 404
+    try:
+        session.feed(request.get_data())
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'status': 'accepted', 'received_sec': round(session.transcriber.received_sec, 3)}), 202
+
+
+@app.route('/transcribe/stream/<session_id>/events', methods=['GET'])
+def transcribe_stream_events(session_id):
+    """
+    События потоковой сессии (text/event-stream)
+    ---
+    description: |
+      partial — неподтвержденный хвост гипотезы (заменяет предыдущий partial),
+      final — подтвержденный сегмент, больше не меняется, done — итог сессии.
+      Поддерживается переподключение с заголовком Last-Event-ID.
+    parameters:
+      - in: path
+        name: session_id
+        type: string
+        required: true
+    responses:
+      200:
+        description: Поток событий SSE
+      404:
+        description: Сессия не найдена
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Сессия не найдена'}), 404
+    try:
+        cursor = int(request.headers.get('Last-Event-ID', '-1')) + 1
+    except ValueError:
+        cursor = 0
+
+    def generate():
+        position = cursor
+        while True:
+            events, finished = session.wait_events(position, timeout=15)
+            for event in events:
+                payload = {key: value for key, value in event.items() if key != 'id'}
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            position += len(events)
+            if finished and not events:
+                break
+            if not events:
+                yield ": keepalive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+
+@app.route('/transcribe/stream/<session_id>/end', methods=['POST'])
+def transcribe_stream_end(session_id):
+    """
+    Завершить запись и получить итог потоковой сессии
+    ---
+    parameters:
+      - in: path
+        name: session_id
+        type: string
+        required: true
+    responses:
+      200:
+        description: Итоговый текст, сегменты и метрики (ttfw_sec — время до первого слова)
+      404:
+        description: Сессия не найдена
+      504:
+        description: Распознавание не успело завершиться
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Сессия не найдена'}), 404
+    session.close()
+    if not session.wait_finished(timeout=float(os.environ.get('STT_STREAM_FINISH_TIMEOUT_SEC', '60'))):
+        return jsonify({'error': 'Распознавание не успело завершиться', 'session_id': session_id}), 504
+    errors = [event['error'] for event in session.events if event['type'] == 'error']
+    if errors:
+        return jsonify({'error': f'Ошибка обработки: {errors[-1]}'}), 500
+    result = session.result()
+    logger.info(f"Потоковая сессия {session_id} завершена: {result['duration_sec']} сек аудио, "
+                f"до первого слова {result['ttfw_sec']} сек, проходов {result['decode_passes']}")
+    return jsonify(dict(result, session_id=session_id, **session.meta))
+
+
+@app.route('/transcribe/stream/<session_id>', methods=['DELETE'])
+def transcribe_stream_cancel(session_id):
+    """
+    Отменить потоковую сессию
+    ---
+    parameters:
+      - in: path
+        name: session_id
+        type: string
+        required: true
+    responses:
+      200:
+        description: Сессия удалена
+      404:
+        description: Сессия не найдена
+    """
+    if stream_sessions.remove(session_id) is None:
+        return jsonify({'error': 'Сессия не найдена'}), 404
+    return jsonify({'status': 'deleted', 'session_id': session_id})
+
+def start_job_runner():
+    """Открывает хранилище заданий и запускает фоновый обработчик (продолжает прерванные задания).
+
+    Обработчик работает только в одном процессе: том, что захватил файловую блокировку
+    рядом с базой. Остальные воркеры gunicorn принимают задания и отдают результаты.
+    """
+    global job_store
+    try:
+        job_store = jobs.JobStore(jobs.STT_JOBS_DB)
+    except Exception as e:
+        logger.error(f"Не удалось открыть хранилище заданий: {e}")
+        return
+    threading.Thread(target=_run_jobs_when_lock_acquired, name='stt-jobs-lock', daemon=True).start()
+
+
+def _run_jobs_when_lock_acquired():
+    global job_runner, _jobs_lock_file
+    try:
+        _jobs_lock_file = open(f"{jobs.STT_JOBS_DB}.lock", 'w')
+        # Блокирующее ожидание: если процесс-владелец завершится, блокировку получит другой воркер
+        fcntl.flock(_jobs_lock_file, fcntl.LOCK_EX)
+        # Файлы заданий идут с пакетным приоритетом: голосовые команды получают модель между пачками
+        job_runner = jobs.JobRunner(job_store, lambda name: serve_model(name, Ticket('batch'))).start()
+        logger.info(f"Обработчик заданий запущен в процессе {os.getpid()}, база: {jobs.STT_JOBS_DB}")
+    except Exception as e:
+        logger.error(f"Не удалось запустить обработчик заданий: {e}")
+
+
+def preload_default_model():
+    """Загрузка модели по умолчанию при старте процесса"""
+    try:
+        model_pool.get(DEFAULT_MODEL)
         logger.info("STT сервис готов к работе!")
-    else:
-        logger.error("Не удалось загрузить модель Whisper")
+    except Exception as e:
+        logger.error(f"Не удалось загрузить модель Whisper: {e}")
+
+
+if __name__ == '__main__':
+    # Режим разработки; в контейнере сервис запускается через gunicorn (gunicorn.conf.py)
+    logger.info("Запуск STT сервиса...")
+    preload_default_model()
+    start_job_runner()
 
     # Запускаем сервер
     port = int(os.environ.get('PORT', 8004))
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковое декодирование загруженного аудио в один буфер float32.
+
+Раньше загрузка читалась в bytes дважды (для хеша и для pydub), pydub
+запускал ffmpeg и отдавал array.array, из которого строился ndarray, —
+несколько полных копий записи плюс ресемплинг в Python. Здесь загрузка
+читается блоками: WAV/FLAC/OGG декодирует soundfile (16 кГц моно читается
+прямо в буфер, остальное сводится в моно и ресемплируется потоково через
+soxr), прочие форматы идут через stdin процесса ffmpeg, который пишет
+моно 16 кГц float32 в stdout, а тот читается readinto прямо в буфер.
+SHA1 и размер считаются блоками (для ffmpeg — по пути в процесс), сумма
+квадратов и пик — по мере заполнения буфера, огибающая — блоками без
+копии всей записи.
+"""
+
+import hashlib
+import os
+import subprocess
+import threading
+import time
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+SAMPLE_RATE = 16000
+# Исполняемый файл ffmpeg для форматов, которые не читает soundfile (webm, mp3, m4a...)
+FFMPEG_BIN = os.environ.get('STT_FFMPEG_BIN', 'ffmpeg')
+# Размер блока чтения загрузки и вывода декодера
+READ_CHUNK_BYTES = 1 << 20
+BLOCK_FRAMES = 1 << 16
+# Одновременных декодирований загрузок (потоки пула в app.py)
+DECODE_WORKERS = int(os.environ.get('STT_DECODE_WORKERS', '4'))
+# Начальная емкость буфера для ffmpeg, когда длительность заранее неизвестна
+INITIAL_CAPACITY_SEC = 30
+
+
+class AudioBuffer:
+    """Растущий буфер float32 с подсчетом энергии и пика по мере записи."""
+
+    def __init__(self, capacity: int):
+        self.data = np.empty(max(1, capacity), dtype=np.float32)
+        self.size = 0
+        self.sum_squares = 0.0
+        self.peak = 0.0
+
+    def reserve(self, samples: int):
+        """Гарантирует место еще под samples отсчетов (емкость растет вдвое)."""
+        needed = self.size + samples
+        if needed <= len(self.data):
+            return
+        grown = np.empty(max(needed, 2 * len(self.data)), dtype=np.float32)
+        grown[:self.size] = self.data[:self.size]
+        self.data = grown
+
+    def commit(self, samples: int):
+        """Учитывает samples отсчетов, уже записанных в data[size:]."""
+        if samples <= 0:
+            return
+        block = self.data[self.size:self.size + samples]
+        self.sum_squares += float(np.dot(block, block))
+        self.peak = max(self.peak, float(np.max(np.abs(block))))
+        self.size += samples
+
+    def append(self, samples: np.ndarray):
+        self.reserve(len(samples))
+        self.data[self.size:self.size + len(samples)] = samples
+        self.commit(len(samples))
+
+    @property
+    def audio(self) -> np.ndarray:
+        return self.data[:self.size]
+
+    @property
+    def rms(self) -> float:
+        return float(np.sqrt(self.sum_squares / self.size)) if self.size else 0.0
+
+
+def amplitude_envelope(audio: np.ndarray, points: int = 64, peak: Optional[float] = None) -> List[float]:
+    """Амплитудная огибающая (0..1): среднее |x| по points равным кускам, деленное на пик."""
+    if audio is None or len(audio) == 0 or points <= 0:
+        return []
+    if peak is None:
+        peak = float(np.max(np.abs(audio)))
+    if peak <= 1e-9:
+        return [0.0] * points
+    chunk = max(1, int(np.ceil(len(audio) / points)))
+    envelope = [float(np.mean(np.abs(audio[idx:idx + chunk])) / peak) for idx in range(0, len(audio), chunk)]
+    envelope = envelope[:points] + [0.0] * (points - len(envelope))
+    return [round(min(1.0, max(0.0, value)), 4) for value in envelope]
+
+
+class DecodedAudio:
+    """Результат декодирования загрузки и метрики, посчитанные по пути."""
+
+    def __init__(self, buffer: AudioBuffer, sha1: str, size_bytes: int, decoder: str,
+                 decode_sec: float, sample_rate: int = SAMPLE_RATE):
+        self.audio = buffer.audio
+        self.sha1 = sha1
+        self.size_bytes = size_bytes
+        self.decoder = decoder
+        self.decode_sec = decode_sec
+        self.sample_rate = sample_rate
+        self.rms = buffer.rms
+        self.peak = buffer.peak
+        self.buffer_bytes = buffer.data.nbytes
+
+    @property
+    def duration_sec(self) -> float:
+        return len(self.audio) / float(self.sample_rate)
+
+    @property
+    def short_hash(self) -> str:
+        return self.sha1[:12] if self.size_bytes > 0 else 'empty'
+
+    def envelope(self, points: int = 64) -> List[float]:
+        return amplitude_envelope(self.audio, points, peak=self.peak)
+
+    def debug(self) -> Dict[str, Any]:
+        return {
+            'decoder': self.decoder,
+            'decode_sec': round(self.decode_sec, 3),
+            'buffer_mb': round(self.buffer_bytes / 1024 ** 2, 2),
+        }
+
+
+def _hash_stream(stream: BinaryIO):
+    sha1 = hashlib.sha1()
+    size = 0
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        sha1.update(chunk)
+        size += len(chunk)
+    return sha1.hexdigest(), size
+
+
+def _decode_soundfile(sound: sf.SoundFile, sample_rate: int) -> AudioBuffer:
+    frames = max(0, sound.frames)
+    expected = int(np.ceil(frames * sample_rate / sound.samplerate))
+    buffer = AudioBuffer(expected + BLOCK_FRAMES)
+
+    if sound.channels == 1 and sound.samplerate == sample_rate:
+        # Без сведения и ресемплинга soundfile пишет отсчеты прямо в буфер
+        while True:
+            buffer.reserve(BLOCK_FRAMES)
+            read = sound.read(BLOCK_FRAMES, dtype='float32', out=buffer.data[buffer.size:buffer.size + BLOCK_FRAMES])
+            buffer.commit(len(read))
+            if len(read) < BLOCK_FRAMES:
+                return buffer
+
+    resampler = soxr.ResampleStream(sound.samplerate, sample_rate, 1, dtype='float32') \
+        if sound.samplerate != sample_rate else None
+    block = np.empty((BLOCK_FRAMES, sound.channels), dtype=np.float32)
+    while True:
+        read = sound.read(BLOCK_FRAMES, dtype='float32', always_2d=True, out=block)
+        last = len(read) < BLOCK_FRAMES
+        mono = read.mean(axis=1, dtype=np.float32) if sound.channels > 1 else read[:, 0]
+        if resampler is not None:
+            mono = resampler.resample_chunk(mono, last=last)
+        buffer.append(mono)
+        if last:
+            return buffer
+
+
+def _decode_ffmpeg(stream: BinaryIO, sample_rate: int):
+    command = [FFMPEG_BIN, '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+               '-f', 'f32le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1']
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise RuntimeError(f"Формат не поддерживается soundfile, а ffmpeg не найден ({FFMPEG_BIN})")
+
+    sha1 = hashlib.sha1()
+    fed = {'size': 0, 'error': None}
+    stderr: List[bytes] = []
+
+    def feed():
+        # Загрузка уходит в ffmpeg блоками, хеш считается по пути
+        try:
+            while True:
+                chunk = stream.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+                fed['size'] += len(chunk)
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg завершился раньше — причина будет в stderr
+        except BaseException as e:
+            fed['error'] = e
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, name='stt-ffmpeg-feed', daemon=True)
+    drainer = threading.Thread(target=lambda: stderr.append(process.stderr.read()), name='stt-ffmpeg-stderr',
+                               daemon=True)
+    feeder.start()
+    drainer.start()
+
+    # Длительность заранее неизвестна: буфер растет вдвое по мере вывода ffmpeg
+    buffer = AudioBuffer(INITIAL_CAPACITY_SEC * sample_rate)
+    pending = 0  # байты неполного отсчета в конце буфера
+    while True:
+        buffer.reserve(BLOCK_FRAMES)
+        raw = memoryview(buffer.data).cast('B')
+        start = buffer.size * 4 + pending
+        read = process.stdout.readinto(raw[start:start + BLOCK_FRAMES * 4 - pending])
+        raw.release()
+        if not read:
+            break
+        complete, pending = divmod(pending + read, 4)
+        buffer.commit(complete)
+
+    process.stdout.close()
+    process.wait()
+    feeder.join()
+    drainer.join()
+    if fed['error'] is not None:
+        raise fed['error']
+    if process.returncode != 0:
+        message = b''.join(stderr).decode('utf-8', 'replace').strip()
+        raise ValueError(f"ffmpeg не смог декодировать аудио: {message[-500:]}")
+    return buffer, sha1.hexdigest(), fed['size']
+
+
+def decode_upload(stream: BinaryIO, sample_rate: int = SAMPLE_RATE) -> DecodedAudio:
+    """Декодирует загрузку в моно float32 с частотой sample_rate.
+
+    stream должен поддерживать seek, если файл может оказаться WAV/FLAC/OGG
+    (загрузки Flask и BytesIO поддерживают).
+    """
+    started = time.time()
+    start_position = stream.tell()
+    try:
+        sound = sf.SoundFile(stream)
+    except RuntimeError:
+        sound = None
+    if sound is not None:
+        with sound:
+            buffer = _decode_soundfile(sound, sample_rate)
+        # soundfile читает загрузку с перемещениями, поэтому хеш — отдельным проходом блоками
+        stream.seek(start_position)
+        sha1, size_bytes = _hash_stream(stream)
+        return DecodedAudio(buffer, sha1, size_bytes, 'soundfile', time.time() - started, sample_rate)
+
+    stream.seek(start_position)
+    buffer, sha1, size_bytes = _decode_ffmpeg(stream, sample_rate)
+    return DecodedAudio(buffer, sha1, size_bytes, 'ffmpeg', time.time() - started, sample_rate)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк бэкендов распознавания: PyTorch-Whisper (fp32 на CPU) против
+CTranslate2/faster-whisper с int8-квантизацией.
+
+Использование (из каталога services/stt):
+    python bench_backends.py --fixtures ./fixtures --model small
+    python bench_backends.py --fixtures ./fixtures --model small --compute-types int8 int8_float32 --threads 4
+
+Каталог фикстур: аудиофайлы (wav/flac/ogg) и рядом эталонные расшифровки
+с тем же именем и расширением .txt (meeting.wav + meeting.txt). Аудио
+читается через soundfile и приводится к 16 кГц моно. Для каждого бэкенда
+печатается строка JSON: время загрузки, суммарное время распознавания,
+real-time factor (время / длительность аудио, меньше — лучше) и WER по
+всем фикстурам (сумма правок / сумма слов эталонов). Сконвертированные
+модели CTranslate2 кешируются в WHISPER_CACHE/ct2 — первый запуск дольше.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+import whisper
+
+import ct2_backend
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg')
+# Параметры декодирования сервиса (см. transcribe_options в app.py)
+OPTIONS = {
+    'task': 'transcribe',
+    'fp16': False,
+    'temperature': 0.0,
+    'condition_on_previous_text': False,
+    'no_speech_threshold': 0.6,
+    'compression_ratio_threshold': 2.4,
+}
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        base, extension = os.path.splitext(path)
+        if extension.lower() not in AUDIO_EXTENSIONS or not os.path.exists(base + '.txt'):
+            continue
+        audio, rate = sf.read(path, dtype='float32', always_2d=True)
+        audio = audio.mean(axis=1)
+        if rate != SAMPLE_RATE:
+            audio = librosa.resample(audio, orig_sr=rate, target_sr=SAMPLE_RATE)
+        with open(base + '.txt', encoding='utf-8') as f:
+            reference = f.read()
+        fixtures.append((os.path.basename(path), np.ascontiguousarray(audio, dtype=np.float32), reference))
+    return fixtures
+
+
+def normalize_words(text):
+    return re.sub(r'[^\w\s]', ' ', text.lower().replace('ё', 'е')).split()
+
+
+def edit_distance(reference, hypothesis):
+    """Расстояние Левенштейна по словам."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def run_backend(label, load, fixtures, options):
+    started = time.perf_counter()
+    model = load()
+    load_sec = time.perf_counter() - started
+
+    decode_sec = 0.0
+    errors = 0
+    words = 0
+    files = []
+    for name, audio, reference in fixtures:
+        started = time.perf_counter()
+        result = model.transcribe(audio, **options)
+        seconds = time.perf_counter() - started
+        decode_sec += seconds
+        reference_words = normalize_words(reference)
+        file_errors = edit_distance(reference_words, normalize_words(result['text']))
+        errors += file_errors
+        words += len(reference_words)
+        files.append({'file': name, 'rtf': round(seconds / (len(audio) / SAMPLE_RATE), 4),
+                      'wer': round(file_errors / max(1, len(reference_words)), 4)})
+
+    audio_sec = sum(len(audio) for _, audio, _ in fixtures) / SAMPLE_RATE
+    print(json.dumps({
+        'backend': label,
+        'load_sec': round(load_sec, 2),
+        'audio_sec': round(audio_sec, 1),
+        'sec': round(decode_sec, 2),
+        'rtf': round(decode_sec / audio_sec, 4),
+        'wer': round(errors / max(1, words), 4),
+        'files': files,
+    }, ensure_ascii=False), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', required=True, help='каталог с аудио и эталонными .txt')
+    parser.add_argument('--model', default='small')
+    parser.add_argument('--language', default='ru')
+    parser.add_argument('--compute-types', nargs='+', default=['int8'], choices=ct2_backend.COMPUTE_TYPES)
+    parser.add_argument('--threads', type=int, default=None, help='потоки torch и CTranslate2')
+    parser.add_argument('--skip-whisper', action='store_true', help='не замерять PyTorch-Whisper')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f'в {args.fixtures} нет пар аудио + .txt')
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    cache_dir = os.environ.get('WHISPER_CACHE', '/app/models')
+    options = dict(OPTIONS, language=args.language)
+
+    if not args.skip_whisper:
+        run_backend('whisper-fp32', lambda: whisper.load_model(args.model, device='cpu', download_root=cache_dir),
+                    fixtures, options)
+    for compute_type in args.compute_types:
+        def load(compute_type=compute_type):
+            model_dir = ct2_backend.ensure_converted(args.model, cache_dir, compute_type)
+            return ct2_backend.CT2Whisper(model_dir, 'cpu', compute_type, cpu_threads=args.threads or 0)
+        run_backend(f'ctranslate2-{compute_type}', load, fixtures, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк декодирования загрузок /transcribe: прежний путь (bytes целиком,
+повторное чтение, pydub + ffmpeg, array -> ndarray) против потокового
+audio_input.decode_upload в один буфер.
+
+Использование (из каталога services/stt):
+    python bench_decode.py                      # синтетическая часовая запись
+    python bench_decode.py --audio lecture.webm --formats source
+    python bench_decode.py --duration 600 --formats wav16k wav44k flac
+
+Каждый замер идет в отдельном процессе: пиковая память — прирост ru_maxrss
+относительно процесса после импортов и пик аллокаций tracemalloc (numpy
+сообщает о своих буферах). Синтетические файлы пишутся во временный
+каталог; форматы webm/mp3 и прежний путь требуют ffmpeg в PATH.
+
+Прежнему пути нужен pydub, которого больше нет в requirements.txt сервиса:
+это зависимость только бенчмарка (pip install pydub). Без него столбец
+legacy пропускается.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+import audio_input
+
+SYNTHETIC_FORMATS = {
+    'wav16k': (16000, 1, 'WAV', 'PCM_16'),
+    'wav44k': (44100, 2, 'WAV', 'PCM_16'),
+    'flac': (48000, 1, 'FLAC', 'PCM_16'),
+}
+FFMPEG_FORMATS = {
+    'webm': ['-c:a', 'libopus', '-b:a', '32k', '-f', 'webm'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3'],
+}
+
+
+def write_synthetic(directory, name, duration):
+    """Тон с модуляцией и шумом, пишется блоками, чтобы не держать час аудио в памяти."""
+    rate, channels, fmt, subtype = SYNTHETIC_FORMATS.get(name, SYNTHETIC_FORMATS['wav16k'])
+    path = os.path.join(directory, f"{name}.{fmt.lower()}")
+    rng = np.random.default_rng(0)
+    with sf.SoundFile(path, 'w', rate, channels, subtype, format=fmt) as f:
+        for start in range(0, int(duration * rate), rate * 60):
+            t = (start + np.arange(min(rate * 60, int(duration * rate) - start))) / rate
+            signal = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.3 * t))
+            signal += 0.01 * rng.standard_normal(len(t))
+            f.write(np.repeat(signal[:, None], channels, axis=1).astype(np.float32))
+    if name in FFMPEG_FORMATS:
+        target = os.path.join(directory, f"{name}.{name}")
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-i', path] + FFMPEG_FORMATS[name] + [target],
+                       check=True)
+        os.remove(path)
+        path = target
+    return path
+
+
+def legacy_decode(path):
+    """Прежний путь app.py: read() + seek, sha1 по bytes, pydub из BytesIO."""
+    from pydub import AudioSegment
+
+    with open(path, 'rb') as upload:
+        raw_audio_bytes = upload.read()
+        upload.seek(0)
+        hashlib.sha1(raw_audio_bytes).hexdigest()
+        audio_data = upload.read()
+        upload.seek(0)
+    audio = AudioSegment.from_file(io.BytesIO(audio_data)).set_channels(1).set_frame_rate(16000)
+    audio_array = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    if audio.sample_width == 2:
+        audio_array = audio_array / 32768.0
+    float(np.sqrt(np.mean(np.square(audio_array))))
+    return audio_array
+
+
+def stream_decode(path):
+    with open(path, 'rb') as upload:
+        decoded = audio_input.decode_upload(upload)
+    decoded.envelope(64)
+    return decoded.audio
+
+
+def measure(path_name, path, queue):
+    decode = legacy_decode if path_name == 'legacy' else stream_decode
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        audio = decode(path)
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+        return
+    seconds = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    queue.put({
+        'decode_sec': round(seconds, 3),
+        'audio_sec': round(len(audio) / 16000, 1),
+        'peak_rss_mb': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024, 1),
+        'peak_alloc_mb': round(traced_peak / 1024 ** 2, 1),
+        'output_mb': round(audio.nbytes / 1024 ** 2, 1),
+    })
+
+
+def run_isolated(path_name, path):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(path_name, path, queue))
+    process.start()
+    row = queue.get()
+    process.join()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', default=None, help='свой файл вместо синтетических (формат source)')
+    parser.add_argument('--duration', type=float, default=3600, help='длительность синтетической записи, сек')
+    parser.add_argument('--formats', nargs='+', default=['wav16k', 'wav44k', 'flac', 'webm'],
+                        choices=list(SYNTHETIC_FORMATS) + list(FFMPEG_FORMATS) + ['source'])
+    args = parser.parse_args()
+
+    has_ffmpeg = shutil.which('ffmpeg') is not None
+    has_pydub = importlib.util.find_spec('pydub') is not None
+    if not has_pydub:
+        print('# pydub не установлен: прежний путь (legacy) пропускается, pip install pydub', file=sys.stderr, flush=True)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.formats:
+            if name == 'source':
+                if not args.audio:
+                    parser.error('формат source требует --audio')
+                path = args.audio
+            elif name in FFMPEG_FORMATS and not has_ffmpeg:
+                print(json.dumps({'format': name, 'skipped': 'нет ffmpeg'}, ensure_ascii=False), flush=True)
+                continue
+            else:
+                path = write_synthetic(directory, name, args.duration)
+            size_mb = round(os.path.getsize(path) / 1024 ** 2, 1)
+            for path_name in ('legacy', 'stream'):
+                if path_name == 'legacy' and not has_pydub:
+                    row = {'skipped': 'нет pydub'}
+                elif path_name == 'legacy' and not has_ffmpeg:
+                    row = {'skipped': 'нет ffmpeg'}
+                else:
+                    row = run_isolated(path_name, path)
+                print(json.dumps(dict({'format': name, 'path': path_name, 'file_mb': size_mb}, **row),
+                                 ensure_ascii=False), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк длинных записей: whisper.transcribe (текущий путь) против
+пакетного декодирования longform на CPU.
+
+Использование (из каталога services/stt):
+    python bench_longform.py --audio meeting.wav --model small --batch-sizes 1 4 8
+    python bench_longform.py --duration 600 --random-weights   # без весов: только проверка пайплайна
+
+Аудио читается через soundfile (wav/flac/ogg) и приводится к 16 кГц моно;
+--duration повторяет запись до нужной длины. Для каждого пути печатается
+строка JSON: время, real-time factor (время обработки / длительность
+аудио, меньше — лучше), число сегментов и для longform — время расчета
+log-mel и декодирования.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+import whisper
+
+import longform
+import vad
+
+SAMPLE_RATE = 16000
+# Параметры декодирования сервиса (см. transcribe_options в app.py)
+OPTIONS = {
+    'task': 'transcribe',
+    'fp16': False,
+    'temperature': 0.0,
+    'condition_on_previous_text': False,
+    'no_speech_threshold': 0.6,
+    'compression_ratio_threshold': 2.4,
+}
+
+
+def load_audio(path, duration):
+    if path:
+        audio, rate = sf.read(path, dtype='float32', always_2d=True)
+        audio = librosa.resample(audio.mean(axis=1), orig_sr=rate, target_sr=SAMPLE_RATE) if rate != SAMPLE_RATE \
+            else audio.mean(axis=1)
+    else:
+        # Шум с паузами вместо речи: для сравнения скорости путей этого достаточно
+        rng = np.random.default_rng(0)
+        audio = (0.1 * rng.standard_normal(20 * SAMPLE_RATE)).astype(np.float32)
+        audio[14 * SAMPLE_RATE:] = 0.0
+    if duration:
+        repeats = int(np.ceil(duration * SAMPLE_RATE / len(audio)))
+        audio = np.tile(audio, repeats)[:int(duration * SAMPLE_RATE)]
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def load_model(name, random_weights):
+    if not random_weights:
+        return whisper.load_model(name, device='cpu', download_root=os.environ.get('WHISPER_CACHE', '/app/models'))
+    from whisper.model import ModelDimensions, Whisper
+    torch.manual_seed(0)
+    model = Whisper(ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=384, n_audio_head=6, n_audio_layer=4,
+                                    n_vocab=51865, n_text_ctx=448, n_text_state=384, n_text_head=6, n_text_layer=4)).eval()
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model
+
+
+def report(path, seconds, audio_sec, result, **extra):
+    row = {
+        'path': path,
+        'audio_sec': round(audio_sec, 1),
+        'sec': round(seconds, 2),
+        'rtf': round(seconds / audio_sec, 4),
+        'segments': len(result.get('segments', [])),
+        'chars': len(result.get('text', '')),
+    }
+    row.update(extra)
+    print(json.dumps(row, ensure_ascii=False), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', default=None, help='файл записи (по умолчанию синтетический)')
+    parser.add_argument('--duration', type=float, default=None, help='повторить запись до этой длины, сек')
+    parser.add_argument('--model', default='base')
+    parser.add_argument('--language', default='ru')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads')
+    parser.add_argument('--random-weights', action='store_true', help='модель со случайными весами размера base')
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    audio = load_audio(args.audio, args.duration)
+    audio_sec = len(audio) / SAMPLE_RATE
+    model = load_model(args.model, args.random_weights)
+    options = dict(OPTIONS, language=args.language)
+    if args.random_weights:
+        # Случайные веса не проходят пороги качества: без них повторы с температурой исказят замер
+        options.update(logprob_threshold=None, compression_ratio_threshold=None, no_speech_threshold=None)
+
+    if not args.skip_sequential:
+        started = time.perf_counter()
+        result = model.transcribe(audio, **options)
+        report('sequential', time.perf_counter() - started, audio_sec, result)
+
+    speech_map = vad.detect_speech(audio, SAMPLE_RATE, 'energy')
+    compact = speech_map.compact(audio)
+    for batch_size in args.batch_sizes:
+        started = time.perf_counter()
+        result = longform.transcribe_long(model, compact, options, cut_points=speech_map.cut_points(),
+                                          batch_size=batch_size)
+        report('longform', time.perf_counter() - started, audio_sec, result,
+               speech_ratio=round(speech_map.speech_ratio, 3), **result['longform'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк /transcribe целиком: загрузка, декодирование аудио, VAD, очередь
+модели и распознавание — так, как их видит клиент.
+
+Использование (из каталога services/stt):
+    python bench_stt.py                                   # tiny, whisper, CPU — запускается на любой сборочной машине
+    python bench_stt.py --models tiny base --backends all --concurrency 1 4 --durations 5 30 120
+    python bench_stt.py --fixtures ./fixtures --output bench.json
+
+Аудио: синтетическая «речь» (гармонический голос со слогами и паузами
+между словами) и почти тишина каждой длительности из --durations, плюс
+WAV-файлы каталога --fixtures (по умолчанию ./fixtures, если он есть).
+Запросы идут через тестовый клиент Flask в том же процессе, что и модель,
+с --concurrency одновременными запросами; кеш результатов выключен, чтобы
+повторы одной записи не попадали в него.
+
+Каждая пара бэкенд + модель замеряется в отдельном процессе (бэкенд
+выбирается STT_BACKEND при импорте app, пиковая память не смешивается).
+--device cpu (по умолчанию) скрывает GPU. Результат — один JSON-документ
+на stdout (и в --output): для каждой записи и конкурентности p50/p95/
+среднее время ответа, real-time factor (время ответа / длительность
+аудио, меньше — лучше), пропускная способность, среднее время
+декодирования загрузки, ожидания очереди и распознавания и пиковый RSS
+процесса.
+"""
+
+import argparse
+import glob
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+import ct2_backend
+
+SAMPLE_RATE = 16000
+FIXTURE_EXTENSIONS = ('.wav',)
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def speech_like(duration, seed=0):
+    """Слова из гармоник основного тона с дрожанием и слоговой огибающей, между словами — паузы."""
+    rng = np.random.default_rng(seed)
+    audio = (0.002 * rng.standard_normal(int(duration * SAMPLE_RATE))).astype(np.float32)
+    position = 0.2
+    while position < duration:
+        word = rng.uniform(0.3, 1.2)
+        t = np.arange(int(min(word, duration - position) * SAMPLE_RATE)) / SAMPLE_RATE
+        f0 = rng.uniform(100, 220) * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+        voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 9))
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * t / word)) * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+        start = int(position * SAMPLE_RATE)
+        audio[start:start + len(t)] += (0.15 * voice * envelope).astype(np.float32)
+        position += word + rng.uniform(0.15, 0.6)
+    return audio
+
+
+def near_silence(duration, seed=0):
+    return (0.0005 * np.random.default_rng(seed).standard_normal(int(duration * SAMPLE_RATE))).astype(np.float32)
+
+
+def wav_bytes(audio):
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, SAMPLE_RATE, subtype='PCM_16', format='WAV')
+    return buffer.getvalue()
+
+
+def build_cases(durations, fixtures_dir):
+    """Записи бенчмарка: (имя, вид, длительность, байты WAV)."""
+    cases = []
+    for duration in durations:
+        cases.append((f"speech-{duration:g}s", 'speech', duration, wav_bytes(speech_like(duration))))
+        cases.append((f"silence-{duration:g}s", 'silence', duration, wav_bytes(near_silence(duration))))
+    if fixtures_dir and os.path.isdir(fixtures_dir):
+        for path in sorted(glob.glob(os.path.join(fixtures_dir, '*'))):
+            if os.path.splitext(path)[1].lower() not in FIXTURE_EXTENSIONS:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            cases.append((os.path.basename(path), 'fixture', sf.info(path).duration, data))
+    return cases
+
+
+def rss_mb():
+    # ru_maxrss на Linux — в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 1) if values else 0.0
+
+
+def mean(values):
+    return round(float(np.mean(values)), 1) if values else 0.0
+
+
+def post(flask_app, name, data, form):
+    # Свой тестовый клиент на запрос: клиент Flask хранит состояние и не рассчитан на общие потоки
+    started = time.perf_counter()
+    response = flask_app.test_client().post('/transcribe', data=dict(form, audio=(io.BytesIO(data), name)),
+                                            content_type='multipart/form-data')
+    latency = time.perf_counter() - started
+    body = response.get_json(silent=True) or {}
+    debug = body.get('debug') or {}
+    queue = debug.get('queue') or {}
+    return {
+        'status': response.status_code,
+        'latency_ms': latency * 1000,
+        'decode_ms': (debug.get('input_decode') or {}).get('decode_sec', 0.0) * 1000,
+        'queue_wait_ms': queue.get('queue_wait_sec', 0.0) * 1000,
+        # Без очереди (запись без речи) распознавания не было
+        'inference_ms': queue.get('service_sec', 0.0) * 1000,
+        'chars': len(body.get('text', '')),
+    }
+
+
+def run_case(flask_app, case, form, concurrency, requests):
+    name, kind, duration, data = case
+    count = max(concurrency, requests)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        rows = list(executor.map(lambda _: post(flask_app, name, data, form), range(count)))
+    wall = time.perf_counter() - started
+    ok = [row for row in rows if row['status'] == 200]
+    latencies = [row['latency_ms'] for row in ok]
+    return {
+        'case': name,
+        'kind': kind,
+        'audio_sec': round(duration, 2),
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': count - len(ok),
+        'statuses': sorted({row['status'] for row in rows}),
+        'wall_sec': round(wall, 3),
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'mean': mean(latencies)},
+        # Время ответа одного запроса к длительности его аудио
+        'rtf': round(float(np.mean(latencies)) / 1000 / duration, 4) if latencies and duration else None,
+        # Сколько секунд обработки уходит на секунду аудио при этой конкурентности
+        'throughput_rtf': round(wall / (len(ok) * duration), 4) if ok and duration else None,
+        'decode_ms': mean([row['decode_ms'] for row in ok]),
+        'queue_wait_ms': mean([row['queue_wait_ms'] for row in ok]),
+        'inference_ms': mean([row['inference_ms'] for row in ok]),
+        'chars': mean([row['chars'] for row in ok]),
+        'peak_rss_mb': rss_mb(),
+    }
+
+
+def measure(backend, model, settings, queue):
+    """Процесс одной пары бэкенд + модель: загрузка, прогрев и все записи на всех уровнях конкурентности."""
+    try:
+        if settings['threads']:
+            import torch
+            torch.set_num_threads(settings['threads'])
+        rss_before_import = rss_mb()
+        import app as stt_app
+
+        started = time.perf_counter()
+        with stt_app.model_pool.acquire(model):
+            pass
+        load_sec = time.perf_counter() - started
+        rss_after_load = rss_mb()
+
+        form = {'model': model, 'language': settings['language']}
+        cases = build_cases(settings['durations'], settings['fixtures'])
+        # Прогрев: первые проходы модели и ленивые пулы потоков не должны попасть в замер
+        post(stt_app.app, cases[0][0], cases[0][3], form)
+        results = [run_case(stt_app.app, case, form, concurrency, settings['requests'])
+                   for concurrency in settings['concurrency'] for case in cases]
+        queue.put({
+            'backend': backend,
+            'model': model,
+            'device': stt_app.device,
+            'load_sec': round(load_sec, 2),
+            'rss_before_import_mb': rss_before_import,
+            'rss_after_load_mb': rss_after_load,
+            'peak_rss_mb': rss_mb(),
+            'results': results,
+        })
+    except BaseException as e:
+        queue.put({'backend': backend, 'model': model, 'error': f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(backend, model, settings, environment):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    # Процесс spawn читает окружение при старте: STT_BACKEND и прочее подставляются на время запуска
+    saved = {key: os.environ.get(key) for key in environment}
+    os.environ.update(environment)
+    try:
+        process = context.Process(target=measure, args=(backend, model, settings, queue))
+        process.start()
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    row = queue.get()
+    process.join()
+    return row
+
+
+def resolve_models(names):
+    if names == ['all']:
+        from app import WHISPER_MODELS
+        return list(WHISPER_MODELS)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=['tiny'], help='модели WHISPER_MODELS или all')
+    parser.add_argument('--backends', nargs='+', default=['whisper'],
+                        choices=list(ct2_backend.SUPPORTED_BACKENDS) + ['all'])
+    parser.add_argument('--durations', nargs='+', type=float, default=[5.0, 30.0],
+                        help='длительности синтетических записей, сек')
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='каталог WAV-фикстур')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--requests', type=int, default=4, help='запросов на запись и уровень конкурентности')
+    parser.add_argument('--language', default='ru')
+    parser.add_argument('--device', choices=('cpu', 'auto'), default='cpu')
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads в процессе замера')
+    parser.add_argument('--output', default=None, help='записать JSON еще и в этот файл')
+    args = parser.parse_args()
+
+    backends = list(ct2_backend.SUPPORTED_BACKENDS) if 'all' in args.backends else args.backends
+    settings = {
+        'durations': args.durations,
+        'fixtures': args.fixtures,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'language': args.language,
+        'threads': args.threads,
+    }
+    # Повторы одной записи не должны отвечаться из кеша результатов
+    environment = {'STT_RESULT_CACHE_SIZE': '0', 'STT_RESULT_CACHE_DIR': ''}
+    if args.device == 'cpu':
+        environment['CUDA_VISIBLE_DEVICES'] = ''
+
+    runs = []
+    for backend in backends:
+        for model in resolve_models(args.models):
+            run = run_isolated(backend, model, settings, dict(environment, STT_BACKEND=backend))
+            runs.append(run)
+            print(f"# {backend}/{model}: {run.get('error') or 'ok'}", file=sys.stderr, flush=True)
+
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': dict(settings, backends=backends, device=args.device),
+        'runs': runs,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пакетирование коротких клипов /transcribe между запросами.
+
+Голосовой ассистент шлет в основном клипы по 2–10 секунд, и приходят они
+одновременно. Вместо отдельного whisper.transcribe на каждый запрос клипы
+одной модели собираются в очередь: пачка уходит в работу, как только
+набралось STT_CLIP_BATCH_SIZE клипов или старейший прождал
+STT_CLIP_BATCH_WAIT_MS. Спектрограммы дополняются до 30-секундного окна,
+энкодер работает один раз на всю пачку, жадный декодер — по группам клипов
+с одинаковыми language/task (язык и задача задают стартовые токены
+декодера), и каждый вызывающий получает свой результат.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import longform
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Максимум клипов в пачке (1 — пакетирование выключено)
+CLIP_BATCH_SIZE = int(os.environ.get('STT_CLIP_BATCH_SIZE', '8'))
+# Сколько ждать попутчиков для первого клипа в очереди, мс
+CLIP_BATCH_WAIT_MS = float(os.environ.get('STT_CLIP_BATCH_WAIT_MS', '30'))
+# Клипы не длиннее этого в режиме auto идут через пакетирование, сек (не больше окна Whisper)
+CLIP_BATCH_MAX_SEC = min(float(os.environ.get('STT_CLIP_BATCH_MAX_SEC', '15')), 30.0)
+
+# Параметры, которые должны совпадать у клипов одного прохода декодера
+DECODE_KEYS = ('task', 'language', 'fp16', 'logprob_threshold', 'compression_ratio_threshold', 'no_speech_threshold')
+
+
+class _Clip:
+    def __init__(self, audio: np.ndarray, options: Dict[str, Any], mel: Optional[Any] = None):
+        self.audio = audio
+        self.options = options
+        self.mel = mel
+        self.future: Future = Future()
+        self.enqueued = time.time()
+
+
+class _ModelQueue:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.clips: List[_Clip] = []
+        self.thread: threading.Thread = None
+
+
+class ClipBatcher:
+    """Очереди коротких клипов по моделям с фоновым пакетным декодером на каждую."""
+
+    def __init__(self, acquire: Callable[[str], ContextManager[Any]], max_batch: int = CLIP_BATCH_SIZE,
+                 max_wait_ms: float = CLIP_BATCH_WAIT_MS, max_clip_sec: float = CLIP_BATCH_MAX_SEC):
+        self._acquire = acquire
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_clip_sec = max_clip_sec
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _ModelQueue] = {}
+        self.batches = 0
+        self.clips = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch > 1
+
+    def accepts(self, audio: np.ndarray) -> bool:
+        return self.enabled and len(audio) / SAMPLE_RATE <= self.max_clip_sec
+
+    def _queue(self, name: str) -> _ModelQueue:
+        with self._lock:
+            queue = self._queues.get(name)
+            if queue is None:
+                queue = self._queues[name] = _ModelQueue()
+                queue.thread = threading.Thread(target=self._run, args=(name, queue),
+                                                name=f"stt-batch-{name}", daemon=True)
+                queue.thread.start()
+            return queue
+
+    def transcribe(self, name: str, audio: np.ndarray, options: Dict[str, Any],
+                   mel: Optional[Any] = None) -> Dict[str, Any]:
+        """Ставит клип в очередь модели и ждет его результат (в формате whisper.transcribe).
+
+        mel — спектрограмма клипа, заранее посчитанная стадией признаков; без нее
+        (или при другом числе mel-полос у модели) она считается уже при модели.
+        """
+        clip = _Clip(audio, options, mel)
+        queue = self._queue(name)
+        with queue.cond:
+            queue.clips.append(clip)
+            queue.cond.notify_all()
+        return clip.future.result()
+
+    def _take_batch(self, queue: _ModelQueue) -> List[_Clip]:
+        with queue.cond:
+            while not queue.clips:
+                queue.cond.wait()
+            # Ждем попутчиков, пока пачка не полна и первый клип не прождал max_wait
+            while len(queue.clips) < self.max_batch:
+                remaining = queue.clips[0].enqueued + self.max_wait - time.time()
+                if remaining <= 0:
+                    break
+                queue.cond.wait(remaining)
+            batch = queue.clips[:self.max_batch]
+            del queue.clips[:self.max_batch]
+            return batch
+
+    def _run(self, name: str, queue: _ModelQueue):
+        while True:
+            batch = self._take_batch(queue)
+            try:
+                results = self._decode(name, batch)
+            except BaseException as e:
+                logger.error(f"Ошибка пакетного распознавания ({name}, {len(batch)} клипов): {e}")
+                for clip in batch:
+                    clip.future.set_exception(e)
+                continue
+            for clip, result in zip(batch, results):
+                clip.future.set_result(result)
+
+    def _decode(self, name: str, batch: List[_Clip]) -> List[Dict[str, Any]]:
+        groups: Dict[Tuple, List[int]] = {}
+        for index, clip in enumerate(batch):
+            key = tuple(clip.options.get(option) for option in DECODE_KEYS)
+            groups.setdefault(key, []).append(index)
+
+        decoded: List[Any] = [None] * len(batch)
+        with self._acquire(name) as model:
+            # Ожидание модели (слот очереди, пул) входит в ожидание клипов, а не в декодирование
+            started = time.time()
+            mels = [clip.mel if clip.mel is not None and clip.mel.shape[0] == model.dims.n_mels
+                    else longform.segment_mel(clip.audio, model.dims.n_mels) for clip in batch]
+            features = longform.encode_mels(model, mels, bool(batch[0].options.get('fp16', False)))
+            for indices in groups.values():
+                results = longform.decode_features(model, features[indices], batch[indices[0]].options)
+                for index, result in zip(indices, results):
+                    decoded[index] = result
+
+            tokenizers: Dict[str, Any] = {}
+            outputs = []
+            for clip, result in zip(batch, decoded):
+                segments = [] if longform.is_silence(result, clip.options) else longform.result_segments(
+                    model, result, 0.0, len(clip.audio) / SAMPLE_RATE, clip.options, tokenizers)
+                outputs.append({
+                    'text': ''.join(segment['text'] for segment in segments),
+                    'segments': [dict(segment, id=number) for number, segment in enumerate(segments)],
+                    'language': result.language or clip.options.get('language', 'unknown'),
+                    'batch': {
+                        'size': len(batch),
+                        'groups': len(groups),
+                        'queue_wait_ms': round((started - clip.enqueued) * 1000, 1),
+                    },
+                })
+
+        decode_ms = round((time.time() - started) * 1000, 1)
+        for output in outputs:
+            output['batch']['decode_ms'] = decode_ms
+        with self._lock:
+            self.batches += 1
+            self.clips += len(batch)
+        logger.info(f"Пачка клипов {name}: {len(batch)} шт., групп {len(groups)}, {decode_ms} мс")
+        return outputs
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_batch': self.max_batch,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'max_clip_sec': self.max_clip_sec,
+                'batches': self.batches,
+                'clips': self.clips,
+                'avg_batch_size': round(self.clips / self.batches, 2) if self.batches else 0.0,
+                'queued': {name: len(queue.clips) for name, queue in self._queues.items()},
+            }
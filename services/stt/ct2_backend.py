@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CTranslate2-бэкенд распознавания (faster-whisper) с int8-квантизацией.
+
+На CPU-узлах PyTorch-Whisper в fp32 для small и крупнее не успевает за
+реальным временем; CTranslate2 с int8 (int8_float16 на GPU) в разы
+быстрее при близком качестве. Модель конвертируется из весов openai/whisper-*
+на Hugging Face один раз и кешируется в WHISPER_CACHE/ct2, при повторных
+запусках загружается готовый каталог.
+
+Модель бэкенда выдает результат в формате whisper.transcribe (text,
+segments, language), поэтому /transcribe и потоковый режим работают с ней
+без изменений. Пакетные режимы longform/batched используют внутренности
+PyTorch-модели и для этого бэкенда заменяются последовательным.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# whisper | ctranslate2
+STT_BACKEND = os.environ.get('STT_BACKEND', 'whisper').strip().lower()
+# Тип вычислений CTranslate2 (пусто — int8_float16 на GPU, int8 на CPU)
+CT2_COMPUTE_TYPE = os.environ.get('STT_CT2_COMPUTE_TYPE', '').strip().lower()
+# Потоков CTranslate2 на CPU (0 — значение рантайма по умолчанию)
+CT2_CPU_THREADS = int(os.environ.get('STT_CT2_CPU_THREADS', '0'))
+
+SUPPORTED_BACKENDS = ('whisper', 'ctranslate2')
+COMPUTE_TYPES = ('int8', 'int8_float16', 'int8_float32', 'float16', 'float32')
+
+# Имена моделей сервиса -> исходные веса на Hugging Face (как у whisper.load_model)
+HF_MODEL_IDS = {
+    'tiny': 'openai/whisper-tiny',
+    'base': 'openai/whisper-base',
+    'small': 'openai/whisper-small',
+    'medium': 'openai/whisper-medium',
+    'large': 'openai/whisper-large-v3',
+    'turbo': 'openai/whisper-large-v3-turbo',
+}
+# Без них faster-whisper не знает словарь и число mel-каналов модели
+CONVERT_COPY_FILES = ['tokenizer.json', 'preprocessor_config.json']
+
+
+def default_compute_type(device: str) -> str:
+    if CT2_COMPUTE_TYPE:
+        return CT2_COMPUTE_TYPE
+    return 'int8_float16' if device == 'cuda' else 'int8'
+
+
+def convert_dir_for(cache_dir: str, name: str, compute_type: str) -> str:
+    return os.path.join(cache_dir, 'ct2', f"whisper-{name.replace('/', '__')}-{compute_type}")
+
+
+def convert_model(name: str, target_dir: str, compute_type: str):
+    """Конвертирует openai/whisper-* в формат CTranslate2 с квантизацией весов."""
+    from ctranslate2.converters import TransformersConverter
+
+    model_id = HF_MODEL_IDS.get(name, name)
+    converter = TransformersConverter(model_id, copy_files=CONVERT_COPY_FILES, load_as_float16=True)
+    converter.convert(target_dir, quantization=compute_type, force=True)
+
+
+def ensure_converted(name: str, cache_dir: str, compute_type: str,
+                     convert: Callable[[str, str, str], None] = convert_model) -> str:
+    """Каталог сконвертированной модели; конвертирует при первом обращении."""
+    target_dir = convert_dir_for(cache_dir, name, compute_type)
+    if os.path.exists(os.path.join(target_dir, 'model.bin')):
+        return target_dir
+
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    started = time.time()
+    logger.info(f"Конвертируем Whisper {name} в CTranslate2 ({compute_type}): {target_dir}")
+    # Конвертируем во временный каталог: прерванная конвертация не оставит битый кеш,
+    # а второй воркер, сконвертировавший модель параллельно, просто проиграет гонку
+    tmp_dir = tempfile.mkdtemp(prefix='.converting-', dir=os.path.dirname(target_dir))
+    try:
+        convert(name, tmp_dir, compute_type)
+        try:
+            os.rename(tmp_dir, target_dir)
+        except OSError:
+            if not os.path.exists(os.path.join(target_dir, 'model.bin')):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Конвертация {name} завершена за {time.time() - started:.1f} сек")
+    return target_dir
+
+
+def transcribe_kwargs(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметры whisper.transcribe -> параметры faster_whisper.WhisperModel.transcribe."""
+    kwargs = {
+        # whisper.transcribe без beam_size декодирует жадно — сохраняем то же поведение
+        'beam_size': 1,
+        # Участки без речи уже вырезаны VAD сервиса
+        'vad_filter': False,
+    }
+    for key in ('task', 'language', 'temperature', 'condition_on_previous_text', 'no_speech_threshold',
+                'compression_ratio_threshold', 'word_timestamps', 'initial_prompt'):
+        if key in options:
+            kwargs[key] = options[key]
+    if 'logprob_threshold' in options:
+        kwargs['log_prob_threshold'] = options['logprob_threshold']
+    return kwargs
+
+
+def to_whisper_result(segments: Iterable[Any], language: Optional[str]) -> Dict[str, Any]:
+    """Сегменты faster-whisper -> словарь в формате whisper.transcribe."""
+    result_segments = []
+    for number, segment in enumerate(segments):
+        item = {
+            'id': number,
+            'seek': getattr(segment, 'seek', 0),
+            'start': float(segment.start),
+            'end': float(segment.end),
+            'text': segment.text,
+            'tokens': list(segment.tokens),
+            'temperature': segment.temperature,
+            'avg_logprob': segment.avg_logprob,
+            'compression_ratio': segment.compression_ratio,
+            'no_speech_prob': segment.no_speech_prob,
+        }
+        if segment.words is not None:
+            item['words'] = [
+                {'word': word.word, 'start': float(word.start), 'end': float(word.end),
+                 'probability': word.probability}
+                for word in segment.words
+            ]
+        result_segments.append(item)
+    return {
+        'text': ''.join(segment['text'] for segment in result_segments),
+        'segments': result_segments,
+        'language': language,
+    }
+
+
+class CT2Whisper:
+    """Модель faster-whisper с интерфейсом transcribe() как у whisper.Whisper."""
+
+    def __init__(self, model_dir: str, device: str, compute_type: str, cpu_threads: int = CT2_CPU_THREADS):
+        from faster_whisper import WhisperModel
+
+        self.model_dir = model_dir
+        self.compute_type = compute_type
+        self.model = WhisperModel(model_dir, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Оценка памяти модели по размеру весов на диске (для бюджета пула)."""
+        return os.path.getsize(os.path.join(self.model_dir, 'model.bin'))
+
+    def transcribe(self, audio, **options) -> Dict[str, Any]:
+        segments, info = self.model.transcribe(audio, **transcribe_kwargs(options))
+        # segments — ленивый генератор: декодирование идет во время обхода
+        return to_whisper_result(segments, info.language)
+
+
+def load_model(name: str, device: str, cache_dir: str, compute_type: Optional[str] = None) -> CT2Whisper:
+    compute_type = compute_type or default_compute_type(device)
+    if compute_type not in COMPUTE_TYPES:
+        raise ValueError(f"STT_CT2_COMPUTE_TYPE должен быть одним из {COMPUTE_TYPES}, получено: {compute_type}")
+    model_dir = ensure_converted(name, cache_dir, compute_type)
+    return CT2Whisper(model_dir, device, compute_type)
+
+
+def backend_info(device: str) -> Dict[str, Any]:
+    info = {'name': STT_BACKEND}
+    if STT_BACKEND == 'ctranslate2':
+        info.update(compute_type=default_compute_type(device), cpu_threads=CT2_CPU_THREADS)
+    return info
@@ -0,0 +1,34 @@
+"""
+Конфигурация gunicorn для STT.
+
+STT_WORKERS        — количество процессов-воркеров (по умолчанию 1: у каждого
+                     процесса свой пул моделей, память под модели умножается)
+STT_WORKER_THREADS — потоков gthread на воркер (по умолчанию 16); потоки
+                     принимают загрузки и держат SSE-сессии, распознавание
+                     ограничено очередью моделей (STT_INFERENCE_SLOTS,
+                     STT_MAX_QUEUED), декодирование аудио — STT_DECODE_WORKERS,
+                     log-mel спектрограммы — STT_FEATURE_WORKERS
+STT_DEFAULT_MODEL  — модель для запросов без параметра model (по умолчанию
+                     base); одна на все воркеры, POST /model/load ее не меняет
+"""
+
+import os
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8004')}"
+workers = int(os.environ.get("STT_WORKERS", "1"))
+# gthread-воркер не убивается по таймауту во время долгого распознавания и SSE
+worker_class = "gthread"
+threads = int(os.environ.get("STT_WORKER_THREADS", "16"))
+timeout = 120
+graceful_timeout = 60
+
+
+def post_worker_init(worker):
+    # Модель по умолчанию грузится в фоне: долгая загрузка не должна задерживать
+    # heartbeat воркера, а ранние запросы дождутся той же загрузки в пуле
+    from app import preload_default_model, start_job_runner
+
+    threading.Thread(target=preload_default_model, name="stt-preload", daemon=True).start()
+    # Задания /jobs: обработчик запустится в воркере, захватившем блокировку базы
+    start_job_runner()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ограниченная очередь распознавания на каждую модель.
+
+Запрос, дошедший до декодирования (не попавший в кеш результатов), сначала
+проходит допуск admit(): если у модели уже занято STT_INFERENCE_SLOTS слотов
+и ждут STT_MAX_QUEUED запросов, он сразу получает QueueFull с оценкой, через
+сколько секунд стоит повторить (503 + Retry-After), вместо того чтобы висеть
+в очереди до таймаута клиента. Допущенный запрос ждет свободный слот slot()
+в порядке прихода; время ожидания и время обслуживания считаются отдельно.
+
+Слот достается в порядке приоритета, внутри приоритета — в порядке прихода.
+Короткие интерактивные клипы (голосовые команды) идут раньше длинных файлов:
+длинная запись распознается пачками сегментов и перед каждой пачкой заново
+встает в очередь, так что ждущий клип получает модель на ближайшей границе
+сегментов, а не после всего файла.
+
+Пакетный декодер коротких клипов занимает один слот на всю пачку. Пул
+моделей выдает модель монопольно, поэтому по умолчанию слот один: при
+нескольких слотах лишние запросы ждут уже внутри пула, и это ожидание
+попадает во время обслуживания.
+"""
+
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Одновременно обслуживаемых запросов на модель
+INFERENCE_SLOTS = int(os.environ.get('STT_INFERENCE_SLOTS', '1'))
+# Сколько запросов может ждать слот модели, остальные получают 503
+MAX_QUEUED = int(os.environ.get('STT_MAX_QUEUED', '16'))
+# Записи не длиннее этого (после VAD) считаются интерактивными, сек
+INTERACTIVE_MAX_SEC = float(os.environ.get('STT_INTERACTIVE_MAX_SEC', '30'))
+# Сегментов longform между точками, где длинная запись уступает слот
+PREEMPT_SEGMENTS = int(os.environ.get('STT_PREEMPT_SEGMENTS', '2'))
+# Вес нового замера в скользящем среднем времени обслуживания
+SERVICE_EWMA_ALPHA = 0.2
+
+
+# Приоритеты слотов: меньше — раньше
+INTERACTIVE = 0
+BATCH = 1
+PRIORITIES = {'interactive': INTERACTIVE, 'batch': BATCH}
+
+
+def classify(duration_sec: float, requested: str = 'auto') -> str:
+    """Класс запроса: явный priority или по длительности распознаваемого аудио."""
+    if requested in PRIORITIES:
+        return requested
+    return 'interactive' if duration_sec <= INTERACTIVE_MAX_SEC else 'batch'
+
+
+class QueueFull(Exception):
+    """Очередь модели заполнена; retry_after — рекомендуемая пауза перед повтором, сек."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Очередь распознавания модели {name} заполнена, повторите через {retry_after} сек")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Замеры одного запроса: ожидание слота и обслуживание."""
+
+    def __init__(self, priority: str = 'interactive'):
+        self.priority = priority
+        self.queue_wait_sec = 0.0
+        self.service_sec = 0.0
+        self.holds = 0  # сколько раз запрос получал слот (у длинных записей — по пачке сегментов)
+
+    def debug(self) -> Dict[str, Any]:
+        return {'priority': self.priority, 'queue_wait_sec': round(self.queue_wait_sec, 3),
+                'service_sec': round(self.service_sec, 3), 'slot_holds': self.holds}
+
+
+class _Lane:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.running = 0
+        self.waiting: list = []  # куча (приоритет, номер прихода, ожидающий)
+        self.admitted = 0  # допущенные и еще не завершенные запросы
+        self.avg_service_sec: Optional[float] = None
+        self.served = 0
+        self.rejected = 0
+        self.wait_total_sec = 0.0
+        self.service_total_sec = 0.0
+
+
+class InferenceQueue:
+    """Допуск запросов и слоты обслуживания по моделям."""
+
+    def __init__(self, slots: int = INFERENCE_SLOTS, max_queued: int = MAX_QUEUED):
+        self.slots = max(1, slots)
+        self.max_queued = max(0, max_queued)
+        self._lock = threading.Lock()
+        self._lanes: Dict[str, _Lane] = {}
+        self._arrivals = itertools.count()
+
+    def _lane(self, name: str) -> _Lane:
+        with self._lock:
+            lane = self._lanes.get(name)
+            if lane is None:
+                lane = self._lanes[name] = _Lane()
+            return lane
+
+    def _retry_after(self, lane: _Lane) -> int:
+        # Сколько займет разбор допущенных запросов при текущей скорости обслуживания
+        service = lane.avg_service_sec if lane.avg_service_sec is not None else 1.0
+        return max(1, int(math.ceil(service * lane.admitted / self.slots)))
+
+    @contextmanager
+    def admit(self, name: str, priority: str = 'interactive'):
+        """Допуск запроса к модели; QueueFull, если ожидающих уже max_queued."""
+        lane = self._lane(name)
+        with lane.cond:
+            if lane.admitted >= self.slots + self.max_queued:
+                lane.rejected += 1
+                raise QueueFull(name, self._retry_after(lane))
+            lane.admitted += 1
+        try:
+            yield Ticket(priority)
+        finally:
+            with lane.cond:
+                lane.admitted -= 1
+
+    @contextmanager
+    def slot(self, name: str, ticket: Optional[Ticket] = None):
+        """Ждет свободный слот модели (по приоритету билета, затем по приходу) и держит его до выхода из блока."""
+        ticket = ticket or Ticket()
+        lane = self._lane(name)
+        waiter = object()
+        requested = time.time()
+        with lane.cond:
+            heapq.heappush(lane.waiting, (PRIORITIES.get(ticket.priority, BATCH), next(self._arrivals), waiter))
+            while lane.running >= self.slots or lane.waiting[0][2] is not waiter:
+                lane.cond.wait()
+            heapq.heappop(lane.waiting)
+            lane.running += 1
+            lane.cond.notify_all()
+        started = time.time()
+        ticket.queue_wait_sec += started - requested
+        ticket.holds += 1
+        try:
+            yield ticket
+        finally:
+            service = time.time() - started
+            ticket.service_sec += service
+            with lane.cond:
+                lane.running -= 1
+                lane.served += 1
+                lane.wait_total_sec += started - requested
+                lane.service_total_sec += service
+                lane.avg_service_sec = service if lane.avg_service_sec is None else (
+                    SERVICE_EWMA_ALPHA * service + (1 - SERVICE_EWMA_ALPHA) * lane.avg_service_sec)
+                lane.cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lanes = dict(self._lanes)
+        models = {}
+        for name, lane in lanes.items():
+            with lane.cond:
+                models[name] = {
+                    'running': lane.running,
+                    'waiting': len(lane.waiting),
+                    'waiting_interactive': sum(1 for priority, _, _ in lane.waiting if priority == INTERACTIVE),
+                    'admitted': lane.admitted,
+                    'served': lane.served,
+                    'rejected': lane.rejected,
+                    'avg_queue_wait_sec': round(lane.wait_total_sec / lane.served, 3) if lane.served else 0.0,
+                    'avg_service_sec': round(lane.service_total_sec / lane.served, 3) if lane.served else 0.0,
+                }
+        return {'slots': self.slots, 'max_queued': self.max_queued, 'models': models}
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Асинхронные задания на распознавание архивов записей.
+
+Задание — список файлов: загруженных в POST /jobs (сохраняются в
+STT_JOBS_UPLOAD_DIR) или найденных в каталоге общего тома из STT_JOBS_DIRS.
+Фоновый поток распознает файлы по очереди, каждый — пачками сегментов
+longform по STT_JOB_BATCH_SEGMENTS; модель берется из общего пула через
+очередь с пакетным приоритетом, так что интерактивные запросы получают ее
+между пачками. Каждая пачка сегментов фиксируется в sqlite отдельной
+транзакцией: после перезапуска файл заново декодируется, а распознавание
+продолжается с первого несохраненного сегмента. Результат файла готов,
+как только распознан его последний сегмент.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import audio_input
+import longform
+import vad
+from inference_queue import PREEMPT_SEGMENTS
+
+logger = logging.getLogger(__name__)
+
+STT_JOBS_DB = os.environ.get('STT_JOBS_DB', '/app/models/stt_jobs.sqlite3')
+# Каталог для файлов, загруженных в задания (удаляются вместе с заданием)
+STT_JOBS_UPLOAD_DIR = os.environ.get('STT_JOBS_UPLOAD_DIR', '/app/models/stt_job_uploads')
+# Каталоги общих томов, которые можно указать в задании (через ':'); пусто — только загрузки
+STT_JOBS_DIRS = [path for path in os.environ.get('STT_JOBS_DIRS', '').split(os.pathsep) if path.strip()]
+# Сегментов longform в одной фиксируемой пачке
+JOB_BATCH_SEGMENTS = int(os.environ.get('STT_JOB_BATCH_SEGMENTS', str(PREEMPT_SEGMENTS)))
+POLL_INTERVAL_SEC = 0.5
+SAMPLE_RATE = 16000
+
+# Расширения, которые берутся из каталога, если шаблон имен не указан
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg', '.oga', '.opus', '.mp3', '.m4a', '.aac', '.webm', '.wma', '.mp4')
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+FINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    model TEXT NOT NULL,
+    options TEXT NOT NULL,
+    vad TEXT NOT NULL,
+    upload_dir TEXT,
+    total_files INTEGER NOT NULL DEFAULT 0,
+    completed_files INTEGER NOT NULL DEFAULT 0,
+    failed_files INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration_sec REAL,
+    segments_total INTEGER,
+    segments_done INTEGER NOT NULL DEFAULT 0,
+    language TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_segments (
+    job_id TEXT NOT NULL,
+    file_idx INTEGER NOT NULL,
+    batch_idx INTEGER NOT NULL,
+    first_segment INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    languages TEXT NOT NULL,
+    segments TEXT NOT NULL,
+    PRIMARY KEY (job_id, file_idx, batch_idx)
+);
+"""
+
+
+def resolve_directory(directory: str, roots: Sequence[str] = STT_JOBS_DIRS) -> str:
+    """Реальный путь каталога задания; ValueError, если он вне разрешенных STT_JOBS_DIRS."""
+    if not roots:
+        raise ValueError("Задания по каталогу отключены: задайте STT_JOBS_DIRS")
+    path = os.path.realpath(directory)
+    for root in roots:
+        root = os.path.realpath(root)
+        if os.path.commonpath([path, root]) == root:
+            if not os.path.isdir(path):
+                raise ValueError(f"Каталог не найден: {directory}")
+            return path
+    raise ValueError(f"Каталог {directory} вне разрешенных STT_JOBS_DIRS")
+
+
+def list_directory(path: str, pattern: Optional[str] = None, recursive: bool = False) -> List[Tuple[str, str]]:
+    """Файлы каталога по шаблону имени (по умолчанию — аудио-расширения): [(относительное имя, путь)]."""
+    found = []
+    for current, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if pattern and not fnmatch.fnmatch(name, pattern):
+                continue
+            if not pattern and not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            full_path = os.path.join(current, name)
+            found.append((os.path.relpath(full_path, path), full_path))
+        if not recursive:
+            break
+    return found
+
+
+def majority_language(languages: Iterable[str], default: str = 'unknown') -> str:
+    counts = Counter(languages)
+    return counts.most_common(1)[0][0] if counts else default
+
+
+class JobStore:
+    """Хранилище заданий в sqlite. Каждая операция открывает свое соединение."""
+
+    def __init__(self, path: str = STT_JOBS_DB, upload_dir: str = STT_JOBS_UPLOAD_DIR):
+        self.path = path
+        self.upload_dir = upload_dir
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение на одну транзакцию: commit/rollback и закрытие по выходу."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def new_upload_dir(self) -> str:
+        """Отдельный каталог под загрузки одного задания."""
+        path = os.path.join(self.upload_dir, uuid.uuid4().hex)
+        os.makedirs(path)
+        return path
+
+    def create_job(self, files: Iterable[Tuple[str, str]], model: str, options: Dict[str, Any], vad_backend: str,
+                   upload_dir: Optional[str] = None) -> Dict[str, Any]:
+        """Создает задание на файлы [(имя, путь)]; upload_dir удаляется вместе с заданием."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        rows = [(job_id, idx, name, path, STATUS_QUEUED) for idx, (name, path) in enumerate(files)]
+        status = STATUS_QUEUED if rows else STATUS_COMPLETED
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, model, options, vad, upload_dir, total_files, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, status, model, json.dumps(options), vad_backend, upload_dir, len(rows), now, now),
+            )
+            conn.executemany("INSERT INTO job_files (job_id, idx, name, path, status) VALUES (?, ?, ?, ?, ?)", rows)
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            running = conn.execute(
+                "SELECT segments_done, segments_total FROM job_files WHERE job_id = ? AND status = ?",
+                (job_id, STATUS_RUNNING),
+            ).fetchall()
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        # Готовые файлы целиком плюс доля распознанных сегментов текущего
+        done = job['completed_files'] + job['failed_files'] + sum(
+            file['segments_done'] / file['segments_total'] for file in running if file['segments_total'])
+        job['progress'] = round(done / job['total_files'], 4) if job['total_files'] else 1.0
+        return job
+
+    def list_files(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, name, status, duration_sec, segments_total, segments_done, language, error "
+                "FROM job_files WHERE job_id = ? ORDER BY idx", (job_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_job(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT upload_dir FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM job_segments WHERE job_id = ?", (job_id,))
+        if row is None:
+            return False
+        if row['upload_dir']:
+            shutil.rmtree(row['upload_dir'], ignore_errors=True)
+        return True
+
+    def next_pending_job(self) -> Optional[Dict[str, Any]]:
+        """Возвращает незавершенное задание: сначала прерванные (running), затем по очереди."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY status = ? DESC, created_at LIMIT 1",
+                (STATUS_QUEUED, STATUS_RUNNING, STATUS_RUNNING),
+            ).fetchone()
+        return self.get_job(row['id']) if row else None
+
+    def next_file(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Первый нераспознанный файл задания (начатый продолжается с сохраненного сегмента)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM job_files WHERE job_id = ? AND status IN (?, ?) ORDER BY idx LIMIT 1",
+                (job_id, STATUS_QUEUED, STATUS_RUNNING),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def mark_running(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                         (STATUS_RUNNING, time.time(), job_id, STATUS_QUEUED))
+
+    def start_file(self, job_id: str, idx: int, segments_total: int, duration_sec: float):
+        """Фиксирует план файла. Если план изменился (файл подменили), начатое распознавание сбрасывается."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT segments_total FROM job_files WHERE job_id = ? AND idx = ?",
+                               (job_id, idx)).fetchone()
+            if row is not None and row['segments_total'] not in (None, segments_total):
+                logger.warning(f"Задание {job_id}: файл {idx} изменился, распознавание начинается заново")
+                conn.execute("DELETE FROM job_segments WHERE job_id = ? AND file_idx = ?", (job_id, idx))
+                conn.execute("UPDATE job_files SET segments_done = 0 WHERE job_id = ? AND idx = ?", (job_id, idx))
+            conn.execute(
+                "UPDATE job_files SET status = ?, segments_total = ?, duration_sec = ? WHERE job_id = ? AND idx = ?",
+                (STATUS_RUNNING, segments_total, round(duration_sec, 3), job_id, idx),
+            )
+
+    def save_segments(self, job: Dict[str, Any], idx: int, first_segment: int, count: int,
+                      segments: List[Dict[str, Any]], languages: List[str]) -> bool:
+        """Атомарно сохраняет пачку сегментов файла; на последней пачке файл считается готовым.
+
+        Возвращает True, если файл распознан полностью.
+        """
+        with self._connect() as conn:
+            file = conn.execute("SELECT segments_total, segments_done FROM job_files WHERE job_id = ? AND idx = ?",
+                                (job['id'], idx)).fetchone()
+            if file is None or file['segments_done'] != first_segment:
+                # Задание удалено или пачка уже сохранена
+                return False
+            batch_idx = conn.execute("SELECT COUNT(*) FROM job_segments WHERE job_id = ? AND file_idx = ?",
+                                     (job['id'], idx)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO job_segments (job_id, file_idx, batch_idx, first_segment, count, languages, segments) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job['id'], idx, batch_idx, first_segment, count, json.dumps(languages),
+                 json.dumps(segments, ensure_ascii=False)),
+            )
+            done = first_segment + count
+            conn.execute("UPDATE job_files SET segments_done = ? WHERE job_id = ? AND idx = ?", (done, job['id'], idx))
+            finished = done >= file['segments_total']
+            if finished:
+                stored = conn.execute("SELECT languages FROM job_segments WHERE job_id = ? AND file_idx = ?",
+                                      (job['id'], idx)).fetchall()
+                language = majority_language(
+                    (language for row in stored for language in json.loads(row['languages'])),
+                    job['options'].get('language', 'unknown'))
+                conn.execute("UPDATE job_files SET status = ?, language = ? WHERE job_id = ? AND idx = ?",
+                             (STATUS_COMPLETED, language, job['id'], idx))
+                self._file_finished(conn, job['id'], 'completed_files')
+            else:
+                conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job['id']))
+        return finished
+
+    def fail_file(self, job_id: str, idx: int, error: str):
+        """Ошибка одного файла не останавливает задание: остальные файлы распознаются."""
+        with self._connect() as conn:
+            updated = conn.execute("UPDATE job_files SET status = ?, error = ? WHERE job_id = ? AND idx = ? "
+                                   "AND status IN (?, ?)",
+                                   (STATUS_FAILED, error, job_id, idx, STATUS_QUEUED, STATUS_RUNNING)).rowcount
+            if updated:
+                self._file_finished(conn, job_id, 'failed_files')
+
+    @staticmethod
+    def _file_finished(conn: sqlite3.Connection, job_id: str, counter: str):
+        conn.execute(f"UPDATE jobs SET {counter} = {counter} + 1, updated_at = ? WHERE id = ?", (time.time(), job_id))
+        conn.execute("UPDATE jobs SET status = ? WHERE id = ? AND completed_files + failed_files >= total_files",
+                     (STATUS_COMPLETED, job_id))
+
+    def get_file_result(self, job_id: str, idx: int) -> Optional[Dict[str, Any]]:
+        """Результат файла (текст и сегменты собираются из сохраненных пачек) или None, если файла нет."""
+        with self._connect() as conn:
+            file = conn.execute("SELECT * FROM job_files WHERE job_id = ? AND idx = ?", (job_id, idx)).fetchone()
+            if file is None:
+                return None
+            batches = conn.execute(
+                "SELECT segments FROM job_segments WHERE job_id = ? AND file_idx = ? ORDER BY batch_idx",
+                (job_id, idx),
+            ).fetchall() if file['status'] == STATUS_COMPLETED else []
+        segments = [segment for batch in batches for segment in json.loads(batch['segments'])]
+        result = {
+            'index': file['idx'],
+            'file': file['name'],
+            'status': file['status'],
+            'duration_sec': file['duration_sec'],
+        }
+        if file['status'] == STATUS_FAILED:
+            result['error'] = file['error']
+        elif file['status'] == STATUS_COMPLETED:
+            result.update(language=file['language'], text=''.join(segment['text'] for segment in segments).strip(),
+                          segments=[dict(segment, text=segment['text'].strip()) for segment in segments])
+        return result
+
+    def iter_results(self, job_id: str, poll_interval: float = POLL_INTERVAL_SEC) -> Iterator[Dict[str, Any]]:
+        """Отдает результаты файлов по порядку, дожидаясь следующих, пока задание не завершится."""
+        idx = 0
+        while True:
+            result = self.get_file_result(job_id, idx)
+            if result is None:
+                return
+            if result['status'] in FINAL_STATUSES:
+                yield result
+                idx += 1
+                continue
+            if self.get_job(job_id) is None:
+                return
+            time.sleep(poll_interval)
+
+
+class FilePlan:
+    """Декодированный файл задания: склеенная речь и ее нарезка на сегменты longform."""
+
+    def __init__(self, audio: np.ndarray, spans: List[longform.Span], duration_sec: float,
+                 speech_map: Optional[vad.SpeechMap] = None):
+        self.audio = audio
+        self.spans = spans
+        self.duration_sec = duration_sec
+        self.speech_map = speech_map
+        self.tokenizers: Dict[str, Any] = {}
+
+
+def plan_file(path: str, vad_backend: str = vad.VAD_BACKEND) -> FilePlan:
+    """Декодирует файл и режет речь на сегменты; нарезка детерминирована, поэтому совпадает после перезапуска."""
+    with open(path, 'rb') as f:
+        decoded = audio_input.decode_upload(f, SAMPLE_RATE)
+    speech_map = vad.detect_speech(decoded.audio, SAMPLE_RATE, vad_backend)
+    if speech_map is None:
+        return FilePlan(decoded.audio, longform.plan_segments(decoded.audio), decoded.duration_sec)
+    if not speech_map.regions:
+        return FilePlan(decoded.audio[:0], [], decoded.duration_sec, speech_map)
+    audio = speech_map.compact(decoded.audio)
+    return FilePlan(audio, longform.plan_segments(audio, speech_map.cut_points()), decoded.duration_sec, speech_map)
+
+
+def transcribe_spans(model: Any, plan: FilePlan, spans: Sequence[longform.Span],
+                     options: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Распознает пачку сегментов файла; времена — по исходной записи."""
+    if hasattr(model, 'dims'):
+        segments, languages = longform.decode_spans(model, plan.audio, spans, options, plan.tokenizers)
+    else:
+        # Модель без PyTorch-декодера (бэкенд ctranslate2): сегменты по одному
+        segments, languages = [], []
+        for start, end in spans:
+            result = model.transcribe(plan.audio[start:end], **options)
+            if not result.get('segments'):
+                continue
+            languages.append(result.get('language') or options.get('language') or 'en')
+            segments.extend({'start': round(start / SAMPLE_RATE + segment['start'], 3),
+                             'end': round(start / SAMPLE_RATE + segment['end'], 3),
+                             'text': segment['text']} for segment in result['segments'])
+    segments = [{'start': segment['start'], 'end': segment['end'], 'text': segment['text']} for segment in segments]
+    if plan.speech_map is not None:
+        plan.speech_map.remap_result({'segments': segments})
+    return segments, languages
+
+
+class JobRunner:
+    """Фоновый поток, последовательно распознающий файлы заданий из JobStore."""
+
+    def __init__(self, store: JobStore, acquire: Callable[[str], ContextManager[Any]],
+                 batch_segments: int = JOB_BATCH_SEGMENTS, poll_interval: float = POLL_INTERVAL_SEC):
+        self.store = store
+        self.acquire = acquire
+        self.batch_segments = max(1, batch_segments)
+        self.poll_interval = poll_interval
+        self._plan: Optional[Tuple[str, int, FilePlan]] = None  # декодированный текущий файл
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stt-jobs', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        """Будит поток сразу после создания нового задания."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.process_next_batch()
+            except Exception as e:
+                logger.error(f"Ошибка обработчика заданий: {str(e)}")
+                processed = False
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _file_plan(self, job: Dict[str, Any], file: Dict[str, Any]) -> FilePlan:
+        if self._plan is not None and self._plan[:2] == (job['id'], file['idx']):
+            return self._plan[2]
+        self._plan = None
+        plan = plan_file(file['path'], job['vad'])
+        self.store.start_file(job['id'], file['idx'], len(plan.spans), plan.duration_sec)
+        self._plan = (job['id'], file['idx'], plan)
+        return plan
+
+    def process_next_batch(self) -> bool:
+        """Распознает одну пачку сегментов ближайшего файла. Возвращает False, если работы нет."""
+        job = self.store.next_pending_job()
+        if job is None:
+            return False
+        self.store.mark_running(job['id'])
+        file = self.store.next_file(job['id'])
+        if file is None:
+            return False
+        try:
+            plan = self._file_plan(job, file)
+            file = self.store.next_file(job['id'])  # прогресс мог сброситься при смене плана
+            first = file['segments_done']
+            spans = plan.spans[first:first + self.batch_segments]
+            if spans:
+                with self.acquire(job['model']) as model:
+                    segments, languages = transcribe_spans(model, plan, spans, job['options'])
+            else:
+                segments, languages = [], []
+        except Exception as e:
+            logger.error(f"Задание {job['id']}: файл {file['name']} завершился ошибкой: {str(e)}")
+            self._plan = None
+            self.store.fail_file(job['id'], file['idx'], str(e))
+            return True
+        if self.store.save_segments(job, file['idx'], first, len(spans), segments, languages):
+            self._plan = None
+            logger.info(f"Задание {job['id']}: файл {file['name']} распознан")
+        return True
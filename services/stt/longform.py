@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Длинные записи: нарезка на сегменты и пакетное декодирование Whisper.
+
+whisper.transcribe идет по файлу окнами по 30 секунд строго по очереди:
+каждое следующее окно начинается там, где закончился текст предыдущего.
+Здесь запись заранее режется на сегменты не длиннее 30 секунд по паузам
+(границы речевых участков VAD, а без них — самые тихие кадры перед
+пределом окна). Log-mel спектрограммы считаются заранее в пуле потоков
+или общей стадии признаков (pipeline), а сегменты декодируются пачками:
+один проход энкодера и жадный декодер на всю пачку. Результаты
+склеиваются по времени.
+
+Сегменты независимы (condition_on_previous_text и так выключен в сервисе),
+поэтому порядок декодирования на результат не влияет.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import whisper
+from whisper.audio import HOP_LENGTH, N_FFT, N_FRAMES, N_SAMPLES, SAMPLE_RATE, mel_filters
+from whisper.tokenizer import get_tokenizer
+
+import vad
+
+logger = logging.getLogger(__name__)
+
+# Записи длиннее этого в режиме auto идут через пакетное декодирование
+LONGFORM_MIN_SEC = float(os.environ.get('STT_LONGFORM_MIN_SEC', '60'))
+# Сегментов в одном проходе декодера
+LONGFORM_BATCH_SIZE = int(os.environ.get('STT_LONGFORM_BATCH_SIZE', '8'))
+# Потоков для расчета log-mel спектрограмм
+MEL_WORKERS = int(os.environ.get('STT_MEL_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Где искать самую тихую точку, если до предела окна нет паузы
+QUIET_SEARCH_SEC = 5.0
+# Повторные попытки с температурой для сегментов, не прошедших проверки (как в whisper.transcribe)
+FALLBACK_TEMPERATURES = (0.2, 0.4, 0.6, 0.8, 1.0)
+
+TIME_PRECISION = 0.02
+
+# Имена моделей с 128 mel-полосами ('large' в openai-whisper — это large-v3)
+LARGE_V3_MODELS = ('large', 'large-v3', 'turbo', 'large-v3-turbo')
+LARGE_V3_N_MELS = 128
+DEFAULT_N_MELS = 80
+
+Span = Tuple[int, int]
+
+
+def plan_segments(audio: np.ndarray, cut_points: Optional[Sequence[int]] = None,
+                  max_samples: int = N_SAMPLES, sample_rate: int = SAMPLE_RATE) -> List[Span]:
+    """Режет запись на отрезки не длиннее max_samples.
+
+    Предпочтительные места разреза — cut_points (паузы между речевыми
+    участками); если в пределах окна их нет, разрез идет по самому тихому
+    кадру в последних QUIET_SEARCH_SEC секундах окна.
+    """
+    total = len(audio)
+    points = sorted(int(point) for point in (cut_points or []) if 0 < point < total)
+    frame = int(sample_rate * vad.FRAME_MS / 1000)
+    spans: List[Span] = []
+    start = 0
+    while total - start > max_samples:
+        limit = start + max_samples
+        inside = [point for point in points if start < point <= limit]
+        if inside:
+            cut = inside[-1]
+        else:
+            search_from = max(start + frame, limit - int(QUIET_SEARCH_SEC * sample_rate))
+            energy = vad.frame_energy_db(audio[search_from:limit], frame)
+            cut = search_from + int(np.argmin(energy)) * frame + frame // 2
+            cut = min(cut, limit)
+        spans.append((start, cut))
+        start = cut
+    if total > start:
+        spans.append((start, total))
+    return spans
+
+
+def segment_mel(audio: np.ndarray, n_mels: int) -> torch.Tensor:
+    """Log-mel 30-секундного окна (короткий сегмент дополняется тишиной)."""
+    mel = whisper.log_mel_spectrogram(torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)),
+                                      n_mels, padding=N_SAMPLES)
+    return whisper.pad_or_trim(mel, N_FRAMES)
+
+
+def batch_mels(audios: Sequence[np.ndarray], n_mels: int) -> List[torch.Tensor]:
+    """Log-mel 30-секундных окон сразу для нескольких отрезков (не длиннее окна) одним STFT.
+
+    Совпадает с segment_mel для каждого отрезка: хвост дополняется тишиной, а
+    нормировка по максимуму считается по каждому окну отдельно.
+    """
+    if not audios:
+        return []
+    # Окно и еще N_FFT тишины: кадры за пределами окна содержат только нули, как в segment_mel
+    batch = torch.zeros(len(audios), N_SAMPLES + N_FFT)
+    for row, audio in enumerate(audios):
+        audio = np.ascontiguousarray(audio[:N_SAMPLES], dtype=np.float32)
+        batch[row, :len(audio)] = torch.from_numpy(audio)
+    stft = torch.stft(batch, N_FFT, HOP_LENGTH, window=torch.hann_window(N_FFT), return_complex=True)
+    mel_spec = mel_filters(batch.device, n_mels) @ (stft[..., :-1].abs() ** 2)
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(1, 2), keepdim=True) - 8.0)
+    return list(((log_spec + 4.0) / 4.0)[..., :N_FRAMES])
+
+
+def model_n_mels(name: str) -> int:
+    """Число mel-полос модели по имени (до загрузки весов): у large-v3 и turbo их 128."""
+    return LARGE_V3_N_MELS if name in LARGE_V3_MODELS else DEFAULT_N_MELS
+
+
+def parse_timestamped(tokenizer: Any, tokens: Sequence[int], duration: float) -> List[Tuple[float, float, str]]:
+    """Разбивает токены с метками времени на (начало, конец, текст) внутри сегмента."""
+    parts: List[Tuple[float, float, str]] = []
+    text_tokens: List[int] = []
+    start: Optional[float] = None
+    for token in tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        moment = min((token - tokenizer.timestamp_begin) * TIME_PRECISION, duration)
+        if text_tokens:
+            parts.append((start if start is not None else 0.0, moment, tokenizer.decode(text_tokens)))
+            text_tokens = []
+            start = None
+        else:
+            start = moment
+    if text_tokens:
+        parts.append((start if start is not None else 0.0, duration, tokenizer.decode(text_tokens)))
+    return [(begin, max(begin, end), text) for begin, end, text in parts if text.strip()]
+
+
+# Пороги и их значения по умолчанию — те же, что у whisper.transcribe
+def _low_logprob(result: Any, options: Dict[str, Any]) -> bool:
+    threshold = options.get('logprob_threshold', -1.0)
+    return threshold is not None and result.avg_logprob < threshold
+
+
+def _needs_fallback(result: Any, options: Dict[str, Any]) -> bool:
+    threshold = options.get('compression_ratio_threshold', 2.4)
+    if threshold is not None and result.compression_ratio > threshold:
+        return True
+    return _low_logprob(result, options) and not is_silence(result, options)
+
+
+def is_silence(result: Any, options: Dict[str, Any]) -> bool:
+    threshold = options.get('no_speech_threshold', 0.6)
+    return threshold is not None and result.no_speech_prob > threshold and _low_logprob(result, options)
+
+
+def decoding_options(options: Dict[str, Any]) -> Any:
+    """DecodingOptions жадного декодирования с метками времени по параметрам сервиса."""
+    return whisper.DecodingOptions(
+        task=options.get('task', 'transcribe'),
+        language=options.get('language'),
+        temperature=0.0,
+        fp16=bool(options.get('fp16', False)),
+        without_timestamps=False,
+    )
+
+
+def encode_mels(model: Any, mels: List[torch.Tensor], fp16: bool = False) -> torch.Tensor:
+    """Один проход энкодера на всю пачку спектрограмм."""
+    batch = torch.stack(mels).to(model.device)
+    with torch.no_grad():
+        return model.embed_audio(batch.half() if fp16 else batch)
+
+
+def decode_features(model: Any, features: torch.Tensor, options: Dict[str, Any]) -> List[Any]:
+    """Жадное декодирование пачки (спектрограммы или выход энкодера); не прошедшие проверки — повтор с температурой по одному."""
+    results = whisper.decode(model, features, decoding_options(options))
+    return [with_fallback(model, features[index], result, options) for index, result in enumerate(results)]
+
+
+def with_fallback(model: Any, features: torch.Tensor, result: Any, options: Dict[str, Any]) -> Any:
+    """Результат жадного декодирования одного окна или повтор с температурой, если он не прошел проверки."""
+    if not _needs_fallback(result, options):
+        return result
+    decode_options = decoding_options(options)
+    for temperature in FALLBACK_TEMPERATURES:
+        result = whisper.decode(model, features, decode_options, temperature=temperature, best_of=5)
+        if not _needs_fallback(result, options):
+            break
+    return result
+
+
+def decode_batch(model: Any, mels: List[torch.Tensor], options: Dict[str, Any]) -> List[Any]:
+    """Энкодер и жадный декодер на пачку сегментов с одинаковыми параметрами."""
+    return decode_features(model, encode_mels(model, mels, bool(options.get('fp16', False))), options)
+
+
+def result_segments(model: Any, result: Any, offset: float, duration: float, options: Dict[str, Any],
+                    tokenizers: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Сегменты whisper.transcribe из результата декодирования 30-секундного окна."""
+    language = result.language or options.get('language') or 'en'
+    tokenizer = tokenizers.get(language)
+    if tokenizer is None:
+        tokenizer = tokenizers[language] = get_tokenizer(
+            model.is_multilingual, num_languages=model.num_languages,
+            language=language, task=options.get('task', 'transcribe'))
+    return [
+        {
+            'start': round(offset + begin, 3),
+            'end': round(offset + finish, 3),
+            'text': text,
+            'avg_logprob': result.avg_logprob,
+            'no_speech_prob': result.no_speech_prob,
+            'compression_ratio': result.compression_ratio,
+        }
+        for begin, finish, text in parse_timestamped(tokenizer, result.tokens, duration)
+    ]
+
+
+def span_segments(model: Any, spans: Sequence[Span], results: Sequence[Any], options: Dict[str, Any],
+                  tokenizers: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Сегменты (время — по всей записи) и языки отрезков; отрезки без речи пропускаются."""
+    segments: List[Dict[str, Any]] = []
+    languages: List[str] = []
+    for (start, end), result in zip(spans, results):
+        if is_silence(result, options):
+            continue
+        languages.append(result.language or options.get('language') or 'en')
+        segments.extend(result_segments(model, result, start / SAMPLE_RATE, (end - start) / SAMPLE_RATE,
+                                        options, tokenizers))
+    return segments, languages
+
+
+def decode_spans(model: Any, audio: np.ndarray, spans: Sequence[Span], options: Dict[str, Any],
+                 tokenizers: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Одна пачка отрезков записи без предвыборки спектрограмм (для пошаговой обработки заданий)."""
+    mels = [segment_mel(audio[start:end], model.dims.n_mels) for start, end in spans]
+    results = decode_batch(model, mels, options)
+    return span_segments(model, spans, results, options, {} if tokenizers is None else tokenizers)
+
+
+def transcribe_long(model: Any, audio: np.ndarray, options: Dict[str, Any],
+                    cut_points: Optional[Sequence[int]] = None, batch_size: int = LONGFORM_BATCH_SIZE,
+                    mel_workers: int = MEL_WORKERS,
+                    acquire: Optional[Callable[[], ContextManager[Any]]] = None,
+                    on_segments: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                    features: Optional[Any] = None, n_mels: Optional[int] = None) -> Dict[str, Any]:
+    """Распознает запись пачками сегментов; результат в формате whisper.transcribe плюс статистика.
+
+    Если передан acquire, модель берется через него заново на каждую пачку (model тогда
+    может быть None): между пачками модель может получить более срочный запрос.
+    on_segments вызывается с сегментами каждой распознанной пачки, уже после
+    освобождения модели (для потоковой выдачи результата).
+    features — общая стадия признаков (pipeline.FeatureStage, ключ — n_mels); без нее
+    спектрограммы считаются в собственном пуле из mel_workers потоков. Если число
+    mel-полос известно заранее (n_mels или model), спектрограммы первых пачек
+    считаются еще до получения модели.
+    """
+    spans = plan_segments(audio, cut_points)
+    hold = acquire if acquire is not None else (lambda: nullcontext(model))
+    if n_mels is None and model is not None:
+        n_mels = model.dims.n_mels
+    stats = {'segments': len(spans), 'batch_size': batch_size, 'batches': 0, 'mel_sec': 0.0,
+             'mel_wait_sec': 0.0, 'decode_sec': 0.0}
+
+    def compute_mel(span: Span) -> Tuple[torch.Tensor, float]:
+        started = time.time()
+        mel = segment_mel(audio[span[0]:span[1]], n_mels)
+        return mel, time.time() - started
+
+    segments: List[Dict[str, Any]] = []
+    languages: List[str] = []
+    tokenizers: Dict[str, Any] = {}
+    futures = []
+
+    def prefetch(first: int):
+        # Спектрограммы считаются на пачку вперед, пока декодируется текущая; в памяти не больше двух пачек
+        while len(futures) < min(len(spans), first + 2 * batch_size):
+            start, end = spans[len(futures)]
+            if features is not None:
+                futures.append(features.submit(n_mels, audio[start:end]))
+            else:
+                futures.append(executor.submit(compute_mel, (start, end)))
+
+    with ThreadPoolExecutor(max_workers=max(1, mel_workers), thread_name_prefix='stt-mel') as executor:
+        for first in range(0, len(spans), batch_size):
+            if n_mels is not None:
+                prefetch(first)
+            with hold() as batch_model:
+                if n_mels is None:
+                    n_mels = batch_model.dims.n_mels
+                prefetch(first)
+                mels = []
+                waited = time.time()
+                for future in futures[first:first + batch_size]:
+                    if features is not None:
+                        mels.append(future.result())
+                    else:
+                        mel, mel_sec = future.result()
+                        mels.append(mel)
+                        stats['mel_sec'] += mel_sec
+                # Сколько модель простояла в ожидании спектрограмм
+                stats['mel_wait_sec'] += time.time() - waited
+                started = time.time()
+                results = decode_batch(batch_model, mels, options)
+                stats['decode_sec'] += time.time() - started
+                stats['batches'] += 1
+
+                batch_segments, batch_languages = span_segments(batch_model, spans[first:first + batch_size],
+                                                                results, options, tokenizers)
+            for index in range(first, min(len(spans), first + batch_size)):
+                futures[index] = None  # спектрограммы распознанной пачки больше не нужны
+            languages.extend(batch_languages)
+            batch_segments = [dict(segment, id=len(segments) + number) for number, segment in enumerate(batch_segments)]
+            segments.extend(batch_segments)
+            if on_segments is not None:
+                on_segments(batch_segments)
+
+    stats['mel_sec'] = round(stats['mel_sec'], 3)
+    stats['mel_wait_sec'] = round(stats['mel_wait_sec'], 3)
+    stats['decode_sec'] = round(stats['decode_sec'], 3)
+    language = max(set(languages), key=languages.count) if languages else options.get('language', 'unknown')
+    return {
+        'text': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': language,
+        'longform': stats,
+    }
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пул резидентных моделей Whisper.
+
+Модели хранятся по имени и остаются в памяти, пока укладываются в бюджет
+(STT_MODEL_MEMORY_BUDGET_MB); при нехватке места выгружается давно не
+использованная модель. Каждая модель загружается один раз даже при
+одновременных запросах: остальные потоки ждут завершения той же загрузки.
+
+Декодирование Whisper вешает kv-cache хуки на модули модели, поэтому одна
+копия модели не может декодировать два запроса одновременно: acquire()
+выдает модель в монопольное пользование, а используемые модели не
+выгружаются.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Бюджет памяти под резидентные модели, МБ (0 — без ограничения)
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get('STT_MODEL_MEMORY_BUDGET_MB', '4096'))
+# Максимум одновременно загруженных моделей (0 — без ограничения)
+MAX_RESIDENT_MODELS = int(os.environ.get('STT_MAX_RESIDENT_MODELS', '0'))
+
+
+def model_memory_bytes(model: Any) -> int:
+    """Размер параметров и буферов модели в байтах."""
+    if hasattr(model, 'memory_bytes'):
+        # Модели не на PyTorch (CTranslate2) сами оценивают свой размер
+        return model.memory_bytes
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class _Entry:
+    def __init__(self, name: str):
+        self.name = name
+        self.model = None
+        self.error: Optional[BaseException] = None
+        self.loaded = threading.Event()
+        self.lock = threading.Lock()  # монопольное использование модели
+        self.users = 0
+        self.size_bytes = 0
+        self.load_sec = 0.0
+        self.last_used = 0.0
+        self.uses = 0
+
+
+class ModelPool:
+    """Потокобезопасный LRU-пул моделей с бюджетом памяти и однократной загрузкой."""
+
+    def __init__(self, loader: Callable[[str], Any], budget_bytes: int = MODEL_MEMORY_BUDGET_MB * 1024 ** 2,
+                 max_models: int = MAX_RESIDENT_MODELS, size_of: Callable[[Any], int] = model_memory_bytes,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self._loader = loader
+        self._size_of = size_of
+        self._on_evict = on_evict
+        self.budget_bytes = budget_bytes
+        self.max_models = max_models
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    def _load(self, entry: _Entry):
+        started = time.time()
+        try:
+            model = self._loader(entry.name)
+            size = self._size_of(model)
+        except BaseException as e:
+            with self._lock:
+                # Неудачная загрузка не остается в пуле: следующий запрос попробует снова
+                self._entries.pop(entry.name, None)
+            entry.error = e
+            entry.loaded.set()
+            raise
+        with self._lock:
+            entry.model = model
+            entry.size_bytes = size
+            entry.load_sec = time.time() - started
+            self.loads += 1
+            self._evict_over_budget(keep=entry.name)
+        entry.loaded.set()
+        logger.info(f"Модель Whisper {entry.name} в пуле: {size / 1024 ** 2:.0f} МБ, загрузка {entry.load_sec:.1f} сек")
+
+    def _evict_over_budget(self, keep: Optional[str]):
+        """Выгружает неиспользуемые модели, начиная с давно не использованной (под self._lock)."""
+        def over_budget():
+            used = sum(entry.size_bytes for entry in self._entries.values())
+            too_big = self.budget_bytes > 0 and used > self.budget_bytes
+            too_many = self.max_models > 0 and len(self._entries) > self.max_models
+            return too_big or too_many
+
+        for name in list(self._entries):
+            if not over_budget():
+                break
+            entry = self._entries[name]
+            if name == keep or entry.users > 0 or entry.model is None:
+                continue
+            del self._entries[name]
+            self.evictions += 1
+            entry.model = None
+            logger.info(f"Модель Whisper {name} выгружена из пула (LRU)")
+            if self._on_evict is not None:
+                self._on_evict(name)
+        if over_budget():
+            logger.warning("Пул моделей превышает бюджет: все остальные модели сейчас используются")
+
+    def _entry(self, name: str) -> _Entry:
+        """Возвращает запись модели, загружая ее при первом обращении (один раз на имя)."""
+        with self._lock:
+            entry = self._entries.get(name)
+            owner = entry is None
+            if owner:
+                entry = self._entries[name] = _Entry(name)
+            entry.users += 1
+            self._entries.move_to_end(name)
+        try:
+            if owner:
+                self._load(entry)
+            else:
+                entry.loaded.wait()
+                if entry.error is not None:
+                    raise entry.error
+            return entry
+        except BaseException:
+            with self._lock:
+                entry.users -= 1
+            raise
+
+    def _release(self, entry: _Entry):
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.time()
+            entry.uses += 1
+            # Освободившаяся модель могла удерживать пул сверх бюджета; последнюю запрошенную не трогаем
+            self._evict_over_budget(keep=next(reversed(self._entries), None))
+
+    def get(self, name: str) -> Any:
+        """Загружает модель при необходимости (без монопольного захвата)."""
+        entry = self._entry(name)
+        self._release(entry)
+        return entry.model
+
+    @contextmanager
+    def acquire(self, name: str):
+        """Выдает модель в монопольное пользование; пока она занята, ее не выгрузят."""
+        entry = self._entry(name)
+        try:
+            with entry.lock:
+                yield entry.model
+        finally:
+            self._release(entry)
+
+    def is_loaded(self, name: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry is not None and entry.model is not None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {
+                name: {
+                    'loaded': entry.model is not None,
+                    'in_use': entry.users,
+                    'size_mb': round(entry.size_bytes / 1024 ** 2, 1),
+                    'load_sec': round(entry.load_sec, 2),
+                    'uses': entry.uses,
+                }
+                for name, entry in self._entries.items()
+            }
+            used = sum(entry.size_bytes for entry in self._entries.values())
+        return {
+            'models': models,
+            'lru_order': list(models),
+            'used_mb': round(used / 1024 ** 2, 1),
+            'budget_mb': round(self.budget_bytes / 1024 ** 2, 1) if self.budget_bytes > 0 else None,
+            'max_models': self.max_models or None,
+            'loads': self.loads,
+            'evictions': self.evictions,
+        }
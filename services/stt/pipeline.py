@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Стадии конвейера /transcribe: декодирование загрузки, спектрограммы, модель.
+
+Раньше запрос проходил все три шага в своем потоке, и CPU-работа одного
+запроса не пересекалась с работой модели для другого. Здесь декодирование
+(soundfile/ffmpeg) и log-mel идут в собственных пулах потоков с
+ограниченными очередями, а модель — через слоты очереди распознавания
+(inference_queue). Пока модель декодирует одну пачку, стадия признаков уже
+считает спектрограммы следующих запросов и следующих пачек длинных записей.
+
+Стадия признаков собирает ждущие отрезки (не длиннее окна Whisper) с
+одинаковым числом mel-полос в пачки до STT_MEL_BATCH_SIZE и считает их
+одним STFT (longform.batch_mels), в том числе отрезки разных запросов.
+
+Заполненная очередь стадии не отклоняет работу, а задерживает ее отправку
+(обратное давление): отказ с 503 делает только очередь модели. По каждой
+стадии считаются ожидание в очереди, время работы и загрузка потоков;
+stats() показывает узкое место — стадию с наибольшим средним ожиданием.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Потоков стадии признаков (log-mel)
+FEATURE_WORKERS = int(os.environ.get('STT_FEATURE_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Отрезков в одном векторизованном расчете log-mel
+MEL_BATCH_SIZE = int(os.environ.get('STT_MEL_BATCH_SIZE', '16'))
+# Ждущих задач в очереди стадии, после которых отправка ждет места
+STAGE_MAX_QUEUED = int(os.environ.get('STT_STAGE_MAX_QUEUED', '64'))
+
+
+class _Task:
+    def __init__(self, key: Hashable, payload: Any):
+        self.key = key
+        self.payload = payload
+        self.future: Future = Future()
+        self.enqueued = time.time()
+        self.queue_wait_sec = 0.0
+        self.service_sec = 0.0
+
+
+class Stage:
+    """Пул потоков стадии с ограниченной очередью и замерами ожидания и работы."""
+
+    def __init__(self, name: str, workers: int, max_queued: int = STAGE_MAX_QUEUED):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self._cond = threading.Condition()
+        self._tasks: deque = deque()
+        self._threads: List[threading.Thread] = []
+        self._started = time.time()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.blocked = 0  # отправок, ждавших места в очереди
+        self.max_seen_queued = 0
+        self.wait_total_sec = 0.0
+        self.service_total_sec = 0.0
+
+    def _start_workers(self):
+        # Потоки запускаются при первой задаче: импорт модуля не плодит потоков
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"stt-{self.name}-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _enqueue(self, task: _Task) -> Future:
+        with self._cond:
+            self._start_workers()
+            if len(self._tasks) >= self.max_queued:
+                self.blocked += 1
+                while len(self._tasks) >= self.max_queued:
+                    self._cond.wait()
+            self._tasks.append(task)
+            self.max_seen_queued = max(self.max_seen_queued, len(self._tasks))
+            self._cond.notify_all()
+        return task.future
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        """Ставит вызов fn в очередь стадии; если очередь полна, ждет места."""
+        return self._enqueue(_Task(None, (fn, args, kwargs)))
+
+    def run(self, fn: Callable, *args: Any, timings: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        """Выполняет fn на стадии и ждет результат; в timings[имя стадии] — ожидание и работа этой задачи."""
+        return self._wait(_Task(None, (fn, args, kwargs)), timings)
+
+    def _wait(self, task: _Task, timings: Optional[Dict[str, Any]]) -> Any:
+        result = self._enqueue(task).result()
+        if timings is not None:
+            timings[self.name] = {'queue_wait_ms': round(task.queue_wait_sec * 1000, 1),
+                                  'service_ms': round(task.service_sec * 1000, 1)}
+        return result
+
+    def _take(self) -> List[_Task]:
+        with self._cond:
+            while not self._tasks:
+                self._cond.wait()
+            tasks = [self._tasks.popleft()]
+            self.running += 1
+            self._cond.notify_all()
+            return tasks
+
+    def _execute(self, tasks: List[_Task]) -> List[Any]:
+        fn, args, kwargs = tasks[0].payload
+        return [fn(*args, **kwargs)]
+
+    def _run(self):
+        while True:
+            tasks = self._take()
+            started = time.time()
+            try:
+                results = self._execute(tasks)
+                error = None
+            except BaseException as e:
+                logger.error(f"Ошибка стадии {self.name} ({len(tasks)} задач): {e}")
+                results, error = None, e
+            service = time.time() - started
+            with self._cond:
+                self.running -= 1
+                for task in tasks:
+                    task.queue_wait_sec = started - task.enqueued
+                    task.service_sec = service
+                    self.wait_total_sec += task.queue_wait_sec
+                self.service_total_sec += service
+                if error is None:
+                    self.completed += len(tasks)
+                else:
+                    self.failed += len(tasks)
+            for index, task in enumerate(tasks):
+                if error is None:
+                    task.future.set_result(results[index])
+                else:
+                    task.future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            done = self.completed + self.failed
+            elapsed = max(1e-9, time.time() - self._started)
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'queued': len(self._tasks),
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'blocked_submits': self.blocked,
+                'max_seen_queued': self.max_seen_queued,
+                'avg_queue_wait_ms': round(self.wait_total_sec / done * 1000, 1) if done else 0.0,
+                'avg_service_ms': round(self.service_total_sec / done * 1000, 1) if done else 0.0,
+                'utilization': round(min(1.0, self.service_total_sec / (elapsed * self.workers)), 3),
+            }
+
+
+class FeatureStage(Stage):
+    """Стадия log-mel: отрезки с одинаковым ключом (числом mel-полос) считаются пачкой одним STFT."""
+
+    def __init__(self, compute: Callable[[Hashable, List[Any]], List[Any]], workers: int = FEATURE_WORKERS,
+                 max_batch: int = MEL_BATCH_SIZE, max_queued: int = STAGE_MAX_QUEUED, name: str = 'features'):
+        super().__init__(name, workers, max_queued)
+        self._compute = compute
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+
+    def submit(self, key: Hashable, item: Any) -> Future:
+        """Ставит отрезок в очередь; результат future — его признаки."""
+        return self._enqueue(_Task(key, item))
+
+    def run(self, key: Hashable, item: Any, timings: Optional[Dict[str, Any]] = None) -> Any:
+        """Признаки одного отрезка с ожиданием результата (время работы — всей его пачки)."""
+        return self._wait(_Task(key, item), timings)
+
+    def _take(self) -> List[_Task]:
+        with self._cond:
+            while not self._tasks:
+                self._cond.wait()
+            # Старейший отрезок и следующие за ним с тем же ключом, в порядке очереди
+            first = self._tasks.popleft()
+            tasks = [first]
+            rest: deque = deque()
+            while self._tasks and len(tasks) < self.max_batch:
+                task = self._tasks.popleft()
+                (tasks if task.key == first.key else rest).append(task)
+            rest.extend(self._tasks)
+            self._tasks = rest
+            self.running += 1
+            self.batches += 1
+            self._cond.notify_all()
+            return tasks
+
+    def _execute(self, tasks: List[_Task]) -> List[Any]:
+        return self._compute(tasks[0].key, [task.payload for task in tasks])
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._cond:
+            finished = self.batches - self.running
+            stats.update(max_batch=self.max_batch, batches=self.batches,
+                         avg_batch_size=round((self.completed + self.failed) / finished, 2) if finished else 0.0)
+        return stats
+
+
+def bottleneck(stages: Dict[str, Dict[str, Any]]) -> Tuple[Optional[str], float]:
+    """Стадия, в очереди которой задачи в среднем ждут дольше всего, и это ожидание, мс."""
+    waits = {name: stats.get('avg_queue_wait_ms', 0.0) for name, stats in stages.items()}
+    if not waits or max(waits.values()) <= 0.0:
+        return None, 0.0
+    name = max(waits, key=waits.get)
+    return name, waits[name]
+
+
+def queue_stage_stats(queue_stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Сводка очереди распознавания (InferenceQueue.stats) по всем моделям в формате стадии."""
+    models = queue_stats.get('models', {})
+    served = sum(lane['served'] for lane in models.values())
+
+    def average(field: str) -> float:
+        # Среднее по всем обслуженным запросам, а не по моделям
+        if not served:
+            return 0.0
+        return round(sum(lane[field] * lane['served'] for lane in models.values()) / served * 1000, 1)
+
+    return {
+        'workers': queue_stats.get('slots', 1) * max(1, len(models)),
+        'max_queued': queue_stats.get('max_queued', 0),
+        'queued': sum(lane['waiting'] for lane in models.values()),
+        'running': sum(lane['running'] for lane in models.values()),
+        'completed': served,
+        'rejected': sum(lane['rejected'] for lane in models.values()),
+        'avg_queue_wait_ms': average('avg_queue_wait_sec'),
+        'avg_service_ms': average('avg_service_sec'),
+    }
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш результатов распознавания по содержимому аудио и параметрам.
+
+Клиенты повторяют загрузки после таймаутов и заново распознают одно и то же
+голосовое сообщение; каждый раз это полное декодирование Whisper. Ключ —
+SHA1 всей загрузки вместе с моделью, бэкендом, режимом, VAD и параметрами
+декодирования, поэтому разные настройки не смешиваются.
+
+Два уровня: LRU в памяти процесса (STT_RESULT_CACHE_SIZE записей) и
+необязательный каталог на диске (STT_RESULT_CACHE_DIR), общий для воркеров
+gunicorn и переживающий перезапуск. Записи обоих уровней живут не дольше
+STT_RESULT_CACHE_TTL_SEC. Одинаковые запросы, пришедшие во время
+декодирования, не запускают его повторно, а ждут результат первого.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Записей в памяти процесса (0 — кеш выключен)
+RESULT_CACHE_SIZE = int(os.environ.get('STT_RESULT_CACHE_SIZE', '256'))
+# Каталог дискового уровня (пусто — только память)
+RESULT_CACHE_DIR = os.environ.get('STT_RESULT_CACHE_DIR', '').strip()
+# Время жизни записи, сек
+RESULT_CACHE_TTL_SEC = float(os.environ.get('STT_RESULT_CACHE_TTL_SEC', '86400'))
+
+
+def cache_key(audio_sha1: str, model: str, options: Dict[str, Any], **extra: Any) -> str:
+    """Ключ результата: полный хеш аудио, модель, параметры декодирования и режим (extra)."""
+    encoded = json.dumps({'audio': audio_sha1, 'model': model, 'options': options, 'extra': extra},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _json_default(value: Any) -> Any:
+    # Скаляры numpy в отладочной информации
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+class ResultCache:
+    """LRU в памяти + необязательный дисковый уровень с TTL и объединением одинаковых запросов."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, directory: Optional[str] = RESULT_CACHE_DIR,
+                 ttl: float = RESULT_CACHE_TTL_SEC, clock: Callable[[], float] = time.time):
+        self.max_entries = max(0, max_entries)
+        self.directory = directory or None
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'coalesced': 0, 'misses': 0, 'expired': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if self._clock() - created > self.ttl:
+            del self._entries[key]
+            self.counters['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_memory(self, key: str, value: Any, created: float):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_disk(self, key: str) -> Optional[Tuple[float, Any]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            created = os.stat(path).st_mtime
+            if self._clock() - created > self.ttl:
+                os.remove(path)
+                with self._lock:
+                    self.counters['expired'] += 1
+                return None
+            with open(path, encoding='utf-8') as f:
+                return created, json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать запись кеша {key[:12]}: {e}")
+            return None
+
+    def _put_disk(self, key: str, value: Any):
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Запись через временный файл: другой воркер не прочитает половину JSON
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False, default=_json_default)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Не удалось сохранить запись кеша {key[:12]}: {e}")
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Tuple[Any, Optional[str]]:
+        """Результат по ключу и его источник: memory, disk, coalesced или None (посчитан заново).
+
+        Значение должно сериализоваться в JSON. Вызывающий получает копию и может ее менять.
+        """
+        if not self.enabled:
+            return compute(), None
+
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                self.counters['memory_hits'] += 1
+                return copy.deepcopy(value), 'memory'
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+
+        if not owner:
+            return copy.deepcopy(future.result()), 'coalesced'
+
+        source = None
+        try:
+            stored = self._get_disk(key)
+            if stored is not None:
+                created, value = stored
+                source = 'disk'
+            else:
+                created, value = self._clock(), compute()
+                self._put_disk(key, value)
+        except BaseException as e:
+            # Ошибку получат и ожидающие, но она не кешируется
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._put_memory(key, value, created)
+            del self._inflight[key]
+            self.counters['disk_hits' if source == 'disk' else 'misses'] += 1
+        future.set_result(value)
+        return copy.deepcopy(value), source
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, enabled=self.enabled, entries=len(self._entries), max_entries=self.max_entries,
+                        disk=bool(self.directory), ttl_sec=self.ttl, inflight=len(self._inflight))
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Спекулятивное декодирование Whisper: малая модель предлагает, большая проверяет.
+
+У medium/large/turbo задержку определяет авторегрессионный декодер: один
+проход большой модели на каждый токен. Здесь малая модель (tiny или base)
+жадно предлагает до STT_SPECULATIVE_DRAFT_TOKENS токенов, а большая
+проверяет их все одним проходом декодера: берется самый длинный префикс,
+совпавший с ее собственным жадным выбором, плюс ее токен на первой позиции
+расхождения (или следующий токен, если совпали все). Каждый выбранный
+токен — argmax логитов большой модели после тех же фильтров, что у
+whisper.decode (подавление пустого начала и служебных токенов, правила
+меток времени), поэтому результат совпадает с жадным декодированием
+большой модели при температуре 0; малая модель влияет только на число
+проходов. Окна, не прошедшие проверки качества, повторяются с
+температурой обычным whisper.decode, как в longform.
+
+Проход проверки считает несколько позиций сразу, поэтому логиты могут
+отличаться от пошаговых на ошибку округления; разойтись выбор может только
+при практически равных кандидатах. kv-cache обеих моделей свой: после
+проверки он откатывается до принятого префикса. Словари моделей совпадают
+с точностью до сдвига служебных токенов: у large-v3 и turbo на один язык
+больше (кантонский), токены после языковых сдвинуты на единицу.
+"""
+
+import logging
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import replace
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from whisper.decoding import DecodingResult, DecodingTask
+from whisper.tokenizer import LANGUAGES
+from whisper.utils import compression_ratio
+
+import longform
+
+logger = logging.getLogger(__name__)
+
+# Токенов, которые малая модель предлагает за один проход проверки
+DRAFT_TOKENS = int(os.environ.get('STT_SPECULATIVE_DRAFT_TOKENS', '5'))
+# Модель-черновик по умолчанию для запросов без draft_model (пусто — выключено)
+DEFAULT_DRAFT = os.environ.get('STT_SPECULATIVE_DRAFT', '').strip().lower()
+
+# Кто может предлагать токены и для кого это имеет смысл
+DRAFT_MODELS = ('tiny', 'base')
+TARGET_MODELS = ('medium', 'large', 'turbo')
+
+
+class _Decoder:
+    """Инкрементальный декодер Whisper со своим kv-cache, который можно откатить.
+
+    Штатный TextDecoder с kv-cache принимает за проход только один новый токен
+    (маска внимания не учитывает смещение), а проверке нужно несколько: здесь
+    тот же проход по блокам модели, но с маской «позиция offset + i видит ключи
+    0..offset + i».
+    """
+
+    def __init__(self, model: Any, audio_features: torch.Tensor):
+        self.decoder = model.decoder
+        self.audio_features = audio_features
+        blocks = self.decoder.blocks
+        self.keys: List[Optional[torch.Tensor]] = [None] * len(blocks)
+        self.values: List[Optional[torch.Tensor]] = [None] * len(blocks)
+        # Ключи и значения перекрестного внимания к аудио не меняются по ходу окна
+        self.cross = [(block.cross_attn.key(audio_features), block.cross_attn.value(audio_features))
+                      for block in blocks]
+        self.length = 0  # токенов в кеше
+        self.passes = 0
+        self.seconds = 0.0
+
+    @staticmethod
+    def _attend(attention: Any, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor,
+                mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        heads = [tensor.view(1, tensor.shape[1], attention.n_head, -1).permute(0, 2, 1, 3) for tensor in (q, k, v)]
+        out = F.scaled_dot_product_attention(*heads, attn_mask=mask)
+        return attention.out(out.permute(0, 2, 1, 3).flatten(start_dim=2))
+
+    def logits(self, tokens: Sequence[int]) -> torch.Tensor:
+        """Логиты для позиций tokens[length:] (по одной строке на каждый новый токен)."""
+        started = time.time()
+        offset = self.length
+        fresh = torch.tensor([list(tokens[offset:])], device=self.audio_features.device)
+        count = fresh.shape[1]
+        x = self.decoder.token_embedding(fresh) + self.decoder.positional_embedding[offset:offset + count]
+        x = x.to(self.audio_features.dtype)
+        mask = torch.ones(count, offset + count, dtype=torch.bool, device=x.device).tril(diagonal=offset)
+        for index, block in enumerate(self.decoder.blocks):
+            hidden = block.attn_ln(x)
+            keys, values = block.attn.key(hidden), block.attn.value(hidden)
+            if offset:
+                keys = torch.cat([self.keys[index][:, :offset], keys], dim=1)
+                values = torch.cat([self.values[index][:, :offset], values], dim=1)
+            self.keys[index], self.values[index] = keys, values
+            x = x + self._attend(block.attn, block.attn.query(hidden), keys, values, mask)
+            hidden = block.cross_attn_ln(x)
+            x = x + self._attend(block.cross_attn, block.cross_attn.query(hidden), *self.cross[index])
+            x = x + block.mlp(block.mlp_ln(x))
+        x = self.decoder.ln(x)
+        logits = (x @ torch.transpose(self.decoder.token_embedding.weight.to(x.dtype), 0, 1)).float()
+        self.length = len(tokens)
+        self.passes += 1
+        self.seconds += time.time() - started
+        return logits[0]
+
+    def rollback(self, length: int):
+        """Оставляет в кеше только первые length токенов (остальные перезапишет следующий проход)."""
+        self.length = min(self.length, length)
+
+
+class _Vocabulary:
+    """Перевод токенов между словарями большой модели и черновика."""
+
+    def __init__(self, target_tokenizer: Any, draft_tokenizer: Any):
+        # Первый токен после языковых (translate) и сдвиг всех следующих за ним
+        self.draft_first_shifted = draft_tokenizer.translate
+        self.target_first_shifted = target_tokenizer.translate
+        self.shift = target_tokenizer.translate - draft_tokenizer.translate
+
+    def to_target(self, token: int) -> int:
+        return token + self.shift if token >= self.draft_first_shifted else token
+
+    def to_draft(self, token: int) -> Optional[int]:
+        if token >= self.target_first_shifted:
+            return token - self.shift
+        # Язык, которого нет у черновика, в его словарь не переводится
+        return token if token < self.draft_first_shifted else None
+
+
+class Stats:
+    """Счетчики спекулятивного декодирования одного запроса."""
+
+    def __init__(self, draft: str, draft_tokens: int):
+        self.draft = draft
+        self.draft_tokens = draft_tokens
+        self.windows = 0
+        self.tokens = 0  # токенов, выбранных жадным декодером большой модели
+        self.proposed = 0
+        self.accepted = 0
+        self.target_passes = 0
+        self.draft_passes = 0
+        self.target_sec = 0.0
+        self.draft_sec = 0.0
+        self.loop_sec = 0.0
+        self.fallbacks = 0
+        self.skipped = 0  # окон, декодированных без черновика
+
+    def add(self, target: _Decoder, draft: Optional[_Decoder], loop_sec: float):
+        self.windows += 1
+        self.target_passes += target.passes
+        self.target_sec += target.seconds
+        self.loop_sec += loop_sec
+        if draft is not None:
+            self.draft_passes += draft.passes
+            self.draft_sec += draft.seconds
+
+    def debug(self) -> Dict[str, Any]:
+        # Без черновика каждый токен стоил бы отдельного прохода большой модели;
+        # время прохода оценивается по проходам проверки этого же запроса
+        baseline_sec = self.tokens * self.target_sec / self.target_passes if self.target_passes else 0.0
+        return {
+            'draft_model': self.draft,
+            'draft_tokens': self.draft_tokens,
+            'windows': self.windows,
+            'tokens': self.tokens,
+            'proposed': self.proposed,
+            'accepted': self.accepted,
+            'acceptance_rate': round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+            'target_passes': self.target_passes,
+            'draft_passes': self.draft_passes,
+            'tokens_per_target_pass': round(self.tokens / self.target_passes, 2) if self.target_passes else 0.0,
+            'target_sec': round(self.target_sec, 3),
+            'draft_sec': round(self.draft_sec, 3),
+            'decode_sec': round(self.loop_sec, 3),
+            'speedup_est': round(baseline_sec / self.loop_sec, 2) if self.loop_sec else 0.0,
+            'fallback_windows': self.fallbacks,
+            'windows_without_draft': self.skipped,
+        }
+
+
+def _choose(task: DecodingTask, logits: torch.Tensor, context: List[int], device: Any) -> Tuple[int, float]:
+    """Жадный выбор whisper.decode для позиции после context: фильтры логитов, argmax и его log-вероятность."""
+    logits = logits[None].clone()
+    tokens = torch.tensor([context], device=device)
+    for logit_filter in task.logit_filters:
+        logit_filter.apply(logits, tokens)
+    token = int(logits[0].argmax())
+    return token, float(F.log_softmax(logits[0].float(), dim=-1)[token])
+
+
+@torch.no_grad()
+def decode_window(target: Any, draft: Any, target_mel: torch.Tensor, draft_mel: torch.Tensor,
+                  options: Dict[str, Any], stats: Stats, draft_tokens: int = DRAFT_TOKENS) -> DecodingResult:
+    """Жадное декодирование одного 30-секундного окна большой моделью с токенами-кандидатами от черновика."""
+    started = time.time()
+    decode_options = longform.decoding_options(options)
+    task = DecodingTask(target, decode_options)
+    tokenizer = task.tokenizer
+    audio_features = task._get_audio_features(target_mel[None])
+    initial = torch.tensor([task.initial_tokens], device=audio_features.device)
+    languages, _ = task._detect_language(audio_features, initial)
+    language = languages[0]
+    tokens: List[int] = initial[0].tolist()
+
+    draft_decoder = None
+    if list(LANGUAGES).index(language) < draft.num_languages:
+        draft_task = DecodingTask(draft, replace(decode_options, language=language))
+        vocabulary = _Vocabulary(tokenizer, draft_task.tokenizer)
+        draft_decoder = _Decoder(draft, draft_task._get_audio_features(draft_mel[None]))
+        draft_context: Optional[List[int]] = list(draft_task.initial_tokens)
+    else:
+        stats.skipped += 1
+        draft_context = None
+    target_decoder = _Decoder(target, audio_features)
+
+    sum_logprob = 0.0
+    no_speech_prob = float('nan')
+    sampled = 0
+    while sampled < task.sample_len:
+        # Черновик жадно предлагает токены, пока не кончится бюджет окна или не предложит конец
+        proposals: List[int] = []
+        budget = min(draft_tokens, task.sample_len - sampled - 1)
+        while draft_context is not None and len(proposals) < budget:
+            logits = draft_decoder.logits(draft_context)[-1]
+            token, _ = _choose(draft_task, logits, draft_context, audio_features.device)
+            draft_context.append(token)
+            proposals.append(vocabulary.to_target(token))
+            if token == draft_task.tokenizer.eot:
+                break
+        stats.proposed += len(proposals)
+
+        # Один проход большой модели: логиты для всех непроверенных позиций сразу
+        first = len(tokens)
+        logits = target_decoder.logits(tokens + proposals)
+        if target_decoder.passes == 1 and tokenizer.no_speech is not None:
+            no_speech_prob = float(logits[task.sot_index].float().softmax(dim=-1)[tokenizer.no_speech])
+        offset = len(logits) - len(proposals) - 1  # строка логитов для позиции first
+        accepted = 0
+        for index in range(len(proposals) + 1):
+            token, logprob = _choose(task, logits[offset + index], tokens, audio_features.device)
+            tokens.append(token)
+            sum_logprob += logprob
+            sampled += 1
+            if index == len(proposals) or token != proposals[index]:
+                break
+            accepted += 1
+            if token == tokenizer.eot:
+                break
+        stats.accepted += accepted
+        stats.tokens += len(tokens) - first
+
+        target_decoder.rollback(len(tokens) - 1)
+        if draft_context is not None:
+            # Черновик продолжает с проверенного префикса: принятые кандидаты и токен большой модели
+            kept = first + accepted
+            del draft_context[kept:]
+            for token in tokens[kept:]:
+                mapped = vocabulary.to_draft(token)
+                if mapped is None:
+                    draft_context = None
+                    break
+                draft_context.append(mapped)
+            else:
+                draft_decoder.rollback(kept)
+        if tokens[-1] == tokenizer.eot:
+            break
+    stats.add(target_decoder, draft_decoder, time.time() - started)
+
+    sampled_tokens = tokens[task.sample_begin:]
+    if tokenizer.eot in sampled_tokens:
+        sampled_tokens = sampled_tokens[:sampled_tokens.index(tokenizer.eot)]
+    text = tokenizer.decode(sampled_tokens).strip()
+    return DecodingResult(
+        audio_features=audio_features[0],
+        language=language,
+        tokens=sampled_tokens,
+        text=text,
+        avg_logprob=sum_logprob / (len(sampled_tokens) + 1),
+        no_speech_prob=no_speech_prob,
+        temperature=0.0,
+        compression_ratio=compression_ratio(text),
+    )
+
+
+def transcribe(target: Any, draft: Any, audio: np.ndarray, options: Dict[str, Any],
+               cut_points: Optional[Sequence[int]] = None, draft_name: str = '',
+               draft_tokens: int = DRAFT_TOKENS,
+               acquire: Optional[Callable[[], ContextManager[Tuple[Any, Any]]]] = None,
+               on_segments: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> Dict[str, Any]:
+    """Распознает запись окнами longform, каждое — спекулятивным жадным декодированием.
+
+    acquire (как в longform.transcribe_long) выдает пару (большая модель, черновик)
+    заново на каждое окно; target и draft тогда могут быть None.
+    Результат — в формате whisper.transcribe плюс статистика в speculative.
+    """
+    spans = longform.plan_segments(audio, cut_points)
+    hold = acquire if acquire is not None else (lambda: nullcontext((target, draft)))
+    stats = Stats(draft_name, draft_tokens)
+    segments: List[Dict[str, Any]] = []
+    languages: List[str] = []
+    tokenizers: Dict[str, Any] = {}
+    for start, end in spans:
+        piece = audio[start:end]
+        with hold() as (target_model, draft_model):
+            target_mel = longform.segment_mel(piece, target_model.dims.n_mels).to(target_model.device)
+            draft_mel = longform.segment_mel(piece, draft_model.dims.n_mels).to(draft_model.device)
+            result = decode_window(target_model, draft_model, target_mel, draft_mel, options, stats, draft_tokens)
+            checked = longform.with_fallback(target_model, target_mel, result, options)
+            if checked is not result:
+                stats.fallbacks += 1
+            window_segments, window_languages = longform.span_segments(target_model, [(start, end)], [checked],
+                                                                       options, tokenizers)
+        languages.extend(window_languages)
+        window_segments = [dict(segment, id=len(segments) + number) for number, segment in enumerate(window_segments)]
+        segments.extend(window_segments)
+        if on_segments is not None:
+            on_segments(window_segments)
+
+    debug = stats.debug()
+    logger.info(f"Спекулятивное декодирование ({draft_name}): окон {debug['windows']}, принято "
+                f"{debug['acceptance_rate']:.0%} кандидатов, {debug['tokens_per_target_pass']} токенов на проход, "
+                f"ускорение ~{debug['speedup_est']}x")
+    language = max(set(languages), key=languages.count) if languages else options.get('language', 'unknown')
+    return {
+        'text': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': language,
+        'speculative': debug,
+    }
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковое распознавание речи для /transcribe/stream.
+
+Клиент открывает сессию, досылает аудио кусками по мере записи и читает
+события SSE. Распознавание идет по скользящему окну с политикой
+подтвержденного префикса (LocalAgreement, как в whisper_streaming): окно от
+начала неподтвержденного аудио перераспознается каждые
+STT_STREAM_MIN_CHUNK_SEC секунд нового звука; слова, совпавшие в двух
+гипотезах подряд, подтверждаются и больше не меняются (событие final),
+остаток гипотезы отдается как partial. Окно обрезается по концу
+подтвержденных слов, а подтвержденный текст уходит в initial_prompt,
+поэтому стоимость шага не растет с длиной записи.
+
+Времена во всех событиях отсчитываются от начала потока.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Сколько секунд нового аудио копить перед очередным проходом декодера
+STREAM_MIN_CHUNK_SEC = float(os.environ.get('STT_STREAM_MIN_CHUNK_SEC', '1.0'))
+# Длина окна, после которой оно обрезается по подтвержденным словам
+STREAM_WINDOW_SEC = float(os.environ.get('STT_STREAM_WINDOW_SEC', '15'))
+# Сессия без активности дольше этого удаляется
+STREAM_IDLE_TIMEOUT_SEC = float(os.environ.get('STT_STREAM_IDLE_TIMEOUT_SEC', '120'))
+# Максимум одновременных потоковых сессий
+STREAM_MAX_SESSIONS = int(os.environ.get('STT_STREAM_MAX_SESSIONS', '32'))
+# Whisper не принимает окно длиннее 30 секунд
+MAX_WINDOW_SEC = 30.0
+# Хвост подтвержденного текста, передаваемый как initial_prompt
+PROMPT_CHARS = 200
+
+PCM_FORMAT = 'pcm_s16le'
+
+# (начало, конец, текст) слова; текст в формате Whisper — с ведущим пробелом
+Word = Tuple[float, float, str]
+TranscribeFn = Callable[[np.ndarray, str], List[Word]]
+
+_NORMALIZE_RE = re.compile(r'[^\w]+')
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE_RE.sub('', text).lower()
+
+
+def words_text(words: List[Word]) -> str:
+    return ''.join(word[2] for word in words).strip()
+
+
+def pcm16_to_float(data: bytes) -> np.ndarray:
+    """PCM 16 бит little-endian → float32 в диапазоне [-1, 1)."""
+    return np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def resample_linear(samples: np.ndarray, source_rate: int, target_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Линейная передискретизация куска; для речи на входе Whisper этого достаточно."""
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    count = int(round(len(samples) * target_rate / source_rate))
+    positions = np.arange(count, dtype=np.float64) * source_rate / target_rate
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class HypothesisBuffer:
+    """Подтверждает слова, совпавшие в двух последовательных гипотезах."""
+
+    def __init__(self):
+        self.committed: List[Word] = []
+        self.pending: List[Word] = []  # неподтвержденный хвост предыдущей гипотезы
+        self.last_committed_end = 0.0
+
+    def _drop_repeated(self, words: List[Word]) -> List[Word]:
+        # Слова, уже подтвержденные раньше, Whisper повторяет в начале окна
+        words = [word for word in words if word[0] > self.last_committed_end - 0.1]
+        if words and self.committed and abs(words[0][0] - self.last_committed_end) < 1.0:
+            for size in range(min(len(self.committed), len(words), 5), 0, -1):
+                tail = [_normalize(word[2]) for word in self.committed[-size:]]
+                head = [_normalize(word[2]) for word in words[:size]]
+                if tail == head:
+                    return words[size:]
+        return words
+
+    def update(self, words: List[Word]) -> List[Word]:
+        """Принимает новую гипотезу (абсолютные времена); возвращает новые подтвержденные слова."""
+        words = self._drop_repeated(words)
+        agreed: List[Word] = []
+        for previous, current in zip(self.pending, words):
+            if _normalize(previous[2]) != _normalize(current[2]):
+                break
+            agreed.append(current)
+        self.pending = words[len(agreed):]
+        self._commit(agreed)
+        return agreed
+
+    def commit_pending(self) -> List[Word]:
+        """Подтверждает весь хвост (конец потока или переполненное окно)."""
+        words, self.pending = self.pending, []
+        self._commit(words)
+        return words
+
+    def _commit(self, words: List[Word]):
+        if words:
+            self.committed.extend(words)
+            self.last_committed_end = words[-1][1]
+
+
+class OnlineTranscriber:
+    """Скользящее окно аудио поверх функции распознавания с пословными временами."""
+
+    def __init__(self, transcribe_fn: TranscribeFn, min_chunk_sec: float = STREAM_MIN_CHUNK_SEC,
+                 window_sec: float = STREAM_WINDOW_SEC, sample_rate: int = SAMPLE_RATE):
+        self.transcribe_fn = transcribe_fn
+        self.min_chunk_sec = min_chunk_sec
+        self.window_sec = min(window_sec, MAX_WINDOW_SEC)
+        self.sample_rate = sample_rate
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.offset_sec = 0.0  # время начала окна от начала потока
+        self.unprocessed = 0  # отсчетов с прошлого прохода
+        self.hypothesis = HypothesisBuffer()
+        self.last_partial = ''
+        self.passes = 0
+        self.decode_sec = 0.0
+
+    @property
+    def received_sec(self) -> float:
+        return self.offset_sec + len(self.audio) / self.sample_rate
+
+    @property
+    def unprocessed_sec(self) -> float:
+        return self.unprocessed / self.sample_rate
+
+    def insert_audio(self, samples: np.ndarray):
+        self.audio = np.concatenate([self.audio, samples.astype(np.float32, copy=False)])
+        self.unprocessed += len(samples)
+
+    def _prompt(self) -> str:
+        # В подсказку идут только слова, чье аудио уже вне окна
+        words = [word for word in self.hypothesis.committed if word[1] <= self.offset_sec]
+        return words_text(words)[-PROMPT_CHARS:]
+
+    def _trim(self, until_sec: float):
+        cut = int((until_sec - self.offset_sec) * self.sample_rate)
+        if cut > 0:
+            self.audio = self.audio[cut:]
+            self.offset_sec += cut / self.sample_rate
+
+    def _final_event(self, words: List[Word]) -> Dict[str, Any]:
+        return {
+            'type': 'final',
+            'start': round(words[0][0], 2),
+            'end': round(words[-1][1], 2),
+            'text': words_text(words),
+        }
+
+    def process(self) -> List[Dict[str, Any]]:
+        """Распознает текущее окно; возвращает события final/partial."""
+        if len(self.audio) == 0:
+            return []
+        started = time.time()
+        relative = self.transcribe_fn(self.audio, self._prompt())
+        self.decode_sec += time.time() - started
+        self.passes += 1
+        self.unprocessed = 0
+
+        words = [(float(start) + self.offset_sec, float(end) + self.offset_sec, text) for start, end, text in relative]
+        agreed = self.hypothesis.update(words)
+        if not agreed and len(self.audio) / self.sample_rate >= MAX_WINDOW_SEC - self.min_chunk_sec:
+            # Гипотеза так и не стабилизировалась, а окно упирается в предел Whisper
+            agreed = self.hypothesis.commit_pending()
+
+        events = []
+        if agreed:
+            events.append(self._final_event(agreed))
+        partial = words_text(self.hypothesis.pending)
+        if partial != self.last_partial:
+            pending = self.hypothesis.pending
+            events.append({
+                'type': 'partial',
+                'start': round(pending[0][0], 2) if pending else None,
+                'end': round(pending[-1][1], 2) if pending else None,
+                'text': partial,
+            })
+            self.last_partial = partial
+
+        if len(self.audio) / self.sample_rate > self.window_sec:
+            if not self.hypothesis.pending:
+                # В окне нет неподтвержденных слов (например, долгая тишина): оставляем только хвост
+                self._trim(max(self.hypothesis.last_committed_end, self.received_sec - self.min_chunk_sec))
+            elif self.hypothesis.committed:
+                self._trim(self.hypothesis.last_committed_end)
+        return events
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Дораспознает остаток и подтверждает все слова."""
+        events = self.process() if self.unprocessed else []
+        events = [event for event in events if event['type'] == 'final']
+        remaining = self.hypothesis.commit_pending()
+        if remaining:
+            events.append(self._final_event(remaining))
+        return events
+
+
+class StreamSession:
+    """Одна потоковая сессия: прием аудио, фоновый декодер и журнал событий."""
+
+    def __init__(self, transcriber: OnlineTranscriber, audio_format: str = PCM_FORMAT,
+                 sample_rate: int = SAMPLE_RATE, decode_fn: Optional[Callable[[bytes], np.ndarray]] = None,
+                 meta: Optional[Dict[str, Any]] = None):
+        if audio_format != PCM_FORMAT and decode_fn is None:
+            raise ValueError(f"Для формата {audio_format} нужен декодер")
+        self.id = uuid.uuid4().hex
+        self.transcriber = transcriber
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.decode_fn = decode_fn
+        self.meta = meta or {}
+        self.created = time.time()
+        self.last_activity = self.created
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        self.finished = False
+        self.first_audio_at: Optional[float] = None
+        self.ttfw_sec: Optional[float] = None
+        self.first_final_sec: Optional[float] = None
+        self._cond = threading.Condition()
+        self._samples: List[np.ndarray] = []
+        self._odd_byte = b''
+        self._encoded = bytearray()
+        self._encoded_dirty = False
+        self._decoded_samples = 0
+        self._thread = threading.Thread(target=self._run, name=f"stt-stream-{self.id[:8]}", daemon=True)
+        self._thread.start()
+
+    def feed(self, data: bytes):
+        """Принимает очередной кусок аудио в формате сессии."""
+        with self._cond:
+            if self.closed:
+                raise RuntimeError("Сессия уже завершена")
+            now = time.time()
+            self.last_activity = now
+            if self.first_audio_at is None and data:
+                self.first_audio_at = now
+            if self.audio_format == PCM_FORMAT:
+                data = self._odd_byte + data
+                usable = len(data) - len(data) % 2
+                self._odd_byte = data[usable:]
+                samples = resample_linear(pcm16_to_float(data[:usable]), self.sample_rate)
+                self._samples.append(samples)
+            else:
+                # Куски Opus/WebM не декодируются по отдельности: храним поток и декодируем его целиком
+                self._encoded.extend(data)
+                self._encoded_dirty = True
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self.last_activity = time.time()
+            self._cond.notify_all()
+
+    def _take_audio(self) -> np.ndarray:
+        """Забирает накопленное аудио (под self._cond)."""
+        if self.audio_format == PCM_FORMAT:
+            samples = np.concatenate(self._samples) if self._samples else np.zeros(0, dtype=np.float32)
+            self._samples = []
+            return samples
+        if not self._encoded_dirty:
+            return np.zeros(0, dtype=np.float32)
+        self._encoded_dirty = False
+        try:
+            decoded = self.decode_fn(bytes(self._encoded))
+        except Exception as e:
+            # Обрезанный контейнер может не декодироваться до прихода следующих кусков
+            logger.debug(f"Поток {self.id} пока не декодируется: {e}")
+            return np.zeros(0, dtype=np.float32)
+        samples = decoded[self._decoded_samples:]
+        self._decoded_samples = max(self._decoded_samples, len(decoded))
+        return samples
+
+    def _ready(self) -> bool:
+        if self.closed:
+            return True
+        if self.audio_format != PCM_FORMAT:
+            return self._encoded_dirty
+        pending = sum(len(samples) for samples in self._samples) / SAMPLE_RATE
+        return self.transcriber.unprocessed_sec + pending >= self.transcriber.min_chunk_sec
+
+    def _publish(self, events: List[Dict[str, Any]]):
+        now = time.time()
+        with self._cond:
+            for event in events:
+                if self.first_audio_at is not None and event['text']:
+                    elapsed = round(now - self.first_audio_at, 3)
+                    if self.ttfw_sec is None:
+                        self.ttfw_sec = elapsed
+                    if event['type'] == 'final' and self.first_final_sec is None:
+                        self.first_final_sec = elapsed
+                event['id'] = len(self.events)
+                self.events.append(event)
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._ready():
+                        self._cond.wait()
+                    samples = self._take_audio()
+                    closed = self.closed
+                if len(samples):
+                    self.transcriber.insert_audio(samples)
+                if closed:
+                    self._publish(self.transcriber.finish())
+                    break
+                if self.transcriber.unprocessed_sec >= self.transcriber.min_chunk_sec:
+                    self._publish(self.transcriber.process())
+            self._publish([dict(self.result(), type='done')])
+        except Exception as e:
+            logger.error(f"Ошибка потокового распознавания в сессии {self.id}: {e}")
+            self._publish([{'type': 'error', 'text': '', 'error': str(e)}])
+        finally:
+            with self._cond:
+                self.finished = True
+                self.closed = True
+                self._cond.notify_all()
+
+    def result(self) -> Dict[str, Any]:
+        """Итог по подтвержденным словам и метрики сессии."""
+        transcriber = self.transcriber
+        segments = [
+            {'start': event['start'], 'end': event['end'], 'text': event['text']}
+            for event in self.events if event['type'] == 'final'
+        ]
+        return {
+            'text': words_text(transcriber.hypothesis.committed),
+            'segments': segments,
+            'duration_sec': round(transcriber.received_sec, 3),
+            'ttfw_sec': self.ttfw_sec,
+            'first_final_sec': self.first_final_sec,
+            'decode_passes': transcriber.passes,
+            'decode_sec': round(transcriber.decode_sec, 3),
+        }
+
+    def wait_events(self, cursor: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """Ждет событий с номера cursor; возвращает (события, сессия завершена)."""
+        with self._cond:
+            if len(self.events) <= cursor and not self.finished:
+                self._cond.wait(timeout)
+            self.last_activity = time.time()
+            return list(self.events[cursor:]), self.finished
+
+    def wait_finished(self, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+
+class SessionRegistry:
+    """Живые потоковые сессии; простаивающие удаляются при создании новых."""
+
+    def __init__(self, max_sessions: int = STREAM_MAX_SESSIONS, idle_timeout: float = STREAM_IDLE_TIMEOUT_SEC):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, StreamSession] = {}
+
+    def _reap(self):
+        deadline = time.time() - self.idle_timeout
+        for session_id, session in list(self._sessions.items()):
+            if session.last_activity < deadline:
+                session.close()
+                del self._sessions[session_id]
+                logger.info(f"Потоковая сессия {session_id} удалена по таймауту")
+
+    def add(self, factory: Callable[[], StreamSession]) -> StreamSession:
+        with self._lock:
+            self._reap()
+            if len(self._sessions) >= self.max_sessions:
+                raise OverflowError("Слишком много потоковых сессий")
+            session = factory()
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id: str) -> Optional[StreamSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def remove(self, session_id: str) -> Optional[StreamSession]:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Субтитры SRT и WebVTT из сегментов распознавания ({start, end, text}).
+"""
+
+from typing import Any, Dict, Iterable
+
+from whisper.utils import format_timestamp
+
+FORMATS = ('srt', 'vtt')
+MIMETYPES = {'srt': 'application/x-subrip', 'vtt': 'text/vtt'}
+
+
+def _cues(segments: Iterable[Dict[str, Any]]):
+    for segment in segments:
+        text = str(segment.get('text', '')).strip().replace('-->', '->')
+        if text:
+            yield float(segment.get('start', 0.0)), float(segment.get('end', 0.0)), text
+
+
+def to_srt(segments: Iterable[Dict[str, Any]]) -> str:
+    blocks = []
+    for number, (start, end, text) in enumerate(_cues(segments), start=1):
+        blocks.append(f"{number}\n{format_timestamp(start, True, ',')} --> {format_timestamp(end, True, ',')}\n{text}\n")
+    return "\n".join(blocks)
+
+
+def to_vtt(segments: Iterable[Dict[str, Any]]) -> str:
+    blocks = ["WEBVTT\n"]
+    for start, end, text in _cues(segments):
+        blocks.append(f"{format_timestamp(start, True)} --> {format_timestamp(end, True)}\n{text}\n")
+    return "\n".join(blocks)
+
+
+def render(segments: Iterable[Dict[str, Any]], subtitle_format: str) -> str:
+    """Субтитры в формате srt или vtt; ValueError для другого формата."""
+    if subtitle_format == 'srt':
+        return to_srt(segments)
+    if subtitle_format == 'vtt':
+        return to_vtt(segments)
+    raise ValueError(f"Формат субтитров должен быть одним из {FORMATS}, получено: {subtitle_format}")
@@ -0,0 +1,128 @@
+import hashlib
+import io
+import shutil
+import unittest
+from unittest import mock
+
+import numpy as np
+import soundfile as sf
+
+import audio_input
+
+SAMPLE_RATE = audio_input.SAMPLE_RATE
+
+
+def tone(seconds, rate, channels=1, seed=0):
+    t = np.arange(int(seconds * rate)) / rate
+    left = 0.5 * np.sin(2 * np.pi * 440 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * t))
+    noise = 0.01 * np.random.default_rng(seed).standard_normal(len(t))
+    columns = [left + noise, 0.2 * left][:channels]
+    return np.stack(columns, axis=1).astype(np.float32)
+
+
+def encode(audio, rate, fmt='WAV', subtype='PCM_16'):
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, rate, format=fmt, subtype=subtype)
+    return buffer.getvalue()
+
+
+class DecodeUploadTests(unittest.TestCase):
+    def test_mono_16k_wav_is_read_in_place(self):
+        audio = tone(5, SAMPLE_RATE)
+        data = encode(audio, SAMPLE_RATE, subtype='FLOAT')
+        decoded = audio_input.decode_upload(io.BytesIO(data))
+
+        self.assertEqual(decoded.decoder, 'soundfile')
+        np.testing.assert_array_equal(decoded.audio, audio[:, 0])
+        self.assertEqual(decoded.sha1, hashlib.sha1(data).hexdigest())
+        self.assertEqual(decoded.size_bytes, len(data))
+        self.assertAlmostEqual(decoded.rms, float(np.sqrt(np.mean(np.square(audio[:, 0], dtype=np.float64)))),
+                               places=5)
+        # Буфер выделен один раз под длину записи с запасом на блок
+        self.assertLessEqual(decoded.buffer_bytes, (len(audio) + audio_input.BLOCK_FRAMES) * 4)
+
+    def test_stereo_44k_is_downmixed_and_resampled(self):
+        audio = tone(3, 44100, channels=2)
+        for fmt in ('WAV', 'FLAC'):
+            decoded = audio_input.decode_upload(io.BytesIO(encode(audio, 44100, fmt)))
+            self.assertAlmostEqual(decoded.duration_sec, 3.0, delta=0.01)
+            expected = audio_input.soxr.resample(audio.mean(axis=1), 44100, SAMPLE_RATE)
+            length = min(len(expected), len(decoded.audio))
+            self.assertLess(np.max(np.abs(decoded.audio[:length] - expected[:length])), 1e-3)
+
+    def test_envelope_matches_full_array_computation(self):
+        audio = tone(7.3, SAMPLE_RATE)[:, 0]
+        decoded = audio_input.decode_upload(io.BytesIO(encode(audio, SAMPLE_RATE, subtype='FLOAT')))
+        magnitude = np.abs(audio)
+        chunk = int(np.ceil(len(audio) / 64))
+        expected = [round(float(np.mean(magnitude[i:i + chunk]) / magnitude.max()), 4)
+                    for i in range(0, len(audio), chunk)]
+        self.assertEqual(decoded.envelope(64), expected + [0.0] * (64 - len(expected)))
+        self.assertEqual(audio_input.amplitude_envelope(np.zeros(100, dtype=np.float32), 4), [0.0] * 4)
+
+    def test_buffer_grows_geometrically_and_keeps_stats(self):
+        buffer = audio_input.AudioBuffer(4)
+        for value in (0.5, -1.0, 0.25):
+            buffer.append(np.full(3, value, dtype=np.float32))
+        np.testing.assert_array_equal(buffer.audio, np.repeat([0.5, -1.0, 0.25], 3).astype(np.float32))
+        self.assertEqual(len(buffer.data), 16)
+        self.assertEqual(buffer.peak, 1.0)
+        self.assertAlmostEqual(buffer.rms, np.sqrt((0.25 + 1.0 + 0.0625) / 3))
+
+    def test_unknown_container_without_ffmpeg_is_reported(self):
+        with mock.patch.object(audio_input, 'FFMPEG_BIN', '/nonexistent/ffmpeg'):
+            with self.assertRaises(RuntimeError):
+                audio_input.decode_upload(io.BytesIO(b'\x1aE\xdf\xa3 not really webm'))
+
+    @unittest.skipIf(shutil.which(audio_input.FFMPEG_BIN) is None, 'ffmpeg не установлен')
+    def test_ffmpeg_pipe_decodes_and_hashes_on_the_fly(self):
+        import subprocess
+        audio = tone(4, 48000)
+        wav = encode(audio, 48000)
+        ogg = subprocess.run([audio_input.FFMPEG_BIN, '-loglevel', 'error', '-f', 'wav', '-i', 'pipe:0',
+                              '-c:a', 'libopus', '-f', 'webm', 'pipe:1'], input=wav, capture_output=True, check=True)
+        decoded = audio_input.decode_upload(io.BytesIO(ogg.stdout))
+        self.assertEqual(decoded.decoder, 'ffmpeg')
+        self.assertEqual(decoded.sha1, hashlib.sha1(ogg.stdout).hexdigest())
+        self.assertAlmostEqual(decoded.duration_sec, 4.0, delta=0.1)
+
+        with self.assertRaises(ValueError):
+            audio_input.decode_upload(io.BytesIO(b'\x1aE\xdf\xa3' + b'\0' * 100))
+
+
+class TranscribeUploadTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        from test_vad import FakeWhisper
+        cls.stt_app = stt_app
+        cls.original_pool = stt_app.model_pool
+        cls.model = FakeWhisper()
+        stt_app.model_pool = ModelPool(lambda name: cls.model, size_of=lambda model: 0)
+        cls.client = stt_app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool = cls.original_pool
+
+    def test_wav_upload_is_decoded_without_ffmpeg(self):
+        data = encode(tone(3, 44100, channels=2), 44100)
+        response = self.client.post('/transcribe', data={
+            'audio': (io.BytesIO(data), 'clip.wav'), 'language': 'ru', 'vad': 'off', 'mode': 'sequential',
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body['text'], 'раз два')
+        debug = body['debug']
+        self.assertEqual(debug['input_audio_hash'], hashlib.sha1(data).hexdigest()[:12])
+        self.assertEqual(debug['input_size_bytes'], len(data))
+        self.assertAlmostEqual(debug['input_duration_sec'], 3.0, delta=0.01)
+        self.assertEqual(debug['input_decode']['decoder'], 'soundfile')
+        self.assertEqual(len(debug['input_amplitude_envelope']), 64)
+        self.assertEqual(self.model.inputs[-1], len(tone(3, SAMPLE_RATE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+
+import whisper
+
+import longform
+from clip_batcher import ClipBatcher
+from test_longform import NO_THRESHOLDS, noise, tiny_whisper
+
+SAMPLE_RATE = 16000
+
+
+def run_concurrently(batcher, clips):
+    """Отправляет клипы из отдельных потоков, как одновременные HTTP-запросы."""
+    results = [None] * len(clips)
+
+    def worker(index, audio, options):
+        results[index] = batcher.transcribe('base', audio, options)
+
+    threads = [threading.Thread(target=worker, args=(index, audio, options))
+               for index, (audio, options) in enumerate(clips)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class ClipBatcherTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = tiny_whisper()
+
+    def acquire(self, name):
+        @contextmanager
+        def hold():
+            self.acquired.append(name)
+            yield self.model
+        return hold()
+
+    def setUp(self):
+        self.acquired = []
+
+    def test_concurrent_clips_share_one_batch_and_keep_their_options(self):
+        batcher = ClipBatcher(self.acquire, max_batch=4, max_wait_ms=2000)
+        clips = [
+            (noise(3, seed=1), dict(NO_THRESHOLDS, language='ru', task='transcribe')),
+            (noise(7, seed=2), dict(NO_THRESHOLDS, language='en', task='transcribe')),
+            (noise(2, seed=3), dict(NO_THRESHOLDS, language='ru', task='transcribe')),
+            (noise(5, seed=4), dict(NO_THRESHOLDS, language='ru', task='translate')),
+        ]
+        results = run_concurrently(batcher, clips)
+
+        self.assertEqual(self.acquired, ['base'])
+        self.assertEqual(batcher.stats()['batches'], 1)
+        for (audio, options), result in zip(clips, results):
+            self.assertEqual(result['batch']['size'], 4)
+            self.assertEqual(result['batch']['groups'], 3)
+            self.assertEqual(result['language'], options['language'])
+            # Тот же текст, что при отдельном декодировании клипа с его параметрами
+            single = whisper.decode(self.model, longform.segment_mel(audio, 80),
+                                    longform.decoding_options(options))
+            self.assertEqual(result['text'].strip(), single.text.strip())
+            for segment in result['segments']:
+                self.assertLessEqual(segment['end'], len(audio) / SAMPLE_RATE)
+
+    def test_lone_clip_is_decoded_after_max_wait(self):
+        batcher = ClipBatcher(self.acquire, max_batch=8, max_wait_ms=50)
+        started = time.time()
+        result = batcher.transcribe('base', noise(2), dict(NO_THRESHOLDS, language='ru'))
+        self.assertEqual(result['batch']['size'], 1)
+        self.assertGreaterEqual(result['batch']['queue_wait_ms'], 40)
+        self.assertLess(time.time() - started, 10)
+
+    def test_errors_reach_every_caller(self):
+        def broken(name):
+            raise RuntimeError('модель не загрузилась')
+
+        batcher = ClipBatcher(broken, max_batch=2, max_wait_ms=1000)
+        errors = []
+
+        def worker():
+            try:
+                batcher.transcribe('base', noise(1), dict(NO_THRESHOLDS))
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, ['модель не загрузилась'] * 2)
+        # Очередь продолжает работать после ошибки
+        batcher._acquire = self.acquire
+        self.assertEqual(batcher.transcribe('base', noise(1), dict(NO_THRESHOLDS))['batch']['size'], 1)
+
+    def test_routing_threshold(self):
+        batcher = ClipBatcher(self.acquire, max_batch=8, max_clip_sec=10)
+        self.assertTrue(batcher.accepts(noise(9.5)))
+        self.assertFalse(batcher.accepts(noise(12)))
+        self.assertFalse(ClipBatcher(self.acquire, max_batch=1).accepts(noise(2)))
+
+
+class AutoRoutingTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        cls.stt_app = stt_app
+        cls.original_pool = stt_app.model_pool
+        model = tiny_whisper()
+        stt_app.model_pool = ModelPool(lambda name: model, size_of=lambda model: 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool = cls.original_pool
+
+    def test_short_clips_go_through_batcher(self):
+        result, _ = self.stt_app.run_whisper(noise(4), 'base', dict(NO_THRESHOLDS, language='ru'), 'off', 'auto')
+        self.assertIn('batch', result)
+
+        long_clip = noise(self.stt_app.clip_batcher.max_clip_sec + 5)
+        result, _ = self.stt_app.run_whisper(long_clip, 'base', dict(NO_THRESHOLDS, language='ru'), 'off', 'auto')
+        self.assertNotIn('batch', result)
+
+
+if __name__ == '__main__':
+    unittest.main()
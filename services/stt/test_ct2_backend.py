@@ -0,0 +1,114 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import ct2_backend
+from model_pool import model_memory_bytes
+
+
+def fake_segment(start, end, text, words=None):
+    return SimpleNamespace(seek=0, start=start, end=end, text=text, tokens=[1, 2], temperature=0.0,
+                           avg_logprob=-0.2, compression_ratio=1.1, no_speech_prob=0.01, words=words)
+
+
+class OptionsTests(unittest.TestCase):
+    def test_service_options_map_to_faster_whisper(self):
+        kwargs = ct2_backend.transcribe_kwargs({
+            'task': 'transcribe', 'fp16': False, 'temperature': 0.0, 'condition_on_previous_text': False,
+            'no_speech_threshold': 0.6, 'compression_ratio_threshold': 2.4, 'logprob_threshold': None,
+            'language': 'ru', 'word_timestamps': True, 'initial_prompt': 'привет',
+        })
+        self.assertEqual(kwargs, {
+            'beam_size': 1, 'vad_filter': False, 'task': 'transcribe', 'language': 'ru', 'temperature': 0.0,
+            'condition_on_previous_text': False, 'no_speech_threshold': 0.6, 'compression_ratio_threshold': 2.4,
+            'word_timestamps': True, 'initial_prompt': 'привет', 'log_prob_threshold': None,
+        })
+
+    def test_compute_type_follows_device(self):
+        if ct2_backend.CT2_COMPUTE_TYPE:
+            self.skipTest('STT_CT2_COMPUTE_TYPE задан явно')
+        self.assertEqual(ct2_backend.default_compute_type('cpu'), 'int8')
+        self.assertEqual(ct2_backend.default_compute_type('cuda'), 'int8_float16')
+
+
+class ResultTests(unittest.TestCase):
+    def test_segments_keep_whisper_shape(self):
+        words = [SimpleNamespace(word=' раз', start=0.1, end=0.4, probability=0.9),
+                 SimpleNamespace(word=' два', start=0.5, end=0.9, probability=0.8)]
+        result = ct2_backend.to_whisper_result(
+            iter([fake_segment(0.0, 1.0, ' раз два', words), fake_segment(1.0, 2.5, ' три')]), 'ru')
+
+        self.assertEqual(result['text'], ' раз два три')
+        self.assertEqual(result['language'], 'ru')
+        self.assertEqual([segment['id'] for segment in result['segments']], [0, 1])
+        self.assertEqual(result['segments'][1]['end'], 2.5)
+        self.assertEqual(result['segments'][0]['words'][1], {'word': ' два', 'start': 0.5, 'end': 0.9,
+                                                               'probability': 0.8})
+        self.assertNotIn('words', result['segments'][1])
+
+
+class ConversionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.cache.cleanup()
+
+    def convert(self, name, target_dir, compute_type):
+        self.calls.append((name, compute_type))
+        with open(os.path.join(target_dir, 'model.bin'), 'wb') as f:
+            f.write(b'\0' * 1024)
+
+    def test_conversion_runs_once_per_model_and_compute_type(self):
+        first = ct2_backend.ensure_converted('small', self.cache.name, 'int8', convert=self.convert)
+        second = ct2_backend.ensure_converted('small', self.cache.name, 'int8', convert=self.convert)
+        ct2_backend.ensure_converted('small', self.cache.name, 'int8_float16', convert=self.convert)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first, os.path.join(self.cache.name, 'ct2', 'whisper-small-int8'))
+        self.assertEqual(self.calls, [('small', 'int8'), ('small', 'int8_float16')])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache.name, 'ct2'))),
+                         ['whisper-small-int8', 'whisper-small-int8_float16'])
+
+    def test_failed_conversion_leaves_no_cache(self):
+        def broken(name, target_dir, compute_type):
+            open(os.path.join(target_dir, 'model.bin'), 'wb').close()
+            raise RuntimeError('нет сети')
+
+        with self.assertRaises(RuntimeError):
+            ct2_backend.ensure_converted('base', self.cache.name, 'int8', convert=broken)
+        self.assertEqual(os.listdir(os.path.join(self.cache.name, 'ct2')), [])
+        ct2_backend.ensure_converted('base', self.cache.name, 'int8', convert=self.convert)
+        self.assertEqual(self.calls, [('base', 'int8')])
+
+    def test_pool_size_uses_weights_on_disk(self):
+        model_dir = ct2_backend.ensure_converted('base', self.cache.name, 'int8', convert=self.convert)
+        model = ct2_backend.CT2Whisper.__new__(ct2_backend.CT2Whisper)
+        model.model_dir = model_dir
+        self.assertEqual(model_memory_bytes(model), 1024)
+
+    def test_unknown_compute_type_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ct2_backend.load_model('base', 'cpu', self.cache.name, compute_type='int4')
+
+
+@unittest.skipIf(importlib.util.find_spec('faster_whisper') is None, 'faster-whisper не установлен')
+class FasterWhisperTests(unittest.TestCase):
+    def test_model_transcribes_in_whisper_format(self):
+        import numpy as np
+
+        cache_dir = os.environ.get('WHISPER_CACHE', '/app/models')
+        try:
+            model = ct2_backend.load_model('tiny', 'cpu', cache_dir)
+        except Exception as e:
+            self.skipTest(f'модель tiny недоступна: {e}')
+        result = model.transcribe(np.zeros(16000, dtype=np.float32), language='ru', temperature=0.0)
+        self.assertEqual(set(result), {'text', 'segments', 'language'})
+        self.assertEqual(result['language'], 'ru')
+
+
+if __name__ == '__main__':
+    unittest.main()
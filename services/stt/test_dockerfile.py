@@ -0,0 +1,48 @@
+import ast
+import os
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINTS = ('app.py', 'gunicorn.conf.py')
+
+
+def local_imports(filename):
+    """Модули этого каталога, которые импортирует файл (в том числе внутри функций)."""
+    with open(os.path.join(HERE, filename), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return {f"{name}.py" for name in names if os.path.isfile(os.path.join(HERE, f"{name}.py"))}
+
+
+def required_files():
+    required, pending = set(), list(ENTRY_POINTS)
+    while pending:
+        filename = pending.pop()
+        if filename not in required:
+            required.add(filename)
+            pending.extend(local_imports(filename))
+    return required
+
+
+def copied_files(dockerfile):
+    with open(os.path.join(HERE, dockerfile), encoding='utf-8') as f:
+        lines = [line.split()[1:-1] for line in f if line.startswith('COPY ')]
+    return {name for line in lines for name in line}
+
+
+class DockerfileTests(unittest.TestCase):
+    def test_images_contain_every_module_the_service_imports(self):
+        required = required_files()
+        self.assertIn('pipeline.py', required)
+        for dockerfile in ('Dockerfile', 'Dockerfile.gpu'):
+            with self.subTest(dockerfile=dockerfile):
+                self.assertEqual(required - copied_files(dockerfile), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import io
+import threading
+import time
+import unittest
+
+from inference_queue import InferenceQueue, QueueFull, Ticket, classify
+
+
+class InferenceQueueTests(unittest.TestCase):
+    def test_slots_serve_in_arrival_order_and_measure_wait(self):
+        queue = InferenceQueue(slots=1, max_queued=8)
+        order = []
+        tickets = {}
+
+        def request(index):
+            with queue.admit('base') as ticket:
+                with queue.slot('base', ticket):
+                    order.append(index)
+                    time.sleep(0.05)
+                tickets[index] = ticket
+
+        threads = []
+        for index in range(3):
+            thread = threading.Thread(target=request, args=(index,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.01)  # фиксируем порядок прихода
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, [0, 1, 2])
+        self.assertLess(tickets[0].queue_wait_sec, 0.03)
+        self.assertGreater(tickets[2].queue_wait_sec, 0.07)
+        for ticket in tickets.values():
+            self.assertAlmostEqual(ticket.service_sec, 0.05, delta=0.04)
+        stats = queue.stats()['models']['base']
+        self.assertEqual((stats['served'], stats['running'], stats['waiting'], stats['admitted']), (3, 0, 0, 0))
+
+    def test_full_queue_rejects_with_retry_after(self):
+        queue = InferenceQueue(slots=1, max_queued=1)
+        release = threading.Event()
+        inside = threading.Event()
+
+        def hold():
+            with queue.admit('base') as ticket, queue.slot('base', ticket):
+                inside.set()
+                release.wait(5)
+
+        with queue.admit('base') as ticket, queue.slot('base', ticket):
+            time.sleep(0.2)  # время обслуживания для оценки Retry-After
+        holder = threading.Thread(target=hold)
+        holder.start()
+        inside.wait(5)
+        with queue.admit('base'):  # второй допущенный ждет в очереди
+            with self.assertRaises(QueueFull) as raised:
+                with queue.admit('base'):
+                    pass
+            # Другие модели не затронуты
+            with queue.admit('small'):
+                pass
+        release.set()
+        holder.join()
+
+        self.assertEqual(raised.exception.retry_after, 1)
+        self.assertEqual(queue.stats()['models']['base']['rejected'], 1)
+        with queue.admit('base'):
+            pass
+
+    def test_retry_after_grows_with_service_time_and_backlog(self):
+        queue = InferenceQueue(slots=1, max_queued=2)
+        lane = queue._lane('base')
+        lane.avg_service_sec = 4.0
+        lane.admitted = 3
+        with self.assertRaises(QueueFull) as raised:
+            with queue.admit('base'):
+                pass
+        self.assertEqual(raised.exception.retry_after, 12)
+
+
+def p95(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+
+class PrioritySchedulingTests(unittest.TestCase):
+    SEGMENT_SEC = 0.05
+    SEGMENTS = 40
+    CLIP_SEC = 0.01
+
+    def short_clip_latencies(self, queue, long_job):
+        """Длинная запись в фоне и голосовые команды каждые 60 мс; задержки команд от прихода до ответа."""
+        latencies = []
+        done = threading.Event()
+        worker = threading.Thread(target=lambda: (long_job(), done.set()))
+        worker.start()
+        time.sleep(0.02)
+        while not done.is_set() and len(latencies) < 25:
+            arrived = time.time()
+            with queue.admit('base', 'interactive') as ticket, queue.slot('base', ticket):
+                time.sleep(self.CLIP_SEC)
+            latencies.append(time.time() - arrived)
+            time.sleep(0.05)
+        worker.join()
+        return latencies
+
+    def test_short_clips_preempt_long_job_at_segment_boundaries(self):
+        queue = InferenceQueue(slots=1, max_queued=8)
+        segments_done = []
+
+        def long_job():
+            with queue.admit('base', 'batch') as ticket:
+                for index in range(self.SEGMENTS):
+                    with queue.slot('base', ticket):
+                        time.sleep(self.SEGMENT_SEC)
+                    segments_done.append(index)
+
+        latencies = self.short_clip_latencies(queue, long_job)
+        self.assertGreaterEqual(len(latencies), 10)
+        # Худший случай: дождаться конца текущего сегмента и обслужиться самому
+        self.assertLess(p95(latencies), self.SEGMENT_SEC + self.CLIP_SEC + 0.06)
+        self.assertEqual(len(segments_done), self.SEGMENTS)  # длинная запись не голодает
+
+    def test_without_segmenting_short_clips_wait_for_whole_file(self):
+        queue = InferenceQueue(slots=1, max_queued=8)
+
+        def long_job():
+            with queue.admit('base', 'batch') as ticket, queue.slot('base', ticket):
+                time.sleep(self.SEGMENT_SEC * self.SEGMENTS)
+
+        latencies = self.short_clip_latencies(queue, long_job)
+        self.assertGreater(max(latencies), self.SEGMENT_SEC * self.SEGMENTS / 2)
+
+    def test_priority_classification(self):
+        self.assertEqual(classify(5.0), 'interactive')
+        self.assertEqual(classify(40 * 60.0), 'batch')
+        self.assertEqual(classify(40 * 60.0, 'interactive'), 'interactive')
+        self.assertEqual(classify(3.0, 'batch'), 'batch')
+        self.assertEqual(Ticket().debug()['priority'], 'interactive')
+
+
+class LongJobYieldTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        from test_longform import tiny_whisper
+        cls.stt_app = stt_app
+        cls.original = (stt_app.model_pool, stt_app.inference_queue)
+        model = tiny_whisper()
+        stt_app.model_pool = ModelPool(lambda name: model, size_of=lambda model: 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool, cls.stt_app.inference_queue = cls.original
+
+    def test_batch_job_releases_model_between_segment_batches(self):
+        from test_longform import NO_THRESHOLDS, noise
+        stt_app = self.stt_app
+        stt_app.inference_queue = InferenceQueue(slots=1, max_queued=8)
+        options = dict(NO_THRESHOLDS, language='ru')
+        finished = {}
+
+        def long_job():
+            finished['long_result'], _ = stt_app.run_whisper(noise(100, seed=5), 'base', options, 'off', 'auto')
+            finished['long'] = time.time()
+
+        worker = threading.Thread(target=long_job)
+        worker.start()
+        while stt_app.inference_queue.stats()['models'].get('base', {}).get('running', 0) == 0:
+            time.sleep(0.005)
+        result, _ = stt_app.run_whisper(noise(3, seed=6), 'base', options, 'off', 'sequential')
+        finished['short'] = time.time()
+        worker.join()
+
+        long_queue = finished['long_result']['queue']
+        self.assertEqual(long_queue['priority'], 'batch')
+        import longform
+        from inference_queue import PREEMPT_SEGMENTS
+        self.assertEqual(finished['long_result']['longform']['batch_size'],
+                         max(1, min(longform.LONGFORM_BATCH_SIZE, PREEMPT_SEGMENTS)))
+        self.assertEqual(long_queue['slot_holds'], finished['long_result']['longform']['batches'])
+        self.assertGreater(long_queue['slot_holds'], 1)
+        self.assertEqual(result['queue']['priority'], 'interactive')
+        self.assertLess(finished['short'], finished['long'])
+
+
+class TranscribeQueueTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        from result_cache import ResultCache
+        from test_vad import FakeWhisper
+        cls.stt_app = stt_app
+        cls.original = (stt_app.model_pool, stt_app.inference_queue, stt_app.result_cache)
+        cls.model = FakeWhisper()
+        stt_app.model_pool = ModelPool(lambda name: cls.model, size_of=lambda model: 0)
+        stt_app.result_cache = ResultCache(max_entries=0, directory=None)
+        cls.client = stt_app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool, cls.stt_app.inference_queue, cls.stt_app.result_cache = cls.original
+
+    def post(self):
+        from test_audio_input import encode, tone
+        return self.client.post('/transcribe', data={
+            'audio': (io.BytesIO(encode(tone(1, 16000), 16000)), 'clip.wav'),
+            'language': 'ru', 'vad': 'off', 'mode': 'sequential',
+        }, content_type='multipart/form-data')
+
+    def test_debug_reports_queue_wait_and_service_time(self):
+        self.stt_app.inference_queue = InferenceQueue(slots=1, max_queued=4)
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        queue_debug = response.get_json()['debug']['queue']
+        self.assertEqual(set(queue_debug), {'priority', 'queue_wait_sec', 'service_sec', 'slot_holds'})
+        self.assertEqual((queue_debug['priority'], queue_debug['slot_holds']), ('interactive', 1))
+
+    def test_full_queue_returns_503_with_retry_after(self):
+        self.stt_app.inference_queue = InferenceQueue(slots=1, max_queued=0)
+        with self.stt_app.inference_queue.admit('base'):
+            response = self.post()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        self.assertEqual(response.get_json()['retry_after_sec'], int(response.headers['Retry-After']))
+        self.assertEqual(self.post().status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
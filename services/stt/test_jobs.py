@@ -0,0 +1,229 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import contextmanager
+
+import numpy as np
+import soundfile as sf
+
+import jobs
+import subtitles
+from test_vad import FakeWhisper
+
+SAMPLE_RATE = 16000
+
+
+def write_wav(directory, name, seconds, seed=0):
+    path = os.path.join(directory, name)
+    audio = 0.1 * np.random.default_rng(seed).standard_normal(int(seconds * SAMPLE_RATE))
+    sf.write(path, audio.astype(np.float32), SAMPLE_RATE, subtype='PCM_16')
+    return path
+
+
+class CountingModel:
+    """Модель, считающая выдачи; acquire(name) как у пула моделей."""
+
+    def __init__(self, model):
+        self.model = model
+        self.holds = 0
+
+    @contextmanager
+    def acquire(self, name):
+        self.holds += 1
+        yield self.model
+
+
+class JobRunnerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = os.path.join(self.tmp.name, 'jobs.sqlite3')
+        # 70 с без пауз режутся на 3 сегмента longform, 3 с — один
+        self.files = [('call_1.wav', write_wav(self.tmp.name, 'call_1.wav', 70, seed=1)),
+                      ('call_2.wav', write_wav(self.tmp.name, 'call_2.wav', 3, seed=2))]
+
+    def create_job(self, store):
+        return store.create_job(self.files, 'base', {'task': 'transcribe', 'language': 'ru'}, 'off')
+
+    def drain(self, runner, limit=100):
+        for _ in range(limit):
+            if not runner.process_next_batch():
+                return
+        self.fail('Задание не завершилось')
+
+    def test_files_are_transcribed_segment_batch_by_batch(self):
+        store = jobs.JobStore(self.db, upload_dir=self.tmp.name)
+        job = self.create_job(store)
+        model = CountingModel(FakeWhisper())
+        runner = jobs.JobRunner(store, model.acquire, batch_segments=1)
+
+        runner.process_next_batch()
+        self.assertEqual(store.get_job(job['id'])['status'], jobs.STATUS_RUNNING)
+        self.assertAlmostEqual(store.get_job(job['id'])['progress'], round(1 / 3 / 2, 4))
+        self.drain(runner)
+
+        finished = store.get_job(job['id'])
+        self.assertEqual((finished['status'], finished['completed_files'], finished['progress']),
+                         (jobs.STATUS_COMPLETED, 2, 1.0))
+        self.assertEqual(model.holds, 4)  # модель выдается на каждую пачку, а не на файл
+        first, second = list(store.iter_results(job['id']))
+        self.assertEqual((first['file'], first['language'], len(first['segments'])), ('call_1.wav', 'ru', 3))
+        self.assertEqual(first['segments'][0]['start'], 0.0)
+        self.assertAlmostEqual(first['segments'][-1]['end'], 70.0, delta=0.01)
+        self.assertEqual([s['start'] for s in first['segments'][1:]], [s['end'] for s in first['segments'][:-1]])
+        self.assertEqual(first['text'], 'раз два раз два раз два')
+        self.assertEqual((second['duration_sec'], len(second['segments'])), (3.0, 1))
+
+    def test_restart_resumes_from_last_saved_segment(self):
+        store = jobs.JobStore(self.db, upload_dir=self.tmp.name)
+        job = self.create_job(store)
+        before_restart = CountingModel(FakeWhisper())
+        runner = jobs.JobRunner(store, before_restart.acquire, batch_segments=1)
+        runner.process_next_batch()
+        runner.process_next_batch()
+        self.assertEqual(store.list_files(job['id'])[0]['segments_done'], 2)
+
+        # Новый процесс: свое соединение с базой и новый обработчик
+        restarted_store = jobs.JobStore(self.db, upload_dir=self.tmp.name)
+        after_restart = CountingModel(FakeWhisper())
+        self.drain(jobs.JobRunner(restarted_store, after_restart.acquire, batch_segments=1))
+
+        # Распознаны только оставшийся сегмент первого файла и второй файл
+        self.assertEqual(len(before_restart.model.inputs), 2)
+        self.assertEqual(len(after_restart.model.inputs), 2)
+        self.assertEqual(sum(before_restart.model.inputs) + after_restart.model.inputs[0], 70 * SAMPLE_RATE)
+        self.assertEqual(after_restart.model.inputs[1], 3 * SAMPLE_RATE)
+        resumed = restarted_store.get_file_result(job['id'], 0)
+        self.assertEqual(len(resumed['segments']), 3)
+        self.assertEqual(restarted_store.get_job(job['id'])['status'], jobs.STATUS_COMPLETED)
+
+    def test_broken_file_fails_alone(self):
+        broken = os.path.join(self.tmp.name, 'broken.wav')
+        with open(broken, 'wb') as f:
+            f.write(b'RIFF not really audio')
+        self.files.insert(0, ('broken.wav', broken))
+        store = jobs.JobStore(self.db, upload_dir=self.tmp.name)
+        job = self.create_job(store)
+        self.drain(jobs.JobRunner(store, CountingModel(FakeWhisper()).acquire))
+
+        finished = store.get_job(job['id'])
+        self.assertEqual((finished['status'], finished['completed_files'], finished['failed_files']),
+                         (jobs.STATUS_COMPLETED, 2, 1))
+        results = list(store.iter_results(job['id']))
+        self.assertEqual([result['status'] for result in results], ['failed', 'completed', 'completed'])
+        self.assertIn('error', results[0])
+
+    def test_longform_path_with_whisper_model(self):
+        from test_longform import NO_THRESHOLDS, tiny_whisper
+        store = jobs.JobStore(self.db, upload_dir=self.tmp.name)
+        job = store.create_job(self.files[:1], 'base', dict(NO_THRESHOLDS, task='transcribe', language='ru'), 'off')
+        self.drain(jobs.JobRunner(store, CountingModel(tiny_whisper()).acquire, batch_segments=2))
+
+        result = store.get_file_result(job['id'], 0)
+        self.assertEqual(result['status'], jobs.STATUS_COMPLETED)
+        self.assertEqual(result['language'], 'ru')
+        self.assertTrue(all(0.0 <= segment['start'] <= segment['end'] <= 70.0 for segment in result['segments']))
+
+    def test_delete_removes_results_and_uploads(self):
+        store = jobs.JobStore(self.db, upload_dir=os.path.join(self.tmp.name, 'uploads'))
+        upload_dir = store.new_upload_dir()
+        path = write_wav(upload_dir, '00000_clip.wav', 1)
+        job = store.create_job([('clip.wav', path)], 'base', {}, 'off', upload_dir=upload_dir)
+        self.assertTrue(store.delete_job(job['id']))
+        self.assertFalse(os.path.exists(upload_dir))
+        self.assertIsNone(store.get_job(job['id']))
+        self.assertFalse(store.delete_job(job['id']))
+
+
+class DirectoryTests(unittest.TestCase):
+    def test_only_allowed_roots_are_listed(self):
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as other:
+            os.makedirs(os.path.join(root, 'calls', 'day2'))
+            for name in ('calls/a.wav', 'calls/b.MP3', 'calls/notes.txt', 'calls/day2/c.flac'):
+                open(os.path.join(root, name), 'wb').close()
+
+            directory = jobs.resolve_directory(os.path.join(root, 'calls'), roots=[root])
+            self.assertEqual([name for name, _ in jobs.list_directory(directory)], ['a.wav', 'b.MP3'])
+            self.assertEqual([name for name, _ in jobs.list_directory(directory, recursive=True)],
+                             ['a.wav', 'b.MP3', os.path.join('day2', 'c.flac')])
+            self.assertEqual([name for name, _ in jobs.list_directory(directory, '*.txt')], ['notes.txt'])
+            for outside in (other, os.path.join(root, 'calls', '..', '..')):
+                with self.assertRaises(ValueError):
+                    jobs.resolve_directory(outside, roots=[root])
+            with self.assertRaises(ValueError):
+                jobs.resolve_directory(root, roots=[])
+
+
+class SubtitlesTests(unittest.TestCase):
+    SEGMENTS = [{'start': 0.0, 'end': 1.5, 'text': ' Привет'}, {'start': 1.5, 'end': 3661.25, 'text': ' мир '},
+                {'start': 4000.0, 'end': 4001.0, 'text': '  '}]
+
+    def test_srt(self):
+        self.assertEqual(subtitles.to_srt(self.SEGMENTS),
+                         "1\n00:00:00,000 --> 00:00:01,500\nПривет\n\n2\n00:00:01,500 --> 01:01:01,250\nмир\n")
+
+    def test_vtt(self):
+        self.assertEqual(subtitles.to_vtt(self.SEGMENTS),
+                         "WEBVTT\n\n00:00:00.000 --> 00:00:01.500\nПривет\n\n00:00:01.500 --> 01:01:01.250\nмир\n")
+
+
+class JobsEndpointTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        cls.stt_app = stt_app
+        cls.original = (stt_app.model_pool, stt_app.job_store, stt_app.job_runner)
+        cls.tmp = tempfile.TemporaryDirectory()
+        stt_app.model_pool = ModelPool(lambda name: FakeWhisper(), size_of=lambda model: 0)
+        stt_app.job_store = jobs.JobStore(os.path.join(cls.tmp.name, 'jobs.sqlite3'),
+                                          upload_dir=os.path.join(cls.tmp.name, 'uploads'))
+        stt_app.job_runner = jobs.JobRunner(stt_app.job_store, lambda name: stt_app.serve_model(name),
+                                            poll_interval=0.05).start()
+        cls.client = stt_app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.job_runner.stop()
+        cls.stt_app.model_pool, cls.stt_app.job_store, cls.stt_app.job_runner = cls.original
+        cls.tmp.cleanup()
+
+    def test_upload_job_streams_results_and_subtitles(self):
+        from test_audio_input import encode, tone
+        response = self.client.post('/jobs', data={
+            'audio': [(io.BytesIO(encode(tone(2, SAMPLE_RATE), SAMPLE_RATE)), 'first.wav'),
+                      (io.BytesIO(encode(tone(1, SAMPLE_RATE), SAMPLE_RATE)), 'second.wav')],
+            'language': 'ru', 'vad': 'off',
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        self.assertEqual(response.get_json()['total_files'], 2)
+
+        results = self.client.get(f'/jobs/{job_id}/results?subtitles=srt')
+        self.assertEqual(results.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in results.get_data(as_text=True).splitlines()]
+        self.assertEqual([(line['index'], line['file'], line['text']) for line in lines],
+                         [(0, 'first.wav', 'раз два'), (1, 'second.wav', 'раз два')])
+        self.assertEqual(lines[1]['srt'], "1\n00:00:00,000 --> 00:00:01,000\nраз два\n")
+
+        status = self.client.get(f'/jobs/{job_id}').get_json()
+        self.assertEqual((status['status'], status['progress']), ('completed', 1.0))
+        self.assertEqual([file['segments_done'] for file in status['files']], [1, 1])
+        vtt = self.client.get(f'/jobs/{job_id}/files/0?format=vtt')
+        self.assertEqual(vtt.mimetype, 'text/vtt')
+        self.assertTrue(vtt.get_data(as_text=True).startswith('WEBVTT\n\n00:00:00.000 --> 00:00:02.000'))
+        self.assertEqual(self.client.get(f'/jobs/{job_id}/files/5').status_code, 404)
+
+        self.assertEqual(self.client.delete(f'/jobs/{job_id}').status_code, 200)
+        self.assertEqual(self.client.get(f'/jobs/{job_id}').status_code, 404)
+
+    def test_directory_job_requires_allowed_root(self):
+        response = self.client.post('/jobs', json={'directory': '/etc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post('/jobs', data={}, content_type='multipart/form-data').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import io
+import json
+import unittest
+
+import numpy as np
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+from whisper.tokenizer import get_tokenizer
+
+import longform
+import vad
+
+SAMPLE_RATE = 16000
+# Без порогов: у модели со случайными весами все сегменты «плохие», повторы с температурой только замедлят тест
+NO_THRESHOLDS = {'fp16': False, 'logprob_threshold': None, 'compression_ratio_threshold': None,
+                 'no_speech_threshold': None}
+
+
+def tiny_whisper(seed=0):
+    """Whisper с крошечными случайными весами: веса настоящих моделей в тестах недоступны."""
+    torch.manual_seed(seed)
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+                           n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1)
+    model = Whisper(dims).eval()
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)  # создается через torch.empty
+    return model
+
+
+def noise(seconds, seed=0, level=0.1):
+    return (level * np.random.default_rng(seed).standard_normal(int(seconds * SAMPLE_RATE))).astype(np.float32)
+
+
+class PlanSegmentsTests(unittest.TestCase):
+    def test_short_audio_is_one_segment(self):
+        self.assertEqual(longform.plan_segments(np.zeros(10 * SAMPLE_RATE, dtype=np.float32)), [(0, 10 * SAMPLE_RATE)])
+
+    def test_cuts_at_last_pause_inside_window(self):
+        audio = noise(70)
+        cut_points = [10 * SAMPLE_RATE, 25 * SAMPLE_RATE, 40 * SAMPLE_RATE, 52 * SAMPLE_RATE]
+        spans = longform.plan_segments(audio, cut_points)
+        self.assertEqual(spans, [(0, 25 * SAMPLE_RATE), (25 * SAMPLE_RATE, 52 * SAMPLE_RATE),
+                                 (52 * SAMPLE_RATE, 70 * SAMPLE_RATE)])
+
+    def test_without_pauses_cuts_at_quietest_frame_before_limit(self):
+        audio = noise(75)
+        audio[int(27.0 * SAMPLE_RATE):int(27.3 * SAMPLE_RATE)] = 0.0
+        spans = longform.plan_segments(audio)
+        self.assertTrue(all(end - start <= whisper.audio.N_SAMPLES for start, end in spans))
+        self.assertAlmostEqual(spans[0][1] / SAMPLE_RATE, 27.15, delta=0.2)
+        self.assertEqual(spans[-1][1], len(audio))
+        self.assertEqual([start for start, _ in spans[1:]], [end for _, end in spans[:-1]])
+
+
+class ParseTimestampedTests(unittest.TestCase):
+    def test_splits_tokens_by_timestamp_pairs(self):
+        tokenizer = get_tokenizer(True, language='ru', task='transcribe')
+        ts = lambda seconds: tokenizer.timestamp_begin + int(round(seconds / 0.02))
+        tokens = ([ts(0.0)] + tokenizer.encode(' Привет') + [ts(1.5), ts(1.5)]
+                  + tokenizer.encode(' мир') + [ts(3.0)] + tokenizer.encode(' и хвост'))
+        parts = longform.parse_timestamped(tokenizer, tokens, duration=5.0)
+        self.assertEqual(parts, [(0.0, 1.5, ' Привет'), (1.5, 3.0, ' мир'), (0.0, 5.0, ' и хвост')])
+
+
+class BatchedDecodingTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = tiny_whisper()
+
+    def test_batched_greedy_matches_one_by_one(self):
+        audio = noise(60, seed=1)
+        mels = [longform.segment_mel(audio[i * 20 * SAMPLE_RATE:(i + 1) * 20 * SAMPLE_RATE], 80) for i in range(3)]
+        batched = longform.decode_batch(self.model, mels, dict(NO_THRESHOLDS, language='ru'))
+        single = [whisper.decode(self.model, mel, whisper.DecodingOptions(language='ru', fp16=False)) for mel in mels]
+        self.assertEqual([result.tokens for result in batched], [result.tokens for result in single])
+
+    def test_segments_are_stitched_in_time_order(self):
+        audio = noise(70, seed=2)
+        result = longform.transcribe_long(self.model, audio, dict(NO_THRESHOLDS, language='ru'),
+                                          cut_points=[20 * SAMPLE_RATE, 45 * SAMPLE_RATE], batch_size=2, mel_workers=2)
+        stats = result['longform']
+        self.assertEqual(stats['segments'], 3)
+        self.assertEqual(stats['batches'], 2)
+        starts = [segment['start'] for segment in result['segments']]
+        self.assertEqual(starts, sorted(starts))
+        self.assertTrue(result['segments'])
+        # Каждый сегмент Whisper лежит внутри своего отрезка нарезки
+        bounds = [(0, 20), (20, 45), (45, 70)]
+        for segment in result['segments']:
+            self.assertTrue(any(low <= segment['start'] <= segment['end'] <= high for low, high in bounds))
+        self.assertEqual(result['text'], ''.join(segment['text'] for segment in result['segments']))
+        self.assertEqual(result['language'], 'ru')
+
+    def test_batch_mels_match_segment_mel(self):
+        audio = noise(70, seed=3)
+        # Короткий клип, ровно 30-секундное окно и отрезок посередине записи
+        pieces = [audio[:3 * SAMPLE_RATE], audio[5 * SAMPLE_RATE:35 * SAMPLE_RATE],
+                  audio[40 * SAMPLE_RATE:57 * SAMPLE_RATE]]
+        for n_mels in (80, 128):
+            for batched, piece in zip(longform.batch_mels(pieces, n_mels), pieces):
+                torch.testing.assert_close(batched, longform.segment_mel(piece, n_mels), atol=1e-4, rtol=1e-4)
+
+    def test_feature_stage_gives_same_result_as_own_mel_pool(self):
+        import pipeline
+        # Те же спектрограммы, что и у собственного пула: проверяется только передача через стадию
+        stage = pipeline.FeatureStage(lambda n_mels, audios: [longform.segment_mel(audio, n_mels) for audio in audios],
+                                      workers=2)
+        audio = noise(70, seed=2)
+        options = dict(NO_THRESHOLDS, language='ru')
+        cut_points = [20 * SAMPLE_RATE, 45 * SAMPLE_RATE]
+        own = longform.transcribe_long(self.model, audio, options, cut_points=cut_points, batch_size=2)
+        staged = longform.transcribe_long(self.model, audio, options, cut_points=cut_points, batch_size=2,
+                                          features=stage)
+        self.assertEqual(staged['segments'], own['segments'])
+        self.assertEqual(stage.stats()['completed'], 3)
+
+    def test_on_segments_receives_each_batch_as_decoded(self):
+        batches = []
+        result = longform.transcribe_long(self.model, noise(70, seed=2), dict(NO_THRESHOLDS, language='ru'),
+                                          cut_points=[20 * SAMPLE_RATE, 45 * SAMPLE_RATE], batch_size=1,
+                                          on_segments=batches.append)
+        self.assertEqual(len(batches), result['longform']['batches'])
+        self.assertEqual([segment for batch in batches for segment in batch], result['segments'])
+
+
+class LongformModeTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        cls.stt_app = stt_app
+        cls.original_pool = stt_app.model_pool
+        model = tiny_whisper()
+        stt_app.model_pool = ModelPool(lambda name: model, size_of=lambda model: 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool = cls.original_pool
+
+    def test_longform_mode_uses_vad_pauses_and_original_time(self):
+        audio = np.zeros(80 * SAMPLE_RATE, dtype=np.float32)
+        for start, end in [(2, 20), (30, 50), (60, 75)]:
+            audio[start * SAMPLE_RATE:end * SAMPLE_RATE] = noise(end - start, seed=start)
+        result, vad_debug = self.stt_app.run_whisper(audio, 'base', dict(NO_THRESHOLDS, language='ru'),
+                                                     'energy', 'longform')
+        self.assertEqual(vad_debug['regions'], 3)
+        self.assertEqual(result['longform']['segments'], 3)
+        pad = (vad.VAD_PAD_MS + vad.FRAME_MS) / 1000
+        for segment in result['segments']:
+            self.assertTrue(any(low - pad <= segment['start'] <= segment['end'] <= high + pad
+                                for low, high in [(2, 20), (30, 50), (60, 75)]))
+
+
+class TranscribeStreamTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        from result_cache import ResultCache
+        cls.stt_app = stt_app
+        cls.original = (stt_app.model_pool, stt_app.inference_queue, stt_app.result_cache, stt_app.transcribe_options)
+        model = tiny_whisper()
+        stt_app.model_pool = ModelPool(lambda name: model, size_of=lambda model: 0)
+        stt_app.result_cache = ResultCache(max_entries=8, directory=None)
+        options = stt_app.transcribe_options
+        stt_app.transcribe_options = lambda task, language: dict(options(task, language), **NO_THRESHOLDS)
+        cls.client = stt_app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        (cls.stt_app.model_pool, cls.stt_app.inference_queue, cls.stt_app.result_cache,
+         cls.stt_app.transcribe_options) = cls.original
+
+    def setUp(self):
+        from inference_queue import InferenceQueue
+        self.stt_app.inference_queue = InferenceQueue(slots=1, max_queued=4)
+
+    def post(self, audio, accept, **form):
+        from test_audio_input import encode
+        fields = dict({'language': 'ru', 'vad': 'off'}, **form)
+        fields['audio'] = (io.BytesIO(encode(audio, SAMPLE_RATE)), 'lecture.wav')
+        return self.client.post('/transcribe', data=fields, content_type='multipart/form-data',
+                                headers={'Accept': accept}, buffered=False)
+
+    def test_ndjson_segments_arrive_while_later_windows_are_still_decoding(self):
+        response = self.post(noise(100, seed=7), 'application/x-ndjson', priority='batch')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        events, served_at_event = [], []
+        for chunk in response.response:
+            for line in chunk.decode('utf-8').splitlines():
+                events.append(json.loads(line))
+                served_at_event.append(self.stt_app.inference_queue.stats()['models']['base']['served'])
+        response.close()
+
+        segments = [event for event in events if event['type'] == 'segment']
+        summary = events[-1]
+        self.assertEqual(summary['type'], 'summary')
+        self.assertEqual(summary['segments_count'], len(segments))
+        self.assertTrue(segments)
+        self.assertEqual(set(segments[0]), {'type', 'start', 'end', 'text', 'avg_logprob'})
+        windows = summary['debug']['longform']['batches']
+        self.assertEqual(summary['debug']['longform']['batch_size'], 1)
+        self.assertGreater(windows, 1)
+        # Первый сегмент ушел клиенту до того, как распознано последнее окно
+        self.assertLess(served_at_event[0], windows)
+
+    def test_sse_replays_cached_result_with_summary(self):
+        audio = noise(40, seed=8)
+        first = self.post(audio, 'text/event-stream').get_data(as_text=True)
+        second = self.post(audio, 'text/event-stream')
+        self.assertEqual(second.mimetype, 'text/event-stream')
+        body = second.get_data(as_text=True)
+        self.assertEqual(body.count('event: segment'), first.count('event: segment'))
+        summary = json.loads(body.rsplit('event: summary\ndata: ', 1)[1])
+        self.assertTrue(summary['debug']['cache_hit'])
+        self.assertNotIn('segments', summary)
+
+    def test_json_is_still_default(self):
+        response = self.post(noise(2, seed=9), '*/*', mode='sequential')
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertIn('segments', response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
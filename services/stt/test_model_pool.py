@@ -0,0 +1,154 @@
+import threading
+import time
+import unittest
+
+from model_pool import ModelPool
+
+MB = 1024 ** 2
+
+
+class FakeModel:
+    def __init__(self, name, size_mb):
+        self.name = name
+        self.size_bytes = size_mb * MB
+
+
+class FakeLoader:
+    """Загрузчик с заданными размерами моделей; считает вызовы по именам."""
+
+    def __init__(self, sizes, delay=0.0, failures=0):
+        self.sizes = sizes
+        self.delay = delay
+        self.failures = failures
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, name):
+        with self._lock:
+            self.calls.append(name)
+            fail = self.failures > 0
+            self.failures -= 1
+        time.sleep(self.delay)
+        if fail:
+            raise RuntimeError(f"нет файла модели {name}")
+        return FakeModel(name, self.sizes[name])
+
+
+def make_pool(loader, budget_mb=0, max_models=0, evicted=None):
+    return ModelPool(loader, budget_bytes=budget_mb * MB, max_models=max_models,
+                     size_of=lambda model: model.size_bytes,
+                     on_evict=evicted.append if evicted is not None else None)
+
+
+class ModelPoolTests(unittest.TestCase):
+    def test_model_stays_resident_between_requests(self):
+        loader = FakeLoader({"base": 150, "small": 500})
+        pool = make_pool(loader, budget_mb=1000)
+
+        for name in ["base", "small", "base", "small", "base"]:
+            with pool.acquire(name) as model:
+                self.assertEqual(model.name, name)
+
+        self.assertEqual(loader.calls, ["base", "small"])
+        status = pool.status()
+        self.assertEqual(status["loads"], 2)
+        self.assertEqual(status["evictions"], 0)
+        self.assertEqual(status["models"]["base"]["uses"], 3)
+        self.assertEqual(status["used_mb"], 650)
+
+    def test_concurrent_requests_load_model_once(self):
+        loader = FakeLoader({"base": 150}, delay=0.1)
+        pool = make_pool(loader)
+        results = []
+
+        def worker():
+            results.append(pool.get("base"))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(loader.calls, ["base"])
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(model is results[0] for model in results))
+
+    def test_least_recently_used_model_is_evicted_over_budget(self):
+        evicted = []
+        loader = FakeLoader({"tiny": 80, "base": 150, "small": 500})
+        pool = make_pool(loader, budget_mb=700, evicted=evicted)
+
+        pool.get("tiny")
+        pool.get("base")
+        pool.get("tiny")  # base становится давно не использованной
+        pool.get("small")
+
+        self.assertEqual(evicted, ["base"])
+        self.assertFalse(pool.is_loaded("base"))
+        self.assertEqual(pool.status()["lru_order"], ["tiny", "small"])
+
+        pool.get("base")
+        self.assertEqual(loader.calls, ["tiny", "base", "small", "base"])
+        self.assertEqual(evicted, ["base", "tiny"])
+
+    def test_max_models_limits_resident_count(self):
+        evicted = []
+        pool = make_pool(FakeLoader({"tiny": 80, "base": 150}), max_models=1, evicted=evicted)
+
+        pool.get("tiny")
+        pool.get("base")
+
+        self.assertEqual(evicted, ["tiny"])
+        self.assertEqual(list(pool.status()["models"]), ["base"])
+
+    def test_model_in_use_is_not_evicted(self):
+        evicted = []
+        pool = make_pool(FakeLoader({"base": 150, "small": 500}), budget_mb=600, evicted=evicted)
+
+        with pool.acquire("base") as model:
+            pool.get("small")
+            self.assertEqual(evicted, [])
+            self.assertTrue(pool.is_loaded("base"))
+            self.assertEqual(model.name, "base")
+
+        # Освобожденная модель уступает место, как только становится старейшей неиспользуемой
+        self.assertEqual(evicted, ["base"])
+        self.assertTrue(pool.is_loaded("small"))
+
+    def test_acquire_is_exclusive_per_model(self):
+        pool = make_pool(FakeLoader({"base": 150}))
+        active = []
+        overlaps = []
+
+        def worker():
+            with pool.acquire("base"):
+                active.append(1)
+                overlaps.append(len(active))
+                time.sleep(0.02)
+                active.pop()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(overlaps, [1, 1, 1, 1])
+        self.assertEqual(pool.status()["models"]["base"]["in_use"], 0)
+
+    def test_failed_load_is_reported_and_retried(self):
+        loader = FakeLoader({"base": 150}, failures=1)
+        pool = make_pool(loader)
+
+        with self.assertRaises(RuntimeError):
+            pool.get("base")
+        self.assertFalse(pool.is_loaded("base"))
+        self.assertEqual(pool.status()["models"], {})
+
+        self.assertEqual(pool.get("base").name, "base")
+        self.assertEqual(loader.calls, ["base", "base"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+import pipeline
+
+
+class StageTests(unittest.TestCase):
+    def test_full_queue_delays_submit_instead_of_rejecting(self):
+        stage = pipeline.Stage('decode', workers=1, max_queued=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+            return 'first'
+
+        first = stage.submit(blocker)
+        started.wait(5)
+        second = stage.submit(lambda: 'second')  # занимает единственное место в очереди
+        submitted = threading.Event()
+
+        def third():
+            stage.submit(lambda: 'third')
+            submitted.set()
+
+        thread = threading.Thread(target=third)
+        thread.start()
+        self.assertFalse(submitted.wait(0.1))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        self.assertEqual((first.result(5), second.result(5)), ('first', 'second'))
+        self.assertEqual(stage.stats()['blocked_submits'], 1)
+
+    def test_run_reports_wait_and_service_and_propagates_errors(self):
+        stage = pipeline.Stage('decode', workers=1)
+        timings = {}
+        self.assertEqual(stage.run(lambda value: time.sleep(0.05) or value * 2, 21, timings=timings), 42)
+        self.assertAlmostEqual(timings['decode']['service_ms'], 50, delta=40)
+
+        def broken():
+            raise ValueError('битый файл')
+
+        with self.assertRaises(ValueError):
+            stage.run(broken)
+        stats = stage.stats()
+        self.assertEqual((stats['completed'], stats['failed'], stats['queued'], stats['running']), (1, 1, 0, 0))
+
+
+class FeatureStageTests(unittest.TestCase):
+    def test_groups_waiting_items_by_key_in_one_call(self):
+        calls = []
+        gate = threading.Event()
+
+        def compute(key, items):
+            gate.wait(5)
+            calls.append((key, list(items)))
+            return [f"{key}:{item}" for item in items]
+
+        stage = pipeline.FeatureStage(compute, workers=1, max_batch=3)
+        futures = [stage.submit(80, 'warmup')]
+        time.sleep(0.05)  # первый отрезок уже в работе, остальные копятся в очереди
+        futures += [stage.submit(key, item) for key, item in [(80, 'a'), (128, 'b'), (80, 'c'), (80, 'd'), (80, 'e')]]
+        gate.set()
+
+        self.assertEqual([future.result(5) for future in futures],
+                         ['80:warmup', '80:a', '128:b', '80:c', '80:d', '80:e'])
+        self.assertEqual(calls, [(80, ['warmup']), (80, ['a', 'c', 'd']), (128, ['b']), (80, ['e'])])
+        self.assertEqual(stage.stats()['batches'], 4)
+
+
+class BottleneckTests(unittest.TestCase):
+    def test_stage_with_longest_queue_wait(self):
+        stages = {'decode': {'avg_queue_wait_ms': 3.0}, 'features': {'avg_queue_wait_ms': 0.5},
+                  'model': {'avg_queue_wait_ms': 120.0}}
+        self.assertEqual(pipeline.bottleneck(stages), ('model', 120.0))
+        self.assertEqual(pipeline.bottleneck({'decode': {'avg_queue_wait_ms': 0.0}}), (None, 0.0))
+
+    def test_queue_stats_are_weighted_by_served_requests(self):
+        stats = pipeline.queue_stage_stats({'slots': 1, 'max_queued': 16, 'models': {
+            'base': {'running': 1, 'waiting': 2, 'served': 3, 'rejected': 0,
+                     'avg_queue_wait_sec': 0.1, 'avg_service_sec': 1.0},
+            'tiny': {'running': 0, 'waiting': 0, 'served': 1, 'rejected': 1,
+                     'avg_queue_wait_sec': 0.5, 'avg_service_sec': 0.2},
+        }})
+        self.assertEqual((stats['queued'], stats['running'], stats['completed'], stats['rejected']), (2, 1, 4, 1))
+        self.assertEqual(stats['avg_queue_wait_ms'], 200.0)
+        self.assertEqual(stats['avg_service_ms'], 800.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
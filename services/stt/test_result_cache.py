@@ -0,0 +1,173 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from result_cache import ResultCache, cache_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def compute(self, value='текст'):
+        def run():
+            self.calls += 1
+            return {'text': value, 'segments': [{'start': 0.0, 'end': 1.0, 'text': value}]}
+        return run
+
+    def test_key_depends_on_audio_model_and_options(self):
+        base = cache_key('a' * 40, 'base', {'task': 'transcribe', 'language': 'ru'}, vad='energy', mode='auto')
+        self.assertEqual(base, cache_key('a' * 40, 'base', {'language': 'ru', 'task': 'transcribe'},
+                                         mode='auto', vad='energy'))
+        self.assertNotEqual(base, cache_key('b' * 40, 'base', {'task': 'transcribe', 'language': 'ru'},
+                                            vad='energy', mode='auto'))
+        self.assertNotEqual(base, cache_key('a' * 40, 'small', {'task': 'transcribe', 'language': 'ru'},
+                                            vad='energy', mode='auto'))
+        self.assertNotEqual(base, cache_key('a' * 40, 'base', {'task': 'translate', 'language': 'ru'},
+                                            vad='energy', mode='auto'))
+        self.assertNotEqual(base, cache_key('a' * 40, 'base', {'task': 'transcribe', 'language': 'ru'},
+                                            vad='off', mode='auto'))
+
+    def test_memory_lru_with_ttl(self):
+        clock = Clock()
+        cache = ResultCache(max_entries=2, directory=None, ttl=60, clock=clock)
+        self.assertEqual(cache.get_or_compute('k1', self.compute())[1], None)
+        value, source = cache.get_or_compute('k1', self.compute())
+        self.assertEqual(source, 'memory')
+        value['text'] = 'изменено'  # вызывающий получает копию
+        self.assertEqual(cache.get_or_compute('k1', self.compute())[0]['text'], 'текст')
+
+        cache.get_or_compute('k2', self.compute())
+        cache.get_or_compute('k3', self.compute())  # вытесняет k1
+        self.assertIsNone(cache.get_or_compute('k1', self.compute())[1])
+        self.assertEqual(self.calls, 4)
+
+        clock.now += 61
+        self.assertIsNone(cache.get_or_compute('k1', self.compute())[1])
+        stats = cache.stats()
+        self.assertEqual(stats['memory_hits'], 2)
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['entries'], 2)
+
+    def test_disk_tier_survives_restart_and_expires(self):
+        clock = Clock()
+        with tempfile.TemporaryDirectory() as directory:
+            ResultCache(max_entries=4, directory=directory, ttl=60, clock=clock).get_or_compute('ab' * 20, self.compute())
+            restarted = ResultCache(max_entries=4, directory=directory, ttl=60, clock=lambda: time.time())
+            value, source = restarted.get_or_compute('ab' * 20, self.compute('другой'))
+            self.assertEqual((value['text'], source), ('текст', 'disk'))
+            self.assertEqual(restarted.get_or_compute('ab' * 20, self.compute())[1], 'memory')
+
+            expired = ResultCache(max_entries=4, directory=directory, ttl=60, clock=lambda: time.time() + 120)
+            self.assertIsNone(expired.get_or_compute('ab' * 20, self.compute('новый'))[1])
+            self.assertEqual(self.calls, 2)
+            self.assertEqual(os.listdir(os.path.join(directory, 'ab')), ['ab' * 20 + '.json'])
+
+    def test_identical_inflight_requests_share_one_decode(self):
+        cache = ResultCache(max_entries=8, directory=None)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            self.calls += 1
+            started.set()
+            release.wait(5)
+            return {'text': 'один раз'}
+
+        results = []
+
+        def worker():
+            results.append(cache.get_or_compute('same', slow))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while cache.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(str(source) for _, source in results), ['None', 'coalesced', 'coalesced', 'coalesced'])
+        self.assertTrue(all(value == {'text': 'один раз'} for value, _ in results))
+
+    def test_errors_are_shared_but_not_cached(self):
+        cache = ResultCache(max_entries=8, directory=None)
+
+        def broken():
+            raise RuntimeError('нет модели')
+
+        with self.assertRaises(RuntimeError):
+            cache.get_or_compute('k', broken)
+        self.assertIsNone(cache.get_or_compute('k', self.compute())[1])
+        self.assertEqual(cache.stats()['inflight'], 0)
+
+    def test_disabled_cache_always_computes(self):
+        cache = ResultCache(max_entries=0, directory=None)
+        for _ in range(2):
+            self.assertIsNone(cache.get_or_compute('k', self.compute())[1])
+        self.assertEqual(self.calls, 2)
+
+
+class TranscribeCacheTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        from test_vad import FakeWhisper
+        cls.stt_app = stt_app
+        cls.original_pool = stt_app.model_pool
+        cls.original_cache = stt_app.result_cache
+        cls.model = FakeWhisper()
+        stt_app.model_pool = ModelPool(lambda name: cls.model, size_of=lambda model: 0)
+        cls.client = stt_app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool = cls.original_pool
+        cls.stt_app.result_cache = cls.original_cache
+
+    def setUp(self):
+        self.stt_app.result_cache = ResultCache(max_entries=8, directory=None)
+        self.model.inputs.clear()
+
+    def post(self, data, **form):
+        fields = dict({'language': 'ru', 'vad': 'off', 'mode': 'sequential'}, **form)
+        fields['audio'] = (io.BytesIO(data), 'voicemail.wav')
+        response = self.client.post('/transcribe', data=fields, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_repeated_upload_is_served_from_cache(self):
+        from test_audio_input import encode, tone
+        data = encode(tone(2, 16000), 16000)
+
+        first = self.post(data)
+        second = self.post(data)
+        other_task = self.post(data, task='translate')
+
+        self.assertFalse(first['debug']['cache_hit'])
+        self.assertTrue(second['debug']['cache_hit'])
+        self.assertEqual(second['debug']['cache_source'], 'memory')
+        self.assertFalse(other_task['debug']['cache_hit'])
+        self.assertEqual(len(self.model.inputs), 2)
+        self.assertEqual(second['text'], first['text'])
+        self.assertEqual(second['segments'], first['segments'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import whisper
+from whisper.tokenizer import get_tokenizer
+
+import longform
+import speculative
+from test_longform import NO_THRESHOLDS, noise, tiny_whisper
+
+SAMPLE_RATE = 16000
+
+
+class SpeculativeDecodingTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.target = tiny_whisper(seed=0)
+
+    def greedy(self, mel, options):
+        return whisper.decode(self.target, mel, longform.decoding_options(options))
+
+    def decode(self, draft, audio, options, draft_tokens=4):
+        stats = speculative.Stats('tiny', draft_tokens)
+        mel = longform.segment_mel(audio, 80)
+        result = speculative.decode_window(self.target, draft, mel, mel, options, stats, draft_tokens)
+        return result, self.greedy(mel, options), stats
+
+    def test_same_model_as_draft_accepts_everything(self):
+        result, greedy, stats = self.decode(self.target, noise(8, seed=1), dict(NO_THRESHOLDS, language='ru'))
+        self.assertEqual(result.tokens, greedy.tokens)
+        self.assertEqual(result.text, greedy.text)
+        self.assertAlmostEqual(result.avg_logprob, greedy.avg_logprob, places=3)
+        self.assertAlmostEqual(result.no_speech_prob, greedy.no_speech_prob, places=4)
+        self.assertEqual(stats.accepted, stats.proposed)
+        self.assertLess(stats.target_passes, stats.tokens)
+
+    def test_unrelated_draft_does_not_change_the_output(self):
+        draft = tiny_whisper(seed=1)
+        for seconds, options in [(5, dict(NO_THRESHOLDS, language='ru')),
+                                 (20, dict(NO_THRESHOLDS, language='en', task='translate')),
+                                 (12, dict(NO_THRESHOLDS))]:
+            result, greedy, stats = self.decode(draft, noise(seconds, seed=seconds), options, draft_tokens=3)
+            self.assertEqual(result.tokens, greedy.tokens)
+            self.assertEqual(result.language, greedy.language)
+            self.assertLessEqual(stats.accepted, stats.proposed)
+
+    def test_transcribe_reports_acceptance_and_stitches_windows(self):
+        audio = noise(50, seed=4)
+        options = dict(NO_THRESHOLDS, language='ru')
+        result = speculative.transcribe(self.target, self.target, audio, options,
+                                        cut_points=[20 * SAMPLE_RATE], draft_name='tiny')
+        expected = longform.transcribe_long(self.target, audio, options, cut_points=[20 * SAMPLE_RATE])
+        self.assertEqual([segment['text'] for segment in result['segments']],
+                         [segment['text'] for segment in expected['segments']])
+        stats = result['speculative']
+        self.assertEqual((stats['windows'], stats['draft_model'], stats['acceptance_rate']), (2, 'tiny', 1.0))
+        self.assertGreater(stats['tokens_per_target_pass'], 1.0)
+
+
+class VocabularyTests(unittest.TestCase):
+    def test_special_tokens_shift_between_99_and_100_languages(self):
+        draft = get_tokenizer(True, num_languages=99, language='ru', task='transcribe')
+        target = get_tokenizer(True, num_languages=100, language='ru', task='transcribe')
+        vocabulary = speculative._Vocabulary(target, draft)
+        text = draft.encode(' привет')[0]
+        self.assertEqual(vocabulary.to_target(text), text)
+        self.assertEqual(vocabulary.to_target(draft.eot), target.eot)
+        self.assertEqual(vocabulary.to_target(draft.timestamp_begin + 7), target.timestamp_begin + 7)
+        self.assertEqual(vocabulary.to_draft(target.timestamp_begin + 7), draft.timestamp_begin + 7)
+        self.assertEqual(vocabulary.to_draft(target.to_language_token('ru')), draft.to_language_token('ru'))
+        self.assertIsNone(vocabulary.to_draft(target.to_language_token('yue')))
+
+
+if __name__ == '__main__':
+    unittest.main()
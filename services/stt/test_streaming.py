@@ -0,0 +1,242 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import wave
+
+import numpy as np
+
+import streaming
+
+SAMPLE_RATE = streaming.SAMPLE_RATE
+TONE_WORDS = {300: "один", 400: "два", 500: "три", 600: "четыре"}
+
+
+class ToneModel:
+    """Вместо речи — тональные посылки: частота посылки определяет слово.
+
+    Повторяет интерфейс whisper.model.transcribe с word_timestamps=True:
+    слова с временами относительно начала переданного окна.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, **options):
+        self.calls.append(dict(options, samples=len(audio)))
+        frame = SAMPLE_RATE // 50
+        frames = len(audio) // frame
+        rms = np.sqrt(np.mean(np.square(audio[:frames * frame].reshape(frames, frame)), axis=1))
+        voiced = np.concatenate([[False], rms > 0.05, [False]])
+        edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+        words = []
+        for first, last in zip(edges[::2], edges[1::2]):
+            if last - first < 5:
+                continue
+            burst = audio[first * frame:last * frame]
+            spectrum = np.abs(np.fft.rfft(burst))
+            frequency = np.fft.rfftfreq(len(burst), 1 / SAMPLE_RATE)[int(np.argmax(spectrum))]
+            text = TONE_WORDS.get(int(round(frequency / 100.0)) * 100, "шум")
+            words.append({"word": f" {text}", "start": first / 50, "end": last / 50})
+        text = "".join(word["word"] for word in words)
+        return {"text": text, "segments": [{"text": text, "words": words}] if words else [], "language": "ru"}
+
+
+def tone_transcribe_fn(model):
+    def transcribe_window(audio, prompt):
+        result = model.transcribe(audio, initial_prompt=prompt)
+        return [(w["start"], w["end"], w["word"]) for s in result["segments"] for w in s["words"]]
+    return transcribe_window
+
+
+def tone_speech(frequencies, lead=0.5, word_sec=0.3, gap_sec=0.3, tail=0.3):
+    parts = [np.zeros(int(lead * SAMPLE_RATE), dtype=np.float32)]
+    t = np.arange(int(word_sec * SAMPLE_RATE)) / SAMPLE_RATE
+    for frequency in frequencies:
+        parts.append((0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32))
+        parts.append(np.zeros(int(gap_sec * SAMPLE_RATE), dtype=np.float32))
+    parts.append(np.zeros(int(tail * SAMPLE_RATE), dtype=np.float32))
+    return np.concatenate(parts)
+
+
+def pcm16(audio):
+    return (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+class HypothesisBufferTests(unittest.TestCase):
+    def test_commits_prefix_agreed_by_two_hypotheses(self):
+        buffer = streaming.HypothesisBuffer()
+        self.assertEqual(buffer.update([(0.0, 0.4, " Привет"), (0.5, 0.9, " мир")]), [])
+        agreed = buffer.update([(0.0, 0.4, " привет,"), (0.5, 0.9, " мирно"), (1.0, 1.2, " всем")])
+        self.assertEqual([word[2] for word in agreed], [" привет,"])
+        self.assertEqual([word[2] for word in buffer.pending], [" мирно", " всем"])
+        self.assertEqual(buffer.last_committed_end, 0.4)
+
+    def test_drops_words_repeated_after_window_trim(self):
+        buffer = streaming.HypothesisBuffer()
+        buffer.update([(0.0, 0.4, " раз"), (0.5, 0.9, " два")])
+        buffer.update([(0.0, 0.4, " раз"), (0.5, 0.9, " два")])
+        self.assertEqual(len(buffer.committed), 2)
+        # Новое окно снова начинается со слова "два" с немного другим временем
+        buffer.update([(0.85, 0.95, " два"), (1.0, 1.4, " три")])
+        agreed = buffer.update([(0.85, 0.95, " два"), (1.0, 1.4, " три")])
+        self.assertEqual([word[2] for word in buffer.committed], [" раз", " два", " три"])
+        self.assertEqual([word[2] for word in agreed], [" три"])
+
+
+class OnlineTranscriberTests(unittest.TestCase):
+    def test_window_is_trimmed_and_committed_text_goes_to_prompt(self):
+        model = ToneModel()
+        transcriber = streaming.OnlineTranscriber(tone_transcribe_fn(model), min_chunk_sec=0.5, window_sec=2.0)
+        audio = tone_speech([300, 400, 500, 600] * 3)
+        events = []
+        for start in range(0, len(audio), SAMPLE_RATE // 2):
+            transcriber.insert_audio(audio[start:start + SAMPLE_RATE // 2])
+            events.extend(transcriber.process())
+        events.extend(transcriber.finish())
+
+        finals = [event for event in events if event["type"] == "final"]
+        self.assertEqual(" ".join(event["text"] for event in finals), " ".join(["один два три четыре"] * 3))
+        self.assertEqual([event["start"] for event in finals], sorted(event["start"] for event in finals))
+        # Окно не растет с длиной записи: самое длинное окно короче двух окон
+        self.assertLess(max(call["samples"] for call in model.calls), 3.0 * SAMPLE_RATE)
+        self.assertTrue(any(call["initial_prompt"] for call in model.calls))
+        # Времена слов в событиях — от начала потока, а не окна
+        self.assertAlmostEqual(finals[-1]["end"], len(audio) / SAMPLE_RATE - 0.6, delta=0.05)
+
+    def test_window_does_not_grow_on_long_silence(self):
+        model = ToneModel()
+        transcriber = streaming.OnlineTranscriber(tone_transcribe_fn(model), min_chunk_sec=1.0, window_sec=3.0)
+        for _ in range(10):
+            transcriber.insert_audio(np.zeros(SAMPLE_RATE, dtype=np.float32))
+            transcriber.process()
+        self.assertLessEqual(max(call["samples"] for call in model.calls), 4 * SAMPLE_RATE)
+        self.assertAlmostEqual(transcriber.received_sec, 10.0)
+
+    def test_pcm_helpers(self):
+        samples = np.array([0.0, 0.5, -0.5], dtype=np.float32)
+        np.testing.assert_allclose(streaming.pcm16_to_float(pcm16(samples)), samples, atol=1e-4)
+        self.assertEqual(len(streaming.resample_linear(np.zeros(8000, dtype=np.float32), 8000)), 16000)
+
+
+class RealTimeReplayTests(unittest.TestCase):
+    def test_time_to_first_word_when_replaying_wav_in_real_time(self):
+        audio = tone_speech([300, 400, 500, 600])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "speech.wav")
+            with wave.open(path, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(SAMPLE_RATE)
+                wav.writeframes(pcm16(audio))
+
+            session = streaming.StreamSession(
+                streaming.OnlineTranscriber(tone_transcribe_fn(ToneModel()), min_chunk_sec=0.5))
+            chunk_sec = 0.1
+
+            def replay():
+                with wave.open(path, "rb") as wav:
+                    while True:
+                        data = wav.readframes(int(chunk_sec * SAMPLE_RATE))
+                        if not data:
+                            break
+                        session.feed(data)
+                        time.sleep(chunk_sec)
+                session.close()
+
+            started = time.time()
+            thread = threading.Thread(target=replay)
+            thread.start()
+            first_word_at = None
+            cursor = 0
+            finished = False
+            while not finished:
+                events, finished = session.wait_events(cursor, timeout=5)
+                cursor += len(events)
+                if first_word_at is None and any(event.get("text") for event in events):
+                    first_word_at = time.time() - started
+            thread.join()
+
+        duration = len(audio) / SAMPLE_RATE
+        first_word_end = 0.8
+        result = session.result()
+        self.assertEqual(result["text"], "один два три четыре")
+        self.assertEqual(session.events[-1]["type"], "done")
+        # Первое слово видно через ~один шаг декодера после того, как оно прозвучало,
+        # задолго до конца записи
+        self.assertIsNotNone(first_word_at)
+        self.assertLess(first_word_at, first_word_end + 2 * 0.5 + 0.3)
+        self.assertLess(first_word_at, duration - 1.0)
+        self.assertLess(result["ttfw_sec"], first_word_end + 2 * 0.5 + 0.3)
+        self.assertLess(result["first_final_sec"], duration)
+
+
+class StreamEndpointTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        cls.stt_app = stt_app
+        cls.model = ToneModel()
+        cls.original_pool = stt_app.model_pool
+        stt_app.model_pool = ModelPool(lambda name: cls.model, size_of=lambda model: 0)
+        cls.client = stt_app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool = cls.original_pool
+
+    def open_session(self, **params):
+        response = self.client.post("/transcribe/stream", json=dict({"language": "ru"}, **params))
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()
+
+    def test_stream_session_emits_partial_and_final_events(self):
+        session = self.open_session(sample_rate=8000)
+        self.assertEqual(session["format"], "pcm_s16le")
+
+        audio = tone_speech([300, 400, 500])
+        audio_8k = audio[::2]
+        data = pcm16(audio_8k)
+        step = 1601  # нечетные куски: половинки отсчетов склеиваются между запросами
+        for start in range(0, len(data), step):
+            response = self.client.post(session["audio_url"], data=data[start:start + step],
+                                        content_type="application/octet-stream")
+            self.assertEqual(response.status_code, 202)
+
+        result = self.client.post(session["end_url"]).get_json()
+        self.assertEqual(result["text"], "один два три")
+        self.assertEqual(result["model"], "base")
+        self.assertAlmostEqual(result["duration_sec"], len(audio) / SAMPLE_RATE, delta=0.01)
+        self.assertTrue(all(call.get("word_timestamps") for call in self.model.calls))
+        self.assertEqual(self.model.calls[-1]["language"], "ru")
+
+        response = self.client.get(session["events_url"])
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = []
+        for block in response.get_data(as_text=True).strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+            events.append((fields["event"], json.loads(fields["data"])))
+        kinds = [kind for kind, _ in events]
+        self.assertEqual(kinds[-1], "done")
+        self.assertIn("final", kinds)
+        finals = [data["text"] for kind, data in events if kind == "final"]
+        self.assertEqual(" ".join(finals), "один два три")
+
+        # Переподключение с Last-Event-ID отдает только оставшиеся события
+        response = self.client.get(session["events_url"], headers={"Last-Event-ID": str(len(events) - 2)})
+        self.assertEqual(response.get_data(as_text=True).count("event: "), 1)
+
+        self.assertEqual(self.client.post(session["audio_url"], data=b"\0\0").status_code, 409)
+        self.assertEqual(self.client.delete(f"/transcribe/stream/{session['session_id']}").status_code, 200)
+        self.assertEqual(self.client.post(session["audio_url"], data=b"\0\0").status_code, 404)
+
+    def test_rejects_unknown_model(self):
+        response = self.client.post("/transcribe/stream", json={"model": "huge"})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
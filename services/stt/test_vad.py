@@ -0,0 +1,164 @@
+import importlib.util
+import unittest
+
+import numpy as np
+
+import vad
+
+SAMPLE_RATE = vad.SAMPLE_RATE
+
+
+def synthetic_recording(duration, bursts, noise=0.001, seed=0):
+    """Фоновый шум и «речь» (тон 220 Гц с модуляцией) на интервалах bursts, сек."""
+    rng = np.random.default_rng(seed)
+    audio = (noise * rng.standard_normal(int(duration * SAMPLE_RATE))).astype(np.float32)
+    for start, end in bursts:
+        t = np.arange(int((end - start) * SAMPLE_RATE)) / SAMPLE_RATE
+        voice = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+        audio[int(start * SAMPLE_RATE):int(start * SAMPLE_RATE) + len(t)] += voice.astype(np.float32)
+    return audio
+
+
+def seconds(regions):
+    return [(start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in regions]
+
+
+class EnergyVadTests(unittest.TestCase):
+    def test_finds_speech_regions_with_padding(self):
+        audio = synthetic_recording(7.0, [(1.0, 2.0), (4.0, 5.5)])
+        regions = seconds(vad.energy_regions(audio))
+
+        self.assertEqual(len(regions), 2)
+        pad = vad.VAD_PAD_MS / 1000
+        frame = vad.FRAME_MS / 1000
+        for (start, end), (expected_start, expected_end) in zip(regions, [(1.0, 2.0), (4.0, 5.5)]):
+            self.assertAlmostEqual(start, expected_start - pad, delta=frame + 0.01)
+            self.assertAlmostEqual(end, expected_end + pad, delta=frame + 0.01)
+
+    def test_short_pauses_are_kept_and_clicks_dropped(self):
+        audio = synthetic_recording(5.0, [(1.0, 2.0), (2.2, 3.0), (4.5, 4.55)])
+        regions = seconds(vad.energy_regions(audio))
+        self.assertEqual(len(regions), 1)
+        self.assertLess(regions[0][0], 1.0)
+        self.assertGreater(regions[0][1], 3.0)
+
+    def test_silence_has_no_speech(self):
+        for audio in (np.zeros(3 * SAMPLE_RATE, dtype=np.float32), np.full(3 * SAMPLE_RATE, 1e-5, dtype=np.float32)):
+            speech_map = vad.detect_speech(audio, backend="energy")
+            self.assertEqual(speech_map.regions, [])
+            self.assertEqual(speech_map.speech_ratio, 0.0)
+
+    def test_quiet_recording_keeps_its_speech(self):
+        # Речь с RMS около 0.0006: тихий микрофон, но выше порога предупреждения /transcribe
+        audio = synthetic_recording(7.0, [(1.0, 2.0), (4.0, 5.5)], noise=0.00002) / 250
+        self.assertAlmostEqual(float(np.sqrt(np.mean(np.square(audio[SAMPLE_RATE:2 * SAMPLE_RATE])))), 0.0006, delta=0.0002)
+
+        regions = seconds(vad.energy_regions(audio))
+
+        self.assertEqual(len(regions), 2)
+        self.assertLess(regions[0][0], 1.0)
+        self.assertGreater(regions[1][1], 5.5)
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            vad.detect_speech(np.zeros(100, dtype=np.float32), backend="webrtc")
+        self.assertIsNone(vad.detect_speech(np.zeros(100, dtype=np.float32), backend="off"))
+
+    @unittest.skipIf(importlib.util.find_spec("silero_vad") is not None, "silero-vad установлен")
+    def test_silero_falls_back_to_energy_without_package(self):
+        audio = synthetic_recording(3.0, [(1.0, 2.0)])
+        speech_map = vad.detect_speech(audio, backend="silero")
+        self.assertEqual(speech_map.backend, "energy")
+        self.assertEqual(len(speech_map.regions), 1)
+
+
+class SpeechMapTests(unittest.TestCase):
+    def setUp(self):
+        regions = [(1 * SAMPLE_RATE, 2 * SAMPLE_RATE), (5 * SAMPLE_RATE, 7 * SAMPLE_RATE)]
+        self.speech_map = vad.SpeechMap(regions, 10 * SAMPLE_RATE, "energy", gap_ms=500)
+
+    def test_compact_concatenates_regions_with_gaps(self):
+        audio = np.arange(10 * SAMPLE_RATE, dtype=np.float32)
+        compact = self.speech_map.compact(audio)
+        self.assertEqual(len(compact), int(3.5 * SAMPLE_RATE))
+        self.assertEqual(compact[0], SAMPLE_RATE)
+        self.assertTrue(np.all(compact[SAMPLE_RATE:int(1.5 * SAMPLE_RATE)] == 0))
+        self.assertEqual(compact[int(1.5 * SAMPLE_RATE)], 5 * SAMPLE_RATE)
+        self.assertAlmostEqual(self.speech_map.speech_ratio, 0.3)
+
+    def test_times_map_back_to_original_recording(self):
+        to_original = self.speech_map.to_original
+        self.assertAlmostEqual(to_original(0.0), 1.0)
+        self.assertAlmostEqual(to_original(0.5), 1.5)
+        self.assertAlmostEqual(to_original(1.2), 2.0)  # пауза склейки прижимается к концу участка
+        self.assertAlmostEqual(to_original(1.5), 5.0)
+        self.assertAlmostEqual(to_original(3.5), 7.0)
+
+        result = self.speech_map.remap_result({"segments": [
+            {"start": 0.2, "end": 0.9, "text": "раз", "words": [{"word": " раз", "start": 0.2, "end": 0.9}]},
+            {"start": 1.6, "end": 3.4, "text": "два"},
+        ]})
+        self.assertEqual([(s["start"], s["end"]) for s in result["segments"]], [(1.2, 1.9), (5.1, 6.9)])
+        self.assertEqual(result["segments"][0]["words"][0]["start"], 1.2)
+
+
+class FakeWhisper:
+    def __init__(self):
+        self.inputs = []
+
+    def transcribe(self, audio, **options):
+        self.inputs.append(len(audio))
+        duration = len(audio) / SAMPLE_RATE
+        return {"text": " раз два", "language": "ru",
+                "segments": [{"start": 0.0, "end": duration, "text": " раз два"}]}
+
+
+class RunWhisperTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as stt_app
+        from model_pool import ModelPool
+        cls.stt_app = stt_app
+        cls.original_pool = stt_app.model_pool
+        cls.model = FakeWhisper()
+        stt_app.model_pool = ModelPool(lambda name: cls.model, size_of=lambda model: 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stt_app.model_pool = cls.original_pool
+
+    def setUp(self):
+        self.model.inputs.clear()
+
+    def test_only_speech_is_decoded_and_segments_use_original_time(self):
+        audio = synthetic_recording(20.0, [(3.0, 5.0), (12.0, 14.0)])
+        result, vad_debug = self.stt_app.run_whisper(audio, "base", {"language": "ru"}, "energy", "sequential")
+
+        self.assertLess(self.model.inputs[0], 6 * SAMPLE_RATE)
+        self.assertEqual(vad_debug["regions"], 2)
+        self.assertAlmostEqual(vad_debug["speech_ratio"], 0.24, delta=0.03)
+        self.assertGreater(vad_debug["saved_sec"], 14.0)
+        self.assertIn("saved_decode_sec_est", vad_debug)
+        segment = result["segments"][0]
+        self.assertAlmostEqual(segment["start"], 3.0 - vad.VAD_PAD_MS / 1000, delta=0.05)
+        self.assertAlmostEqual(segment["end"], 14.0 + vad.VAD_PAD_MS / 1000, delta=0.05)
+
+    def test_without_speech_regions_full_audio_is_decoded(self):
+        audio = np.zeros(5 * SAMPLE_RATE, dtype=np.float32)
+        result, vad_debug = self.stt_app.run_whisper(audio, "base", {}, "energy", "sequential")
+        self.assertEqual(self.model.inputs, [len(audio)])
+        self.assertEqual(result["segments"][0]["end"], 5.0)
+        self.assertTrue(vad_debug["no_speech"])
+        self.assertEqual(vad_debug["fallback"], "full_audio")
+        self.assertEqual(vad_debug["saved_sec"], 0.0)
+
+    def test_vad_off_decodes_full_audio(self):
+        audio = synthetic_recording(5.0, [(1.0, 2.0)])
+        result, vad_debug = self.stt_app.run_whisper(audio, "base", {}, "off", "sequential")
+        self.assertEqual(self.model.inputs, [len(audio)])
+        self.assertEqual(vad_debug["backend"], "off")
+        self.assertEqual(result["segments"][0]["end"], 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Детектор речи (VAD) перед Whisper.
+
+Из аудио вырезаются участки без речи: Whisper не тратит на них время
+декодирования и не «слышит» в тишине несуществующих фраз. Речевые участки
+склеиваются через короткие паузы, а SpeechMap переводит времена сегментов
+обратно на шкалу исходной записи.
+
+Бэкенды (STT_VAD):
+  * energy — энергия кадров по 30 мс с порогом относительно уровня шума и пика
+    записи (тихая запись речью остается);
+  * silero — модель Silero VAD (пакет silero-vad, если установлен; иначе energy);
+  * off — без VAD.
+"""
+
+import bisect
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+VAD_BACKEND = os.environ.get('STT_VAD', 'energy').lower()
+# Превышение над уровнем шума (10-й перцентиль энергии кадров), дБ
+VAD_MARGIN_DB = float(os.environ.get('STT_VAD_MARGIN_DB', '10'))
+# Кадры тише этого уровня (дБ относительно полной шкалы) речью не считаются.
+# Только отсечка цифровой тишины: ниже уровня, с которого /transcribe
+# предупреждает о тихой записи (RMS 0.0002, около -74 дБ)
+VAD_MIN_DB = float(os.environ.get('STT_VAD_MIN_DB', '-80'))
+# Паузы короче этого не вырезаются
+VAD_MIN_SILENCE_MS = int(os.environ.get('STT_VAD_MIN_SILENCE_MS', '400'))
+# Запас вокруг речевого участка, чтобы не срезать начала и концы слов
+VAD_PAD_MS = int(os.environ.get('STT_VAD_PAD_MS', '200'))
+# Речевые участки короче этого (щелчки, стуки) отбрасываются
+VAD_MIN_SPEECH_MS = 150
+# Пауза между склеенными участками, чтобы слова соседних фраз не сливались
+VAD_JOIN_GAP_MS = 200
+FRAME_MS = 30
+
+BACKENDS = ('energy', 'silero', 'off')
+
+Region = Tuple[int, int]
+
+_silero_lock = threading.Lock()
+_silero_model = None
+_silero_failed = False
+
+
+def frame_energy_db(audio: np.ndarray, frame: int) -> np.ndarray:
+    """Уровень каждого кадра в дБ относительно полной шкалы (последний кадр дополняется нулями)."""
+    frames = -(-len(audio) // frame)
+    padded = np.zeros(frames * frame, dtype=np.float32)
+    padded[:len(audio)] = audio
+    rms = np.sqrt(np.mean(np.square(padded.reshape(frames, frame)), axis=1))
+    return 20.0 * np.log10(rms + 1e-10)
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Начала и концы (не включая) серий True."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def mask_to_regions(mask: np.ndarray, frame: int, total_samples: int, sample_rate: int = SAMPLE_RATE,
+                    min_silence_ms: int = VAD_MIN_SILENCE_MS, pad_ms: int = VAD_PAD_MS,
+                    min_speech_ms: int = VAD_MIN_SPEECH_MS) -> List[Region]:
+    """Покадровая маска речи → участки в отсчетах с закрытыми короткими паузами и запасом по краям."""
+    starts, ends = _runs(mask)
+    if len(starts) == 0:
+        return []
+    frame_ms = 1000.0 * frame / sample_rate
+    # Закрываем паузы короче min_silence
+    keep_gap = (starts[1:] - ends[:-1]) * frame_ms >= min_silence_ms
+    starts = np.concatenate([starts[:1], starts[1:][keep_gap]])
+    ends = np.concatenate([ends[:-1][keep_gap], ends[-1:]])
+    # Отбрасываем одиночные щелчки
+    long_enough = (ends - starts) * frame_ms >= min_speech_ms
+    starts, ends = starts[long_enough] * frame, ends[long_enough] * frame
+
+    pad = int(pad_ms * sample_rate / 1000)
+    regions: List[Region] = []
+    for start, end in zip(starts, ends):
+        start, end = max(0, int(start) - pad), min(total_samples, int(end) + pad)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def energy_regions(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> List[Region]:
+    """Речевые участки по энергии кадров с порогом над оценкой уровня шума.
+
+    Порог относительный: уровень записи (тихий микрофон) его не сдвигает.
+    """
+    if len(audio) == 0:
+        return []
+    frame = int(sample_rate * FRAME_MS / 1000)
+    energy = frame_energy_db(audio, frame)
+    noise_floor = float(np.percentile(energy, 10))
+    # Запись целиком из речи: порог над «шумом» не должен срезать тихие слоги
+    threshold = min(noise_floor + VAD_MARGIN_DB, float(energy.max()) - VAD_MARGIN_DB)
+    return mask_to_regions(energy > max(threshold, VAD_MIN_DB), frame, len(audio), sample_rate)
+
+
+def _load_silero():
+    global _silero_model, _silero_failed
+    with _silero_lock:
+        if _silero_model is None and not _silero_failed:
+            try:
+                from silero_vad import load_silero_vad
+                _silero_model = load_silero_vad()
+                logger.info("Silero VAD загружен")
+            except Exception as e:
+                _silero_failed = True
+                logger.warning(f"Silero VAD недоступен ({e}), используется энергетический VAD")
+        return _silero_model
+
+
+def silero_regions(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> Optional[List[Region]]:
+    """Речевые участки по Silero VAD; None, если модель недоступна."""
+    model = _load_silero()
+    if model is None:
+        return None
+    import torch
+    from silero_vad import get_speech_timestamps
+    with _silero_lock:  # состояние модели Silero не рассчитано на параллельные вызовы
+        timestamps = get_speech_timestamps(
+            torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)), model,
+            sampling_rate=sample_rate,
+            min_silence_duration_ms=VAD_MIN_SILENCE_MS,
+            min_speech_duration_ms=VAD_MIN_SPEECH_MS,
+            speech_pad_ms=VAD_PAD_MS,
+        )
+    return [(int(item['start']), int(item['end'])) for item in timestamps]
+
+
+class SpeechMap:
+    """Склейка речевых участков и обратное отображение времен на исходную запись."""
+
+    def __init__(self, regions: List[Region], total_samples: int, backend: str,
+                 sample_rate: int = SAMPLE_RATE, gap_ms: int = VAD_JOIN_GAP_MS):
+        self.regions = regions
+        self.total_samples = total_samples
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.gap = int(gap_ms * sample_rate / 1000)
+        # Начало каждого участка в склеенном аудио
+        self.compact_starts: List[int] = []
+        position = 0
+        for start, end in regions:
+            self.compact_starts.append(position)
+            position += end - start + self.gap
+        self.compact_samples = max(0, position - self.gap)
+
+    @property
+    def speech_samples(self) -> int:
+        return sum(end - start for start, end in self.regions)
+
+    @property
+    def speech_ratio(self) -> float:
+        return self.speech_samples / self.total_samples if self.total_samples else 0.0
+
+    def compact(self, audio: np.ndarray) -> np.ndarray:
+        """Речевые участки подряд через паузы по gap_ms."""
+        result = np.zeros(self.compact_samples, dtype=np.float32)
+        for (start, end), position in zip(self.regions, self.compact_starts):
+            result[position:position + end - start] = audio[start:end]
+        return result
+
+    def cut_points(self) -> List[int]:
+        """Середины пауз склейки в склеенном аудио — естественные места разреза на сегменты."""
+        return [position - self.gap // 2 for position in self.compact_starts[1:]]
+
+    def to_original(self, seconds: float) -> float:
+        """Время в склеенном аудио → время в исходной записи."""
+        if not self.regions:
+            return seconds
+        sample = seconds * self.sample_rate
+        index = max(0, bisect.bisect_right(self.compact_starts, sample) - 1)
+        start, end = self.regions[index]
+        offset = min(max(sample - self.compact_starts[index], 0.0), end - start)  # паузу склейки прижимаем к концу участка
+        return (start + offset) / self.sample_rate
+
+    def remap_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Переводит времена сегментов (и слов) результата Whisper на шкалу исходной записи."""
+        for segment in result.get('segments', []):
+            segment['start'] = round(self.to_original(segment.get('start', 0.0)), 3)
+            segment['end'] = round(self.to_original(segment.get('end', 0.0)), 3)
+            for word in segment.get('words', []) or []:
+                word['start'] = round(self.to_original(word.get('start', 0.0)), 3)
+                word['end'] = round(self.to_original(word.get('end', 0.0)), 3)
+        return result
+
+    def debug(self) -> Dict[str, Any]:
+        speech_sec = self.speech_samples / self.sample_rate
+        total_sec = self.total_samples / self.sample_rate
+        return {
+            'backend': self.backend,
+            'speech_ratio': round(self.speech_ratio, 4),
+            'speech_sec': round(speech_sec, 3),
+            'removed_sec': round(total_sec - speech_sec, 3),
+            'decoded_sec': round(self.compact_samples / self.sample_rate, 3),
+            'regions': len(self.regions),
+        }
+
+
+def detect_speech(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, backend: str = VAD_BACKEND) -> Optional[SpeechMap]:
+    """Карта речевых участков выбранным бэкендом; None при backend=off."""
+    if backend == 'off':
+        return None
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный VAD: {backend}. Доступные: {list(BACKENDS)}")
+    regions = silero_regions(audio, sample_rate) if backend == 'silero' else None
+    if regions is None:
+        backend = 'energy'
+        regions = energy_regions(audio, sample_rate)
+    return SpeechMap(regions, len(audio), backend, sample_rate)
@@ -619,6 +619,10 @@ function Voice() {
                 formData.append('language', sttLanguage);
             }
             formData.append('task', 'transcribe');
+            // Модель по умолчанию у сервиса одна на все воркеры: выбранную передаем с каждым запросом
+            if (currentSttModel) {
+                formData.append('model', currentSttModel);
+            }
 
             const response = await window.api.fetch('/api/stt/transcribe', {
                 method: 'POST',
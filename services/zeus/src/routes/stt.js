@@ -139,6 +139,9 @@ router.get('/models', async (req, res) => {
  *                 type: string
  *               task:
  *                 type: string
+ *               model:
+ *                 type: string
+ *                 description: Модель Whisper (по умолчанию — STT_DEFAULT_MODEL сервиса)
  *     responses:
  *       200:
  *         description: Успешное распознавание речи
@@ -155,7 +158,7 @@ router.post('/transcribe', upload.single('audio'), async (req, res) => {
             });
         }
 
-        const { language = 'auto', task = 'transcribe' } = req.body;
+        const { language = 'auto', task = 'transcribe', model } = req.body;
 
         logger.info(`STT Whisper transcription request for file: ${req.file.originalname}, size: ${req.file.size} bytes, language: ${language}, task: ${task}`);
 
@@ -168,6 +171,9 @@ router.post('/transcribe', upload.single('audio'), async (req, res) => {
         });
         formData.append('language', language);
         formData.append('task', task);
+        if (model) {
+            formData.append('model', model);
+        }
 
         // Отправляем запрос в STT сервис
         const response = await fetchWithTimeout(`${STT_SERVICE_URL}/transcribe`, {